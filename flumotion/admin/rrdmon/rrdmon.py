@@ -21,8 +21,10 @@
 
 """RRD resource poller daemon for Flumotion.
 
-Makes periodic observations on components' UI states, recording them to
-RRD files. One can then extract graphs using rrdtool graph. For example,
+Records the values of keys of components' UI states to RRD files, at
+regular intervals. The values are pushed by the components as they
+change, and the sources recorded in the same RRD file are written in
+one update. One can then extract graphs using rrdtool graph. For example,
 to show a stream bandwidth graph for the last 30 minutes with the
 example configuration file, in the source tree as
 conf/rrdmon/default.xml, the following command makes a graph:
@@ -41,13 +43,13 @@ the RRD resource poller.
 import os
 import random
 import rrdtool
-import datetime
 import time
 
+from twisted.internet import reactor
+
 from flumotion.admin import multi
-from flumotion.common import log, common
-from flumotion.common import eventcalendar
-from flumotion.component.base import scheduler
+from flumotion.common import log, common, poller
+from flumotion.common.planet import moods
 
 # register the unjellyable
 from flumotion.common import componentui
@@ -100,27 +102,196 @@ def sourceGetUIStateKey(source):
     return source['ui-state-key']
 
 
+def sourcesGroupByFile(sources):
+    """
+    Group sources by the RRD file they are recorded in, each file
+    holding one DS per source.
+
+    @returns: the files, in the order of the sources, with their sources
+    @rtype:   list of (str, list of source)
+    """
+    files = []
+    byFile = {}
+    for source in sources:
+        rrdFile = sourceGetFileName(source)
+        if rrdFile not in byFile:
+            byFile[rrdFile] = []
+            files.append((rrdFile, byFile[rrdFile]))
+        byFile[rrdFile].append(source)
+    return files
+
+
+class UIStateSubscription(log.Loggable):
+    """
+    I keep the last values of some keys of the UI state of a component.
+
+    I get the UI state of the component once, when it is happy, and
+    listen to the changes the component pushes for it instead of asking
+    for the whole UI state for every sample.  I get it again when the
+    component was restarted, or when L{retry} is called after getting it
+    failed.
+
+    @ivar managerId:   id of the manager the component is in
+    @type managerId:   str
+    @ivar componentId: id of the component
+    @type componentId: str
+    @ivar keys:        the UI state keys to keep the value of
+    @type keys:        set of str
+    """
+    logCategory = 'rrdmon'
+
+    def __init__(self, managerId, componentId, keys=()):
+        self.managerId = managerId
+        self.componentId = componentId
+        self.keys = set(keys)
+        self._values = {}
+        self._admin = None
+        self._componentState = None
+        self._uiState = None
+        self._generation = 0
+        self._failed = False
+
+    ### Public Methods ###
+
+    def attach(self, admin, componentState):
+        """
+        Start following a component.
+
+        @type admin:          L{flumotion.admin.admin.AdminModel}
+        @type componentState: L{flumotion.common.planet.AdminComponentState}
+        """
+        self.detach()
+        self._admin = admin
+        self._componentState = componentState
+        componentState.addListener(self, set_=self._componentStateSet)
+        if componentState.get('mood') == moods.happy.value:
+            self._subscribe()
+
+    def detach(self):
+        """
+        Stop following the component, because it or its manager is gone.
+        """
+        self._unsubscribe()
+        if self._componentState is not None:
+            self._componentState.removeListener(self)
+        self._componentState = None
+        self._admin = None
+
+    def isAttached(self):
+        return self._componentState is not None
+
+    def isAttachedTo(self, componentState):
+        return self._componentState is componentState
+
+    def retry(self):
+        """
+        Get the UI state again if getting it failed while the component
+        was happy.
+        """
+        if (self._failed and self._componentState is not None
+            and self._componentState.get('mood') == moods.happy.value):
+            self._subscribe()
+
+    def getValue(self, key):
+        """
+        @returns: the last value of a UI state key, or None if it is not
+                  known, for example because the component is not running
+        """
+        return self._values.get(key)
+
+    ### Private Methods ###
+
+    def _subscribe(self):
+        if self._uiState is not None:
+            return
+        self._failed = False
+        generation = self._generation
+
+        def gotUIState(uiState):
+            if generation != self._generation:
+                # the component went away in the meantime
+                return
+            self._uiState = uiState
+            for key in self.keys:
+                if uiState.hasKey(key):
+                    self._values[key] = uiState.get(key)
+                else:
+                    self.warning('uiState of %s%s has no key %s',
+                                 self.managerId, self.componentId, key)
+            uiState.addListener(self, set_=self._uiStateSet,
+                                invalidate=self._uiStateInvalidate)
+
+        def errback(failure):
+            self.warning('could not get the ui state of %s%s',
+                         self.managerId, self.componentId)
+            self.debug('reason: %s', log.getFailureMessage(failure))
+            if generation == self._generation:
+                self._failed = True
+
+        self.debug('subscribing to the ui state of %s%s', self.managerId,
+                   self.componentId)
+        d = self._admin.componentCallRemote(self._componentState,
+                                            'getUIState')
+        d.addCallbacks(gotUIState, errback)
+
+    def _unsubscribe(self):
+        self._generation += 1
+        self._failed = False
+        if self._uiState is not None:
+            self._uiState.removeListener(self)
+            self._uiState = None
+        self._values.clear()
+
+    def _componentStateSet(self, state, key, value):
+        if key != 'mood':
+            return
+        if value == moods.happy.value:
+            self._subscribe()
+        elif value in (moods.sleeping.value, moods.lost.value,
+                       moods.sad.value):
+            # the ui state we have is not updated anymore
+            self._unsubscribe()
+
+    def _uiStateSet(self, uiState, key, value):
+        if key in self.keys:
+            self._values[key] = value
+
+    def _uiStateInvalidate(self, uiState):
+        self._unsubscribe()
+
+
 class RRDMonitor(log.Loggable):
     logName = 'rrdmon'
 
     def __init__(self, sources):
         self.debug('started rrd monitor')
         self.multi = multi.MultiAdminModel()
-        self.scheduler = scheduler.Scheduler()
+        self.multi.addListener(self)
+        self._files = sourcesGroupByFile(sources)
+        self._subscriptions = {} # (managerId, componentId) -> subscription
+        self._pollers = []
+        for source in sources:
+            key = self._getSubscriptionKey(source)
+            if key not in self._subscriptions:
+                self._subscriptions[key] = UIStateSubscription(*key)
+            self._subscriptions[key].keys.add(sourceGetUIStateKey(source))
         self.ensureRRDFiles(sources)
         self.connectToManagers(sources)
-        self.startScheduler(sources)
+        self.startSampling()
+
+    ### Public Methods ###
 
     def ensureRRDFiles(self, sources):
-        for source in sources:
-            rrdfile = sourceGetFileName(source)
+        for rrdfile, fileSources in sourcesGroupByFile(sources):
             if not os.path.exists(rrdfile):
                 try:
                     self.info('Creating RRD file %s', rrdfile)
+                    args = [sourceGetDS(source) for source in fileSources]
+                    args.extend(sourceGetRRAList(fileSources[0]))
                     rrdtool.create(rrdfile,
-                                   "-s", str(sourceGetSampleFrequency(source)),
-                                   sourceGetDS(source),
-                                   *sourceGetRRAList(source))
+                                   "-s", str(sourceGetSampleFrequency(
+                                       fileSources[0])),
+                                   *args)
                 except rrdtool.error, e:
                     self.warning('Could not create RRD file %s',
                                  rrdfile)
@@ -132,89 +303,127 @@ class RRDMonitor(log.Loggable):
             connectionInfo = sourceGetConnectionInfo(source)
             self.multi.addManager(connectionInfo, tenacious=True)
 
-    def startScheduler(self, sources):
+    def startSampling(self):
+        """
+        Update each RRD file once per sample, randomly offset to spread
+        the updates of the files.
+        """
         r = random.Random()
-        now = datetime.datetime.now(eventcalendar.LOCAL)
-
-        def eventInstanceStarted(eventInstance):
-            self.pollData(*eventInstance.event.content)
-
-        def eventStopped(eventInstance):
-            pass
-
-        self.scheduler.subscribe(eventInstanceStarted, eventInstanceStopped)
 
+        def makeUpdater(rrdFile, fileSources):
+
+            def update():
+                self.updateFile(rrdFile, fileSources)
+            return update
+
+        for rrdFile, fileSources in self._files:
+            freq = sourceGetSampleFrequency(fileSources[0])
+            p = poller.Poller(makeUpdater(rrdFile, fileSources), freq,
+                              start=False)
+            reactor.callLater(r.randint(0, freq), p.start)
+            self._pollers.append(p)
+
+    def stopSampling(self):
+        for p in self._pollers:
+            p.stop()
+        self._pollers = []
+
+    def updateFile(self, rrdFile, sources):
+        """
+        Record the last known values of the sources of an RRD file, in
+        one update.
+        """
+        names = []
+        values = []
         for source in sources:
-            freq = sourceGetSampleFrequency(source)
-
-            # randomly offset the polling
-            offset = datetime.timedelta(seconds=r.randint(0, freq))
-
-            data = (str(sourceGetConnectionInfo(source)),
-                    sourceGetComponentId(source),
-                    sourceGetUIStateKey(source),
-                    sourceGetName(source),
-                    sourceGetFileName(source))
-
-            # FIXME: Event never actually allowed a timedelta as rrule,
-            # so I doubt this refactoring of scheduler ever worked
-            calendar = eventcalendar.Calendar()
-            calendar.addEvent(now.isoformat(),
-                now + offset, now + offset + datetime.timedelta(seconds=1),
-                data, rrule=datetime.timedelta(seconds=freq))
-            self.scheduler.setCalendar(calendar)
-
-    def pollData(self, managerId, componentId, uiStateKey, dsName,
-                 rrdFile):
-
-        def stateListToDict(l):
-            return dict([(x.get('name'), x) for x in l])
-
-        if managerId in self.multi.admins:
-            admin = self.multi.admins[managerId]
-
-            flowName, componentName = common.parseComponentId(componentId)
-
-            flows = stateListToDict(admin.planet.get('flows'))
-            if flowName not in flows:
-                self.warning('not polling %s%s:%s: no such flow %s',
-                             managerId, componentId, uiStateKey,
-                             flowName)
-                return
-
-            components = stateListToDict(flows[flowName].get('components'))
-            if componentName not in components:
-                self.warning('not polling %s%s:%s: no such component %s',
-                             managerId, componentId, uiStateKey,
-                             componentId)
-                return
-
-            state = components[componentName]
-
-            def gotUIState(uiState):
-                if not uiState.hasKey(uiStateKey):
-                    self.warning('while polling %s%s:%s: uiState has no '
-                                 'key %s', managerId, componentId,
-                                 uiStateKey, uiStateKey)
-                else:
-                    try:
-                        value = '%d:%s' % (int(time.time()),
-                                           uiState.get(uiStateKey))
-                        self.log("polled %s%s:%s, updating ds %s = %s",
-                                 managerId, componentId, uiStateKey,
-                                 dsName, value)
-                        rrdtool.update(rrdFile, "-t", dsName, value)
-                    except rrdtool.error, e:
-                        self.warning('error updating rrd file %s for '
-                                     '%s%s:%s', rrdFile, managerId,
-                                     componentId, uiStateKey)
-                        self.debug('error reason: %s',
-                                   log.getExceptionMessage(e))
-
-            def errback(failure):
-                self.warning('not polling %s%s:%s: failed to get ui '
-                             'state')
-                self.debug('reason: %s', log.getFailureMessage(failure))
-
-            d = admin.componentCallRemote(state, 'getUIState')
-            d.addCallbacks(gotUIState, errback)
+            subscription = self._subscriptions[
+                self._getSubscriptionKey(source)]
+            subscription.retry()
+            value = subscription.getValue(sourceGetUIStateKey(source))
+            if value is None:
+                self.log('no value for %s%s:%s', subscription.managerId,
+                         subscription.componentId,
+                         sourceGetUIStateKey(source))
+                continue
+            names.append(sourceGetName(source))
+            values.append(str(value))
+        if not names:
+            return
+
+        try:
+            value = '%d:%s' % (int(time.time()), ':'.join(values))
+            self.log("updating ds %s of %s = %s", ':'.join(names), rrdFile,
+                     value)
+            rrdtool.update(rrdFile, "-t", ':'.join(names), value)
+        except rrdtool.error, e:
+            self.warning('error updating rrd file %s', rrdFile)
+            self.debug('error reason: %s', log.getExceptionMessage(e))
+
+    ### MultiAdminModel Listener Methods ###
+
+    def model_addPlanet(self, admin, planet):
+        managerId = admin.managerId
+
+        def flowStateAppend(state, key, value):
+            if key == 'components':
+                self._attachSubscription(admin, state, value)
+
+        def flowStateRemove(state, key, value):
+            if key == 'components':
+                self._detachSubscriptions(value)
+
+        def planetStateAppend(state, key, value):
+            if key == 'flows':
+                value.addListener(self, append=flowStateAppend,
+                                  remove=flowStateRemove)
+                for component in value.get('components'):
+                    flowStateAppend(value, 'components', component)
+
+        def planetStateRemove(state, key, value):
+            if key == 'flows':
+                value.removeListener(self)
+                for component in value.get('components'):
+                    flowStateRemove(value, 'components', component)
+
+        # components of a flow that is removed and loaded again get new
+        # states, so follow them instead of looking them up once
+        planet.addListener(self, append=planetStateAppend,
+                           remove=planetStateRemove)
+        for flow in planet.get('flows'):
+            planetStateAppend(planet, 'flows', flow)
+
+        for subscription in self._subscriptions.values():
+            if (subscription.managerId == managerId
+                and not subscription.isAttached()):
+                self.warning('not monitoring %s%s yet: no such component',
+                             managerId, subscription.componentId)
+
+    def model_removePlanet(self, admin, planet):
+        planet.removeListener(self)
+        for flow in planet.get('flows'):
+            flow.removeListener(self)
+        for subscription in self._subscriptions.values():
+            if subscription.managerId == admin.managerId:
+                subscription.detach()
+
+    ### Private Methods ###
+
+    def _getSubscriptionKey(self, source):
+        return (str(sourceGetConnectionInfo(source)),
+                sourceGetComponentId(source))
+
+    def _attachSubscription(self, admin, flowState, componentState):
+        componentId = common.componentId(flowState.get('name'),
+                                         componentState.get('name'))
+        subscription = self._subscriptions.get((admin.managerId,
+                                                componentId))
+        if subscription is not None:
+            self.debug('monitoring %s%s', admin.managerId, componentId)
+            subscription.attach(admin, componentState)
+
+    def _detachSubscriptions(self, componentState):
+        for subscription in self._subscriptions.values():
+            if subscription.isAttachedTo(componentState):
+                self.debug('%s%s is gone', subscription.managerId,
+                           subscription.componentId)
+                subscription.detach()
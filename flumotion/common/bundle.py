@@ -24,18 +24,40 @@ bundles of files used to implement caching over the network
 """
 
 import StringIO
+import cPickle
 import errno
 import os
+import struct
 import sys
 import tempfile
 import zipfile
+import zlib
 
 from flumotion.common import errors, dag, python
 from flumotion.common.python import makedirs
 
-__all__ = ['Bundle', 'Bundler', 'Unbundler', 'BundlerBasket']
+__all__ = ['Bundle', 'Bundler', 'Unbundler', 'BundlerBasket', 'HashCache']
 __version__ = "$Rev$"
 
+HASH_CACHE_VERSION = 1
+
+# name of the file listing the files of an unbundled bundle; it is
+# written last, so a bundle directory without it is incomplete
+MANIFEST_NAME = '.manifest'
+# directory of the files fetched on their own, by md5sum
+FILES_DIR = '.files'
+
+# all members of a zip get the same date and permissions, so that the
+# zip of a bundle, and thus its md5sum, only depends on the names and
+# contents of its files
+_ZIP_DOS_DATE = (1 << 5) | 1 # 1980-01-01
+_ZIP_DOS_TIME = 0
+_ZIP_EXTERNAL_ATTR = 0644 << 16L
+_ZIP_VERSION = 20
+_ZIP_LOCAL_HEADER = '<4s5H3L2H'
+_ZIP_CENTRAL_HEADER = '<4s6H3L5H2L'
+_ZIP_END = '<4s4H2LH'
+
 
 def rename(source, dest):
     return os.rename(source, dest)
@@ -57,26 +79,207 @@ if sys.platform == 'win32':
     rename = _win32Rename
 
 
+def _writeAtomically(path, data):
+    # atomically write to path, see #373
+    parent = os.path.split(path)[0]
+    try:
+        makedirs(parent)
+    except OSError, err:
+        # Reraise error unless if it's an already existing
+        if err.errno != errno.EEXIST or not os.path.isdir(parent):
+            raise
+    fd, tempname = tempfile.mkstemp(dir=parent)
+    handle = os.fdopen(fd, 'wb')
+    handle.write(data)
+    handle.close()
+    rename(tempname, path)
+
+
+def deflate(data):
+    """
+    Compress data the way it is stored in a zip file.
+
+    @rtype: str
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                  zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate(data):
+    """
+    Decompress data compressed with L{deflate}.
+
+    @rtype: str
+    """
+    return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+def _writeZip(members):
+    # members is a list of (name, member) with member as returned by
+    # BundledFile.getMember()
+    filelike = StringIO.StringIO()
+    central = []
+    for name, (md5sum, crc, size, deflated) in members:
+        offset = filelike.tell()
+        filelike.write(struct.pack(_ZIP_LOCAL_HEADER, 'PK\003\004',
+                                   _ZIP_VERSION, 0, zipfile.ZIP_DEFLATED,
+                                   _ZIP_DOS_TIME, _ZIP_DOS_DATE, crc,
+                                   len(deflated), size, len(name), 0))
+        filelike.write(name)
+        filelike.write(deflated)
+        central.append(struct.pack(_ZIP_CENTRAL_HEADER, 'PK\001\002',
+                                   _ZIP_VERSION, _ZIP_VERSION, 0,
+                                   zipfile.ZIP_DEFLATED, _ZIP_DOS_TIME,
+                                   _ZIP_DOS_DATE, crc, len(deflated), size,
+                                   len(name), 0, 0, 0, 0,
+                                   _ZIP_EXTERNAL_ATTR, offset) + name)
+    start = filelike.tell()
+    central = ''.join(central)
+    filelike.write(central)
+    filelike.write(struct.pack(_ZIP_END, 'PK\005\006', 0, 0,
+                               len(members), len(members), len(central),
+                               start, 0))
+    data = filelike.getvalue()
+    filelike.close()
+    return data
+
+
+class HashCache:
+    """
+    I cache the md5sums of bundled files, by their inode, size and
+    modification time, and the md5sums of the bundles made from them.
+    I can be saved to a file, so that a restarted manager does not have
+    to read all the bundled files again.
+    """
+
+    def __init__(self, filename=None):
+        """
+        @param filename: the file to load from and save to, if any
+        @type  filename: str
+        """
+        self.filename = filename
+        self._files = {} # path -> ((inode, size, mtime), md5sum)
+        self._bundles = {} # bundle name -> (manifest, md5sum)
+        self._dirty = False
+        if filename:
+            self.load()
+
+    def getFileSum(self, path, key):
+        """
+        @param key: the (inode, size, modification time) of the file
+        @type  key: tuple
+
+        @returns: the cached md5sum of the file, or None
+        @rtype:   str
+        """
+        entry = self._files.get(path)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def setFileSum(self, path, key, md5sum):
+        self._files[path] = (key, md5sum)
+        self._dirty = True
+
+    def getBundleSum(self, name, manifest):
+        """
+        @param manifest: the (destination, md5sum) of all the files of the
+                         bundle, sorted
+        @type  manifest: tuple of (str, str)
+
+        @returns: the cached md5sum of the bundle's zip, or None
+        @rtype:   str
+        """
+        entry = self._bundles.get(name)
+        if entry is None or entry[0] != manifest:
+            return None
+        return entry[1]
+
+    def setBundleSum(self, name, manifest, md5sum):
+        self._bundles[name] = (manifest, md5sum)
+        self._dirty = True
+
+    def load(self):
+        """
+        Load the cache from my file. A missing, unreadable or outdated
+        file leaves me empty.
+        """
+        try:
+            f = open(self.filename, 'rb')
+            try:
+                data = cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return
+        if not isinstance(data, dict) or \
+                data.get('version') != HASH_CACHE_VERSION:
+            return
+        self._files = data['files']
+        self._bundles = data['bundles']
+        self._dirty = False
+
+    def save(self):
+        """
+        Save the cache to my file, if it changed since it was loaded or
+        last saved.
+
+        @raises EnvironmentError: if the file could not be written
+        """
+        if not self.filename or not self._dirty:
+            return
+        data = {'version': HASH_CACHE_VERSION,
+                'files': self._files,
+                'bundles': self._bundles}
+        _writeAtomically(self.filename, cPickle.dumps(data, 2))
+        self._dirty = False
+
+
 class BundledFile:
     """
     I represent one file as managed by a bundler.
     """
 
-    def __init__(self, source, destination):
+    def __init__(self, source, destination, hashCache=None):
         self.source = source
         self.destination = destination
-        self._last_md5sum = None
-        self._last_timestamp = None
-        self.zipped = False
+        self._hashCache = hashCache
+        self._key = None # (inode, size, mtime) when last summed
+        self._md5sum = None
+        self._member = None # cached result of getMember()
+
+    def statKey(self):
+        """
+        @returns: the inode, size and modification time of the file
+        @rtype:   tuple
+        """
+        st = os.stat(self.source)
+        return (st.st_ino, st.st_size, st.st_mtime)
 
     def md5sum(self):
         """
         Calculate the md5sum of the given file.
 
+        The file is only read again when its inode, size or modification
+        time changed.
+
         @returns: the md5 sum a 32 character string of hex characters.
         """
-        data = open(self.source, "r").read()
-        return python.md5(data).hexdigest()
+        key = self.statKey()
+        if key == self._key:
+            return self._md5sum
+        md5sum = None
+        if self._hashCache:
+            md5sum = self._hashCache.getFileSum(self.source, key)
+        if md5sum is None:
+            data = open(self.source, "rb").read()
+            md5sum = python.md5(data).hexdigest()
+            if self._hashCache:
+                self._hashCache.setFileSum(self.source, key, md5sum)
+        self._key = key
+        self._md5sum = md5sum
+        return md5sum
 
     def timestamp(self):
         """
@@ -86,48 +289,44 @@ class BundledFile:
 
     def hasChanged(self):
         """
-        Check if the file has changed since it was last checked.
+        Check if the file has changed since it was last compressed.
 
         @rtype: boolean
         """
+        return self._member is None or self.md5sum() != self._member[0]
 
-        # if it wasn't zipped yet, it needs zipping, so we pretend it
-        # was changed
-        # FIXME: move this out here
-        if not self.zipped:
-            return True
-
-        timestamp = self.timestamp()
-        # if file still has an old timestamp, it hasn't changed
-        # FIXME: looks bogus, shouldn't this check be != instead of <= ?
-        if self._last_timestamp and timestamp <= self._last_timestamp:
-            return False
-        self._last_timestamp = timestamp
+    def getMember(self):
+        """
+        Get the file as it is stored in a zip. It is only compressed
+        again when its contents changed.
 
-        # if the md5sum has changed, it has changed
+        @returns: the md5sum, CRC, size and deflated data of the file
+        @rtype:   (str, int, int, str)
+        """
         md5sum = self.md5sum()
-        if self._last_md5sum != md5sum:
-            self._last_md5sum = md5sum
-            return True
-
-        return False
-
-    def pack(self, zip):
-        self._last_timestamp = self.timestamp()
-        self._last_md5sum = self.md5sum()
-        zip.write(self.source, self.destination)
-        self.zipped = True
+        if self._member is None or self._member[0] != md5sum:
+            data = open(self.source, "rb").read()
+            md5sum = python.md5(data).hexdigest()
+            self._member = (md5sum, zlib.crc32(data) & 0xffffffffL,
+                            len(data), deflate(data))
+        return self._member
 
 
 class Bundle:
     """
     I am a bundle of files, represented by a zip file and md5sum.
+
+    @ivar manifest: the (destination, md5sum) of the files in the bundle,
+                    sorted, if known
+    @type manifest: tuple of (str, str)
     """
 
     def __init__(self, name):
         self.zip = None
         self.md5sum = None
         self.name = name
+        self.manifest = None
+        self._zipper = None
 
     def setZip(self, zip):
         """
@@ -136,10 +335,21 @@ class Bundle:
         self.zip = zip
         self.md5sum = python.md5(self.zip).hexdigest()
 
+    def setLazyZip(self, md5sum, zipper):
+        """
+        Set the md5sum of the bundle, and a callable that builds the zip
+        file with that md5sum when it is needed.
+        """
+        self.md5sum = md5sum
+        self._zipper = zipper
+
     def getZip(self):
         """
         Get the bundle's zip data.
         """
+        if self.zip is None and self._zipper is not None:
+            self.setZip(self._zipper())
+            self._zipper = None
         return self.zip
 
 
@@ -147,6 +357,9 @@ class Unbundler:
     """
     I unbundle bundles by unpacking them in the given directory
     under directories with the bundle's md5sum.
+
+    Files fetched one by one are kept by md5sum, so that later versions
+    of a bundle only need the files that changed.
     """
 
     def __init__(self, directory):
@@ -165,6 +378,56 @@ class Unbundler:
         """
         return self.unbundlePathByInfo(bundle.name, bundle.md5sum)
 
+    def isUnbundled(self, name, md5sum):
+        """
+        Check if the bundle with the given name and md5sum was completely
+        unbundled.
+
+        @rtype: bool
+        """
+        return os.path.exists(os.path.join(
+            self.unbundlePathByInfo(name, md5sum), MANIFEST_NAME))
+
+    def _memberPath(self, md5sum):
+        return os.path.join(self._undir, FILES_DIR, md5sum)
+
+    def hasFile(self, md5sum):
+        """
+        Check if a file with the given md5sum was stored with L{storeFile}.
+
+        @rtype: bool
+        """
+        return os.path.exists(self._memberPath(md5sum))
+
+    def storeFile(self, md5sum, deflated):
+        """
+        Store a file fetched on its own, compressed with L{deflate}.
+
+        @raises errors.NoBundleError: if the data does not match md5sum
+        """
+        data = inflate(deflated)
+        if python.md5(data).hexdigest() != md5sum:
+            raise errors.NoBundleError(
+                'Received file does not match md5sum %s' % md5sum)
+        _writeAtomically(self._memberPath(md5sum), data)
+
+    def unbundleManifest(self, name, md5sum, manifest):
+        """
+        Unbundle a bundle from files stored with L{storeFile}.
+
+        @param manifest: the (destination, md5sum) of the files of the bundle
+        @type  manifest: list of (str, str)
+
+        @rtype: string
+        @returns: the full path to the directory where it was unpacked
+        """
+        directory = self.unbundlePathByInfo(name, md5sum)
+        for filepath, fileSum in manifest:
+            data = open(self._memberPath(fileSum), 'rb').read()
+            _writeAtomically(os.path.join(directory, filepath), data)
+        self._writeManifest(directory, manifest)
+        return directory
+
     def unbundle(self, bundle):
         """
         Unbundle the given bundle.
@@ -180,39 +443,38 @@ class Unbundler:
         zipFile = zipfile.ZipFile(filelike, "r")
         zipFile.testzip()
 
+        manifest = []
         filepaths = zipFile.namelist()
         for filepath in filepaths:
-            path = os.path.join(directory, filepath)
-            parent = os.path.split(path)[0]
-            try:
-                makedirs(parent)
-            except OSError, err:
-                # Reraise error unless if it's an already existing
-                if err.errno != errno.EEXIST or not os.path.isdir(parent):
-                    raise
             data = zipFile.read(filepath)
-
-            # atomically write to path, see #373
-            fd, tempname = tempfile.mkstemp(dir=parent)
-            handle = os.fdopen(fd, 'wb')
-            handle.write(data)
-            handle.close()
-            rename(tempname, path)
+            _writeAtomically(os.path.join(directory, filepath), data)
+            manifest.append((filepath, python.md5(data).hexdigest()))
+        self._writeManifest(directory, manifest)
         return directory
 
+    def _writeManifest(self, directory, manifest):
+        lines = ['%s %s\n' % (fileSum, filepath)
+                 for filepath, fileSum in manifest]
+        _writeAtomically(os.path.join(directory, MANIFEST_NAME),
+                         ''.join(lines))
+
 
 class Bundler:
     """
     I bundle files into a bundle so they can be cached remotely easily.
     """
 
-    def __init__(self, name):
+    def __init__(self, name, hashCache=None):
         """
         Create a new bundle.
+
+        @param hashCache: where to cache the md5sums of files and bundles
+        @type  hashCache: L{HashCache}
         """
         self._bundledFiles = {} # dictionary of BundledFile's indexed on path
         self.name = name
-        self._bundle = Bundle(name)
+        self._hashCache = hashCache
+        self._bundle = None
 
     def add(self, source, destination = None):
         """
@@ -226,9 +488,41 @@ class Bundler:
         """
         if destination == None:
             destination = os.path.split(source)[1]
-        self._bundledFiles[source] = BundledFile(source, destination)
+        self._bundledFiles[source] = BundledFile(source, destination,
+                                                 self._hashCache)
         return destination
 
+    def getManifest(self):
+        """
+        Get the md5sums of the files registered with the bundler.
+
+        @returns: the (destination, md5sum) of the files, sorted
+        @rtype:   tuple of (str, str)
+        """
+        manifest = [(bundledFile.destination, bundledFile.md5sum())
+                    for bundledFile in self._bundledFiles.values()]
+        manifest.sort()
+        return tuple(manifest)
+
+    def getDeflatedFiles(self, md5sums):
+        """
+        Get the files of the bundle with the given md5sums, compressed
+        with L{deflate}.
+
+        @type  md5sums: list of str
+
+        @returns: dictionary of md5sum -> deflated data, for the md5sums
+                  of files in this bundle
+        @rtype:   dict of str -> str
+        """
+        wanted = dict([(md5sum, True) for md5sum in md5sums])
+        ret = {}
+        for bundledFile in self._bundledFiles.values():
+            if bundledFile.md5sum() in wanted:
+                md5sum, crc, size, deflated = bundledFile.getMember()
+                ret[md5sum] = deflated
+        return ret
+
     def bundle(self):
         """
         Bundle the files registered with the bundler.
@@ -237,33 +531,44 @@ class Bundler:
         """
         # rescan files registered in the bundle, and check if we need to
         # rebuild the internal zip
-        if not self._bundle.getZip():
-            self._bundle.setZip(self._buildzip())
+        manifest = self.getManifest()
+        if self._bundle and self._bundle.manifest == manifest:
             return self._bundle
 
-        update = False
-        for bundledFile in self._bundledFiles.values():
-            if bundledFile.hasChanged():
-                update = True
-                break
-
-        if update:
-            self._bundle.setZip(self._buildzip())
-
-        return self._bundle
+        bundle = Bundle(self.name)
+        md5sum = None
+        if self._hashCache:
+            md5sum = self._hashCache.getBundleSum(self.name, manifest)
+        if md5sum:
+            # only build the zip when someone asks for it
+            bundle.manifest = manifest
+            bundle.setLazyZip(md5sum, self._buildzip)
+        else:
+            # files can change while we read them, so use the manifest
+            # of what ends up in the zip
+            bundle.manifest, data = self._zipMembers()
+            bundle.setZip(data)
+            if self._hashCache:
+                self._hashCache.setBundleSum(self.name, manifest,
+                                             bundle.md5sum)
+        self._bundle = bundle
+        return bundle
 
     # build the zip file containing the files registered in the bundle
     # and return the zip file data
 
     def _buildzip(self):
-        filelike = StringIO.StringIO()
-        zipFile = zipfile.ZipFile(filelike, "w")
-        for bundledFile in self._bundledFiles.values():
-            bundledFile.pack(zipFile)
-        zipFile.close()
-        data = filelike.getvalue()
-        filelike.close()
-        return data
+        return self._zipMembers()[1]
+
+    def _zipMembers(self):
+        files = [(bundledFile.destination, bundledFile)
+                 for bundledFile in self._bundledFiles.values()]
+        files.sort()
+        members = [(destination, bundledFile.getMember())
+                   for destination, bundledFile in files]
+        manifest = tuple([(destination, member[0])
+                          for destination, member in members])
+        return manifest, _writeZip(members)
 
 
 class BundlerBasket:
@@ -271,11 +576,16 @@ class BundlerBasket:
     I manage bundlers that are registered through me.
     """
 
-    def __init__(self):
+    def __init__(self, hashCache=None):
         """
         Create a new bundler basket.
+
+        @param hashCache: where the bundlers cache the md5sums of files
+                          and bundles
+        @type  hashCache: L{HashCache}
         """
         self._bundlers = {} # bundler name -> bundle
+        self._hashCache = hashCache
 
         self._files = {}        # filename          -> bundle name
         self._imports = {}      # import statements -> bundle name
@@ -293,7 +603,7 @@ class BundlerBasket:
         """
         # get the bundler and create it if need be
         if not bundleName in self._bundlers:
-            bundler = Bundler(bundleName)
+            bundler = Bundler(bundleName, self._hashCache)
             self._bundlers[bundleName] = bundler
         else:
             bundler = self._bundlers[bundleName]
@@ -374,6 +684,15 @@ class BundlerBasket:
             return self._files[filename]
         return None
 
+    def saveHashCache(self):
+        """
+        Save the md5sums computed by my bundlers, if I have a hash cache.
+
+        @raises EnvironmentError: if the hash cache could not be written
+        """
+        if self._hashCache:
+            self._hashCache.save()
+
     def getBundlerNames(self):
         """
         Get all bundler names.
@@ -407,7 +726,7 @@ class MergedBundler(Bundler):
         """
         if bundler.name not in self._subbundlers:
             self._subbundlers[bundler.name] = bundler
-            for bfile in bundler._files.values():
+            for bfile in bundler._bundledFiles.values():
                 self.add(bfile.source, bfile.destination)
 
     def getSubBundlers(self):
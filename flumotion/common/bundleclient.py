@@ -26,6 +26,7 @@ import os
 import sys
 
 from twisted.internet import error, defer
+from twisted.spread import flavors
 
 from flumotion.common import bundle, common, errors, log, package
 from flumotion.configure import configure
@@ -65,46 +66,25 @@ class BundleLoader(log.Loggable):
                   for this package.
         """
 
-        def annotated(d, *extraVals):
-
-            def annotatedReturn(ret):
-                return (ret, ) + extraVals
-            d.addCallback(annotatedReturn)
-            return d
-
-        def getZips(sums):
+        def fetchBundles(sums):
             # sums is a list of name, sum tuples, highest to lowest
             # figure out which bundles we're missing
             toFetch = []
             for name, md5 in sums:
-                path = os.path.join(configure.cachedir, name, md5)
-                if os.path.exists(path):
+                if self._unbundler.isUnbundled(name, md5):
                     self.log('%s is up to date', name)
-                else:
+                elif name not in toFetch:
                     self.log('%s needs fetching', name)
-                # FIXME: We cannot be completelly sure the bundle has the
-                # correct content only by checking that the directory exists.
-                # The worker/manager could have died during a download leaving
-                # the package incomplete.
-                toFetch.append(name)
-            if toFetch:
-                return annotated(self.callRemote('getBundleZips', toFetch),
-                                 toFetch, sums)
-            else:
-                return {}, [], sums
-
-        def unpackAndRegister((zips, toFetch, sums)):
-            for name in toFetch:
-                if name not in zips:
-                    msg = "Missing bundle %s was not received"
-                    self.warning(msg, name)
-                    raise errors.NoBundleError(msg % name)
-
-                b = bundle.Bundle(name)
-                b.setZip(zips[name])
-                path = self._unbundler.unbundle(b)
+                    toFetch.append(name)
+            if not toFetch:
+                return sums
+            d = self._fetchManifests(toFetch, sums)
+            d.addErrback(self._fetchZips, toFetch, sums)
+            return d
 
+        def register(sums):
             # register all package paths; to do so we need to reverse sums
+            sums = list(sums)
             sums.reverse()
             ret = []
             for name, md5 in sums:
@@ -121,8 +101,68 @@ class BundleLoader(log.Loggable):
 
         # get sums for all bundles we need
         d = self.callRemote('getBundleSums', **kwargs)
-        d.addCallback(getZips)
-        d.addCallback(unpackAndRegister)
+        d.addCallback(fetchBundles)
+        d.addCallback(register)
+        return d
+
+    def _fetchManifests(self, toFetch, sums):
+        # fetch the files of the bundles we do not have yet, and unbundle
+        # them; returns a deferred firing the sums of the bundles
+
+        def gotManifests(manifests):
+            # a bundle can have changed since we got its md5sum
+            newSums = []
+            for name, md5 in sums:
+                if name in manifests:
+                    md5 = manifests[name][0]
+                newSums.append((name, md5))
+
+            missing = {}
+            for name in toFetch:
+                for path, fileSum in manifests[name][1]:
+                    if not self._unbundler.hasFile(fileSum):
+                        missing[fileSum] = True
+            self.debug('fetching %d files for bundles %r',
+                       len(missing), toFetch)
+            if missing:
+                d = self.callRemote('getBundleFiles', toFetch,
+                                    missing.keys())
+            else:
+                d = defer.succeed({})
+            d.addCallback(gotFiles, manifests)
+            d.addCallback(lambda _: newSums)
+            return d
+
+        def gotFiles(files, manifests):
+            for fileSum, deflated in files.items():
+                self._unbundler.storeFile(fileSum, deflated)
+            for name in toFetch:
+                md5, manifest = manifests[name]
+                self._unbundler.unbundleManifest(name, md5, manifest)
+
+        d = self.callRemote('getBundleManifests', toFetch)
+        d.addCallback(gotManifests)
+        return d
+
+    def _fetchZips(self, failure, toFetch, sums):
+        # managers that cannot send the files of a bundle send whole zips
+        failure.trap(flavors.NoSuchMethod)
+        self.debug('manager cannot send bundle files, fetching zips')
+
+        def gotZips(zips):
+            for name in toFetch:
+                if name not in zips:
+                    msg = "Missing bundle %s was not received"
+                    self.warning(msg, name)
+                    raise errors.NoBundleError(msg % name)
+
+                b = bundle.Bundle(name)
+                b.setZip(zips[name])
+                self._unbundler.unbundle(b)
+            return sums
+
+        d = self.callRemote('getBundleZips', toFetch)
+        d.addCallback(gotZips)
         return d
 
     def loadModule(self, moduleName):
@@ -20,6 +20,7 @@
 
 # Headers in this file shall remain intact.
 
+import bisect
 import datetime
 import time
 
@@ -538,6 +539,179 @@ class EventSet(log.Loggable):
         """
         return self._events
 
+    def _getIndexSources(self):
+        # the intervals of the events that do not recur, and a cursor over
+        # the instances of the recurring event, if any, for _ActiveIndex
+        intervals = []
+        cursor = None
+        skipped = []
+        recurring = self._getRecurringEvent()
+        for event in self._events:
+            if event.recurrenceid:
+                skipped.append(event.recurrenceid)
+            if event is not recurring:
+                intervals.append((event.start, event.end, False,
+                                  EventInstance(event, event.start,
+                                                event.end)))
+        if recurring:
+            if recurring.exdates:
+                skipped.extend(recurring.exdates)
+            cursor = _RecurrenceCursor(recurring, skipped)
+        return intervals, cursor
+
+
+class _RecurrenceCursor(object):
+    """
+    I walk the instances of a recurring event in order, so that they are
+    only computed once as an L{_ActiveIndex} advances.
+    """
+
+    def __init__(self, event, skipped):
+        # FIXME: support multiple RRULE; see 4.8.5.4 Recurrence Rule
+        startRecurRule = rrule.rrulestr(event.rrules[0], dtstart=event.start)
+        self._starts = iter(startRecurRule)
+        self._event = event
+        self._delta = event.end - event.start
+        self._skipped = skipped
+        self._next = self._getNext()
+
+    def hasMore(self):
+        return self._next is not None
+
+    def advance(self, start, end):
+        """
+        Get the intervals of the instances starting before end, and active
+        at start or later, that were not returned yet.
+
+        Like L{EventSet.getActiveEventInstances}, an instance is active
+        from its start, excluded, to its end or the start of the next
+        instance, included.
+        """
+        ret = []
+        while self._next is not None and self._next < end:
+            dtstart = self._next
+            self._next = self._getNext()
+            if dtstart in self._skipped:
+                continue
+            dtend = dtstart + self._delta
+            until = dtend
+            if self._next is not None and self._next < until:
+                until = self._next
+            if until < start:
+                continue
+            ret.append((dtstart, until, True,
+                        EventInstance(self._event, dtstart, dtend)))
+        return ret
+
+    def _getNext(self):
+        try:
+            return self._starts.next()
+        except StopIteration:
+            return None
+
+
+class _ActiveIndex(object):
+    """
+    I know the event instances of a calendar active during a window of
+    time.  The times at which the active instances change are kept
+    sorted, with the instances active at each of them and between them,
+    so finding the instances active at a time is a binary search.
+
+    The window is extended when asked about times after its end; the
+    recurring events are only expanded for the new part of the window.
+
+    @ivar start: the first time I know about
+    @ivar end:   the time I know about the instances active before
+    """
+
+    def __init__(self, eventSets, start, size):
+        self._size = size
+        self._cursors = []
+        singles = []
+        for eventSet in eventSets:
+            intervals, cursor = eventSet._getIndexSources()
+            singles.extend(intervals)
+            if cursor:
+                self._cursors.append(cursor)
+        singles.sort()
+        self._singles = singles
+        self._nextSingle = 0
+        self._intervals = []
+
+        self.start = start
+        self.end = start
+        self.extend(start)
+
+    def extend(self, when):
+        """
+        Extend the window so that it goes one window size past the given
+        time.
+        """
+        # forget about the instances that ended, but keep the ones still
+        # active now, which will be asked about again
+        now = datetime.datetime.now(UTC)
+        start = max(self.start, min(when, now))
+        end = when + self._size
+        intervals = [i for i in self._intervals if i[1] >= start]
+        for cursor in self._cursors:
+            intervals.extend(cursor.advance(start, end))
+        while (self._nextSingle < len(self._singles)
+               and self._singles[self._nextSingle][0] < end):
+            interval = self._singles[self._nextSingle]
+            self._nextSingle += 1
+            if interval[1] >= start:
+                intervals.append(interval)
+        intervals.sort()
+        self._intervals = intervals
+        self.start = start
+        self.end = end
+        self._sweep()
+
+    def hasMore(self):
+        """
+        @returns: whether there are instances starting after the window
+        """
+        for cursor in self._cursors:
+            if cursor.hasMore():
+                return True
+        return self._nextSingle < len(self._singles)
+
+    def getActive(self, when):
+        i = bisect.bisect_left(self._points, when)
+        if i < len(self._points) and self._points[i] == when:
+            return list(self._slots[2 * i + 1])
+        return list(self._slots[2 * i])
+
+    def getNextBoundary(self, when):
+        i = bisect.bisect_right(self._points, when)
+        if i < len(self._points):
+            return self._points[i]
+        return None
+
+    def _sweep(self):
+        # the intervals are sorted by their start
+        starting = {}
+        ending = {}
+        for interval in self._intervals:
+            starting.setdefault(interval[0], []).append(interval)
+            ending.setdefault(interval[1], []).append(interval)
+        points = starting.keys() + [p for p in ending if p not in starting]
+        points.sort()
+
+        # _slots[2 * i + 1] are the instances active at _points[i], and
+        # _slots[2 * i] the ones active between _points[i - 1] and
+        # _points[i]
+        slots = [()]
+        active = []
+        for p in points:
+            slots.append(tuple([i[3] for i in active if i[1] > p or i[2]]))
+            if p in ending:
+                active = [i for i in active if i[1] != p]
+            active.extend(starting.get(p, []))
+            slots.append(tuple([i[3] for i in active]))
+        self._points = points
+        self._slots = slots
+
 
 class Calendar(log.Loggable):
     """
@@ -548,8 +722,12 @@ class Calendar(log.Loggable):
 
     logCategory = 'calendar'
 
+    # how far ahead of the times asked about to expand the events
+    indexWindow = datetime.timedelta(days=1)
+
     def __init__(self):
         self._eventSets = {} # uid -> EventSet
+        self._index = None
 
     def addEvent(self, event):
         """
@@ -562,6 +740,7 @@ class Calendar(log.Loggable):
         if uid not in self._eventSets:
             self._eventSets[uid] = EventSet(uid)
         self._eventSets[uid].addEvent(event)
+        self._index = None
 
     def getPoints(self, start=None, delta=None):
         """
@@ -597,17 +776,49 @@ class Calendar(log.Loggable):
 
         @rtype: list of L{EventInstance}
         """
-        result = []
-
         if not when:
             when = datetime.datetime.now(UTC)
 
-        for eventSet in self._eventSets.values():
-            result.extend(eventSet.getActiveEventInstances(when))
+        result = self._getIndex(when).getActive(when)
 
         self.debug('%d active event instances at %s', len(result), str(when))
         return result
 
+    def getNextBoundary(self, when=None):
+        """
+        Get the first time after the given time at which an event instance
+        starts or ends.
+
+        @param when: the time to start from; defaults to right now
+        @type  when: L{datetime.datetime}
+
+        @rtype:   L{datetime.datetime} or None
+        @returns: the time, or None if no event instance starts or ends
+                  after the given time
+        """
+        if not when:
+            when = datetime.datetime.now(UTC)
+
+        index = self._getIndex(when)
+        while True:
+            boundary = index.getNextBoundary(when)
+            if boundary is not None and boundary < index.end:
+                return boundary
+            if not index.hasMore():
+                return boundary
+            index.extend(index.end)
+
+    def _getIndex(self, when):
+        # the index is built when first needed after the calendar changed,
+        # and again if asked about a time before it
+        if self._index is None or when < self._index.start:
+            self.debug('indexing event instances from %s', str(when))
+            self._index = _ActiveIndex(self._eventSets.values(), when,
+                                       self.indexWindow)
+        elif when >= self._index.end:
+            self._index.extend(when)
+        return self._index
+
 
 def _timezoneFromTZID(timezoneInfo):
     """
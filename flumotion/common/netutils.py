@@ -31,7 +31,7 @@ import struct
 
 from twisted.internet import address
 
-from flumotion.common import avltree
+from flumotion.common import radixtree
 
 __version__ = "$Rev$"
 
@@ -149,6 +149,14 @@ def countTrailingZeroes32(n):
 
 
 class RoutingTable(object):
+    """
+    I map IPv4 subnets to routes, and find the routes for an address by
+    longest-prefix match.
+
+    Subnets are kept in a L{radixtree.RadixTree}, so looking up a route
+    costs at most one step per bit of the address, regardless of the
+    number of subnets in the table.
+    """
 
     def fromFile(klass, f, requireNames=True, defaultRouteName='*default*'):
         """
@@ -177,6 +185,7 @@ class RoutingTable(object):
                            r'(\d{1,2})'
                            r'(\s+([^\s](.*[^\s])?))?\s*$')
         ret = klass()
+        subnets = []
         n = 0
         for line in f:
             n += 1
@@ -194,44 +203,66 @@ class RoutingTable(object):
                                      % (f, n, line))
                 else:
                     route = defaultRouteName
-            ret.addSubnet(route, m.group(1), int(m.group(2)))
+            subnets.append((route, m.group(1), int(m.group(2))))
             if route not in ret.routeNames:
                 ret.routeNames.append(route)
 
+        ret.addSubnets(subnets)
         return ret
     fromFile = classmethod(fromFile)
 
     def __init__(self):
-        self.avltree = avltree.AVLTree()
+        self.tree = radixtree.RadixTree()
         self.routeNames = []
 
     def getRouteNames(self):
         return self.routeNames
 
     def _parseSubnet(self, ipv4String, maskBits):
-        return (ipv4StringToInt(ipv4String),
-                ~((1 << (32 - maskBits)) - 1))
-
-    def addSubnet(self, route, ipv4String, maskBits=32):
-        ipv4Int, mask = self._parseSubnet(ipv4String, maskBits)
-        if not ipv4Int & mask == ipv4Int:
+        if maskBits < 0 or maskBits > 32:
+            raise ValueError('Invalid number of mask bits: %d' % maskBits)
+        ipv4Int = ipv4StringToInt(ipv4String)
+        if not ipv4Int & ~((1 << (32 - maskBits)) - 1) == ipv4Int:
             raise ValueError('Net %s too specific for mask with %d bits'
                              % (ipv4String, maskBits))
-        self.avltree.insert((mask, ipv4Int, route))
+        return ipv4Int
+
+    def addSubnet(self, route, ipv4String, maskBits=32):
+        ipv4Int = self._parseSubnet(ipv4String, maskBits)
+        self.tree.insert(ipv4Int, maskBits, route)
+
+    def addSubnets(self, subnets):
+        """
+        Add many subnets at once. All of them are validated before the
+        table is modified.
+
+        @param subnets: the subnets to add
+        @type  subnets: iterable of (route, ipv4String, maskBits) tuples
+        """
+        entries = []
+        for route, ipv4String, maskBits in subnets:
+            entries.append((self._parseSubnet(ipv4String, maskBits),
+                            maskBits, route))
+        self.tree.insertMany(entries)
 
     def removeSubnet(self, route, ipv4String, maskBits=32):
-        ipv4Int, mask = self._parseSubnet(ipv4String, maskBits)
-        self.avltree.delete((mask, ipv4Int, route))
+        ipv4Int = self._parseSubnet(ipv4String, maskBits)
+        self.tree.delete(ipv4Int, maskBits, route)
 
     def __iter__(self):
-        return self.avltree.iterreversed()
+        # most specific subnets first
+        entries = [(~((1 << (32 - maskBits)) - 1), net, route)
+                   for net, maskBits, route in self.tree]
+        entries.sort()
+        entries.reverse()
+        return iter(entries)
 
     def iterHumanReadable(self):
         for mask, net, route in self:
             yield route, ipv4IntToString(net), 32-countTrailingZeroes32(mask)
 
     def __len__(self):
-        return len(self.avltree)
+        return len(self.tree)
 
     def route(self, ip):
         """
@@ -243,11 +274,11 @@ class RoutingTable(object):
         if isinstance(ip, str):
             ip = ipv4StringToInt(ip)
 
-        for netmask, net, route in self:
-            if ip & netmask == net:
-                return route
-
-        return None
+        match = self.tree.longestMatch(ip)
+        if match is None:
+            return None
+        net, maskBits, routes = match
+        return routes[-1]
 
     def route_iter(self, ip):
         """
@@ -258,9 +289,9 @@ class RoutingTable(object):
         """
         if isinstance(ip, str):
             ip = ipv4StringToInt(ip)
-        for mask, net, route in self:
-            if ip & mask == net:
-                yield route
+        for net, maskBits, routes in self.tree.iterMatches(ip):
+            for i in range(len(routes) - 1, -1, -1):
+                yield routes[i]
         # Yield the default route
         yield None
 
@@ -0,0 +1,271 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_common_radixtree -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""compressed binary radix tree.
+A pure python path-compressed binary trie (also known as a Patricia
+tree) over 32-bit keys. Each node is identified by a prefix, that is, a
+key and a number of significant bits, and can hold any number of
+values. Lookups walk at most one node per significant bit, which makes
+them independent of the number of prefixes stored; useful for
+longest-prefix matching of IPv4 networks.
+"""
+
+import bisect
+
+__version__ = "$Rev$"
+
+KEY_BITS = 32
+
+# _MASKS[n] has the n most significant bits of a 32-bit key set
+_MASKS = [(0xffffffffL << (KEY_BITS - n)) & 0xffffffffL
+          for n in range(KEY_BITS + 1)]
+
+
+def _bitAt(key, n):
+    """Return the value of the bit of key at position n, counting from
+    the most significant bit."""
+    return (key >> (KEY_BITS - 1 - n)) & 1
+
+
+def _commonPrefixLength(a, b, maxBits):
+    """Return the number of leading bits shared by a and b, bounded by
+    maxBits."""
+    diff = a ^ b
+    n = 0
+    while n < maxBits and not diff & (1 << (KEY_BITS - 1 - n)):
+        n += 1
+    return n
+
+
+class _Node(object):
+    __slots__ = ('key', 'bits', 'values', 'children')
+
+    def __init__(self, key, bits, values=None):
+        self.key = key
+        self.bits = bits
+        # sorted list of values, or None for a pure branching node
+        self.values = values
+        self.children = [None, None]
+
+
+class RadixTree(object):
+    """
+    I am a set of (key, bits, value) entries, indexed by prefix.
+
+    Values stored under the same prefix are kept sorted; it is an error
+    to store the same value twice under one prefix.
+    """
+
+    def __init__(self, seq=()):
+        self._root = _Node(0, 0)
+        self._len = 0
+        self.insertMany(seq)
+
+    def _check(self, key, bits):
+        if bits < 0 or bits > KEY_BITS:
+            raise ValueError('invalid number of bits: %r' % (bits, ))
+        if key & _MASKS[bits] != key:
+            raise ValueError('key %r has bits set beyond the first %d'
+                             % (key, bits))
+
+    def insert(self, key, bits, value):
+        """
+        Store a value under a prefix.
+
+        @param key:   the prefix, with all the bits after the first
+                      C{bits} cleared
+        @type  key:   int
+        @param bits:  the number of significant bits in C{key}
+        @type  bits:  int
+        @param value: the value to store
+        """
+        self._check(key, bits)
+        node = self._root
+        while True:
+            if node.bits == bits:
+                if node.values is None:
+                    node.values = [value]
+                else:
+                    i = bisect.bisect_left(node.values, value)
+                    if i < len(node.values) and node.values[i] == value:
+                        raise ValueError('tree already has value %r'
+                                         % ((key, bits, value), ))
+                    node.values.insert(i, value)
+                break
+
+            branch = _bitAt(key, node.bits)
+            child = node.children[branch]
+            if child is None:
+                node.children[branch] = _Node(key, bits, [value])
+                break
+
+            common = _commonPrefixLength(key, child.key,
+                                         min(child.bits, bits))
+            if common == child.bits:
+                node = child
+                continue
+
+            # split the edge leading to child; both child and the new
+            # entry share at least the bit that made us take this branch
+            middle = _Node(key & _MASKS[common], common)
+            middle.children[_bitAt(child.key, common)] = child
+            if common == bits:
+                middle.values = [value]
+            else:
+                middle.children[_bitAt(key, common)] = _Node(key, bits,
+                                                             [value])
+            node.children[branch] = middle
+            break
+
+        self._len += 1
+
+    def insertMany(self, seq):
+        """
+        Bulk-load a sequence of (key, bits, value) entries.
+
+        The entries are inserted in prefix order, so that covering
+        prefixes are created before the more specific ones and the
+        number of edge splits is kept to a minimum.
+        """
+        entries = list(seq)
+        entries.sort()
+        for key, bits, value in entries:
+            self.insert(key, bits, value)
+
+    def delete(self, key, bits, value):
+        """
+        Remove a value previously stored under a prefix.
+
+        @raises ValueError: if the value is not stored under the prefix
+        """
+        self._check(key, bits)
+        parent = None
+        node = self._root
+        while node is not None and node.bits < bits:
+            parent = node
+            node = node.children[_bitAt(key, node.bits)]
+            if node is not None and key & _MASKS[node.bits] != node.key:
+                node = None
+
+        if (node is None or node.bits != bits or node.values is None):
+            raise ValueError('tree has no value %r' % ((key, bits, value), ))
+        i = bisect.bisect_left(node.values, value)
+        if i == len(node.values) or node.values[i] != value:
+            raise ValueError('tree has no value %r' % ((key, bits, value), ))
+
+        del node.values[i]
+        self._len -= 1
+        if node.values or node is self._root:
+            if not node.values:
+                node.values = None
+            return
+
+        node.values = None
+        self._prune(parent, node)
+
+    def _prune(self, parent, node):
+        # remove a node that no longer holds values, merging pure
+        # branching nodes with a single child into their child
+        left, right = node.children
+        if left is not None and right is not None:
+            return
+        replacement = left or right
+        index = parent.children.index(node)
+        parent.children[index] = replacement
+        if (replacement is None and parent is not self._root
+            and parent.values is None):
+            # parent was branching between node and its sibling; it now
+            # has a single child and can be collapsed too
+            grandparent = self._findParent(parent)
+            self._prune(grandparent, parent)
+
+    def _findParent(self, target):
+        node = self._root
+        while True:
+            child = node.children[_bitAt(target.key, node.bits)]
+            if child is target:
+                return node
+            node = child
+
+    def _iterMatches(self, key):
+        # yield the nodes holding values whose prefix matches key, from
+        # the least to the most specific
+        node = self._root
+        while node is not None:
+            if node.values is not None:
+                yield node
+            if node.bits == KEY_BITS:
+                break
+            node = node.children[_bitAt(key, node.bits)]
+            if node is not None and key & _MASKS[node.bits] != node.key:
+                break
+
+    def longestMatch(self, key):
+        """
+        Find the most specific prefix matching a key.
+
+        @returns: a (key, bits, values) tuple, where values is the
+                  sorted list of values for the prefix, or None if no
+                  prefix matches
+        """
+        best = None
+        for node in self._iterMatches(key):
+            best = node
+        if best is None:
+            return None
+        return best.key, best.bits, best.values
+
+    def iterMatches(self, key):
+        """
+        Iterate over the prefixes matching a key, from the most to the
+        least specific.
+
+        @returns: an iterator of (key, bits, values) tuples
+        """
+        nodes = list(self._iterMatches(key))
+        nodes.reverse()
+        for node in nodes:
+            yield node.key, node.bits, node.values
+
+    def __iter__(self):
+        """
+        Iterate over all (key, bits, value) entries, in no particular
+        order.
+        """
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.values is not None:
+                for value in node.values:
+                    yield node.key, node.bits, value
+            for child in node.children:
+                if child is not None:
+                    stack.append(child)
+
+    def __contains__(self, (key, bits, value)):
+        for k, b, values in self.iterMatches(key):
+            if b == bits:
+                i = bisect.bisect_left(values, value)
+                return i < len(values) and values[i] == value
+        return False
+
+    def __len__(self):
+        return self._len
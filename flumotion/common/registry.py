@@ -22,6 +22,7 @@
 """parsing of registry, which holds component and bundle information
 """
 
+import cPickle
 import os
 import stat
 import errno
@@ -34,7 +35,7 @@ from twisted.python import runtime
 
 from flumotion.common import common, log, errors, fxml, python
 from flumotion.common.python import makedirs
-from flumotion.common.bundle import BundlerBasket, MergedBundler
+from flumotion.common.bundle import BundlerBasket, HashCache, MergedBundler
 from flumotion.configure import configure
 
 __all__ = ['ComponentRegistry', 'registry']
@@ -44,6 +45,10 @@ __version__ = "$Rev$"
 # decide that it's a good idea, or something. See #799.
 READ_CACHE = False
 
+# Bump when the registry entry classes change in a way that breaks
+# unpickling of the binary registry cache.
+BINARY_CACHE_VERSION = 1
+
 _VALID_WIZARD_COMPONENT_TYPES = [
     'audio-producer',
     'video-producer',
@@ -62,6 +67,62 @@ def _getMTime(file):
     return os.stat(file)[stat.ST_MTIME]
 
 
+class _Pickled(object):
+    __slots__ = ('data', )
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _LazyEntries(dict):
+    """
+    I am a dict of registry entries read from the binary registry cache.
+    The entries are kept pickled until they are looked up, so that
+    processes only pay for the component and plug types they use.
+    """
+
+    def __init__(self, pickled):
+        dict.__init__(self)
+        for key, data in pickled.items():
+            dict.__setitem__(self, key, _Pickled(data))
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _Pickled):
+            value = cPickle.loads(value.data)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+
+def _pickleEntries(entries):
+    ret = {}
+    for key in entries.keys():
+        value = dict.__getitem__(entries, key)
+        if isinstance(value, _Pickled):
+            # never looked up, no need to pickle it again
+            ret[key] = value.data
+        else:
+            ret[key] = cPickle.dumps(value, 2)
+    return ret
+
+
 class RegistryEntryScenario(pb.Copyable, pb.RemoteCopy):
     """
     I represent a <scenario> entry in the registry
@@ -1237,11 +1298,16 @@ class RegistryDirectory(log.Loggable):
     I represent a directory under a path managed by the registry.
     I can be queried for a list of partial registry .xml files underneath
     the given path, under the given prefix.
+
+    I remember the modification times of the directories and .xml files
+    I found, so that checking for changes does not need to list the
+    directories again.
     """
 
     def __init__(self, path, prefix=configure.PACKAGE):
         self._path = path
         self._prefix = prefix
+        self._mtimes = {} # path -> modification time when scanned
         scanPath = os.path.join(path, prefix)
         self._files, self._dirs = self._getFileLists(scanPath)
 
@@ -1262,6 +1328,9 @@ class RegistryDirectory(log.Loggable):
 
         if os.path.exists(root):
             try:
+                # before listing, so that files added meanwhile are seen
+                # as changes later
+                mtime = _getMTime(root)
                 directory_files = os.listdir(root)
             except OSError, e:
                 if e.errno == errno.EACCES:
@@ -1270,6 +1339,7 @@ class RegistryDirectory(log.Loggable):
                     raise
 
             dirs.append(root)
+            self._mtimes[root] = mtime
 
             for entry in directory_files:
                 path = os.path.join(root, entry)
@@ -1277,6 +1347,7 @@ class RegistryDirectory(log.Loggable):
                 if not os.path.isdir(path):
                     if path.endswith('.xml'):
                         files.append(path)
+                        self._mtimes[path] = _getMTime(path)
                 # if it's a directory and not an svn directory, then get
                 # its files and add them
                 elif entry != '.svn':
@@ -1286,25 +1357,24 @@ class RegistryDirectory(log.Loggable):
 
         return files, dirs
 
-    def rebuildNeeded(self, mtime):
+    def rebuildNeeded(self):
+        """
+        Check whether the registry files underneath this path changed
+        since they were scanned.
 
-        def _rebuildNeeded(file):
+        Adding, removing or renaming a file changes the modification
+        time of its directory, so only the directories and the .xml
+        files found when scanning need to be checked.
+        """
+        for f, mtime in self._mtimes.items():
             try:
-                if _getMTime(file) > mtime:
+                if _getMTime(f) != mtime:
                     self.debug("Path %s changed since registry last "
                                "scanned", f)
                     return True
-                return False
             except OSError:
                 self.debug("Failed to stat file %s, need to rescan", f)
                 return True
-
-        for f in self._files:
-            if _rebuildNeeded(f):
-                return True
-        for f in self._dirs:
-            if _rebuildNeeded(f):
-                return True
         return False
 
     def getFiles(self):
@@ -1522,11 +1592,20 @@ class ComponentRegistry(log.Loggable):
             self._paths = self._getRegistryPathsFromEnviron()
         self.prefix = prefix
         self.filename = cachePath
+        # the binary cache is saved along with the XML one
+        self.binaryFilename = os.path.splitext(cachePath)[0] + '.cache'
+        # and so are the md5sums of the bundled files
+        self.hashCacheFilename = (os.path.splitext(cachePath)[0] +
+                                  '-bundles.cache')
         self.seconds = seconds
+        self._hashCache = None
         self.mtime = None
 
         self._parser = RegistryParser()
 
+        if self._loadBinaryCache():
+            return
+
         if (READ_CACHE and
             os.path.exists(self.filename) and
             os.access(self.filename, os.R_OK)):
@@ -1642,8 +1721,13 @@ class ComponentRegistry(log.Loggable):
         @rtype: L{flumotion.common.bundle.BundlerBasket}
         """
 
+        # the hash cache outlives the baskets, which are made again when
+        # the registry changes
+        if self._hashCache is None:
+            self._hashCache = HashCache(self.hashCacheFilename)
+
         def load():
-            ret = BundlerBasket()
+            ret = BundlerBasket(self._hashCache)
             for b in self.getBundles():
                 bundleName = b.getName()
                 self.debug('Adding bundle %s' % bundleName)
@@ -1719,9 +1803,8 @@ class ComponentRegistry(log.Loggable):
             if filter(os.path.exists, registryPaths - oldRegistryPaths):
                 return True
 
-        registry_modified = self.mtime
         for d in self._parser.getDirectories():
-            if d.rebuildNeeded(registry_modified):
+            if d.rebuildNeeded():
                 return True
 
         return False
@@ -1756,6 +1839,81 @@ class ComponentRegistry(log.Loggable):
             else:
                 raise
 
+        self._saveBinaryCache()
+
+    def _saveBinaryCache(self):
+        # Each entry is pickled on its own so they can be unpickled
+        # lazily. Several processes can save the cache at the same time,
+        # so write to a temporary file and rename it into place.
+        p = self._parser
+        data = {'version': (BINARY_CACHE_VERSION, configure.version),
+                'prefix': self.prefix,
+                'mtime': self.mtime,
+                'components': _pickleEntries(p._components),
+                'plugs': _pickleEntries(p._plugs),
+                'scenarios': _pickleEntries(p._scenarios),
+                'bundles': _pickleEntries(p._bundles),
+                'directories': p._directories}
+        tmp = '%s.%d' % (self.binaryFilename, os.getpid())
+        try:
+            f = open(tmp, 'wb')
+            try:
+                cPickle.dump(data, f, 2)
+            finally:
+                f.close()
+            os.rename(tmp, self.binaryFilename)
+        except (IOError, OSError, cPickle.PicklingError), e:
+            self.warning('Could not save binary registry cache %s: %s',
+                         self.binaryFilename, log.getExceptionMessage(e))
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _loadBinaryCache(self):
+        """
+        Load the registry from the binary cache, if it is up to date.
+
+        @rtype:   bool
+        @returns: whether the registry was loaded
+        """
+        try:
+            f = open(self.binaryFilename, 'rb')
+        except IOError:
+            return False
+        try:
+            try:
+                data = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            self.warning('Could not read binary registry cache %s',
+                         self.binaryFilename)
+            self.debug('Reason: %s', log.getExceptionMessage(e))
+            return False
+
+        if not isinstance(data, dict) or (data.get('version') !=
+                (BINARY_CACHE_VERSION, configure.version)):
+            self.debug('Binary registry cache %s has an old version',
+                       self.binaryFilename)
+            return False
+        if data['prefix'] != self.prefix:
+            return False
+
+        p = self._parser
+        p._components = _LazyEntries(data['components'])
+        p._plugs = _LazyEntries(data['plugs'])
+        p._scenarios = _LazyEntries(data['scenarios'])
+        p._bundles = _LazyEntries(data['bundles'])
+        p._directories = data['directories']
+        self.mtime = data['mtime']
+        if self.rebuildNeeded():
+            self.debug('Binary registry cache %s is outdated',
+                       self.binaryFilename)
+            self.clean()
+            self.mtime = None
+            return False
+        self.info('Loaded registry from %s', self.binaryFilename)
+        return True
+
     def _getRegistryPathsFromEnviron(self):
         registryPaths = [configure.pythondir, ]
         if 'FLU_PROJECT_PATH' in os.environ:
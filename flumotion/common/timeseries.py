@@ -0,0 +1,295 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_common_timeseries -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+compact time series stored in fixed-size files
+
+A time series file holds the samples of one metric in round-robin
+archives of decreasing resolution.  Each slot of an archive holds the
+average of the samples recorded during its step; a slot is reused when
+the archive wraps around.  The file is mapped in memory, so recording a
+sample is a memory write; the changes reach the disk when the file is
+flushed.
+
+@var DEFAULT_ARCHIVES: the (step, rows) of the archives of new files:
+                       an hour of seconds, a day of minutes and a month
+                       of hours
+@var SUFFIX:           suffix of the files of a L{TimeSeriesStore}
+"""
+
+import mmap
+import os
+import struct
+
+from flumotion.common import log
+
+__version__ = "$Rev$"
+
+DEFAULT_ARCHIVES = ((1, 3600), (60, 1440), (3600, 720))
+SUFFIX = '.ts'
+
+_MAGIC = 'FLTS'
+_VERSION = 1
+# magic, version, number of archives, time of the last sample
+_HEADER = '<4sIId'
+# step, rows
+_ARCHIVE = '<II'
+# slot number, sum of the samples, number of samples
+_ROW = '<qdd'
+
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_ARCHIVE_SIZE = struct.calcsize(_ARCHIVE)
+_ROW_SIZE = struct.calcsize(_ROW)
+
+
+class _Archive(object):
+
+    def __init__(self, step, rows, offset):
+        self.step = step
+        self.rows = rows
+        self.offset = offset # of the first row in the file
+
+
+class TimeSeriesFile(object):
+    """
+    I am a time series file, created with the given archives if it does
+    not exist.
+
+    @ivar path:     path of the file
+    @type path:     str
+    @ivar archives: the (step, rows) of the archives of the file, finest
+                    first
+    @type archives: list of (int, int)
+    """
+
+    def __init__(self, path, archives=DEFAULT_ARCHIVES):
+        """
+        @raises ValueError: if the file exists and is not a time series
+                            file
+        """
+        self.path = path
+        if not os.path.exists(path) or not os.path.getsize(path):
+            self._create(path, archives)
+        self._file = open(path, 'r+b')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self._readHeader()
+        except:
+            self._file.close()
+            raise
+        self.archives = [(a.step, a.rows) for a in self._archives]
+
+    ### Public Methods ###
+
+    def record(self, when, value):
+        """
+        Record a sample.
+
+        @param when:  time of the sample, in epoch seconds
+        @type  when:  float
+        @param value: value of the sample
+        @type  value: float
+        """
+        m = self._map
+        for a in self._archives:
+            slot = int(when // a.step)
+            offset = a.offset + (slot % a.rows) * _ROW_SIZE
+            rowSlot, total, count = struct.unpack(
+                _ROW, m[offset:offset + _ROW_SIZE])
+            if rowSlot != slot:
+                # a slot from a previous round, or never used
+                total, count = 0.0, 0
+            m[offset:offset + _ROW_SIZE] = struct.pack(
+                _ROW, slot, total + value, count + 1)
+        if when > self._last:
+            self._last = when
+            m[0:_HEADER_SIZE] = struct.pack(_HEADER, _MAGIC, _VERSION,
+                                            len(self._archives), when)
+
+    def fetch(self, start, end=None, step=None):
+        """
+        Get the samples recorded between two times, averaged by step.
+
+        @param start: first time to get, in epoch seconds
+        @type  start: float
+        @param end:   last time to get, in epoch seconds; defaults to the
+                      time of the last sample
+        @type  end:   float or None
+        @param step:  step of the archive to get the samples from;
+                      defaults to the finest archive going back to start
+        @type  step:  int or None
+
+        @returns: the step of the archive and the (time, average) of its
+                  slots with samples
+        @rtype:   tuple of (int, list of (int, float))
+        """
+        if end is None:
+            end = self._last
+        archive = self._getArchive(start, step)
+        first = int(start // archive.step)
+        last = int(end // archive.step)
+        # older slots were reused
+        first = max(first, int(self._last // archive.step) - archive.rows + 1)
+        m = self._map
+        result = []
+        for slot in xrange(first, last + 1):
+            offset = archive.offset + (slot % archive.rows) * _ROW_SIZE
+            rowSlot, total, count = struct.unpack(
+                _ROW, m[offset:offset + _ROW_SIZE])
+            if rowSlot == slot and count:
+                result.append((slot * archive.step, total / count))
+        return archive.step, result
+
+    def getLastTime(self):
+        """
+        @returns: the time of the last sample, or 0.0 if there is none
+        """
+        return self._last
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    ### Private Methods ###
+
+    def _create(self, path, archives):
+        f = open(path, 'wb')
+        try:
+            f.write(struct.pack(_HEADER, _MAGIC, _VERSION, len(archives),
+                                0.0))
+            for step, rows in archives:
+                f.write(struct.pack(_ARCHIVE, step, rows))
+            for step, rows in archives:
+                f.write('\0' * (_ROW_SIZE * rows))
+        finally:
+            f.close()
+
+    def _readHeader(self):
+        m = self._map
+        if len(m) < _HEADER_SIZE:
+            raise ValueError('%s is not a time series file' % self.path)
+        magic, version, count, self._last = struct.unpack(
+            _HEADER, m[:_HEADER_SIZE])
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('%s is not a time series file' % self.path)
+        self._archives = []
+        offset = _HEADER_SIZE + count * _ARCHIVE_SIZE
+        for i in range(count):
+            start = _HEADER_SIZE + i * _ARCHIVE_SIZE
+            step, rows = struct.unpack(_ARCHIVE,
+                                       m[start:start + _ARCHIVE_SIZE])
+            self._archives.append(_Archive(step, rows, offset))
+            offset += rows * _ROW_SIZE
+        if offset != len(m):
+            raise ValueError('%s is truncated' % self.path)
+
+    def _getArchive(self, start, step):
+        if step is not None:
+            for a in self._archives:
+                if a.step == step:
+                    return a
+            raise ValueError('%s has no archive with a step of %r'
+                             % (self.path, step))
+        for a in self._archives:
+            if start > self._last - a.step * a.rows:
+                return a
+        return self._archives[-1]
+
+
+class TimeSeriesStore(log.Loggable):
+    """
+    I record the time series of metrics in a directory, in a
+    L{TimeSeriesFile} per metric.
+
+    @ivar directory: directory the files are in
+    @type directory: str
+    """
+
+    logCategory = 'timeseries'
+
+    def __init__(self, directory, archives=DEFAULT_ARCHIVES):
+        self.directory = directory
+        self._archives = archives
+        self._files = {} # key -> TimeSeriesFile
+
+    ### Public Methods ###
+
+    def record(self, key, when, value):
+        """
+        Record a sample of a metric, creating its file if needed.
+        """
+        f = self._files.get(key)
+        if f is None:
+            f = self._open(key, True)
+        f.record(when, value)
+
+    def fetch(self, key, start, end=None, step=None):
+        """
+        Get the samples of a metric, see L{TimeSeriesFile.fetch}.
+
+        @raises KeyError: if no sample of the metric was recorded
+        """
+        f = self._files.get(key)
+        if f is None:
+            f = self._open(key, False)
+        return f.fetch(start, end, step)
+
+    def getKeys(self):
+        """
+        @returns: the metrics recorded in the directory
+        @rtype:   list of str
+        """
+        keys = set(self._files.keys())
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                keys.add(name[:-len(SUFFIX)])
+        keys = list(keys)
+        keys.sort()
+        return keys
+
+    def flush(self):
+        """
+        Write the samples recorded since the last flush to disk.
+        """
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    ### Private Methods ###
+
+    def _open(self, key, create):
+        if not key or os.sep in key or key.startswith('.'):
+            raise KeyError(key)
+        path = os.path.join(self.directory, key + SUFFIX)
+        if not create and not os.path.exists(path):
+            raise KeyError(key)
+        self.debug('opening time series file %s', path)
+        f = TimeSeriesFile(path, self._archives)
+        self._files[key] = f
+        return f
@@ -19,8 +19,12 @@
 
 # Headers in this file shall remain intact.
 
+import copy
 import struct
 import socket
+import time
+
+from collections import deque
 
 from twisted.web import http, server
 from twisted.web import resource as web_resource
@@ -31,7 +35,7 @@ from flumotion.configure import configure
 from flumotion.common import errors
 from flumotion.twisted.credentials import cryptChallenge
 
-from flumotion.common import common, log, keycards
+from flumotion.common import common, log, keycards, python
 
 #__all__ = ['HTTPStreamingResource', 'MultifdSinkStreamer']
 __version__ = "$Rev$"
@@ -70,6 +74,15 @@ class Issuer(log.Loggable):
         """
         raise NotImplementedError
 
+    def getCacheKey(self, keycard):
+        """
+        Return a key identifying the credentials on a keycard I issued,
+        so that a bouncer's decision on them can be reused for other
+        keycards with the same credentials; or None if decisions should
+        not be reused.
+        """
+        return None
+
 
 class HTTPGenericIssuer(Issuer):
     """
@@ -101,6 +114,11 @@ class HTTPAuthIssuer(Issuer):
             keycard.username, keycard.password, keycard.address))
         return keycard
 
+    def getCacheKey(self, keycard):
+        # don't keep the password around in the clear
+        return (keycard.username, python.md5(keycard.password).digest(),
+                keycard.address)
+
 
 class HTTPTokenIssuer(Issuer):
     """
@@ -122,6 +140,9 @@ class HTTPTokenIssuer(Issuer):
             request.getClientIP(), request.path)
         return keycard
 
+    def getCacheKey(self, keycard):
+        return (keycard.token, keycard.address, keycard.path)
+
 
 class HTTPGetArgumentsIssuer(Issuer):
     """
@@ -135,10 +156,39 @@ class HTTPGetArgumentsIssuer(Issuer):
         path = request.path
         return keycards.KeycardHTTPGetArguments(arguments, address, path)
 
+    def getCacheKey(self, keycard):
+        arguments = []
+        for name, values in keycard.arguments.items():
+            if isinstance(values, list):
+                values = tuple(values)
+            arguments.append((name, values))
+        arguments.sort()
+        return (tuple(arguments), keycard.address, keycard.path)
+
 
 BOUNCER_SOCKET = 'flumotion.component.bouncers.plug.BouncerPlug'
 
 
+class _Decision:
+    """
+    A remote bouncer's decision on the credentials of a keycard.
+
+    @ivar keycard: the keycard the bouncer authenticated, or None if it
+                   refused it
+    @ivar fds:     the requests using the keycard
+    @type fds:     dict of int -> None
+    @ivar expired: whether the bouncer expired the keycard
+    """
+
+    def __init__(self, key, keycard, decided, expires):
+        self.key = key
+        self.keycard = keycard
+        self.decided = decided
+        self.expires = expires
+        self.fds = {}
+        self.expired = False
+
+
 class HTTPAuthentication(log.Loggable):
     """
     Helper object for handling HTTP authentication for twisted.web
@@ -150,6 +200,7 @@ class HTTPAuthentication(log.Loggable):
     KEYCARD_TTL = 60 * 60
     KEYCARD_KEEPALIVE_INTERVAL = 20 * 60
     KEYCARD_TRYAGAIN_INTERVAL = 1 * 60
+    DECISION_CACHE_TTL = 1 * 60
 
     def __init__(self, component):
         self.component = component
@@ -166,6 +217,17 @@ class HTTPAuthentication(log.Loggable):
         self._pendingCleanups = []
         self._keepAlive = None
 
+        # decisions of the remote bouncer, reused for requests with the
+        # same credentials
+        self._cacheSize = 0
+        self._cacheTTL = None
+        self._decisions = {}           # cache key -> _Decision
+        self._decisionOrder = deque()  # _Decision, oldest first
+        self._idToDecision = {}        # keycard id -> _Decision
+        self._pendingDecisions = {}    # cache key -> [(Deferred, Keycard)]
+        self._cacheHits = 0
+        self._cacheMisses = 0
+
         if (BOUNCER_SOCKET in self.component.plugs
             and self.component.plugs[BOUNCER_SOCKET]):
             assert len(self.component.plugs[BOUNCER_SOCKET]) == 1
@@ -229,6 +291,31 @@ class HTTPAuthentication(log.Loggable):
     def setDefaultDuration(self, defaultDuration):
         self._defaultDuration = defaultDuration
 
+    def setDecisionCache(self, size, ttl=None):
+        """
+        Reuse the decisions of the remote bouncer for requests with the
+        same credentials, so that they are not sent to the manager.
+
+        A decision is reused for at most ttl seconds. The bouncer can
+        revoke it earlier by expiring its keycard, which also drops the
+        requests using it. Only the credentials issued by token,
+        GET arguments and HTTP authentication issuers are cached.
+
+        @param size: how many decisions to keep, or 0 not to keep any
+        @type  size: int
+        @param ttl:  how many seconds to reuse a decision for, or None
+                     for DECISION_CACHE_TTL
+        @type  ttl:  float
+        """
+        if ttl is None:
+            ttl = self.DECISION_CACHE_TTL
+        self._cacheSize = size
+        self._cacheTTL = ttl
+        uiState = getattr(self.component, 'uiState', None)
+        if size and uiState is not None:
+            uiState.addKey('auth-cache-hits', self._cacheHits)
+            uiState.addKey('auth-cache-misses', self._cacheMisses)
+
     def setIssuerClass(self, issuerClass):
         # FIXME: in the future, we want to make this pluggable and have it
         # look up somewhere ?
@@ -265,10 +352,119 @@ class HTTPAuthentication(log.Loggable):
             return defer.succeed(keycard)
         else:
             keycard.ttl = self.KEYCARD_TTL
+            key = None
+            if self._cacheSize:
+                key = self._issuer.getCacheKey(keycard)
+            if key is not None:
+                return self._authenticateCached(key, keycard)
             self.debug('sending keycard to remote bouncer %r',
                        self.bouncerName)
             return self.authenticateKeycard(self.bouncerName, keycard)
 
+    def _authenticateCached(self, key, keycard):
+        decision = self._getDecision(key)
+        if decision is not None:
+            self._countCache(hit=True)
+            return defer.succeed(self._useDecision(decision, keycard))
+        if key in self._pendingDecisions:
+            # the same credentials are already being authenticated
+            self._countCache(hit=True)
+            d = defer.Deferred()
+            self._pendingDecisions[key].append((d, keycard))
+            return d
+
+        self._countCache(hit=False)
+        self.debug('sending keycard to remote bouncer %r',
+                   self.bouncerName)
+        self._pendingDecisions[key] = []
+        d = self.authenticateKeycard(self.bouncerName, keycard)
+        d.addBoth(self._decided, key, keycard)
+        return d
+
+    def _decided(self, result, key, keycard):
+        waiting = self._pendingDecisions.pop(key)
+        if isinstance(result, failure.Failure):
+            for d, _ in waiting:
+                d.errback(result)
+            return result
+
+        if result and result.state != keycards.AUTHENTICATED:
+            # not a decision yet; the others have to ask for themselves
+            for d, waitingKeycard in waiting:
+                self.authenticateKeycard(self.bouncerName,
+                                         waitingKeycard).chainDeferred(d)
+            return result
+
+        now = time.time()
+        expires = now + self._cacheTTL
+        if result and result.duration:
+            expires = min(expires, now + result.duration)
+        decision = _Decision(key, result, now, expires)
+        self._addDecision(decision)
+        for d, waitingKeycard in waiting:
+            d.callback(self._useDecision(decision, waitingKeycard))
+        return self._useDecision(decision, keycard)
+
+    def _countCache(self, hit):
+        if hit:
+            self._cacheHits += 1
+            key, value = 'auth-cache-hits', self._cacheHits
+        else:
+            self._cacheMisses += 1
+            key, value = 'auth-cache-misses', self._cacheMisses
+        uiState = getattr(self.component, 'uiState', None)
+        if uiState is not None:
+            uiState.set(key, value)
+
+    def _getDecision(self, key):
+        decision = self._decisions.get(key)
+        if decision is not None and decision.expires <= time.time():
+            self._retireDecision(decision)
+            return None
+        return decision
+
+    def _useDecision(self, decision, keycard):
+        # every request gets its own copy of the authenticated keycard
+        if decision.keycard is None:
+            return None
+        authenticated = copy.copy(decision.keycard)
+        authenticated._fd = keycard._fd
+        if authenticated.duration:
+            authenticated.duration -= time.time() - decision.decided
+        return authenticated
+
+    def _addDecision(self, decision):
+        now = time.time()
+        # decisions are added in about the order they expire in
+        order = self._decisionOrder
+        while order and (len(self._decisions) >= self._cacheSize
+                         or order[0].expires <= now):
+            self._retireDecision(order.popleft())
+        self._decisions[decision.key] = decision
+        order.append(decision)
+        if decision.keycard is not None:
+            self._idToDecision[decision.keycard.id] = decision
+
+    def _retireDecision(self, decision):
+        # stop reusing a decision; its keycard is cleaned up once the
+        # last request using it is done
+        if self._decisions.get(decision.key) is decision:
+            del self._decisions[decision.key]
+        self._releaseDecision(decision)
+
+    def _releaseDecision(self, decision):
+        if decision.fds or decision.keycard is None:
+            return
+        if self._decisions.get(decision.key) is decision:
+            return
+        if self._idToDecision.get(decision.keycard.id) is not decision:
+            return
+        del self._idToDecision[decision.keycard.id]
+        if not decision.expired:
+            self.debug('asking bouncer %s to remove cached keycard id %s',
+                       self.bouncerName, decision.keycard.id)
+            self.doCleanupKeycard(self.bouncerName, decision.keycard)
+
     def authenticateKeycard(self, bouncerName, keycard):
         return self.component.medium.authenticate(bouncerName, keycard)
 
@@ -306,16 +502,23 @@ class HTTPAuthentication(log.Loggable):
     def cleanupAuth(self, fd):
         if self.bouncerName and fd in self._fdToKeycard:
             keycard = self._fdToKeycard[fd]
-            self.debug('[fd %5d] asking bouncer %s to remove keycard id %s',
-                       fd, self.bouncerName, keycard.id)
-            self.doCleanupKeycard(self.bouncerName, keycard)
+            # cached keycards are cleaned up with their decision
+            if keycard.id not in self._idToDecision:
+                self.debug('[fd %5d] asking bouncer %s to remove keycard '
+                           'id %s', fd, self.bouncerName, keycard.id)
+                self.doCleanupKeycard(self.bouncerName, keycard)
         self._removeKeycard(fd)
 
     def _removeKeycard(self, fd):
         if self.bouncerName and fd in self._fdToKeycard:
             keycard = self._fdToKeycard[fd]
             del self._fdToKeycard[fd]
-            del self._idToKeycard[keycard.id]
+            decision = self._idToDecision.get(keycard.id)
+            if decision is None:
+                del self._idToKeycard[keycard.id]
+            else:
+                del decision.fds[fd]
+                self._releaseDecision(decision)
         if fd in self._fdToDurationCall:
             self.debug('[fd %5d] canceling later expiration call' % fd)
             self._fdToDurationCall[fd].cancel()
@@ -338,6 +541,11 @@ class HTTPAuthentication(log.Loggable):
         """
         Expire a client's connection associated with the keycard Id.
         """
+        decision = self._idToDecision.get(keycardId)
+        if decision is not None:
+            self._expireDecision(decision)
+            return
+
         keycard = self._idToKeycard[keycardId]
         fd = keycard._fd
 
@@ -348,6 +556,18 @@ class HTTPAuthentication(log.Loggable):
         self.debug('[fd %5d] asking streamer to remove client' % fd)
         self.clientDone(fd)
 
+    def _expireDecision(self, decision):
+        # the bouncer revoked a cached decision, and forgot its keycard
+        self.debug('bouncer expired cached keycard id %s, used by %d '
+                   'clients', decision.keycard.id, len(decision.fds))
+        decision.expired = True
+        fds = decision.fds.keys()
+        self._retireDecision(decision)
+        for fd in fds:
+            self._removeKeycard(fd)
+            self.debug('[fd %5d] asking streamer to remove client' % fd)
+            self.clientDone(fd)
+
     def expireKeycards(self, keycardIds):
         """
         Expire client's connections associated with the keycard Ids.
@@ -382,7 +602,16 @@ class HTTPAuthentication(log.Loggable):
         if request.method == 'GET':
             fd = request.transport.fileno()
 
+            decision = None
             if self.bouncerName:
+                decision = self._idToDecision.get(keycard.id)
+            if decision is not None:
+                # the request was finished before the callback was executed
+                if fd == -1:
+                    return None
+                self._fdToKeycard[fd] = keycard
+                decision.fds[fd] = None
+            elif self.bouncerName:
                 # the request was finished before the callback was executed
                 if fd == -1:
                     self.debug('Request interrupted before authentification '
@@ -83,6 +83,7 @@ preferred, albeit not strictly necessary, that callers of authenticate()
 call removeKeycardId when the keycard is no longer used.
 """
 
+import heapq
 import random
 import time
 
@@ -101,6 +102,67 @@ __version__ = "$Rev$"
 EXPIRE_BLOCK_SIZE = 100
 
 
+class _ExpiryIndex:
+    """
+    I keep ids ordered by the time they expire at, so that expiring them
+    only costs as much as the number of ids that expire.
+
+    Time is counted as the expirer says it passes, so ids expire on the
+    first expirer call at or after their deadline.
+
+    @ivar now: the time that has passed so far
+    @type now: float
+    """
+
+    def __init__(self):
+        self.now = 0
+        self._deadlines = {} # id -> deadline
+        self._heap = [] # (deadline, id), including outdated deadlines
+
+    def __contains__(self, id):
+        return id in self._deadlines
+
+    def set(self, id, ttl):
+        """
+        Make an id expire ttl seconds from now, forgetting any earlier
+        deadline it had.
+        """
+        deadline = self.now + ttl
+        self._deadlines[id] = deadline
+        heapq.heappush(self._heap, (deadline, id))
+        # keep alives leave outdated deadlines behind in the heap
+        if len(self._heap) > 2 * len(self._deadlines) + 100:
+            self._heap = [(d, i) for i, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, id):
+        self._deadlines.pop(id, None)
+
+    def getRemaining(self, id):
+        """
+        @returns: the time left before the id expires
+        @rtype:   float
+        """
+        return self._deadlines[id] - self.now
+
+    def advance(self, elapsed):
+        """
+        Let time pass, and forget the ids that expire.
+
+        @returns: the ids that expired and their time left, which is
+                  zero or less, in the order they expired in
+        @rtype:   list of (id, float)
+        """
+        self.now += elapsed
+        expired = []
+        while self._heap and self._heap[0][0] <= self.now:
+            deadline, id = heapq.heappop(self._heap)
+            if self._deadlines.get(id) == deadline:
+                del self._deadlines[id]
+                expired.append((id, deadline - self.now))
+        return expired
+
+
 class BouncerMedium(component.BaseComponentMedium):
 
     logCategory = 'bouncermedium'
@@ -172,6 +234,14 @@ class Bouncer(component.BaseComponent):
         self._idCounter = 0
         self._idFormat = time.strftime('%Y%m%d%H%M%S-%%d')
         self._keycards = {} # keycard id -> Keycard
+        # keycards expire on their own until their issuer keeps them
+        # alive; from then on they expire together with the issuer's
+        # other kept alive keycards
+        self._keycardExpiry = _ExpiryIndex() # keycard ids
+        self._issuerExpiry = _ExpiryIndex() # issuer names
+        # issuerName -> {keycard id -> None}
+        self._notKeptAlive = {}
+        self._keptAlive = {}
 
         self._expirer = Poller(self._expire,
                                self.KEYCARD_EXPIRE_INTERVAL,
@@ -244,11 +314,13 @@ class Bouncer(component.BaseComponent):
                   the expirer poller MAY be stopped.
         @rtype: bool
         """
-        for k in self._keycards.values():
-            if hasattr(k, 'ttl'):
-                k.ttl -= elapsed
-                if k.ttl <= 0:
-                    self.expireKeycardId(k.id)
+        for keycardId, ttl in self._keycardExpiry.advance(elapsed):
+            self._keycards[keycardId].ttl = ttl
+            self.expireKeycardId(keycardId)
+        for issuerName, ttl in self._issuerExpiry.advance(elapsed):
+            for keycardId in self._keptAlive.pop(issuerName):
+                self._keycards[keycardId].ttl = ttl
+                self.expireKeycardId(keycardId)
         return len(self._keycards) > 0
 
     def do_validate(self, keycard):
@@ -311,6 +383,22 @@ class Bouncer(component.BaseComponent):
     def hasKeycard(self, keycard):
         return keycard in self._keycards.values()
 
+    def getKeycardTTL(self, keycard):
+        """
+        The keycard's ttl attribute is only updated when the keycard
+        expires; this is the time it has left now.
+
+        @returns: the time left before the keycard expires, or None if
+                  it does not expire
+        @rtype:   float or None
+        """
+        if keycard.id in self._keycardExpiry:
+            return self._keycardExpiry.getRemaining(keycard.id)
+        issuerName = getattr(keycard, 'issuerName', None)
+        if keycard.id in self._keptAlive.get(issuerName, {}):
+            return self._issuerExpiry.getRemaining(issuerName)
+        return None
+
     def generateKeycardId(self):
         # FIXME: what if it already had one ?
         # FIXME: deal with wraparound ?
@@ -348,6 +436,16 @@ class Bouncer(component.BaseComponent):
             raise KeyError
 
         del self._keycards[keycard.id]
+        self._keycardExpiry.remove(keycard.id)
+        issuerName = getattr(keycard, 'issuerName', None)
+        for index in self._notKeptAlive, self._keptAlive:
+            ids = index.get(issuerName, {})
+            if keycard.id in ids:
+                del ids[keycard.id]
+                if not ids:
+                    del index[issuerName]
+        if issuerName not in self._keptAlive:
+            self._issuerExpiry.remove(issuerName)
         self.on_keycardRemoved(keycard)
 
         self.info("removed keycard with id %s" % keycard.id)
@@ -361,9 +459,19 @@ class Bouncer(component.BaseComponent):
         self.removeKeycard(keycard)
 
     def keepAlive(self, issuerName, ttl):
-        for k in self._keycards.itervalues():
-            if hasattr(k, 'issuerName') and k.issuerName == issuerName:
-                k.ttl = ttl
+        # the issuer's keycards now all expire at the same time; the
+        # ones it keeps alive for the first time stop expiring on their
+        # own
+        ids = self._notKeptAlive.pop(issuerName, {})
+        for keycardId in ids:
+            self._keycardExpiry.remove(keycardId)
+        if issuerName in self._keptAlive:
+            self._keptAlive[issuerName].update(ids)
+        elif ids:
+            self._keptAlive[issuerName] = ids
+        else:
+            return
+        self._issuerExpiry.set(issuerName, ttl)
 
     def expireAllKeycards(self):
         return self.expireKeycardIds(self._keycards.keys())
@@ -420,6 +528,11 @@ class Bouncer(component.BaseComponent):
         Used by sub-class knowing what they do.
         """
         self._keycards[keycard.id] = keycard
+        if hasattr(keycard, 'ttl'):
+            self._keycardExpiry.set(keycard.id, keycard.ttl)
+        if hasattr(keycard, 'issuerName'):
+            ids = self._notKeptAlive.setdefault(keycard.issuerName, {})
+            ids[keycard.id] = None
         self.on_keycardAdded(keycard)
 
         self.debug("added keycard with id %s, ttl %r", keycard.id,
@@ -441,10 +554,12 @@ class AuthSessionBouncer(Bouncer):
     def init(self):
         # Keycards pending to be authenticated
         self._sessions = {} # keycard id -> (ttl, data)
+        self._sessionExpiry = _ExpiryIndex() # ids of sessions with a ttl
 
     def on_disabled(self):
         # Removing all pending authentication
         self._sessions.clear()
+        self._sessionExpiry = _ExpiryIndex()
 
     def do_extractKeycardInfo(self, keycard, oldData):
         """
@@ -546,6 +661,7 @@ class AuthSessionBouncer(Bouncer):
         """
         keycard.state = keycards.REFUSED
         del self._sessions[keycard.id]
+        self._sessionExpiry.remove(keycard.id)
 
     def confirmAuthSession(self, keycard):
         """
@@ -573,6 +689,7 @@ class AuthSessionBouncer(Bouncer):
             return False
 
         del self._sessions[keycardId]
+        self._sessionExpiry.remove(keycardId)
 
         # Check if there already an authenticated keycard with the same id
         if keycardId in self._keycards:
@@ -600,15 +717,13 @@ class AuthSessionBouncer(Bouncer):
         if ttl is None:
             ttl = getattr(keycard, 'ttl', None)
         self._sessions[keycard.id] = (ttl, data)
+        if ttl is not None and keycard.id not in self._sessionExpiry:
+            self._sessionExpiry.set(keycard.id, ttl)
 
     def do_expireKeycards(self, elapsed):
         cont = Bouncer.do_expireKeycards(self, elapsed)
-        for id, (ttl, data) in self._sessions.items():
-            if ttl is not None:
-                ttl -= elapsed
-                self._sessions[id] = (ttl, data)
-                if ttl <= 0:
-                    del self._sessions[id]
+        for id, ttl in self._sessionExpiry.advance(elapsed):
+            del self._sessions[id]
 
         return cont and len(self._sessions) > 0
 
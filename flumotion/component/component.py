@@ -269,6 +269,43 @@ class BaseComponentMedium(medium.PingingMedium):
         """
         return self.comp.uiState
 
+    def remote_getTimeSeries(self, key, start, end=None, step=None):
+        """
+        Get the samples of a UI state key recorded between two times by
+        the time series plug of the component.
+
+        @param start: first time to get, in epoch seconds
+        @type  start: float
+        @param end:   last time to get, in epoch seconds; defaults to the
+                      time of the last sample
+        @type  end:   float or None
+        @param step:  resolution of the samples, in seconds; defaults to
+                      the finest one going back to start
+
+        @returns: the resolution and the (time, average) of the samples
+        @rtype:   tuple of (int, list of (int, float))
+        """
+        if self.comp.timeSeries is None:
+            raise errors.FlumotionError('%s does not record time series'
+                                        % self.comp.name)
+        try:
+            return self.comp.timeSeries.fetch(key, start, end, step)
+        except KeyError:
+            raise errors.FlumotionError('%s has no time series for %s'
+                                        % (self.comp.name, key))
+        except ValueError, e:
+            raise errors.FlumotionError(log.getExceptionMessage(e))
+
+    def remote_getTimeSeriesKeys(self):
+        """
+        @returns: the UI state keys recorded by the time series plug of
+                  the component
+        @rtype:   list of str
+        """
+        if self.comp.timeSeries is None:
+            return []
+        return self.comp.timeSeries.getKeys()
+
     def remote_getMasterClockInfo(self):
         """
         Base implementation of getMasterClockInfo, can be overridden by
@@ -308,6 +345,13 @@ class BaseComponent(common.InitMixin, log.Loggable):
                     - virtual-size: virtual memory size in bytes
                    Subclasses can add additional keys for their respective UI.
     @type uiState: L{componentui.WorkerComponentUIState}
+    @ivar uiBatchWindow: seconds to batch changes to UI states for, from
+                         the ui-batch-window property of components that
+                         have one; None to send them right away
+    @type uiBatchWindow: float or None
+    @ivar timeSeries: time series of the statistics of the component,
+                      recorded by a time series plug; None without one
+    @type timeSeries: L{flumotion.common.timeseries.TimeSeriesStore}
 
     @cvar componentMediumClass: the medium class to use for this component
     @type componentMediumClass: child class of L{BaseComponentMedium}
@@ -363,9 +407,14 @@ class BaseComponent(common.InitMixin, log.Loggable):
         self.uiState.addKey('virtual-size')
         self.uiState.addKey('total-memory')
 
+        self.uiBatchWindow = self.config.get('properties', {}).get(
+            'ui-batch-window', None)
+        self.uiState.setBatchWindow(self.uiBatchWindow)
+
         self.uiState.addHook(self)
 
         self.plugs = {}
+        self.timeSeries = None
 
         self._happyWaits = []
 
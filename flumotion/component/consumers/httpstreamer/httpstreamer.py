@@ -521,6 +521,10 @@ class MultifdSinkStreamer(feedcomponent.ParseLaunchComponent, Stats):
         if 'issuer-class' in properties:
             self.httpauth.setIssuerClass(properties['issuer-class'])
 
+        if 'auth-cache-size' in properties:
+            self.httpauth.setDecisionCache(properties['auth-cache-size'],
+                                           properties.get('auth-cache-ttl'))
+
         if 'duration' in properties:
             self.httpauth.setDefaultDuration(
                 float(properties['duration']))
@@ -524,5 +524,5 @@ class HTTPRoot(web_resource.Resource, log.Loggable):
         self.debug("[fd %5d] Incoming request %r for path %s",
             request.transport.fileno(), request, fullPath)
         r = web_resource.Resource.getChildWithDefault(self, fullPath, request)
-        self.debug("Returning resource %r" % r)
+        self.debug("Returning resource %r", r)
         return r
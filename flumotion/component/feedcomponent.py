@@ -68,6 +68,7 @@ class FeedComponentMedium(basecomponent.BaseComponentMedium):
         self._eaterFeedServer = {}  # fullFeedId -> (host, port) tuple
                                     # for remote eaters
         self._eaterPendingConnections = {} # feederName -> cancel thunk
+        self._localEaters = set() # eaterAliases connected by the worker
         self.logName = component.name
 
     ### Referenceable remote methods which can be called from manager
@@ -118,14 +119,32 @@ class FeedComponentMedium(basecomponent.BaseComponentMedium):
 
         Called on by the manager-side ComponentAvatar.
         """
-        if self._feederFeedServer.get(eaterAlias):
+        if (self._feederFeedServer.get(eaterAlias)
+            and eaterAlias not in self._localEaters):
             if self._feederFeedServer[eaterAlias] == (fullFeedId, host, port):
                 self.debug("Feed:%r is the same as the current one. "\
                            "Request ignored.", (fullFeedId, host, port))
                 return
+        self._localEaters.discard(eaterAlias)
         self._feederFeedServer[eaterAlias] = (fullFeedId, host, port)
         return self.connectEater(eaterAlias)
 
+    def remote_eatFromLocal(self, eaterAlias, fullFeedId, host, port):
+        """
+        Tell the component that the worker connected a local eater to a
+        feeder running on the same worker, and the host and port of the
+        FeedServer through which it can reconnect to it.
+
+        Called on by the manager-side ComponentAvatar.
+        """
+        cancel = self._feederPendingConnections.pop(eaterAlias, None)
+        if cancel:
+            self.debug('cancelling previous connection attempt on %s',
+                       eaterAlias)
+            cancel()
+        self._localEaters.add(eaterAlias)
+        self._feederFeedServer[eaterAlias] = (fullFeedId, host, port)
+
     def _getAuthenticatorForFeed(self, eaterAliasOrFeedName):
         # The avatarId on the keycards issued by the authenticator will
         # identify us to the remote component. Attempt to use our
@@ -107,7 +107,8 @@ class FeedComponent(basecomponent.BaseComponent):
                 self.uiState.append('eaters', self.eaters[eaterAlias].uiState)
 
         for feederName in feeder_config:
-            self.feeders[feederName] = Feeder(feederName)
+            self.feeders[feederName] = Feeder(feederName,
+                                              self.uiBatchWindow)
             self.uiState.append('feeders',
                                  self.feeders[feederName].uiState)
 
@@ -38,8 +38,16 @@ class Feeder:
     @ivar uiState: the serializable UI State for this feeder
     """
 
-    def __init__(self, feederName):
+    def __init__(self, feederName, batchWindow=None):
+        """
+        @param batchWindow: the batch window of the UI states of the
+                            feeder's clients, see
+                            L{flumotion.twisted.flavors.StateCacheable.
+                            setBatchWindow}
+        @type  batchWindow: float or None
+        """
         self.feederName = feederName
+        self._batchWindow = batchWindow
         self.elementName = 'feeder:' + feederName
         self.payName = self.elementName + '-pay'
         self.uiState = componentui.WorkerComponentUIState()
@@ -65,7 +73,7 @@ class Feeder:
         """
         if clientId not in self._clients:
             # first time we see this client, create an object
-            client = FeederClient(clientId)
+            client = FeederClient(clientId, self._batchWindow)
             self._clients[clientId] = client
             self.uiState.append('clients', client.uiState)
 
@@ -114,8 +122,10 @@ class FeederClient:
     @ivar fd:       file descriptor the client is currently using, or None.
     """
 
-    def __init__(self, clientId):
+    def __init__(self, clientId, batchWindow=None):
         self.uiState = componentui.WorkerComponentUIState()
+        # the stats are set several at a time, and often
+        self.uiState.setBatchWindow(batchWindow)
         self.uiState.addKey('client-id', clientId)
         self.fd = None
         self.uiState.addKey('fd', None)
@@ -19,6 +19,7 @@
 
 # Headers in this file shall remain intact.
 
+import collections
 import errno
 import os
 import stat
@@ -40,6 +41,9 @@ from flumotion.component.misc.httpserver.fileprovider import NotFoundError
 
 SEEK_SET = 0 # os.SEEK_SET is not defined in python 2.4
 FILE_COPY_BUFFER_SIZE = abstract.FileDescriptor.bufferSize
+# the copy buffer grows up to this size while no client waits for data
+MAX_COPY_BUFFER_SIZE = 16 * FILE_COPY_BUFFER_SIZE
+DEFAULT_COPY_WORKERS = 1
 MAX_LOGNAME_SIZE = 30 # maximum number of characters to use for logging a path
 
 
@@ -81,17 +85,21 @@ class FileProviderLocalCachedPlug(fileprovider.FileProviderPlug,
     Multiple instances can share the same cache directory,
     but it's recommended to use slightly different values
     for the property cleanup-high-watermark.
-    I'm using the directory access time to know when
-    the cache usage changed and keep an estimation
-    of the cache usage for statistics.
-
-    I'm creating a unique thread to do the file copying block by block,
-    for all files to be copied to the cache.
-    Using a thread instead of a reactor.callLater 'loop' allow for
+    The cache manager keeps an index of the cached files
+    to estimate the cache usage and to know which files
+    to delete first when cleaning up.
+
+    I'm using a pool of threads to do the file copying block by block,
+    for all files to be copied to the cache; its size is set by
+    the property copy-workers.
+    Using threads instead of a reactor.callLater 'loop' allow for
     higher copy throughput and do not slow down the mail loop when
     lots of files are copied at the same time.
     Simulations with real request logs show that using a thread
     gives better results than the equivalent asynchronous implementation.
+    Each copy session is handled by one worker at a time, and the
+    sessions with clients waiting for data not yet copied are
+    handled first.
     """
 
     logCategory = LOG_CATEGORY
@@ -108,8 +116,9 @@ class FileProviderLocalCachedPlug(fileprovider.FileProviderPlug,
         cleanupEnabled = props.get('cleanup-enabled')
         cleanupHighWatermark = props.get('cleanup-high-watermark')
         cleanupLowWatermark = props.get('cleanup-low-watermark')
+        cacheDirLevels = props.get('cache-dir-levels')
+        copyWorkers = props.get('copy-workers', DEFAULT_COPY_WORKERS)
 
-        self._sessions = {} # {CopySession: None}
         self._index = {} # {path: CopySession}
 
         self.stats = cachestats.CacheStatistics()
@@ -118,20 +127,22 @@ class FileProviderLocalCachedPlug(fileprovider.FileProviderPlug,
                                                cacheDir, cacheSize,
                                                cleanupEnabled,
                                                cleanupHighWatermark,
-                                               cleanupLowWatermark)
+                                               cleanupLowWatermark,
+                                               cacheDirLevels=cacheDirLevels)
 
         common.ensureDir(self._sourceDir, "source")
 
-        # Startup copy thread
-        self._thread = CopyThread(self)
+        # Copy workers, started with the plug
+        self._scheduler = CopyScheduler(self, max(1, copyWorkers))
+        self.stats.setCopyWorkers(self._scheduler.workers)
 
     def start(self, component):
         d = self.cache.setUp()
-        d.addCallback(lambda x: self._thread.start())
+        d.addCallback(lambda x: self._scheduler.start())
         return d
 
     def stop(self, component):
-        self._thread.stop()
+        self._scheduler.stop()
         dl = []
         for s in self._index.values():
             d = s.close()
@@ -197,25 +208,16 @@ class FileProviderLocalCachedPlug(fileprovider.FileProviderPlug,
 
     def activateSession(self, session):
         self.debug("Starting Copy Session '%s' (%d)",
-                   session.logName, len(self._sessions))
-        if session in self._sessions:
-            return
-        self._sessions[session] = None
-        self._activateCopyLoop()
+                   session.logName, len(self._scheduler))
+        self._scheduler.add(session)
 
     def disableSession(self, session):
         self.debug("Stopping Copy Session '%s' (%d)",
-                   session.logName, len(self._sessions))
-        if session in self._sessions:
-            del self._sessions[session]
-        if not self._sessions:
-            self._disableCopyLoop()
-
-    def _activateCopyLoop(self):
-        self._thread.wakeup()
+                   session.logName, len(self._scheduler))
+        self._scheduler.remove(session)
 
-    def _disableCopyLoop(self):
-        self._thread.sleep()
+    def prioritizeSession(self, session):
+        self._scheduler.prioritize(session)
 
 
 class LocalPath(localpath.LocalPath, log.Loggable):
@@ -247,47 +249,195 @@ class LocalPath(localpath.LocalPath, log.Loggable):
         try:
             os.remove(cachePath)
             self.debug("Deleted cached file '%s'", cachePath)
+            self.plug.cache.onCachedFileRemoved(cachePath)
         except OSError, e:
             if e.errno != errno.ENOENT:
                 self.warning("Error deleting file: %s", str(e))
 
 
-class CopyThread(threading.Thread, log.Loggable):
+class CopyScheduler(log.Loggable):
+    """
+    I'm dispatching the active copy sessions to a pool of copy workers.
+
+    A session is never handled by two workers at the same time,
+    because its files are not thread safe. The sessions with pending
+    client reads are queued before the others, so clients waiting
+    for data not yet copied do not wait for the other copies.
+    """
 
     logCategory = LOG_CATEGORY
 
-    def __init__(self, plug):
-        threading.Thread.__init__(self)
+    def __init__(self, plug, workerCount):
         self.plug = plug
+        self.workers = [CopyWorker(self, i) for i in range(workerCount)]
+        self._running = False
+        self._cond = threading.Condition()
+        self._active = {} # {CopySession: None}
+        self._busy = {} # {CopySession: urgent} handled by a worker
+        self._queued = {} # {CopySession: queue}
+        self._urgent = collections.deque()
+        self._ready = collections.deque()
+
+    def __len__(self):
+        return len(self._active)
+
+    def start(self):
         self._running = True
-        self._event = threading.Event()
+        for worker in self.workers:
+            worker.start()
 
     def stop(self):
-        self._running = False
-        self._event.set()
-        self.join()
+        self._cond.acquire()
+        try:
+            self._running = False
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for worker in self.workers:
+            if worker.isAlive():
+                worker.join()
+
+    def add(self, session):
+        self._cond.acquire()
+        try:
+            if session not in self._active:
+                self._active[session] = None
+                self._schedule(session, False)
+        finally:
+            self._cond.release()
+
+    def remove(self, session):
+        self._cond.acquire()
+        try:
+            self._active.pop(session, None)
+            # stale queue entries are skipped by the workers
+            self._queued.pop(session, None)
+        finally:
+            self._cond.release()
+
+    def prioritize(self, session):
+        """
+        Ask for a session to be handled before the sessions without
+        pending client reads.
+        """
+        self._cond.acquire()
+        try:
+            if session in self._busy:
+                self._busy[session] = True
+            elif session in self._active:
+                self._schedule(session, True)
+        finally:
+            self._cond.release()
+
+    def next(self):
+        """
+        Called by the workers to get the next session to handle.
+        Blocks until there is one.
 
-    def wakeup(self):
-        self._event.set()
+        @returns: a CopySession, or None if the workers should stop
+        """
+        self._cond.acquire()
+        try:
+            while self._running:
+                session = self._pop(self._urgent)
+                if session is None:
+                    session = self._pop(self._ready)
+                if session is not None:
+                    self._busy[session] = False
+                    return session
+                self._cond.wait()
+            return None
+        finally:
+            self._cond.release()
 
-    def sleep(self):
-        self._event.clear()
+    def done(self, session, more):
+        """
+        Called by the workers when they are done handling a session.
+
+        @param more: whether the session has more data to copy
+        """
+        self._cond.acquire()
+        try:
+            urgent = self._busy.pop(session)
+            if session in self._active and (more or urgent):
+                self._schedule(session, urgent or session.hasPendingReads())
+        finally:
+            self._cond.release()
+
+    def _schedule(self, session, urgent):
+        # Must be called with the lock held
+        if session in self._busy:
+            # The worker will queue it again when done
+            return
+        queue = self._queued.get(session)
+        if queue is self._urgent or (queue is not None and not urgent):
+            return
+        if urgent:
+            queue = self._urgent
+        else:
+            queue = self._ready
+        # a session moved to the urgent queue leaves a stale entry
+        # in the ready queue, skipped when popped
+        queue.append(session)
+        self._queued[session] = queue
+        self._cond.notify()
+
+    def _pop(self, queue):
+        # Must be called with the lock held
+        while queue:
+            session = queue.popleft()
+            if self._queued.get(session) is queue:
+                del self._queued[session]
+                return session
+        return None
+
+
+class CopyWorker(threading.Thread, log.Loggable):
+    """
+    I'm a thread copying files to the cache, and serving the source
+    file reads delegated by the copy sessions.
+    My statistics are only updated from my thread.
+    """
+
+    logCategory = LOG_CATEGORY
+
+    def __init__(self, scheduler, index):
+        threading.Thread.__init__(self)
+        self.setName("CopyWorker-%d" % index)
+        self.scheduler = scheduler
+        self.index = index
+        self.steps = 0
+        self.readsServed = 0
+        self.bytesServed = 0L
+        self.bytesCopied = 0L
 
     def run(self):
-        while self._running:
-            sessions = self.plug._sessions.keys()
-            for session in sessions:
-                try:
-                    session.doServe()
-                except Exception, e:
-                    log.warning("Error during async file serving: %s",
-                                log.getExceptionMessage(e))
-                try:
-                    session.doCopy()
-                except Exception, e:
-                    log.warning("Error during file copy: %s",
-                                log.getExceptionMessage(e))
-            self._event.wait()
+        while True:
+            session = self.scheduler.next()
+            if session is None:
+                break
+            more = False
+            try:
+                more = self._process(session)
+            finally:
+                self.scheduler.done(session, more)
+
+    def _process(self, session):
+        self.steps += 1
+        try:
+            reads, size = session.doServe()
+            self.readsServed += reads
+            self.bytesServed += size
+        except Exception, e:
+            log.warning("Error during async file serving: %s",
+                        log.getExceptionMessage(e))
+        try:
+            self.bytesCopied += session.doCopy()
+        except Exception, e:
+            log.warning("Error during file copy: %s",
+                        log.getExceptionMessage(e))
+            return False
+        return bool(session.copying)
 
 
 class CopySessionCancelled(Exception):
@@ -299,7 +449,7 @@ class CopySession(log.Loggable):
     I'm serving a file at the same time I'm copying it
     from the network file system to the cache.
     If the client ask for data not yet copied, the source file
-    read operation is delegated the the copy thread as an asynchronous
+    read operation is delegated to the copy workers as an asynchronous
     operation because file seeking/reading is not thread safe.
 
     The copy session have to open two times the temporary file,
@@ -340,6 +490,7 @@ class CopySession(log.Loggable):
         self._refCount = 0
         self._copied = 0 # None when the file is fully copied
         self._correction = 0 # Used to take into account copies data for stats
+        self._copyBufferSize = FILE_COPY_BUFFER_SIZE
         self._startCopyingDefer = self._startCopying()
 
     def outdate(self):
@@ -391,6 +542,7 @@ class CopySession(log.Loggable):
 
                 d.addCallback(updateStats)
                 self._pending.append((position, size, d))
+                self.plug.prioritizeSession(self)
                 return d
             # Not copying, it's safe to read directly
             self._sourceFile.seek(position)
@@ -430,33 +582,55 @@ class CopySession(log.Loggable):
             d.addCallback(lambda _: self._close())
             return d
 
-    def doServe(self):
-        if not (self.copying and self._pending):
-            # Nothing to do anymore.
-            return False
-        # We have pending source file read operations
-        position, size, d = self._pending.pop(0)
-        self._sourceFile.seek(position)
-        data = self._sourceFile.read(size)
-        # Call the deferred in the main thread
-        reactor.callFromThread(d.callback, data)
+    def hasPendingReads(self):
         return len(self._pending) > 0
 
+    def doServe(self):
+        """
+        Serve the pending source file reads.
+        Called in a copy worker context.
+
+        @returns: the number of reads served and the number of bytes read
+        @rtype:   (int, int)
+        """
+        count, total = 0, 0
+        while self.copying and self._pending:
+            position, size, d = self._pending.pop(0)
+            self._sourceFile.seek(position)
+            data = self._sourceFile.read(size)
+            # Call the deferred in the main thread
+            reactor.callFromThread(d.callback, data)
+            count += 1
+            total += len(data)
+        return count, total
+
     def doCopy(self):
-        # Called in the copy thread context.
+        """
+        Copy a buffer from the source file to the temporary writing file.
+        Called in a copy worker context.
+
+        The buffer size doubles after each buffer copied,
+        up to MAX_COPY_BUFFER_SIZE, and drops back to
+        FILE_COPY_BUFFER_SIZE when clients are waiting for data.
+
+        @returns: the number of bytes copied
+        @rtype:   int
+        """
         if not self.copying:
             # Nothing to do anymore.
-            return False
-        # Copy a buffer from the source file to the temporary writing file
-        cont = True
+            return 0
+        if self._pending:
+            self._copyBufferSize = FILE_COPY_BUFFER_SIZE
+        bufferSize = self._copyBufferSize
+        size = 0
         try:
             # It's safe to use self._copied, because it's only set
-            # by the copy thread during copy.
+            # by the copy worker during copy.
             self._sourceFile.seek(self._copied)
-            self._wTempFile.seek(self._copied)
-            data = self._sourceFile.read(FILE_COPY_BUFFER_SIZE)
+            data = self._sourceFile.read(bufferSize)
+            # The writing file is not buffered, the data can be read
+            # from the reading file as soon as it is written
             self._wTempFile.write(data)
-            self._wTempFile.flush()
         except IOError, e:
             self.warning("Failed to copy source file: %s",
                          log.getExceptionMessage(e))
@@ -464,26 +638,24 @@ class CopySession(log.Loggable):
             self.copying = False
             reactor.callFromThread(self.plug.disableSession, self)
             reactor.callFromThread(self._cancelSession)
-            # Do not continue
-            cont = False
-        else:
-            size = len(data)
-            self._copied += size
-            self._correction += size
-            if  size < FILE_COPY_BUFFER_SIZE:
-                # Stop copying
-                self.copying = False
-                reactor.callFromThread(self.plug.disableSession, self)
-                reactor.callFromThread(self._onCopyFinished)
-                cont = False
+            return 0
+        size = len(data)
+        self._copied += size
+        self._correction += size
+        if size < bufferSize:
+            # Stop copying
+            self.copying = False
+            reactor.callFromThread(self.plug.disableSession, self)
+            reactor.callFromThread(self._onCopyFinished)
+        elif bufferSize < MAX_COPY_BUFFER_SIZE:
+            self._copyBufferSize = bufferSize * 2
         # Check for cancellation
         if self._waitCancel and self.copying:
             # Copy has been cancelled
             self.copying = False
             reactor.callFromThread(self.plug.disableSession, self)
             reactor.callFromThread(self._onCopyCancelled, *self._waitCancel)
-            return False
-        return cont
+        return size
 
 
     ## Private Methods ##
@@ -520,7 +692,8 @@ class CopySession(log.Loggable):
         try:
             fd, transientPath = tempfile.mkstemp(".tmp", LOG_CATEGORY)
             self.log("Created transient file '%s'", transientPath)
-            self._wTempFile = os.fdopen(fd, "wb")
+            # Not buffered, so the copied data is readable without flushing
+            self._wTempFile = os.fdopen(fd, "wb", 0)
             self.log("Opened temporary file for writing [fd %d]",
                      self._wTempFile.fileno())
             self._rTempFile = file(transientPath, "rb")
@@ -584,7 +757,7 @@ class CopySession(log.Loggable):
 
     def _onCopyCancelled(self, closeSource, closeTempWrite):
         self.log("Copy session cancelled")
-        # Called when the copy thread really stopped to read/write
+        # Called when the copy worker really stopped to read/write
         self._waitCancel = None
         self.plug.stats.onCopyCancelled(self.size, self._copied)
         # Resolve all pending source read operations
@@ -610,7 +783,7 @@ class CopySession(log.Loggable):
     def _onCopyFinished(self):
         if self._sourceFile is None:
             return
-        # Called when the copy thread really stopped to read/write
+        # Called when the copy worker really stopped to read/write
         self.debug("Finished caching '%s' [fd %d]",
                    self.sourcePath, self._sourceFile.fileno())
         self.plug.stats.onCopyFinished(self.size)
@@ -637,6 +810,7 @@ class CopySession(log.Loggable):
             self._cancelSession()
         try:
             self.log("Renaming temporary file to '%s'", self.cachePath)
+            self.plug.cache.ensureCacheSubdir(self.cachePath)
             os.rename(self.tempPath, self.cachePath)
         except OSError, e:
             if e.errno == errno.ENOENT:
@@ -645,6 +819,8 @@ class CopySession(log.Loggable):
                 self.warning("Failed to rename temporary file: %s",
                              log.getExceptionMessage(e))
             self._cancelSession()
+        else:
+            self.plug.cache.onCachedFileAdded(self.cachePath, self.size)
         # Complete all pending source read operations with the temporary file.
         for position, size, d in self._pending:
             try:
@@ -913,7 +1089,12 @@ class CachedFile(fileprovider.File, log.Loggable):
         self.logName = self.plug.getLogName(self._path, sourceFile.fileno())
         # Opening cached file
         try:
-            cachedFile, cachedInfo = open_stat(cachedPath)
+            try:
+                cachedFile, cachedInfo = open_stat(cachedPath)
+            except NotFoundError:
+                if not self.plug.cache.migrateCachedFile(cachedPath):
+                    raise
+                cachedFile, cachedInfo = open_stat(cachedPath)
             self.log("Opened cached file [fd %d]", cachedFile.fileno())
         except NotFoundError:
             self.debug("Did not find cached file '%s'", cachedPath)
@@ -937,6 +1118,7 @@ class CachedFile(fileprovider.File, log.Loggable):
         self._closeSourceFile(sourceFile)
         # We have a valid cached file, just delegate to it.
         self.debug("Serving cached file '%s'", cachedPath)
+        self.plug.cache.onCachedFileAccessed(cachedPath)
         delegate = CachedFileDelegate(self.plug, cachedPath,
                                       cachedFile, cachedInfo)
         self.stats.onStarted(delegate.size, cachestats.CACHE_HIT)
@@ -946,6 +1128,7 @@ class CachedFile(fileprovider.File, log.Loggable):
         try:
             os.remove(cachePath)
             self.debug("Deleted cached file '%s'", cachePath)
+            self.plug.cache.onCachedFileRemoved(cachePath)
         except OSError, e:
             if e.errno != errno.ENOENT:
                 self.warning("Error deleting cached file: %s", str(e))
@@ -21,11 +21,12 @@
 
 import errno
 import os
+import string
 import tempfile
 import time
 import stat
 
-from twisted.internet import defer, threads, protocol, reactor, utils
+from twisted.internet import defer, threads, protocol, reactor
 
 from flumotion.common import log, common, python, format, errors
 
@@ -38,11 +39,131 @@ DEFAULT_CACHE_DIR = "/tmp/httpserver"
 DEFAULT_CLEANUP_ENABLED = True
 DEFAULT_CLEANUP_HIGH_WATERMARK = 1.0
 DEFAULT_CLEANUP_LOW_WATERMARK = 0.6
+DEFAULT_CACHE_DIR_LEVELS = 0
+MAX_CACHE_DIR_LEVELS = 3
 ID_CACHE_MAX_SIZE = 1024
+ID_LENGTH = 40
 TEMP_FILE_POSTFIX = ".tmp"
 
 
+class CacheIndex(object):
+    """
+    I keep track of the files in the cache and of their size,
+    ordered from the least to the most recently used.
+    All my operations are done in constant time.
+    """
+
+    def __init__(self):
+        self._entries = {} # {path: [previous, next, path, size]}
+        # Circular doubly linked list, the oldest entry is after the root
+        self._root = root = []
+        root[:] = [root, root, None, 0]
+        self.totalSize = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __iter__(self):
+        """
+        Iterate over (path, size) tuples from the oldest to the newest.
+        """
+        root = self._root
+        link = root[1]
+        while link is not root:
+            yield link[2], link[3]
+            link = link[1]
+
+    def _link(self, entry, before):
+        previous = before[0]
+        entry[0], entry[1] = previous, before
+        previous[1] = before[0] = entry
+
+    def _unlink(self, entry):
+        previous, next = entry[0], entry[1]
+        previous[1] = next
+        next[0] = previous
+
+    def add(self, path, size):
+        """
+        Add or replace a file as the most recently used one.
+
+        @return: the size of the replaced file or None
+        """
+        old = self.remove(path)
+        entry = [None, None, path, size]
+        self._link(entry, self._root)
+        self._entries[path] = entry
+        self.totalSize += size
+        return old
+
+    def addOldest(self, path, size):
+        """
+        Add a file as the least recently used one,
+        unless it is already known.
+        """
+        if path in self._entries:
+            return
+        entry = [None, None, path, size]
+        self._link(entry, self._root[1])
+        self._entries[path] = entry
+        self.totalSize += size
+
+    def touch(self, path):
+        """
+        Mark a file as the most recently used one.
+        """
+        entry = self._entries.get(path)
+        if entry is not None:
+            self._unlink(entry)
+            self._link(entry, self._root)
+
+    def remove(self, path):
+        """
+        @return: the size of the removed file or None
+        """
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return None
+        self._unlink(entry)
+        self.totalSize -= entry[3]
+        return entry[3]
+
+    def popOldest(self):
+        """
+        Remove the least recently used file.
+
+        @return: a tuple (path, size) or None if the index is empty
+        """
+        entry = self._root[1]
+        if entry is self._root:
+            return None
+        self.remove(entry[2])
+        return entry[2], entry[3]
+
+
 class CacheManager(object, log.Loggable):
+    """
+    I manage the cache directory and its usage.
+
+    I keep an in-memory index of the cached files, ordered by last access,
+    seeded by scanning the cache directory in a thread the first time the
+    cache usage is needed and then updated by every operation done through
+    me. Cleaning up the cache only touches the evicted files.
+
+    If the cache directory is shared with other processes, I only know
+    about their files from the last scan; the directory is scanned again
+    when a cleanup cannot free enough space from the index.
+
+    Cached files can be spread in sub-directories named after the first
+    hex digits of their identifier, one level of 256 sub-directories for
+    each cache directory level, to keep the directories small. Cached
+    files found in another layout by the initial scan are moved to the
+    configured one; until the scan is done, cached files that are not
+    found are looked for in the other layouts.
+    """
 
     logCategory = LOG_CATEGORY
 
@@ -52,7 +173,8 @@ class CacheManager(object, log.Loggable):
                  cleanupEnabled = None,
                  cleanupHighWatermark = None,
                  cleanupLowWatermark = None,
-                 cacheRealm = None):
+                 cacheRealm = None,
+                 cacheDirLevels = None):
 
         if cacheDir is None:
             cacheDir = DEFAULT_CACHE_DIR
@@ -64,6 +186,8 @@ class CacheManager(object, log.Loggable):
             cleanupHighWatermark = DEFAULT_CLEANUP_HIGH_WATERMARK
         if cleanupLowWatermark is None:
             cleanupLowWatermark = DEFAULT_CLEANUP_LOW_WATERMARK
+        if cacheDirLevels is None:
+            cacheDirLevels = DEFAULT_CACHE_DIR_LEVELS
 
         self.stats = stats
         self._cacheDir = cacheDir
@@ -71,21 +195,32 @@ class CacheManager(object, log.Loggable):
         self._cleanupEnabled = cleanupEnabled
         highWatermark = max(0.0, min(1.0, float(cleanupHighWatermark)))
         lowWatermark = max(0.0, min(1.0, float(cleanupLowWatermark)))
+        self._cacheDirLevels = max(0, min(MAX_CACHE_DIR_LEVELS,
+                                          int(cacheDirLevels)))
 
         self._cachePrefix = (cacheRealm and (cacheRealm + ":")) or ""
 
         self._identifiers = {} # {path: identifier}
+        self._identifierOrder = CacheIndex() # Least recently used first
 
         self.info("Cache Manager initialized")
         self.debug("Cache directory: '%s'", self._cacheDir)
         self.debug("Cache size: %d bytes", self._cacheSize)
         self.debug("Cache cleanup enabled: %s", self._cleanupEnabled)
+        self.debug("Cache directory levels: %d", self._cacheDirLevels)
 
         common.ensureDir(self._cacheDir, "cache")
+        # Directories known to exist
+        self._cacheSubdirs = set([self._cacheDir])
+        # True until the initial scan moved all the cached files
+        # to the configured layout
+        self._migrating = True
+
+        self._index = CacheIndex()
+        self._scanWaiters = None # [Deferred] while scanning the cache
 
         self._cacheUsage = None
         self._cacheUsageLastUpdate = None
-        self._lastCacheTime = None
 
         self._cacheMaxUsage = self._cacheSize * highWatermark # in bytes
         self._cacheMinUsage = self._cacheSize * lowWatermark # in bytes
@@ -104,20 +239,24 @@ class CacheManager(object, log.Loggable):
         """
         The returned identifier is a digest of the path encoded in hex string.
         The hash function used is SHA1.
-        It caches the identifiers in a dictionary indexed by path and with
-        a maximum number of entry specified by the constant ID_CACHE_MAX_SIZE.
+        It caches the identifiers of the most recently used paths,
+        up to the number specified by the constant ID_CACHE_MAX_SIZE.
 
         @return: an identifier for path.
         """
         ident = self._identifiers.get(path, None)
-        if ident is None:
-            hash = python.sha1()
-            hash.update(self._cachePrefix + path)
-            ident = hash.digest().encode("hex").strip('\n')
-            # Prevent the cache from growing endlessly
-            if len(self._identifiers) >= ID_CACHE_MAX_SIZE:
-                self._identifiers.clear()
-            self._identifiers[path] = ident
+        if ident is not None:
+            self._identifierOrder.touch(path)
+            return ident
+        hash = python.sha1()
+        hash.update(self._cachePrefix + path)
+        ident = hash.digest().encode("hex").strip('\n')
+        self._identifiers[path] = ident
+        self._identifierOrder.add(path, 0)
+        # Prevent the cache from growing endlessly
+        if len(self._identifiers) > ID_CACHE_MAX_SIZE:
+            oldest, _ = self._identifierOrder.popOldest()
+            del self._identifiers[oldest]
         return ident
 
     def getCachePath(self, path):
@@ -125,7 +264,37 @@ class CacheManager(object, log.Loggable):
         @return: the cached file path for a path.
         """
         ident = self.getIdentifier(path)
-        return os.path.join(self._cacheDir, ident)
+        return self._getLayoutPath(ident, self._cacheDirLevels)
+
+    def ensureCacheSubdir(self, cachePath):
+        """
+        Create the directory of a cached file path if needed.
+        Must be called before creating a file at a path
+        returned by getCachePath().
+
+        @raise: OSError
+        """
+        dirname = os.path.dirname(cachePath)
+        if dirname in self._cacheSubdirs:
+            return
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._cacheSubdirs.add(dirname)
+
+    def migrateCachedFile(self, cachePath):
+        """
+        Move a cached file not found at a path returned by getCachePath()
+        from another cache directory layout, as long as the initial scan
+        did not move all of them.
+
+        @return: True if the cached file has been moved to cachePath.
+        """
+        if not self._migrating:
+            return False
+        return self._migrateFile(os.path.basename(cachePath))
 
     def getTempPath(self, path):
         """
@@ -152,75 +321,174 @@ class CacheManager(object, log.Loggable):
         @return: a defered with the cache usage in bytes.
         @raise: OSError or FlumotionError
         """
+        # Only scan the cache directory the first time,
+        # afterward the cache usage is kept up to date by the index
+        if self._cacheUsage is None:
+            return self._scanCache()
+        return defer.succeed(self._cacheUsage)
 
-        # Only calculate cache usage if the cache directory
-        # modification time changed since the last time we looked at it.
-        try:
-            cacheTime = os.path.getmtime(self._cacheDir)
-        except OSError, e:
-            return defer.fail(e)
-
-        if ((self._cacheUsage is None) or (self._lastCacheTime < cacheTime)):
-            self._lastCacheTime = cacheTime
-            self.log('Getting disk usage for path %r', self._cacheDir)
-            d = utils.getProcessOutput('du', ['-bs', self._cacheDir])
-            d.addCallback(lambda o: int(o.split('\t', 1)[0]))
-            d.addCallback(self._updateCacheUsage)
+    def onCachedFileAdded(self, path, size):
+        """
+        Inform me that a cached file has been completed.
+        Its size has to be allocated with allocateCacheSpace first.
+        """
+        old = self._index.add(path, size)
+        if old is not None and self._cacheUsage is not None:
+            # An older version of the file has been replaced
+            self._cacheUsage -= old
+            self.updateCacheUsageStatistics()
+
+    def onCachedFileAccessed(self, path):
+        """
+        Inform me that a cached file has been used.
+        """
+        self._index.touch(path)
+
+    def onCachedFileRemoved(self, path):
+        """
+        Inform me that a cached file has been deleted.
+        """
+        size = self._index.remove(path)
+        if size is not None and self._cacheUsage is not None:
+            self._cacheUsage -= size
+            self.updateCacheUsageStatistics()
+
+    def _getLayoutPath(self, ident, levels):
+        parts = [ident[i * 2:i * 2 + 2] for i in range(levels)]
+        parts.append(ident)
+        return os.path.join(self._cacheDir, *parts)
+
+    def _isIdentifier(self, name):
+        return len(name) == ID_LENGTH and not name.strip(string.hexdigits)
+
+    def _migrateFile(self, ident):
+        # May be called in a thread
+        cachePath = self._getLayoutPath(ident, self._cacheDirLevels)
+        for levels in range(MAX_CACHE_DIR_LEVELS + 1):
+            if levels == self._cacheDirLevels:
+                continue
+            oldPath = self._getLayoutPath(ident, levels)
+            try:
+                self.ensureCacheSubdir(cachePath)
+                os.rename(oldPath, cachePath)
+                return True
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    # TODO: is warning() thread safe?
+                    self.warning("Error moving cached file: %s", str(e))
+        return False
+
+    def _listCacheDir(self):
+        # Called in a thread
+        files = []
+        usage = 0
+        migrated = 0
+        # Files moved to a directory the walk has not visited yet are
+        # listed again there
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self._cacheDir):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                if path in seen:
+                    continue
+                if self._isIdentifier(f):
+                    cachePath = self._getLayoutPath(f, self._cacheDirLevels)
+                    if path != cachePath:
+                        if os.path.exists(cachePath):
+                            # Already cached again in the configured layout
+                            self._rmfiles([path])
+                            continue
+                        if not self._migrateFile(f):
+                            continue
+                        path = cachePath
+                        migrated += 1
+                seen.add(path)
+                try:
+                    info = os.stat(path)
+                except OSError, e:
+                    if e.errno == errno.ENOENT:
+                        continue
+                    raise
+                usage += info.st_size
+                # Temporary files are accounted but never cleaned up
+                if not f.endswith(TEMP_FILE_POSTFIX):
+                    files.append((info.st_atime, path, info.st_size))
+        files.sort()
+        return files, usage, migrated
+
+    def _scanCache(self):
+        d = defer.Deferred()
+        if self._scanWaiters is not None:
+            # Already scanning the cache directory
+            self._scanWaiters.append(d)
             return d
-        else:
-            return defer.succeed(self._cacheUsage)
+        self._scanWaiters = [d]
+        self.log('Scanning cache directory %r', self._cacheDir)
+        sd = threads.deferToThread(self._listCacheDir)
+        sd.addCallbacks(self._cbCacheScanned, self._ebCacheScanFailed)
+        return d
+
+    def _cbCacheScanned(self, (files, usage, migrated)):
+        # Files used since the scan started are already in the index;
+        # add the others, newest first, as the least recently used ones.
+        files.reverse()
+        for atime, path, size in files:
+            self._index.addOldest(path, size)
+        self.debug('Found %d files in cache directory %r',
+                   len(files), self._cacheDir)
+        if migrated:
+            self.info('Moved %d cached files to a layout with %d '
+                      'directory levels', migrated, self._cacheDirLevels)
+        self._migrating = False
+        waiters, self._scanWaiters = self._scanWaiters, None
+        self._updateCacheUsage(usage)
+        for d in waiters:
+            d.callback(usage)
+
+    def _ebCacheScanFailed(self, failure):
+        self.warning('Failed to scan cache directory %r: %s',
+                     self._cacheDir, log.getFailureMessage(failure))
+        waiters, self._scanWaiters = self._scanWaiters, None
+        for d in waiters:
+            d.errback(failure)
 
     def _rmfiles(self, files):
-        try:
-            for path in files:
+        for path in files:
+            try:
                 os.remove(path)
-        except OSError, e:
-            if e.errno != errno.ENOENT:
-                # TODO: is warning() thread safe?
-                self.warning("Error cleaning cached file: %s", str(e))
-
-    def _setCacheUsage(self, _, usage):
-        # Update the cache usage
-        self._cacheUsage = usage
-        self._cacheUsageLastUpdate = time.time()
-        return usage
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    # TODO: is warning() thread safe?
+                    self.warning("Error cleaning cached file: %s", str(e))
 
     def _cleanUp(self):
         # Update cleanup statistics
         self.stats.onCleanup()
-        # List the cached files with file state
-        try:
-            listdir = os.listdir(self._cacheDir)
-        except OSError, e:
-            return defer.fail(e)
-
-        files = []
-        for f in listdir:
-            f = os.path.join(self._cacheDir, f)
-            # There's a possibility of getting an error on os.stat here.
-            try:
-                files.append((f, os.stat(f)))
-            except OSError, e:
-                if e.errno == errno.ENOENT:
-                    pass
-                else:
-                    return defer.fail(e)
-
-        # Calculate the cached file total size
-        usage = sum([d[1].st_size for d in files])
-        # Delete the cached file starting by the oldest accessed ones
-        files.sort(key=lambda d: d[1].st_atime)
+        # Evict the least recently used files until the cache usage
+        # drops below the low watermark
         rmlist = []
-        for path, info in files:
-            usage -= info.st_size
-            rmlist.append(path)
-            if usage <= self._cacheMinUsage:
-                # We reach the cleanup limit
-                self.debug('cleaned up, cache use is now %sbytes',
-                    format.formatStorage(usage))
+        evicted = 0
+        while self._cacheUsage > self._cacheMinUsage:
+            entry = self._index.popOldest()
+            if entry is None:
                 break
+            path, size = entry
+            self._cacheUsage -= size
+            evicted += size
+            rmlist.append(path)
+        self.stats.onEvicted(len(rmlist), evicted)
+        self.debug('cleaned up %d files, cache use is now %sbytes',
+                   len(rmlist), format.formatStorage(self._cacheUsage))
+
         d = threads.deferToThread(self._rmfiles, rmlist)
-        d.addBoth(self._setCacheUsage, usage)
+        if self._cacheUsage > self._cacheMinUsage:
+            # The index does not know about enough files,
+            # other processes may be sharing the cache directory.
+            self.debug('cache still too full, scanning cache directory')
+            self._cacheUsage = None
+            d.addCallback(lambda _: self._scanCache())
+        else:
+            d.addCallback(lambda _: self._cacheUsage)
         return d
 
     def _allocateCacheSpaceAfterCleanUp(self, usage, size):
@@ -287,7 +555,8 @@ class CacheManager(object, log.Loggable):
         Low-level function to release reserved cache space.
         """
         lastUpdate, size = tag
-        if lastUpdate == self._cacheUsageLastUpdate:
+        if (self._cacheUsage is not None
+            and lastUpdate == self._cacheUsageLastUpdate):
             self._cacheUsage -= size
             self.updateCacheUsageStatistics()
 
@@ -296,9 +565,16 @@ class CacheManager(object, log.Loggable):
         @return: a defer to a CacheFile instance or None
         """
         try:
-            return defer.succeed(CachedFile(self, path))
+            cachedFile = CachedFile(self, path)
         except:
-            return defer.succeed(None)
+            if not self.migrateCachedFile(self.getCachePath(path)):
+                return defer.succeed(None)
+            try:
+                cachedFile = CachedFile(self, path)
+            except:
+                return defer.succeed(None)
+        self.onCachedFileAccessed(cachedFile.name)
+        return defer.succeed(cachedFile)
 
     def _newTempFile(self, tag, path, size, mtime=None):
         # if allocation fails
@@ -335,6 +611,7 @@ class CachedFile:
         cachemgr.log("Opened cached file %s [fd %d]",
                      cachedPath, file.fileno())
 
+        self.cachemgr = cachemgr
         self.name = cachedPath
         self.file = file
         self.stat = stat
@@ -349,6 +626,7 @@ class CachedFile:
             if (s[stat.ST_MTIME] > self.stat[stat.ST_MTIME]):
                 return
             os.unlink(self.name)
+            self.cachemgr.onCachedFileRemoved(self.name)
         except OSError, e:
             pass
 
@@ -476,12 +754,14 @@ class TempFile:
                     self.cachemgr.log("Did not complete(), "
                                       "a more recent version exists already")
                     os.unlink(self.name)
+                    self.cachemgr.releaseCacheSpace(self.tag)
                     self.name = self._finishPath
                     return
         except OSError, e:
             pass
 
         try:
+            self.cachemgr.ensureCacheSubdir(self._finishPath)
             os.rename(self.name, self._finishPath)
         except OSError, e:
             if e.errno == errno.ENOENT:
@@ -492,6 +772,7 @@ class TempFile:
                 return
 
         self.setModificationTime()
+        self.cachemgr.onCachedFileAdded(self._finishPath, self.size)
 
         self.name = self._finishPath
         self.cachemgr.log("Temporary file renamed to '%s' [fd %d]",
@@ -34,6 +34,7 @@ STATS_UPDATE_PERIOD = 10
 CACHE_MISS = 0
 CACHE_HIT = 1
 TEMP_HIT = 2
+MEMORY_HIT = 3
 
 
 class RequestStatistics(object):
@@ -67,6 +68,10 @@ class RequestStatistics(object):
             cs.cacheHitCount += 1
             cs.tempHitCount += 1
             self._status = "temp-hit"
+        elif cacheStatus == MEMORY_HIT:
+            cs.cacheHitCount += 1
+            cs.memoryHitCount += 1
+            self._status = "memory-hit"
         elif cacheStatus == CACHE_MISS:
             cs.cacheMissCount += 1
             if self._outdated:
@@ -75,6 +80,7 @@ class RequestStatistics(object):
                 self._status = "cache-miss"
         cs._set("cache-hit-count", cs.cacheHitCount)
         cs._set("temp-hit-count", cs.tempHitCount)
+        cs._set("memory-hit-count", cs.memoryHitCount)
         cs._set("cache-miss-count", cs.cacheMissCount)
 
     def onCacheOutdated(self):
@@ -97,7 +103,7 @@ class RequestStatistics(object):
         """
         Provide the following log fields:
             cache-status:  value can be 'cache-miss', 'cache-outdate',
-                           'cache-hit', or 'temp-hit'
+                           'cache-hit', 'temp-hit' or 'memory-hit'
             cache-read:    how many bytes where read from the cache for
                            this resource. the difference from resource-read
                            was read from the source file (network file system?)
@@ -119,12 +125,18 @@ class CacheStatistics(object):
         # For cache usage
         self._cacheUsage = 0
         self._cacheUsageRatio = 0.0
+        # For memory cache usage
+        self._memoryUsage = 0
+        self._memoryUsageRatio = 0.0
         # For cache statistics
         self.cacheHitCount = 0
         self.tempHitCount = 0
+        self.memoryHitCount = 0
         self.cacheMissCount = 0
         self.cacheOutdateCount = 0
         self.cleanupCount = 0
+        self.evictionCount = 0
+        self.bytesEvicted = 0L
         # For real file reading statistics
         self.bytesReadFromSource = 0L
         self.bytesReadFromCache = 0L
@@ -135,14 +147,20 @@ class CacheStatistics(object):
         self.cancelledCopyCount = 0
         self.bytesCopied = 0L
         self._copyRatios = 0.0
+        # Copy workers, for per worker statistics
+        self._copyWorkers = ()
 
     def startUpdates(self, updater):
         self._updater = updater
         if updater and (self._callId is None):
             self._set("cache-usage-estimation", self._cacheUsage)
             self._set("cache-usage-ratio-estimation", self._cacheUsageRatio)
+            self._set("memory-cache-usage", self._memoryUsage)
+            self._set("memory-cache-usage-ratio", self._memoryUsageRatio)
             self._set("cleanup-count", self.cleanupCount)
             self._set("last-cleanup-time", time.time())
+            self._set("eviction-count", self.evictionCount)
+            self._set("evicted-bytes", self.bytesEvicted)
             self._set("current-copy-count", self.currentCopyCount)
             self._set("finished-copy-count", self.finishedCopyCount)
             self._set("cancelled-copy-count", self.cancelledCopyCount)
@@ -163,6 +181,20 @@ class CacheStatistics(object):
         return float(self.bytesReadFromCache) / total
     cacheReadRatio = property(getCacheReadRatio)
 
+    def getCacheHitRatio(self):
+        total = self.cacheHitCount + self.cacheMissCount
+        if total == 0:
+            return 0
+        return float(self.cacheHitCount) / total
+    cacheHitRatio = property(getCacheHitRatio)
+
+    def getMemoryHitRatio(self):
+        total = self.cacheHitCount + self.cacheMissCount
+        if total == 0:
+            return 0
+        return float(self.memoryHitCount) / total
+    memoryHitRatio = property(getMemoryHitRatio)
+
     def getMeanBytesCopied(self):
         if self.finishedCopyCount == 0:
             return 0
@@ -175,17 +207,38 @@ class CacheStatistics(object):
         return self._copyRatios / self.finishedCopyCount
     meanCopyRatio = property(getMeanCopyRatio)
 
+    def setCopyWorkers(self, workers):
+        """
+        Set the copy workers to report statistics for.
+        The workers statistics are read when the statistics are updated,
+        they are expected to have the attributes steps, readsServed,
+        bytesServed and bytesCopied.
+        """
+        self._copyWorkers = workers
+
     def onEstimateCacheUsage(self, usage, max):
         self._cacheUsage = usage
         self._cacheUsageRatio = float(usage) / max
         self._set("cache-usage-estimation", self._cacheUsage)
         self._set("cache-usage-ratio-estimation", self._cacheUsageRatio)
 
+    def onMemoryCacheUsage(self, usage, max):
+        self._memoryUsage = usage
+        self._memoryUsageRatio = float(usage) / max
+        self._set("memory-cache-usage", self._memoryUsage)
+        self._set("memory-cache-usage-ratio", self._memoryUsageRatio)
+
     def onCleanup(self):
         self.cleanupCount += 1
         self._set("cleanup-count", self.cleanupCount)
         self._set("last-cleanup-time", time.time())
 
+    def onEvicted(self, count, size):
+        self.evictionCount += count
+        self.bytesEvicted += size
+        self._set("eviction-count", self.evictionCount)
+        self._set("evicted-bytes", self.bytesEvicted)
+
     def onCopyStarted(self):
         self.currentCopyCount += 1
         self.totalCopyCount += 1
@@ -219,9 +272,31 @@ class CacheStatistics(object):
 
     def _update(self):
         self._set("cache-read-ratio", self.cacheReadRatio)
+        self._set("cache-hit-ratio", self.cacheHitRatio)
+        self._set("memory-hit-ratio", self.memoryHitRatio)
+        self._updateCopyWorkers()
         self._logStatsLine()
         self._callId = reactor.callLater(STATS_UPDATE_PERIOD, self._update)
 
+    def _updateCopyWorkers(self):
+        workers = self._copyWorkers
+        if not workers:
+            return
+        self._set("copy-worker-count", len(workers))
+        self._set("copy-worker-steps", [w.steps for w in workers])
+        self._set("copy-worker-reads-served",
+                  [w.readsServed for w in workers])
+        self._set("copy-worker-bytes-served",
+                  [w.bytesServed for w in workers])
+        self._set("copy-worker-bytes-copied",
+                  [w.bytesCopied for w in workers])
+        log.debug("stats-local-cache", "copy workers: %s",
+                  "; ".join(["%d: %d steps, %d reads, %d bytes served, "
+                             "%d bytes copied"
+                             % (i, w.steps, w.readsServed, w.bytesServed,
+                                w.bytesCopied)
+                             for i, w in enumerate(workers)]))
+
     def _logStatsLine(self):
         """
         Statistic fields names:
@@ -229,10 +304,15 @@ class CacheStatistics(object):
             CMC: Cache Miss Count
             CHC: Cache Hit Count
             THC: Temp Hit Count
+            MHC: Memory Hit Count
+            CHR: Cache Hit Ratio
+            MHR: Memory Hit Ratio
             COC: Cache Outdate Count
             CCC: Cache Cleanup Count
+            CEC: Cache Eviction Count
             CCU: Cache Current Usage
             CUR: Cache Usage Ratio
+            MCU: Memory Cache Usage
             PTC: coPy Total Count
             PCC: coPy Current Count
             PAC: coPy cAncellation Count
@@ -240,13 +320,18 @@ class CacheStatistics(object):
             MCR: Mean Copy Ratio
         """
         log.debug("stats-local-cache",
-                  "CRR: %.4f; CMC: %d; CHC: %d; THC: %d; COC: %d; "
-                  "CCC: %d; CCU: %d; CUR: %.5f; "
+                  "CRR: %.4f; CMC: %d; CHC: %d; THC: %d; MHC: %d; "
+                  "CHR: %.4f; MHR: %.4f; COC: %d; "
+                  "CCC: %d; CEC: %d; CCU: %d; CUR: %.5f; MCU: %d; "
                   "PTC: %d; PCC: %d; PAC: %d; MCS: %d; MCR: %.4f",
                   self.cacheReadRatio, self.cacheMissCount,
                   self.cacheHitCount, self.tempHitCount,
+                  self.memoryHitCount, self.cacheHitRatio,
+                  self.memoryHitRatio,
                   self.cacheOutdateCount, self.cleanupCount,
+                  self.evictionCount,
                   self._cacheUsage, self._cacheUsageRatio,
+                  self._memoryUsage,
                   self.totalCopyCount, self.currentCopyCount,
                   self.cancelledCopyCount, self.meanBytesCopied,
                   self.meanCopyRatio)
@@ -27,6 +27,7 @@ from flumotion.component.misc.httpserver import cachestats
 from flumotion.component.misc.httpserver import localpath
 from flumotion.component.misc.httpserver.httpcached import http_client
 from flumotion.component.misc.httpserver.httpcached import http_utils
+from flumotion.component.misc.httpserver.httpcached import memory_cache
 from flumotion.component.misc.httpserver.httpcached import request_manager
 from flumotion.component.misc.httpserver.httpcached import resource_manager
 from flumotion.component.misc.httpserver.httpcached import server_selection
@@ -50,6 +51,7 @@ class FileReaderHTTPCachedPlug(log.Loggable):
     Offers a file-like interface to streams retrieved using HTTP.
     It supports:
      - Local caching with TTL expiration, and cooperative managment.
+     - Optional in-memory caching of small and popular files.
      - Load-balanced HTTP servers with priority level (fall-back).
      - More than one IP by server hostname with periodic DNS refresh.
      - Connection resuming if HTTP connection got disconnected.
@@ -69,6 +71,7 @@ class FileReaderHTTPCachedPlug(log.Loggable):
         cleanupEnabled = props.get('cleanup-enabled')
         cleanupHighWatermark = props.get('cleanup-high-watermark')
         cleanupLowWatermark = props.get('cleanup-low-watermark')
+        cacheDirLevels = props.get('cache-dir-levels')
 
         self.virtualHost = props.get('virtual-hostname')
         self.virtualPort = props.get('virtual-port', DEFAULT_VIRTUAL_PORT)
@@ -84,7 +87,8 @@ class FileReaderHTTPCachedPlug(log.Loggable):
                                                   cleanupEnabled,
                                                   cleanupHighWatermark,
                                                   cleanupLowWatermark,
-                                                  self.virtualHost)
+                                                  self.virtualHost,
+                                                  cacheDirLevels)
 
         selector = server_selection.ServerSelector(dnsRefresh)
 
@@ -119,14 +123,31 @@ class FileReaderHTTPCachedPlug(log.Loggable):
         connTimeout = props.get('connection-timeout', DEFAULT_CONN_TIMEOUT)
         idleTimeout = props.get('idle-timeout', DEFAULT_IDLE_TIMEOUT)
 
-        client = http_client.StreamRequester(connTimeout, idleTimeout)
+        maxConnections = props.get('server-connections',
+                                   http_client.DEFAULT_MAX_CONNECTIONS)
+        keepAliveTimeout = props.get('keepalive-timeout',
+                                     http_client.DEFAULT_KEEPALIVE_TIMEOUT)
+
+        pool = http_client.ConnectionPool(connTimeout, maxConnections,
+                                          keepAliveTimeout)
+        client = http_client.StreamRequester(connTimeout, idleTimeout, pool)
 
         reqmgr = request_manager.RequestManager(selector, client)
 
         cacheTTL = props.get('cache-ttl', DEFAULT_CACHE_TTL)
 
+        memcache = None
+        memorySizeInMB = props.get('memory-cache-size')
+        if memorySizeInMB:
+            maxObjectSize = props.get('memory-cache-max-file-size',
+                memory_cache.DEFAULT_MAX_OBJECT_SIZE / 1024) * 1024
+            memcache = memory_cache.MemoryCache(self.stats,
+                                                memorySizeInMB * 10 ** 6,
+                                                maxObjectSize)
+
         self.strategy = strategy_basic.CachingStrategy(self.cachemgr,
-                                                       reqmgr, cacheTTL)
+                                                       reqmgr, cacheTTL,
+                                                       memcache)
 
         self.resmgr = resource_manager.ResourceManager(self.strategy,
                                                        self.stats)
@@ -19,8 +19,10 @@
 
 # Headers in this file shall remain intact.
 
-import datetime
 import cgi
+import datetime
+import time
+from collections import deque
 
 from twisted.internet import defer, protocol, reactor
 from twisted.python.util import InsensitiveDict
@@ -36,6 +38,9 @@ LOG_CATEGORY = "stream-provider"
 
 USER_AGENT = "FlumotionClient/0.1"
 
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+
 
 def ts2str(ts):
     if ts:
@@ -98,14 +103,20 @@ class StreamInfo(object):
 
 class StreamRequester(log.Loggable):
     """
-    Allows retrieval of data streams using HTTP 1.0.
+    Allows retrieval of data streams using HTTP 1.1.
+
+    The connections to the servers are kept open between requests
+    by a L{ConnectionPool}.
     """
 
     logCategory = LOG_CATEGORY
 
-    def __init__(self, connTimeout=0, idleTimeout=0):
+    def __init__(self, connTimeout=0, idleTimeout=0, pool=None):
         self.connTimeout = connTimeout
         self.idleTimeout = idleTimeout
+        if pool is None:
+            pool = ConnectionPool(connTimeout)
+        self.pool = pool
 
     def retrieve(self, consumer, url, proxyAddress=None, proxyPort=None,
                  ifModifiedSince=None, ifUnmodifiedSince=None,
@@ -123,17 +134,441 @@ class StreamRequester(log.Loggable):
         getter = StreamGetter(consumer, url,
                               ifModifiedSince, ifUnmodifiedSince,
                               start, size, self.idleTimeout)
-        getter.connect(proxyAddress, proxyPort, self.connTimeout)
+        getter.connect(self.pool, proxyAddress, proxyPort)
+        return getter
+
+    def cleanup(self):
+        return self.pool.close()
+
+
+class ConnectionPool(log.Loggable):
+    """
+    Keeps HTTP 1.1 connections to the servers open between requests.
+
+    The connections are kept by server address and port, with at most
+    maxConnections of them to each server.  A request for a server with
+    all of its connections busy waits for one of them to be free.
+    Idle connections are closed after keepAliveTimeout seconds; with a
+    timeout of 0 the connections are closed after every request.
+
+    A server that refused or timed out HOST_MAX_FAILURES connections
+    in a row is considered down for HOST_RETRY_DELAY seconds, during
+    which its requests fail right away, so the caller can try another
+    server.  Requests waiting longer than the connection timeout for a
+    free connection fail the same way.
+    """
+
+    logCategory = LOG_CATEGORY
+
+    HOST_MAX_FAILURES = 3
+    HOST_RETRY_DELAY = 5
+
+    def __init__(self, connTimeout=0,
+                 maxConnections=DEFAULT_MAX_CONNECTIONS,
+                 keepAliveTimeout=DEFAULT_KEEPALIVE_TIMEOUT):
+        self.connTimeout = connTimeout
+        self.maxConnections = maxConnections
+        self.keepAliveTimeout = keepAliveTimeout
+
+        self._hosts = {} # (address, port) => _HostConnections
+        self._closing = False
+        self._closeDeferreds = []
+
+    ### Public Methods ###
+
+    def request(self, getter):
+        """
+        Sends the request of a L{StreamGetter} to its server, on an
+        idle connection if there is one.
+        """
+        host = self._getHost(getter.host, getter.port)
+        if host.isDown():
+            message = "Server %s:%s marked as unavailable" % host.key
+            reactor.callLater(0, getter.connectionFailed, message)
+            return
+        if host.idle:
+            connection = host.idle.pop()
+            connection.stopIdling()
+            host.reuses += 1
+            self.log("Reusing connection to %s:%s for %s",
+                     host.address, host.port, getter.url)
+            connection.request(getter)
+            return
+        if host.count < self.maxConnections:
+            self._connect(host, getter)
+            return
+        self.log("All connections to %s:%s busy, %s waits",
+                 host.address, host.port, getter.url)
+        host.waiting.append(getter)
+        if self.connTimeout:
+            host.waitCalls[getter] = reactor.callLater(
+                self.connTimeout, self._waitTimeout, host, getter)
+
+    def withdraw(self, getter):
+        """
+        Forgets about the request of a L{StreamGetter} that has not been
+        sent yet.
+        """
+        host = self._hosts.get((getter.host, getter.port))
+        if host is None:
+            return
+        if getter in host.waiting:
+            host.waiting.remove(getter)
+            self._cancelWait(host, getter)
+        factory = host.connecting.pop(getter, None)
+        if factory is not None:
+            factory.getter = None
+
+    def close(self):
+        """
+        Closes the idle connections, and the others once their current
+        request is done.
+
+        @returns: a deferred fired when all the connections are closed.
+        @rtype:   L{twisted.internet.defer.Deferred}
+        """
+        self._closing = True
+        for host in self._hosts.values():
+            for connection in list(host.idle):
+                connection.close()
+        d = defer.Deferred()
+        self._closeDeferreds.append(d)
+        self._checkClosed()
+        return d
+
+    def getStatistics(self):
+        """
+        @returns: for every server, a dict with the number of open and
+                  idle connections, waiting requests, connections made,
+                  connections reused and connections that failed.
+        @rtype:   dict of (str, int) -> dict of str -> int
+        """
+        stats = {}
+        for key, host in self._hosts.items():
+            stats[key] = {'connections': host.count,
+                          'idle': len(host.idle),
+                          'waiting': len(host.waiting),
+                          'connects': host.connects,
+                          'reuses': host.reuses,
+                          'failures': host.failures}
+        return stats
+
+    ### Called by the connections ###
+
+    def connectionMade(self, connection, getter):
+        host = connection.host
+        host.connecting.pop(getter, None)
+        host.consecutiveFailures = 0
+        if getter is None:
+            self.connectionIdle(connection)
+        else:
+            connection.request(getter)
+
+    def connectionFailed(self, host, getter, reason):
+        host.count -= 1
+        host.failures += 1
+        host.consecutiveFailures += 1
+        if host.consecutiveFailures >= self.HOST_MAX_FAILURES:
+            self.debug("Server %s:%s failed %d times in a row, not "
+                       "using it for %s seconds", host.address, host.port,
+                       host.consecutiveFailures, self.HOST_RETRY_DELAY)
+            host.downUntil = time.time() + self.HOST_RETRY_DELAY
+        host.connecting.pop(getter, None)
+        # the requests waiting for the same server would most probably
+        # fail too, let them try another one
+        getters = []
+        while host.waiting:
+            getters.append(self._popWaiting(host))
+        if getter is not None:
+            getters.insert(0, getter)
+        message = reason.getErrorMessage()
+        for getter in getters:
+            getter.connectionFailed(message)
+        self._checkClosed()
+
+    def connectionIdle(self, connection):
+        host = connection.host
+        if host.waiting:
+            host.reuses += 1
+            connection.request(self._popWaiting(host))
+            return
+        if self._closing or not self.keepAliveTimeout:
+            connection.close()
+            return
+        host.idle.append(connection)
+        connection.startIdling(self.keepAliveTimeout)
+
+    def connectionLost(self, connection):
+        host = connection.host
+        host.count -= 1
+        if connection in host.idle:
+            host.idle.remove(connection)
+        if host.waiting and host.count < self.maxConnections:
+            self._connect(host, self._popWaiting(host))
+        self._checkClosed()
+
+    ### Private Methods ###
+
+    def _getHost(self, address, port):
+        key = (address, port)
+        host = self._hosts.get(key)
+        if host is None:
+            host = _HostConnections(address, port)
+            self._hosts[key] = host
+        return host
+
+    def _connect(self, host, getter):
+        self.log("Connecting to %s:%s for %s",
+                 host.address, host.port, getter.url)
+        host.count += 1
+        host.connects += 1
+        factory = _ConnectionFactory(self, host, getter)
+        host.connecting[getter] = factory
+        reactor.connectTCP(host.address, host.port, factory,
+                           self.connTimeout)
+
+    def _checkClosed(self):
+        if not self._closing:
+            return
+        for host in self._hosts.values():
+            if host.count:
+                return
+        deferreds = self._closeDeferreds
+        self._closeDeferreds = []
+        for d in deferreds:
+            d.callback(None)
+
+    def _popWaiting(self, host):
+        getter = host.waiting.popleft()
+        self._cancelWait(host, getter)
         return getter
 
+    def _cancelWait(self, host, getter):
+        call = host.waitCalls.pop(getter, None)
+        if call is not None:
+            call.cancel()
+
+    def _waitTimeout(self, host, getter):
+        del host.waitCalls[getter]
+        host.waiting.remove(getter)
+        getter.connectionFailed("Timeout waiting for a connection to %s:%s"
+                                % host.key)
 
-class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
+
+class _HostConnections(object):
+    """
+    The connections a L{ConnectionPool} has to a server.
     """
-    Retrieves a stream using HTTP 1.0.
 
-    This class is at the same time a Factory and a Protocol,
-    this can be done because it's a client and in twisted
-    client factories only create on protocol.
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.key = (address, port)
+
+        self.count = 0
+        self.idle = []
+        self.waiting = deque()
+        self.waitCalls = {} # StreamGetter => DelayedCall
+        self.connecting = {} # StreamGetter => _ConnectionFactory
+
+        self.connects = 0
+        self.reuses = 0
+        self.failures = 0
+        self.consecutiveFailures = 0
+        self.downUntil = None
+
+    def isDown(self):
+        if self.downUntil is None:
+            return False
+        if time.time() < self.downUntil:
+            return True
+        self.downUntil = None
+        return False
+
+
+class _ConnectionFactory(protocol.ClientFactory):
+
+    def __init__(self, pool, host, getter):
+        self.pool = pool
+        self.host = host
+        self.getter = getter
+
+    def buildProtocol(self, addr):
+        return HTTPConnection(self)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool.connectionFailed(self.host, self.getter, reason)
+
+
+class HTTPConnection(http.HTTPClient, log.Loggable):
+    """
+    A connection to a server, owned by a L{ConnectionPool}, on which
+    the requests of L{StreamGetter}s are sent one after the other.
+
+    If a getter gives up on an error response, the rest of the response
+    is read and dropped to keep the connection; if it gives up while
+    receiving a stream, the connection is closed.
+    """
+
+    logCategory = LOG_CATEGORY
+
+    def __init__(self, factory):
+        self.pool = factory.pool
+        self.host = factory.host
+        self._factory = factory
+
+        self.getter = None
+        self.requests = 0
+        self.keepAlive = False
+
+        self._busy = False
+        self._status = None
+        self._emptyBody = False
+        self._closing = False
+        self._idleCall = None
+
+    def request(self, getter):
+        self.getter = getter
+        self._busy = True
+        self._status = None
+        self.requests += 1
+        self.firstLine = True
+        self.length = None
+        self._header = ""
+        self.keepAlive = self.pool.keepAliveTimeout > 0
+        getter.sendRequest(self, self.keepAlive)
+
+    def release(self, getter):
+        """
+        Called by a getter giving up on its response.
+        """
+        if self.getter is not getter:
+            return
+        self.getter = None
+        if (self.keepAlive and self._status is not None
+            and self._status not in (http.OK, http.PARTIAL_CONTENT)):
+            if self.paused:
+                self.resumeProducing()
+            self.startIdling(self.pool.keepAliveTimeout)
+            return
+        self.close()
+
+    def close(self):
+        self.stopIdling()
+        self._closing = True
+        self.transport.loseConnection()
+
+    def startIdling(self, timeout):
+        self._idleCall = reactor.callLater(timeout, self._onIdleTimeout)
+
+    def stopIdling(self):
+        if self._idleCall is not None:
+            self._idleCall.cancel()
+            self._idleCall = None
+
+    ### Overridden Methods ###
+
+    def connectionMade(self):
+        getter = self._factory.getter
+        self._factory = None
+        self.pool.connectionMade(self, getter)
+
+    def connectionLost(self, reason):
+        self.stopIdling()
+        getter = self.getter
+        self.getter = None
+        self.pool.connectionLost(self)
+        if getter is None:
+            return
+        if self._status is None and self.requests > 1:
+            # the server closed the connection before we reused it
+            self.log("Connection to %s:%s closed by the server, "
+                     "retrying %s", self.host.address, self.host.port,
+                     getter.url)
+            getter.connection = None
+            self.pool.request(getter)
+            return
+        getter.connectionLost(reason)
+
+    def sendCommand(self, command, path):
+        # We want HTTP/1.1 for persistent connections, conditional GET
+        # and range requests
+        self.transport.write('%s %s HTTP/1.1\r\n' % (command, path))
+
+    def lineReceived(self, line):
+        http.HTTPClient.lineReceived(self, line)
+        if self._emptyBody:
+            self._emptyBody = False
+            self.setLineMode()
+            self.handleResponseEnd()
+
+    def handleStatus(self, version, status, message):
+        if not self._busy:
+            self.debug("Unexpected response from %s:%s",
+                       self.host.address, self.host.port)
+            self.close()
+            return
+        self._status = int(status)
+        if version != 'HTTP/1.1':
+            self.keepAlive = False
+        if self.getter is not None:
+            self.getter.handleStatus(version, status, message)
+
+    def handleHeader(self, key, val):
+        if key.lower() == 'connection' and val.lower() == 'close':
+            self.keepAlive = False
+        if self.getter is not None:
+            self.getter.handleHeader(key, val)
+
+    def handleEndHeaders(self):
+        if self._status in http.NO_BODY_CODES:
+            self.length = 0
+        if self.length is None:
+            # the response ends when the connection is closed
+            self.keepAlive = False
+        if self.getter is not None:
+            self.getter.handleEndHeaders()
+        if self.length == 0:
+            self._emptyBody = True
+
+    def handleResponsePart(self, data):
+        if self.getter is not None:
+            self.getter.handleResponsePart(data)
+
+    def handleResponseEnd(self):
+        if not self._busy or self._status is None:
+            return
+        getter = self.getter
+        self.getter = None
+        self._busy = False
+        self._status = None
+        self.stopIdling()
+        # give the connection back before telling the getter, so
+        # the requests its consumer makes when done can reuse it
+        if not self._closing:
+            if self.paused:
+                self.resumeProducing()
+            if self.keepAlive:
+                self.pool.connectionIdle(self)
+            else:
+                self.close()
+        if getter is not None:
+            getter.handleResponseEnd()
+
+    ### Private Methods ###
+
+    def _onIdleTimeout(self):
+        self._idleCall = None
+        self.close()
+
+
+class StreamGetter(log.Loggable):
+    """
+    Retrieves a stream using HTTP 1.1.
+
+    The request is sent on a connection given by a L{ConnectionPool};
+    the connection calls back the response handling methods of the
+    getter.
 
     The outcome, the stream info and stream data is forwarded
     to a common.StreamConsumer instance given at creating time.
@@ -163,10 +598,11 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
         self.timeout = timeout
 
         self.headers = {}
-        self.peer = None
+        self.connection = None
         self.status = None
         self.info = None
 
+        self._pool = None
         self._connected = False
         self._canceled = False
         self._remaining = None
@@ -179,9 +615,10 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
 
     ### Public Methods ###
 
-    def connect(self, proxyAddress=None, proxyPort=None, timeout=0):
+    def connect(self, pool, proxyAddress=None, proxyPort=None):
         assert not self._connected, "Already connected"
         self._connected = True
+        self._pool = pool
         url = self.url
         self.host = proxyAddress or url.hostname
         self.port = proxyPort or url.port
@@ -189,64 +626,64 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
             msg = "URL scheme %s not implemented" % url.scheme
             self._serverError(common.NOT_IMPLEMENTED, msg)
         else:
-            self.log("Connecting to %s:%s for %s",
-                     self.host, self.port, self.url)
-            reactor.connectTCP(self.host, self.port, self, timeout)
+            pool.request(self)
 
     def pause(self):
-        if not self.paused and self.transport is not None:
-            self.pauseProducing()
+        connection = self.connection
+        if connection is not None and not connection.paused:
+            connection.pauseProducing()
             self.log("Request paused for %s", self.url)
 
     def resume(self):
-        if self.paused and self.transport is not None:
-            self.resumeProducing()
+        connection = self.connection
+        if connection is not None and connection.paused:
+            connection.resumeProducing()
             self.log("Request resumed for %s", self.url)
 
     def cancel(self):
-        if self._connected and self.transport is not None:
-            self.transport.loseConnection()
+        if self._connected:
+            self._release()
         self._cancelIdleCheck()
         self.log("Request canceled for %s", self.url)
         self._canceled = True
 
-    ### Overridden Methods ###
-
-    def buildProtocol(self, addr):
-        assert self.peer is None, "Protocol already built"
-        self.peer = addr
-        return self
+    ### Called by the pool and the connection ###
 
-    def clientConnectionFailed(self, connector, reason):
-        self._serverError(common.SERVER_UNAVAILABLE, reason.getErrorMessage())
-
-    def connectionMade(self):
-        self.log("Connection made for %s", self.url)
-        self.sendCommand(self.HTTP_METHOD, self.url.location)
-        self.sendHeader('Host', self.url.host)
-        self.sendHeader('User-Agent', USER_AGENT)
-        self.sendHeader('Connection', "close") # Pipeline not yet supported
+    def sendRequest(self, connection, keepAlive):
+        self.connection = connection
+        self.log("Sending request for %s", self.url)
+        connection.sendCommand(self.HTTP_METHOD, self.url.location)
+        connection.sendHeader('Host', self.url.host)
+        connection.sendHeader('User-Agent', USER_AGENT)
+        if not keepAlive:
+            connection.sendHeader('Connection', "close")
 
         if self.ifModifiedSince:
             datestr = http.datetimeToString(self.ifModifiedSince)
-            self.sendHeader('If-Modified-Since', datestr)
+            connection.sendHeader('If-Modified-Since', datestr)
 
         if self.ifUnmodifiedSince:
             datestr = http.datetimeToString(self.ifUnmodifiedSince)
-            self.sendHeader('If-Unmodified-Since', datestr)
+            connection.sendHeader('If-Unmodified-Since', datestr)
 
         if self.start or self.size:
             start = self.start or 0
             end = (self.size and (start + self.size - 1)) or None
             rangeSpecs = "bytes=%s-%s" % (start, end or "")
-            self.sendHeader('Range', rangeSpecs)
+            connection.sendHeader('Range', rangeSpecs)
 
-        self.endHeaders()
+        connection.endHeaders()
 
         self._resetIdleCheck()
 
+    def connectionFailed(self, message):
+        if self._canceled:
+            return
+        self._serverError(common.SERVER_UNAVAILABLE, message)
+
     def connectionLost(self, reason):
         self.log("Connection lost for %s", self.url)
+        self.connection = None
         self.handleResponseEnd()
         if not self._canceled:
             self._serverError(common.SERVER_DISCONNECTED,
@@ -306,6 +743,8 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
         self._onData(data)
 
     def handleResponseEnd(self):
+        # the response is over, the connection is not ours anymore
+        self.connection = None
         if self.info is not None:
             if self._remaining == 0:
                 self.log("Request done, got %d bytes starting at %d from %s, "
@@ -321,10 +760,6 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
         else:
             self.log("Incomplete request %s", self.url.toString())
 
-    def sendCommand(self, command, path):
-        # We want HTTP/1.1 for conditional GET and range requests
-        self.transport.write('%s %s HTTP/1.1\r\n' % (command, path))
-
     ### Private Methods ###
 
     def _keepActive(self):
@@ -351,11 +786,18 @@ class StreamGetter(protocol.ClientFactory, http.HTTPClient, log.Loggable):
         self._idlecheck = None
         self._serverError(common.SERVER_TIMEOUT, "Server timeout")
 
+    def _release(self):
+        connection = self.connection
+        self.connection = None
+        if connection is not None:
+            connection.release(self)
+        elif self._pool is not None:
+            self._pool.withdraw(self)
+
     def _cancel(self):
         self._cancelIdleCheck()
         if self.consumer:
-            if self.transport:
-                self.transport.loseConnection()
+            self._release()
             self.consumer = None
 
     def _serverError(self, code, message):
@@ -0,0 +1,139 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+from collections import deque
+
+from flumotion.common import log
+from flumotion.component.misc.httpserver import cachemanager
+
+LOG_CATEGORY = "memory-cache"
+
+DEFAULT_MAX_OBJECT_SIZE = 1024 * 1024
+PROTECTED_RATIO = 0.8
+HISTORY_SIZE = 4096
+
+
+class MemoryCache(log.Loggable):
+    """
+    I keep the content of small and popular cached files in memory,
+    by identifier, within a budget of bytes.
+
+    Files are only admitted on the second time they are read from the
+    disk cache while their identifier is still in my history, so files
+    read only once never take memory.  Admitted files are kept in a
+    segmented LRU: they start in the probation segment and are moved to
+    the protected segment when they are hit again; the protected segment
+    takes at most PROTECTED_RATIO of the budget and pushes its least
+    recently used files back to probation, from which files are evicted.
+
+    I do not know when files expire or are refetched, the caching
+    strategy removes them when they do.
+    """
+
+    logCategory = LOG_CATEGORY
+
+    def __init__(self, stats, maxSize, maxObjectSize=DEFAULT_MAX_OBJECT_SIZE):
+        self.stats = stats
+        self.maxSize = maxSize
+        self.maxObjectSize = min(maxObjectSize, maxSize)
+
+        self._entries = {} # {IDENTIFIER: (DATA, MTIME)}
+        self._probation = cachemanager.CacheIndex()
+        self._protected = cachemanager.CacheIndex()
+        self._protectedSize = int(maxSize * PROTECTED_RATIO)
+        self._history = {}
+        self._historyOrder = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, identifier):
+        return identifier in self._entries
+
+    def getUsage(self):
+        return self._probation.totalSize + self._protected.totalSize
+
+    def get(self, identifier):
+        """
+        @return: a tuple (data, mtime) or None if not in memory
+        """
+        entry = self._entries.get(identifier)
+        if entry is None:
+            return None
+        if identifier in self._protected:
+            self._protected.touch(identifier)
+        else:
+            size = self._probation.remove(identifier)
+            self._protected.add(identifier, size)
+            while self._protected.totalSize > self._protectedSize:
+                oldest, oldestSize = self._protected.popOldest()
+                self._probation.add(oldest, oldestSize)
+        return entry
+
+    def admit(self, identifier, size):
+        """
+        Tell if a file read from the disk cache should be kept in memory.
+        """
+        if size > self.maxObjectSize:
+            return False
+        if identifier in self._history:
+            return True
+        self._history[identifier] = None
+        self._historyOrder.append(identifier)
+        if len(self._historyOrder) > HISTORY_SIZE:
+            self._history.pop(self._historyOrder.popleft(), None)
+        return False
+
+    def add(self, identifier, data, mtime):
+        self.remove(identifier)
+        self._history.pop(identifier, None)
+        self._entries[identifier] = (data, mtime)
+        self._probation.add(identifier, len(data))
+        self.log("Keeping %d bytes of %s in memory", len(data), identifier)
+        self._evict()
+
+    def remove(self, identifier):
+        if self._entries.pop(identifier, None) is None:
+            return
+        if self._probation.remove(identifier) is None:
+            self._protected.remove(identifier)
+        self._updateUsage()
+
+    def clear(self):
+        self._entries.clear()
+        self._probation = cachemanager.CacheIndex()
+        self._protected = cachemanager.CacheIndex()
+        self._updateUsage()
+
+    ### Private Methods ###
+
+    def _evict(self):
+        while self.getUsage() > self.maxSize:
+            oldest = self._probation.popOldest()
+            if oldest is None:
+                oldest = self._protected.popOldest()
+            identifier, size = oldest
+            del self._entries[identifier]
+            self.log("Dropped %d bytes of %s from memory", size, identifier)
+        self._updateUsage()
+
+    def _updateUsage(self):
+        self.stats.onMemoryCacheUsage(self.getUsage(), self.maxSize)
@@ -62,7 +62,8 @@ class RequestManager(log.Loggable):
         return self.selector.setup()
 
     def cleanup(self):
-        return self.selector.cleanup()
+        self.selector.cleanup()
+        return self.client.cleanup()
 
 
 class ConsumerManager(common.StreamConsumer, log.Loggable):
@@ -61,14 +61,18 @@ class CachingStrategy(log.Loggable):
 
     Handles the cache lookup, cache expiration checks,
     statistics gathering and caching sessions managment.
+
+    If a memory cache is given, the files it keeps are served
+    from memory while they have not expired.
     """
 
     logCategory = "base-caching"
 
-    def __init__(self, cachemgr, reqmgr, ttl):
+    def __init__(self, cachemgr, reqmgr, ttl, memcache=None):
         self.cachemgr = cachemgr
         self.reqmgr = reqmgr
         self.ttl = ttl
+        self.memcache = memcache
 
         self._identifiers = {} # {IDENTIFIER: CachingSession}
         self._etimes = {} # {IDENTIFIER: EXPIRATION_TIME}
@@ -81,10 +85,13 @@ class CachingStrategy(log.Loggable):
 
     def cleanup(self):
         self._stopCleanupLoop()
-        self.reqmgr.cleanup()
         for session in self._identifiers.values():
             session.cancel()
-        return self
+        if self.memcache is not None:
+            self.memcache.clear()
+        d = defer.maybeDeferred(self.reqmgr.cleanup)
+        d.addCallback(lambda _: self)
+        return d
 
     def getSourceFor(self, url, stats):
         identifier = self.cachemgr.getIdentifier(url.path)
@@ -107,6 +114,10 @@ class CachingStrategy(log.Loggable):
             d.addCallback(RemoteSource, stats)
             return d
 
+        source = self._getMemorySource(url, identifier, stats)
+        if source is not None:
+            return defer.succeed(source)
+
         self.log("Looking for cached file for '%s'", url)
         d = defer.Deferred()
         d.addCallback(self.cachemgr.openCacheFile)
@@ -157,6 +168,8 @@ class CachingStrategy(log.Loggable):
         expired = [i for i, e in self._etimes.items() if e < now]
         for ident in expired:
             del self._etimes[ident]
+            if self.memcache is not None:
+                self.memcache.remove(ident)
 
     def _onNewSession(self, session):
         identifier = session.identifier
@@ -164,6 +177,9 @@ class CachingStrategy(log.Loggable):
         if old is not None:
             old.cancel()
         self._identifiers[session.identifier] = session
+        # the resource is being fetched again, it may have changed
+        if self.memcache is not None:
+            self.memcache.remove(identifier)
 
     def _onSessionCanceled(self, session):
         if self._identifiers[session.identifier] == session:
@@ -187,14 +203,51 @@ class CachingStrategy(log.Loggable):
             self.log("Opened cached file '%s'", cachedFile.name)
             etime = self._etimes.get(identifier, None)
             if etime and (etime > time.time()):
-                stats.onStarted(cachedFile.stat[stat.ST_SIZE],
-                                cachestats.CACHE_HIT)
+                size = cachedFile.stat[stat.ST_SIZE]
+                stats.onStarted(size, cachestats.CACHE_HIT)
+                memcache = self.memcache
+                if memcache is not None and memcache.admit(identifier, size):
+                    return self._loadMemorySource(url, identifier, size,
+                                                  cachedFile, stats)
                 return CachedSource(identifier, url, cachedFile, stats)
             self.debug("Cached file may have expired '%s'", cachedFile.name)
             return self._onCacheOutdated(url, identifier, cachedFile, stats)
         self.debug("Resource not cached '%s'", url)
         return self._onCacheMiss(url, stats)
 
+    def _getMemorySource(self, url, identifier, stats):
+        if self.memcache is None:
+            return None
+        etime = self._etimes.get(identifier, None)
+        if not (etime and (etime > time.time())):
+            # the cached file has to be checked, the disk path does it
+            self.memcache.remove(identifier)
+            return None
+        entry = self.memcache.get(identifier)
+        if entry is None:
+            return None
+        data, mtime = entry
+        self.log("Serving '%s' from memory", url)
+        stats.onStarted(len(data), cachestats.MEMORY_HIT)
+        return MemorySource(identifier, url, data, mtime, stats)
+
+    def _loadMemorySource(self, url, identifier, size, cachedFile, stats):
+        try:
+            cachedFile.seek(0)
+            data = cachedFile.read(size)
+        except IOError, e:
+            self.debug("Failed to read cached file '%s' to memory: %s",
+                       cachedFile.name, log.getExceptionMessage(e))
+            cachedFile.seek(0)
+            return CachedSource(identifier, url, cachedFile, stats)
+        if len(data) != size:
+            cachedFile.seek(0)
+            return CachedSource(identifier, url, cachedFile, stats)
+        mtime = cachedFile.stat[stat.ST_MTIME]
+        cachedFile.close()
+        self.memcache.add(identifier, data, mtime)
+        return MemorySource(identifier, url, data, mtime, stats)
+
 
 class CachedSource(resource_manager.DataSource):
     """
@@ -235,6 +288,36 @@ class CachedSource(resource_manager.DataSource):
         self._file = None
 
 
+class MemorySource(resource_manager.DataSource):
+    """
+    Data source that read data from a cached file kept in memory.
+    """
+
+    mimetypes = mimetypes.MimeTypes()
+
+    def __init__(self, ident, url, data, mtime, stats):
+        self.identifier = ident
+        self.url = url
+        self._data = data
+        self.stats = stats
+
+        self.mimeType = self.mimetypes.fromPath(url.path)
+        self.mtime = mtime
+        self.size = len(data)
+
+    def produce(self, consumer, offset):
+        return None
+
+    def read(self, offset, size):
+        data = self._data[offset:offset + size]
+        self.stats.onBytesRead(0, len(data), 0)
+        return data
+
+    def close(self):
+        self.stats.onClosed()
+        self._data = None
+
+
 class BaseRemoteSource(resource_manager.DataSource):
     """
     Base class for resource not yet cached.
@@ -52,8 +52,9 @@ class CachingStrategy(strategy_base.CachingStrategy):
 
     logCategory = LOG_CATEGORY
 
-    def __init__(self, cachemgr, reqmgr, ttl):
-        strategy_base.CachingStrategy.__init__(self, cachemgr, reqmgr, ttl)
+    def __init__(self, cachemgr, reqmgr, ttl, memcache=None):
+        strategy_base.CachingStrategy.__init__(self, cachemgr, reqmgr, ttl,
+                                               memcache)
 
     def _onCacheMiss(self, url, stats):
         session = strategy_base.CachingSession(self, url, self.cachemgr.stats)
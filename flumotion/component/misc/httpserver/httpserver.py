@@ -328,6 +328,9 @@ class HTTPFileStreamer(component.BaseComponent, log.Loggable):
             self.httpauth.setBouncerName(props['bouncer'])
         if 'issuer-class' in props:
             self.httpauth.setIssuerClass(props['issuer-class'])
+        if 'auth-cache-size' in props:
+            self.httpauth.setDecisionCache(props['auth-cache-size'],
+                                           props.get('auth-cache-ttl'))
         if 'ip-filter' in props:
             logFilter = http.LogFilter()
             for f in props['ip-filter']:
@@ -23,7 +23,8 @@ import os
 import stat
 import errno
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor, abstract
+from twisted.python import failure, threadpool
 
 from flumotion.common import log
 from flumotion.component.misc.httpserver import fileprovider, localpath
@@ -35,11 +36,17 @@ SEEK_SET = 0
 
 LOG_CATEGORY = "fileprovider-local"
 
+DEFAULT_READ_AHEAD = 4 * abstract.FileDescriptor.bufferSize
+
 
 class FileProviderLocalPlug(fileprovider.FileProviderPlug, log.Loggable):
     """
     I am a plug that provide local files directly,
     faking the file access is asynchronous.
+
+    If the read-threads property is set, files are opened and read
+    from a pool of threads instead, so a slow disk or network file
+    system does not block the main loop.
     """
 
     logcategory = LOG_CATEGORY
@@ -47,6 +54,19 @@ class FileProviderLocalPlug(fileprovider.FileProviderPlug, log.Loggable):
     def __init__(self, args):
         props = args['properties']
         self._path = props.get('path', None)
+        self._readThreads = props.get('read-threads', 0)
+        self._readAhead = props.get('read-ahead', DEFAULT_READ_AHEAD)
+        self._readPool = None
+
+    def start(self, component):
+        if self._readThreads > 0:
+            self._readPool = ReadThreadPool(self._readThreads)
+            self._readPool.start()
+
+    def stop(self, component):
+        if self._readPool is not None:
+            self._readPool.stop()
+            self._readPool = None
 
     def startStatsUpdates(self, updater):
         # No statistics for local file provider
@@ -58,13 +78,67 @@ class FileProviderLocalPlug(fileprovider.FileProviderPlug, log.Loggable):
     def getRootPath(self):
         if self._path is None:
             return None
-        return LocalPath(self._path)
+        return LocalPath(self._path, self._readPool, self._readAhead)
+
+
+class ReadThreadPool(log.Loggable):
+    """
+    I run blocking file operations in a bounded pool of threads,
+    and give back their result in the reactor thread.
+    """
+
+    logCategory = LOG_CATEGORY
+
+    def __init__(self, maxThreads):
+        self._pool = threadpool.ThreadPool(0, maxThreads)
+
+    def start(self):
+        self.debug("Starting read thread pool with up to %d threads",
+                   self._pool.max)
+        self._pool.start()
+
+    def stop(self):
+        self.debug("Stopping read thread pool")
+        self._pool.stop()
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call a function in one of the pool's threads.
+
+        @returns: a deferred fired in the reactor thread with the result
+        @rtype:   L{defer.Deferred}
+        """
+        d = defer.Deferred()
+
+        def inThread():
+            try:
+                result = func(*args, **kwargs)
+            except:
+                reactor.callFromThread(d.errback, failure.Failure())
+            else:
+                reactor.callFromThread(d.callback, result)
+
+        self._pool.callInThread(inThread)
+        return d
 
 
 class LocalPath(localpath.LocalPath):
 
+    def __init__(self, path, readPool=None, readAhead=DEFAULT_READ_AHEAD):
+        localpath.LocalPath.__init__(self, path)
+        self._readPool = readPool
+        self._readAhead = readAhead
+
+    def child(self, name):
+        childpath = self._getChildPath(name)
+        return type(self)(childpath, self._readPool, self._readAhead)
+
     def open(self):
-        return LocalFile(self._path, self.mimeType)
+        if self._readPool is None:
+            return LocalFile(self._path, self.mimeType)
+        return self._readPool.run(ThreadedLocalFile, self._path,
+                                  self.mimeType, self._readPool,
+                                  self._readAhead)
 
 
 class LocalFile(fileprovider.File, log.Loggable):
@@ -169,3 +243,136 @@ class LocalFile(fileprovider.File, log.Loggable):
 
     def getLogFields(self):
         return {}
+
+
+class ThreadedLocalFile(LocalFile):
+    """
+    I am an asynchronous file reading from a local file system
+    in a L{ReadThreadPool}.
+    Reads are served in order, at most one of them being done by
+    a thread at any time; every thread read fetches at least
+    read-ahead bytes so the following small reads are served
+    from memory.
+    """
+
+    # Default values, in case opening the file fails
+    _reading = False
+    _waiting = ()
+    _buffer = ''
+
+    def __init__(self, path, mimeType, readPool, readAhead):
+        LocalFile.__init__(self, path, mimeType)
+        self._readPool = readPool
+        self._readAhead = readAhead
+        self._position = 0
+        self._buffer = ''
+        # file offset of the end of file, once a read reached it
+        self._eofOffset = None
+        self._reading = False
+        self._waiting = [] # [(size, Deferred)]
+        self._closingFile = None
+
+    def __str__(self):
+        return "<ThreadedLocalFile '%s'>" % self._path
+
+    def tell(self):
+        if self._file is None:
+            raise FileClosedError("File closed")
+        return self._position
+
+    def seek(self, offset):
+        if self._file is None:
+            raise FileClosedError("File closed")
+        skip = offset - self._position
+        if skip >= 0 and skip <= len(self._buffer):
+            self._buffer = self._buffer[skip:]
+        else:
+            self._buffer = ''
+        self._position = offset
+
+    def read(self, size):
+        if self._file is None:
+            raise FileClosedError("File closed")
+        d = defer.Deferred()
+        self._waiting.append((size, d))
+        self._serve()
+        return d
+
+    def close(self):
+        if self._file is not None and self._reading:
+            # let the thread finish with the file before closing it
+            self._closingFile = self._file
+            self._file = None
+            self._info = None
+        LocalFile.close(self)
+        self._buffer = ''
+        waiting, self._waiting = self._waiting, []
+        for size, d in waiting:
+            d.errback(FileClosedError("File closed"))
+
+
+    ## Private Methods ##
+
+    def _atEOF(self):
+        return (self._eofOffset is not None
+                and self._position + len(self._buffer) >= self._eofOffset)
+
+    def _serve(self):
+        while self._waiting and not self._reading:
+            size, d = self._waiting[0]
+            if len(self._buffer) < size and not self._atEOF():
+                offset = self._position + len(self._buffer)
+                amount = max(size - len(self._buffer), self._readAhead)
+                self._reading = True
+                rd = self._readPool.run(self._readBlock, self._file,
+                                        offset, amount)
+                rd.addCallbacks(self._cbRead, self._ebRead,
+                                callbackArgs=(offset, amount),
+                                errbackArgs=(offset, ))
+                return
+            del self._waiting[0]
+            data = self._buffer[:size]
+            self._buffer = self._buffer[size:]
+            self._position += len(data)
+            # this may call read() again
+            d.callback(data)
+
+    def _readBlock(self, file, offset, size):
+        # called in a thread
+        file.seek(offset, SEEK_SET)
+        return file.read(size)
+
+    def _readDone(self):
+        self._reading = False
+        if self._closingFile is not None:
+            try:
+                self._closingFile.close()
+            except IOError, e:
+                self.warning("Failed to close file '%s': %s",
+                             self._path, str(e))
+            self._closingFile = None
+            return False
+        return self._file is not None
+
+    def _cbRead(self, data, offset, amount):
+        if not self._readDone():
+            return
+        if offset == self._position + len(self._buffer):
+            # no seek happened while reading
+            self._buffer += data
+            if len(data) < amount:
+                self._eofOffset = offset + len(data)
+        self._serve()
+
+    def _ebRead(self, fail, offset):
+        if not self._readDone():
+            return
+        if offset == self._position + len(self._buffer) and self._waiting:
+            size, d = self._waiting.pop(0)
+            if fail.check(IOError):
+                e = fail.value
+                cls = self._errorLookup.get(e[0], FileError)
+                fail = failure.Failure(cls("Failed to read data from %s: %s"
+                                           % (self._path, str(e))))
+            d.errback(fail)
+        self._serve()
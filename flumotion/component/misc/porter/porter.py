@@ -42,6 +42,145 @@ __version__ = "$Rev$"
 T_ = gettexter()
 
 
+class _PrefixNode(object):
+    __slots__ = ('label', 'value', 'hasValue', 'children')
+
+    def __init__(self, label):
+        self.label = label
+        self.value = None
+        self.hasValue = False
+        # first character of the child's label -> child
+        self.children = {}
+
+
+class PrefixTree(object):
+    """
+    I map string prefixes to values, and find the value for the longest
+    registered prefix of a string.
+
+    I am a radix tree over the characters of the prefixes, so a lookup
+    costs at most one step per character of the string, regardless of
+    the number of prefixes registered.
+    """
+
+    def __init__(self):
+        self._root = _PrefixNode('')
+        self._len = 0
+
+    def _find(self, prefix):
+        # returns the list of nodes from the root to the node for
+        # exactly this prefix, or None
+        path = [self._root]
+        node = self._root
+        pos = 0
+        while pos < len(prefix):
+            node = node.children.get(prefix[pos])
+            if node is None or not prefix.startswith(node.label, pos):
+                return None
+            pos += len(node.label)
+            path.append(node)
+        return path
+
+    def __setitem__(self, prefix, value):
+        node = self._root
+        pos = 0
+        while pos < len(prefix):
+            child = node.children.get(prefix[pos])
+            if child is None:
+                child = _PrefixNode(prefix[pos:])
+                node.children[prefix[pos]] = child
+                node = child
+                break
+
+            label = child.label
+            common = 1
+            while (common < len(label) and pos + common < len(prefix)
+                   and label[common] == prefix[pos + common]):
+                common += 1
+            if common < len(label):
+                # split the edge to child
+                middle = _PrefixNode(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[prefix[pos]] = middle
+                child = middle
+            node = child
+            pos += common
+
+        if not node.hasValue:
+            self._len += 1
+        node.value = value
+        node.hasValue = True
+
+    def __getitem__(self, prefix):
+        path = self._find(prefix)
+        if path is None or not path[-1].hasValue:
+            raise KeyError(prefix)
+        return path[-1].value
+
+    def __delitem__(self, prefix):
+        path = self._find(prefix)
+        if path is None or not path[-1].hasValue:
+            raise KeyError(prefix)
+        node = path.pop()
+        node.value = None
+        node.hasValue = False
+        self._len -= 1
+
+        # drop nodes that lead nowhere, and merge nodes without a value
+        # into their only child
+        while path and not node.hasValue and len(node.children) < 2:
+            parent = path.pop()
+            if node.children:
+                child = node.children.values()[0]
+                child.label = node.label + child.label
+                parent.children[node.label[0]] = child
+            else:
+                del parent.children[node.label[0]]
+            node = parent
+
+    def __contains__(self, prefix):
+        path = self._find(prefix)
+        return path is not None and path[-1].hasValue
+
+    def __len__(self):
+        return self._len
+
+    def keys(self):
+        ret = []
+        stack = [('', self._root)]
+        while stack:
+            prefix, node = stack.pop()
+            prefix += node.label
+            if node.hasValue:
+                ret.append(prefix)
+            for child in node.children.values():
+                stack.append((prefix, child))
+        return ret
+
+    def longestPrefixMatch(self, string, default=None):
+        """
+        Find the value for the longest registered prefix of a string.
+
+        @param string: the string to look up
+        @type  string: str
+        @param default: the value to return if no prefix matches
+        """
+        ret = default
+        node = self._root
+        pos = 0
+        while True:
+            if node.hasValue:
+                ret = node.value
+            if pos >= len(string):
+                break
+            node = node.children.get(string[pos])
+            if node is None or not string.startswith(node.label, pos):
+                break
+            pos += len(node.label)
+        return ret
+
+
 class PorterAvatar(pb.Avatar, log.Loggable):
     """
     An Avatar in the porter representing a streamer
@@ -130,7 +269,7 @@ class Porter(component.BaseComponent, log.Loggable):
         # We maintain a map of path -> avatar (the underlying transport is
         # accessible from the avatar, we need this for FD-passing)
         self._mappings = {}
-        self._prefixes = {}
+        self._prefixes = PrefixTree()
 
         self._socketlistener = None
 
@@ -218,17 +357,7 @@ class Porter(component.BaseComponent, log.Loggable):
                 "Not removing prefix destination: expected avatar not found")
 
     def findPrefixMatch(self, path):
-        found = None
-        # TODO: Horribly inefficient. Replace with pathtree code.
-        for prefix in self._prefixes.keys():
-            self.log("Checking: %r, %r" % (prefix, path))
-            if (path.startswith(prefix) and
-                (not found or len(found) < len(prefix))):
-                found = prefix
-        if found:
-            return self._prefixes[found]
-        else:
-            return None
+        return self._prefixes.longestPrefixMatch(path)
 
     def findDestination(self, path):
         """
@@ -435,7 +564,7 @@ class PorterProtocol(protocol.Protocol, log.Loggable):
 
     def dataReceived(self, data):
         self._buffer = self._buffer + data
-        self.log("Got data, buffer now \"%s\"" % self._buffer)
+        self.log("Got data, buffer now \"%s\"", self._buffer)
         # We accept more than just '\r\n' (the true HTTP line end) in the
         # interests of compatibility.
         for delim in self.delimiters:
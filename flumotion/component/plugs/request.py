@@ -19,13 +19,22 @@
 
 # Headers in this file shall remain intact.
 
+import collections
+import threading
 import time
 
-from flumotion.common import errors
+from flumotion.common import errors, log
+from flumotion.common.poller import Poller
 from flumotion.component.plugs import base
 
 __version__ = "$Rev$"
 
+_DEFAULT_BUFFER_SIZE = 64 * 1024 # in bytes
+_DEFAULT_FLUSH_INTERVAL = 1.0 # in seconds
+_DEFAULT_MAX_QUEUE = 10000 # in lines
+_OVERFLOW_POLICIES = ('drop', 'block')
+_STATS_INTERVAL = 1.0 # in seconds
+
 
 class RequestLoggerPlug(base.ComponentPlug):
     """
@@ -90,3 +99,165 @@ class RequestLoggerFilePlug(RequestLoggerPlug):
     def rotate(self):
         self.stop()
         self.start()
+
+
+class RequestLoggerBufferedFilePlug(RequestLoggerFilePlug):
+    """
+    I log requests to a file like L{RequestLoggerFilePlug}, without
+    writing to it from the reactor.
+
+    The lines are queued and written by a thread, a group of lines at a
+    time: when buffer-size bytes are queued, or flush-interval seconds
+    after the last write.  When max-queue lines are waiting, new lines
+    are dropped, or the reactor waits for the thread to write them if
+    the overflow property is 'block'.  The number of lines waiting and
+    dropped are shown in the UI state of the component.
+    """
+
+    def start(self, component=None):
+        properties = self.args['properties']
+        self._bufferSize = properties.get('buffer-size', _DEFAULT_BUFFER_SIZE)
+        self._flushInterval = properties.get('flush-interval',
+                                             _DEFAULT_FLUSH_INTERVAL)
+        self._maxQueue = properties.get('max-queue', _DEFAULT_MAX_QUEUE)
+        self._overflow = properties.get('overflow', 'drop')
+        if self._overflow not in _OVERFLOW_POLICIES:
+            raise errors.PropertyError('overflow should be one of %s, '
+                                       'not %s'
+                                       % (', '.join(_OVERFLOW_POLICIES),
+                                          self._overflow))
+        RequestLoggerFilePlug.start(self, component)
+
+        self._cond = threading.Condition()
+        self._lines = collections.deque()
+        self._queuedSize = 0
+        self._running = True
+        self._rotating = False
+        self.dropped = 0
+
+        self._writer = threading.Thread(target=self._write,
+                                        name='RequestLogWriter')
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+        self._component = component
+        self._statsPoller = None
+        if component is not None:
+            component.uiState.addKey('request-log-queue-depth', 0)
+            component.uiState.addKey('request-log-dropped', 0)
+            self._statsPoller = Poller(self._updateStats, _STATS_INTERVAL)
+
+    def stop(self, component=None):
+        if self._statsPoller:
+            self._statsPoller.stop()
+            self._statsPoller = None
+        self._cond.acquire()
+        try:
+            self._running = False
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        # the thread writes the queued lines before exiting
+        self._writer.join()
+        RequestLoggerFilePlug.stop(self, component)
+
+    def event_http_session_completed(self, args):
+        line = _http_session_completed_to_apache_log(args)
+        self._cond.acquire()
+        try:
+            while len(self._lines) >= self._maxQueue:
+                if self._overflow == 'drop' or not self._running:
+                    self.dropped += 1
+                    return
+                self._cond.wait()
+            self._lines.append(line)
+            self._queuedSize += len(line)
+            if self._queuedSize >= self._bufferSize:
+                self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def rotate(self):
+        """
+        Reopen the log file once the lines queued so far are written to
+        the previous one.
+        """
+        self._cond.acquire()
+        try:
+            self._rotating = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def getQueueDepth(self):
+        """
+        @returns: the number of lines waiting to be written
+        """
+        return len(self._lines)
+
+    ### Private Methods ###
+
+    def _updateStats(self):
+        uiState = self._component.uiState
+        uiState.set('request-log-queue-depth', self.getQueueDepth())
+        uiState.set('request-log-dropped', self.dropped)
+
+    def _write(self):
+        # runs in the writer thread; only it touches the file
+        self._cond.acquire()
+        try:
+            while True:
+                if (self._running and not self._rotating
+                    and self._queuedSize < self._bufferSize):
+                    self._cond.wait(self._flushInterval)
+                lines = list(self._lines)
+                self._lines.clear()
+                self._queuedSize = 0
+                rotating = self._rotating
+                self._rotating = False
+                running = self._running
+                # wake up the reactor if it waits for room in the queue
+                self._cond.notifyAll()
+                self._cond.release()
+                try:
+                    try:
+                        if lines:
+                            self._writeLines(lines)
+                        if rotating:
+                            self._reopen()
+                    except Exception, e:
+                        # keep the thread alive, or a reactor blocked on
+                        # a full queue would wait forever
+                        self.warning('could not write %d lines to %s: %s',
+                                     len(lines), self.filename,
+                                     log.getExceptionMessage(e))
+                finally:
+                    self._cond.acquire()
+                if not running and not self._lines:
+                    break
+        finally:
+            # if the thread dies anyway, lines get dropped instead of
+            # blocking the reactor
+            self._running = False
+            self._cond.notifyAll()
+            self._cond.release()
+
+    def _writeLines(self, lines):
+        try:
+            self.file.write(''.join(lines))
+            self.file.flush()
+        except (IOError, ValueError), e:
+            self.warning('could not write %d lines to %s: %s', len(lines),
+                         self.filename, log.getExceptionMessage(e))
+
+    def _reopen(self):
+        self.debug('reopening %s', self.filename)
+        try:
+            f = open(self.filename, 'a')
+        except IOError, e:
+            self.warning('could not reopen log file %s, still logging to '
+                         'the previous one: %s', self.filename,
+                         log.getExceptionMessage(e))
+            return
+        self.file.close()
+        self.file = f
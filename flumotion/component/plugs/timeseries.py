@@ -0,0 +1,112 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import time
+
+from flumotion.component.plugs import base
+from flumotion.common import messages, i18n, log, timeseries
+from flumotion.common.poller import Poller
+
+from flumotion.common.i18n import N_
+T_ = i18n.gettexter()
+
+_DEFAULT_SAMPLE_INTERVAL = 1 # in seconds
+_DEFAULT_FLUSH_INTERVAL = 60 # in seconds
+
+__version__ = "$Rev$"
+
+
+class ComponentTimeSeriesPlug(base.ComponentPlug):
+    """
+    I record numeric keys of the UI state of a component in time series
+    files, one per key, that admins can query through the component's
+    medium.
+    """
+
+    ### ComponentPlug methods
+
+    def start(self, component):
+        self._component = component
+        self._store = None
+        self._samplePoller = None
+        self._flushPoller = None
+        self._skipped = set()
+
+        properties = self.args['properties']
+        directory = properties['directory']
+        self._keys = properties.get('key', [])
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError, e:
+            self.warning("Could not create directory '%s': %s", directory,
+                         log.getExceptionMessage(e))
+            m = messages.Warning(T_(N_(
+                "Could not create the time series directory '%s'.\n"),
+                directory),
+                debug=log.getExceptionMessage(e),
+                mid='timeseries-directory-error')
+            m.add(T_(N_(
+                "The time series plug for this component is disabled.")))
+            component.addMessage(m)
+            return
+
+        self._store = timeseries.TimeSeriesStore(directory)
+        component.timeSeries = self._store
+        self._samplePoller = Poller(self._sample, properties.get(
+            'sample-interval', _DEFAULT_SAMPLE_INTERVAL))
+        self._flushPoller = Poller(self._store.flush, properties.get(
+            'flush-interval', _DEFAULT_FLUSH_INTERVAL))
+
+    def stop(self, component):
+        if self._store is None:
+            return
+        self._samplePoller.stop()
+        self._flushPoller.stop()
+        component.timeSeries = None
+        self._store.close()
+        self._store = None
+
+    ### Private Methods ###
+
+    def _sample(self):
+        uiState = self._component.uiState
+        now = time.time()
+        for key in self._keys or uiState.keys():
+            if key in self._skipped:
+                continue
+            value = uiState.get(key)
+            if value is None:
+                continue
+            if (isinstance(value, bool)
+                or not isinstance(value, (int, long, float))):
+                if self._keys:
+                    self.warning('not recording ui state key %s: its '
+                                 'value %r is not a number', key, value)
+                self._skipped.add(key)
+                continue
+            try:
+                self._store.record(key, now, value)
+            except (EnvironmentError, ValueError), e:
+                self.warning('not recording ui state key %s: %s', key,
+                             log.getExceptionMessage(e))
+                self._skipped.add(key)
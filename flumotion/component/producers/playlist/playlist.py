@@ -19,12 +19,14 @@
 
 # Headers in this file shall remain intact.
 
+import os
 import time
 
 import gst
 from twisted.internet import defer, reactor
 
 from flumotion.common import messages, fxml, gstreamer, documentation
+from flumotion.configure import configure
 from flumotion.common.i18n import N_, gettexter
 from flumotion.component import feedcomponent
 from flumotion.component.base import watcher
@@ -36,6 +38,8 @@ import playlistparser
 __version__ = "$Rev$"
 T_ = gettexter()
 
+DEFAULT_DISCOVERERS = 2
+
 
 def _tsToString(ts):
     """
@@ -124,6 +128,10 @@ class PlaylistProducer(feedcomponent.FeedComponent):
         self._asrcs = {} # { PlaylistItem -> gnlsource }
 
         self.uiState.addListKey("playlist")
+        # the last time all the pending entries were discovered
+        self.uiState.addKey("discovered-files", 0)
+        self.uiState.addKey("discovered-cached-files", 0)
+        self.uiState.addKey("discovery-time", 0.0)
 
     def _buildAudioPipeline(self, pipeline, src):
         audiorate = gst.element_factory_make("audiorate")
@@ -381,6 +389,10 @@ class PlaylistProducer(feedcomponent.FeedComponent):
         self._playlistfile = props.get('playlist', None)
         self._playlistdirectory = props.get('playlist-directory', None)
         self._baseDirectory = props.get('base-directory', None)
+        self._discoverers = props.get('discoverers', DEFAULT_DISCOVERERS)
+        self._discoveryCache = props.get('discovery-cache',
+            os.path.join(configure.cachedir, 'playlist-discovery' +
+                         self.config['avatarId'].replace('/', '-')))
 
         self._width = props.get('width', 320)
         self._height = props.get('height', 240)
@@ -398,6 +410,12 @@ class PlaylistProducer(feedcomponent.FeedComponent):
 
         return pipeline
 
+    def _discoveryDone(self, files, cachedFiles, elapsed):
+        self.debug("Discovered %d files in %.1f seconds", files, elapsed)
+        self.uiState.set("discovered-files", files)
+        self.uiState.set("discovered-cached-files", cachedFiles)
+        self.uiState.set("discovery-time", elapsed)
+
     def _watchDirectory(self, dir):
         self.debug("Watching directory %s", dir)
         self._filesAdded = {}
@@ -469,7 +487,12 @@ class PlaylistProducer(feedcomponent.FeedComponent):
 
     def do_setup(self):
         playlist = playlistparser.Playlist(self)
-        self.playlistparser = playlistparser.PlaylistXMLParser(playlist)
+        cache = None
+        if self._discoveryCache:
+            cache = playlistparser.DiscoveryCache(self._discoveryCache)
+        self.playlistparser = playlistparser.PlaylistXMLParser(playlist,
+            discoverers=self._discoverers, cache=cache,
+            discoveryDone=self._discoveryDone)
         if self._baseDirectory:
             self.playlistparser.setBaseDirectory(self._baseDirectory)
 
@@ -22,6 +22,9 @@
 import gst
 from gst.extend import discoverer
 
+import bisect
+import cPickle
+import os
 import time
 import calendar
 from StringIO import StringIO
@@ -34,6 +37,9 @@ from flumotion.common import log, fxml
 
 __version__ = "$Rev$"
 
+# bump when the format of the discovery cache changes
+DISCOVERY_CACHE_VERSION = 1
+
 
 class PlaylistItem(object, log.Loggable):
 
@@ -52,6 +58,15 @@ class PlaylistItem(object, log.Loggable):
 
 
 class Playlist(object, log.Loggable):
+    """
+    I keep the items of a playlist, in a linked list in the order of
+    their timestamps, which do not overlap.
+
+    The items are also indexed in sorted arrays of their timestamps, so
+    that finding the item playing at a given time and the items a new
+    one overlaps is a binary search instead of a walk of the list.
+    """
+
     logCategory = 'playlist-list'
 
     def __init__(self, producer):
@@ -60,20 +75,28 @@ class Playlist(object, log.Loggable):
         """
         self.items = None # PlaylistItem linked list
         self._itemsById = {}
+        # the items from the head of the list, and their timestamps
+        self._sorted = []
+        self._starts = []
 
         self.producer = producer
 
     def _findItem(self, timePosition):
         # timePosition is the position in terms of the clock time
         # Get the item that corresponds to timePosition, or None
-        cur = self.items
-        while cur:
-            if cur.timestamp < timePosition and \
-                    cur.timestamp + cur.duration > timePosition:
+        i = bisect.bisect_left(self._starts, timePosition) - 1
+        if i >= 0:
+            cur = self._sorted[i]
+            if cur.timestamp + cur.duration > timePosition:
                 return cur
-            if cur.timestamp > timePosition:
-                return None # fail without having to iterate over everything
-            cur = cur.next
+        return None
+
+    def _indexOf(self, item):
+        i = bisect.bisect_left(self._starts, item.timestamp)
+        while i < len(self._sorted) and self._starts[i] == item.timestamp:
+            if self._sorted[i] is item:
+                return i
+            i += 1
         return None
 
     def _getCurrentItem(self):
@@ -84,11 +107,11 @@ class Playlist(object, log.Loggable):
         return item
 
     def removeItems(self, piid):
-        current = self._getCurrentItem()
-
         if piid not in self._itemsById:
             return
 
+        current = self._getCurrentItem()
+
         items = self._itemsById[piid]
         for item in items:
             self.debug("removeItems: item %r ts: %d", item, item.timestamp)
@@ -120,6 +143,9 @@ class Playlist(object, log.Loggable):
         # We don't care about anything older than now; drop references to them
         if current:
             self.items = current
+            i = self._indexOf(current)
+            del self._sorted[:i]
+            del self._starts[:i]
 
         newitem = PlaylistItem(piid, timestamp, uri, offset, duration)
         newitem.hasAudio = hasAudio
@@ -134,34 +160,29 @@ class Playlist(object, log.Loggable):
         # next starts after the new item, and ends after the
         # end of the new item
         prev = next = None
-        item = self.items
-        while item:
-            if item.timestamp < newitem.timestamp:
-                prev = item
-            else:
-                break
-            item = item.next
+        first = bisect.bisect_left(self._starts, timestamp)
+        if first > 0:
+            prev = self._sorted[first - 1]
 
-        if prev:
-            item = prev.next
-        while item:
+        last = first
+        while last < len(self._sorted):
+            item = self._sorted[last]
             if (item.timestamp > newitem.timestamp and
                     item.timestamp + item.duration >
                     newitem.timestamp + newitem.duration):
                 next = item
                 break
-            item = item.next
-
-        if prev:
-            # Then things between prev and next (next might be None) are to be
-            # deleted. Do so.
-            cur = prev.next
-            while cur != next:
-                self._itemsById[cur.id].remove(cur)
-                if not self._itemsById[cur.id]:
-                    del self._itemsById[cur.id]
-                self.producer.unscheduleItem(cur)
-                cur = cur.next
+            last += 1
+
+        # Then things between prev and next (next might be None) are to be
+        # deleted. Do so.
+        for cur in self._sorted[first:last]:
+            self._itemsById[cur.id].remove(cur)
+            if not self._itemsById[cur.id]:
+                del self._itemsById[cur.id]
+            self.producer.unscheduleItem(cur)
+        self._sorted[first:last] = [newitem]
+        self._starts[first:last] = [timestamp]
 
         # update links.
         if prev:
@@ -188,6 +209,8 @@ class Playlist(object, log.Loggable):
             duration = next.duration - (ts - next.timestamp)
             next.duration = duration
             next.timestamp = ts
+            # still before the item after it, which it did not overlap
+            self._starts[first + 1] = ts
             self.producer.adjustItemScheduling(next)
 
         # Then we need to actually add newitem into the gnonlin timeline
@@ -208,17 +231,159 @@ class Playlist(object, log.Loggable):
         if item.next:
             item.next.prev = item.prev
 
+        i = self._indexOf(item)
+        if i is not None:
+            del self._sorted[i]
+            del self._starts[i]
+
+
+def getFileKey(path):
+    """
+    @returns: the (size, mtime) of a file, that change when it is
+              modified, or None if it cannot be read
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+class DiscoveryCache(object, log.Loggable):
+    """
+    I remember what the discoverer found in media files, in a file, so
+    that a file is only discovered again when its size or modification
+    time changes.
+
+    The information of a file is a tuple of (isMedia, hasAudio,
+    hasVideo, audioLength, videoLength).
+    """
+    logCategory = 'playlist-cache'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = {} # path -> (key, info)
+        self._changed = False
+        self._load()
+
+    def get(self, path, key):
+        """
+        @param key: the current L{getFileKey} of the file
+
+        @returns: the information of the file, or None if it is not
+                  known for this version of the file
+        """
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def set(self, path, key, info):
+        """
+        @param key: the L{getFileKey} of the file when it was discovered
+        """
+        self._entries[path] = (key, info)
+        self._changed = True
+
+    def save(self):
+        """
+        Write the cache to its file, if it changed since it was loaded
+        or last saved.
+        """
+        if not self._changed:
+            return
+        data = {'version': DISCOVERY_CACHE_VERSION,
+                'entries': self._entries}
+        # several processes can save the cache at the same time, so write
+        # to a temporary file and rename it into place
+        tmp = '%s.%d' % (self.filename, os.getpid())
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            f = open(tmp, 'wb')
+            try:
+                cPickle.dump(data, f, 2)
+            finally:
+                f.close()
+            os.rename(tmp, self.filename)
+        except (IOError, OSError, cPickle.PicklingError), e:
+            self.warning('Could not save discovery cache %s: %s',
+                         self.filename, log.getExceptionMessage(e))
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        self._changed = False
+        self.debug('Saved %d entries to %s', len(self._entries),
+                   self.filename)
+
+    def _load(self):
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return
+        try:
+            try:
+                data = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            self.warning('Could not read discovery cache %s',
+                         self.filename)
+            self.debug('Reason: %s', log.getExceptionMessage(e))
+            return
+
+        if not isinstance(data, dict) or (data.get('version') !=
+                DISCOVERY_CACHE_VERSION):
+            self.debug('Discovery cache %s has an old version',
+                       self.filename)
+            return
+        self._entries = data['entries']
+        self.debug('Loaded %d entries from %s', len(self._entries),
+                   self.filename)
+
+
+class _Discovery(object):
+
+    def __init__(self, item, key):
+        self.item = item
+        self.key = key # of the file when it was discovered
+        self.info = None # set when discovered
+
 
 class PlaylistParser(object, log.Loggable):
     logCategory = 'playlist-parse'
 
-    def __init__(self, playlist):
+    def __init__(self, playlist, discoverers=1, cache=None,
+                 discoveryDone=None):
+        """
+        @param discoverers:   how many files to discover at the same time
+        @type  discoverers:   int
+        @param cache:         the cache of the discovered files, if any
+        @type  cache:         L{DiscoveryCache} or None
+        @param discoveryDone: called with the number of files discovered,
+                              the number of them found in the cache and
+                              the seconds it took when all the pending
+                              entries were discovered and scheduled
+        @type  discoveryDone: callable or None
+        """
         self.playlist = playlist
 
         self._pending_items = []
         self._discovering = False
         self._discovering_blocked = 0
 
+        self._discoverers = discoverers
+        self._cache = cache
+        self._discoveryDone = discoveryDone
+        # the entries being discovered, in the order they were pending;
+        # they are added to the playlist in that order
+        self._discoveries = []
+        self._running = 0
+        self._discoveryStarted = None
+        self._discoveredCount = 0
+        self._cachedCount = 0
+
         self._baseDirectory = None
 
     def setBaseDirectory(self, baseDir):
@@ -260,8 +425,7 @@ class PlaylistParser(object, log.Loggable):
         self.log('startDiscovery: discovering: %s, block: %d, pending: %d' %
                  (self._discovering, self._discovering_blocked,
                   len(self._pending_items)))
-        if not self._discovering and self._discovering_blocked < 1 \
-               and self._pending_items:
+        if self._discovering_blocked < 1 and self._pending_items:
             if doSort:
                 self._sortPending()
             self._discoverPending()
@@ -275,72 +439,112 @@ class PlaylistParser(object, log.Loggable):
         self._pending_items = [elt for (ts, elt) in sortlist]
 
     def _discoverPending(self):
-
-        def _discovered(disc, is_media):
-            self.debug("Discovered! is media: %d mime type %s", is_media,
-                disc.mimetype)
-            reactor.callFromThread(_discoverer_done, disc, is_media)
-
-        def _discoverer_done(disc, is_media):
-            if is_media:
-                self.debug("Discovery complete, media found")
-                # FIXME: does item exist because it is popped below ?
-                # if so, that's ugly and non-obvious and should be fixed
-                uri = "file://" + item[0]
-                timestamp = item[1]
-                duration = item[2]
-                offset = item[3]
-                piid = item[4]
-
-                hasA = disc.is_audio
-                hasV = disc.is_video
-                durationDiscovered = 0
-                if hasA and hasV:
-                    durationDiscovered = min(disc.audiolength,
-                        disc.videolength)
-                elif hasA:
-                    durationDiscovered = disc.audiolength
-                elif hasV:
-                    durationDiscovered = disc.videolength
-                if not duration or duration > durationDiscovered:
-                    duration = durationDiscovered
-
-                if duration + offset > durationDiscovered:
-                    offset = 0
-
-                if duration > 0:
-                    self.playlist.addItem(piid, timestamp, uri,
-                        offset, duration, hasA, hasV)
-                else:
-                    self.warning("Duration of item is zero, not adding")
+        if not self._discovering:
+            self._discovering = True
+            if self._discoveryStarted is None:
+                self._discoveryStarted = time.time()
+
+        # files in the cache do not take a discoverer
+        while (self._pending_items and self._discovering_blocked < 1
+               and self._running < self._discoverers):
+            item = self._pending_items.pop(0)
+            discovery = _Discovery(item, getFileKey(item[0]))
+            self._discoveries.append(discovery)
+            if self._cache and discovery.key:
+                discovery.info = self._cache.get(item[0], discovery.key)
+            if discovery.info is not None:
+                self.log("Found file %s in the discovery cache", item[0])
+                self._cachedCount += 1
             else:
-                self.warning("Discover failed to find media in %s", item[0])
+                self._discover(discovery)
 
-            # We don't want to burn too much cpu discovering all the files;
-            # this throttles the discovery rate to a reasonable level
-            self.debug("Continuing on to next file in one second")
-            reactor.callLater(1, self._discoverPending)
+        self._addDiscovered()
 
-        if not self._pending_items:
-            self.debug("No more files to discover")
-            self._discovering = False
+        if self._running:
             return
-
-        if self._discovering_blocked > 0:
+        self._discovering = False
+        if self._discovering_blocked > 0 and self._pending_items:
             self.debug("Discovering blocked: %d" % self._discovering_blocked)
-            self._discovering = False
             return
 
-        self._discovering = True
+        self.debug("No more files to discover")
+        elapsed = time.time() - self._discoveryStarted
+        self.info("Discovered %d files in %.1f seconds, %d of them from "
+                  "the cache", self._discoveredCount, elapsed,
+                  self._cachedCount)
+        if self._cache:
+            self._cache.save()
+        if self._discoveryDone:
+            self._discoveryDone(self._discoveredCount, self._cachedCount,
+                                elapsed)
+        self._discoveryStarted = None
+        self._discoveredCount = 0
+        self._cachedCount = 0
+
+    def _discover(self, discovery):
 
-        item = self._pending_items.pop(0)
+        def _discovered(disc, is_media):
+            self.debug("Discovered! is media: %d mime type %s", is_media,
+                disc.mimetype)
+            reactor.callFromThread(self._discovererDone, discovery, disc,
+                is_media)
 
-        self.debug("Discovering file %s", item[0])
-        disc = discoverer.Discoverer(item[0])
+        self.debug("Discovering file %s", discovery.item[0])
+        self._running += 1
+        disc = discoverer.Discoverer(discovery.item[0])
 
         disc.connect('discovered', _discovered)
         disc.discover()
 
+    def _discovererDone(self, discovery, disc, is_media):
+        self._running -= 1
+        discovery.info = (bool(is_media), disc.is_audio, disc.is_video,
+                          disc.audiolength, disc.videolength)
+        if self._cache and discovery.key:
+            self._cache.set(discovery.item[0], discovery.key,
+                            discovery.info)
+        self._discoverPending()
+
+    def _addDiscovered(self):
+        # add the discovered entries that are not waiting for entries
+        # pending before them
+        while self._discoveries and self._discoveries[0].info is not None:
+            discovery = self._discoveries.pop(0)
+            self._discoveredCount += 1
+            self._addDiscoveredItem(discovery.item, discovery.info)
+
+    def _addDiscoveredItem(self, item, info):
+        is_media, hasA, hasV, audiolength, videolength = info
+        if not is_media:
+            self.warning("Discover failed to find media in %s", item[0])
+            return
+
+        self.debug("Discovery complete, media found")
+        uri = "file://" + item[0]
+        timestamp = item[1]
+        duration = item[2]
+        offset = item[3]
+        piid = item[4]
+
+        durationDiscovered = 0
+        if hasA and hasV:
+            durationDiscovered = min(audiolength, videolength)
+        elif hasA:
+            durationDiscovered = audiolength
+        elif hasV:
+            durationDiscovered = videolength
+        if not duration or duration > durationDiscovered:
+            duration = durationDiscovered
+
+        if duration + offset > durationDiscovered:
+            offset = 0
+
+        if duration > 0:
+            self.playlist.addItem(piid, timestamp, uri,
+                offset, duration, hasA, hasV)
+        else:
+            self.warning("Duration of item is zero, not adding")
+
     def addItemToPlaylist(self, filename, timestamp, duration, offset, piid):
         # We only want to add it if it's plausibly schedulable.
         end = timestamp
@@ -34,6 +34,10 @@ _PACKAGE_SCRUB_LIST = []
 # dynamic dictionary of categories already seen and their level
 _categories = {}
 
+# dynamic dictionary of categories and the highest level of messages that
+# any handler wants for them; cleared when levels or handlers change
+_thresholds = {}
+
 # log handlers registered
 _log_handlers = []
 _log_handlers_limited = []
@@ -137,6 +141,7 @@ def registerCategory(category):
                 level = 5
     # store it
     _categories[category] = level
+    _thresholds.pop(category, None)
 
 
 def getCategoryLevel(category):
@@ -167,6 +172,7 @@ def setLogSettings(state):
      categories,
      _log_handlers,
      _log_handlers_limited) = state
+    _thresholds.clear()
 
     for category in categories:
         registerCategory(category)
@@ -184,13 +190,22 @@ def getLogSettings():
             _log_handlers_limited)
 
 
-def _canShortcutLogging(category, level):
+def _getThreshold(category):
     if _log_handlers:
         # we have some loggers operating without filters, have to do
         # everything
-        return False
+        threshold = LOG
     else:
-        return level > getCategoryLevel(category)
+        threshold = getCategoryLevel(category)
+    _thresholds[category] = threshold
+    return threshold
+
+
+def _canShortcutLogging(category, level):
+    try:
+        return level > _thresholds[category]
+    except KeyError:
+        return level > _getThreshold(category)
 
 
 def scrubFilename(filename):
@@ -302,41 +317,38 @@ def doLog(level, object, category, format, args, where=-1,
     """
     ret = {}
 
+    # only format the message and look up the caller's file and line if
+    # a handler is going to get the message
+    limited = _log_handlers_limited and level <= getCategoryLevel(category)
+    if not _log_handlers and not limited:
+        return ret
+
     if args:
         message = format % args
     else:
         message = format
 
-    # first all the unlimited ones
-    if _log_handlers:
-        if filePath is None and line is None:
-            (filePath, line) = getFileLine(where=where)
-        ret['filePath'] = filePath
-        ret['line'] = line
-        for handler in _log_handlers:
-            try:
-                handler(level, object, category, file, line, message)
-            except TypeError, e:
-                raise SystemError("handler %r raised a TypeError: %s" % (
-                    handler, getExceptionMessage(e)))
+    if filePath is None and line is None:
+        (filePath, line) = getFileLine(where=where)
+    ret['filePath'] = filePath
+    ret['line'] = line
 
-    if level > getCategoryLevel(category):
-        return ret
+    # first all the unlimited ones
+    for handler in _log_handlers:
+        try:
+            handler(level, object, category, filePath, line, message)
+        except TypeError, e:
+            raise SystemError("handler %r raised a TypeError: %s" % (
+                handler, getExceptionMessage(e)))
 
-    if _log_handlers_limited:
-        if filePath is None and line is None:
-            (filePath, line) = getFileLine(where=where)
-        ret['filePath'] = filePath
-        ret['line'] = line
+    if limited:
         for handler in _log_handlers_limited:
-            # set this a second time, just in case there weren't unlimited
-            # loggers there before
             try:
                 handler(level, object, category, filePath, line, message)
             except TypeError:
                 raise SystemError("handler %r raised a TypeError" % handler)
 
-        return ret
+    return ret
 
 
 def errorObject(object, cat, format, *args):
@@ -533,6 +545,7 @@ def reset():
     _log_handlers = []
     _log_handlers_limited = []
     _initialized = False
+    _thresholds.clear()
 
 
 def addLogHandler(func):
@@ -553,6 +566,7 @@ def addLogHandler(func):
 
     if func not in _log_handlers:
         _log_handlers.append(func)
+        _thresholds.clear()
 
 
 def addLimitedLogHandler(func):
@@ -587,6 +601,7 @@ def removeLogHandler(func):
     @raises ValueError: if func is not registered
     """
     _log_handlers.remove(func)
+    _thresholds.clear()
 
 
 def removeLimitedLogHandler(func):
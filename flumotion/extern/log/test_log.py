@@ -177,6 +177,56 @@ class TestLog(unittest.TestCase):
     def testAddLogHandlerRaises(self):
         self.assertRaises(TypeError, log.addLogHandler, 1)
 
+    def testLogHandlerFileLine(self):
+        log.setDebug("testlog:3")
+        log.addLogHandler(self.handler)
+
+        self.tester.log("visible")
+        # test_log.py ends in log.py too, so it can't be the file
+        self.failUnless(isinstance(self.file, str))
+        self.failUnless(isinstance(self.line, int))
+
+    def testSetDebugAfterLogging(self):
+        log.setDebug("testlog:3")
+        log.addLimitedLogHandler(self.handler)
+
+        self.tester.debug("not visible")
+        assert not self.message
+
+        log.setDebug("testlog:4")
+        self.tester.debug("visible")
+        assert self.message == 'visible'
+
+        log.setDebug("testlog:3")
+        self.tester.debug("not visible again")
+        assert self.message == 'visible'
+
+    def testAddLogHandlerAfterLogging(self):
+        log.setDebug("testlog:3")
+        self.tester.log("not visible")
+
+        log.addLogHandler(self.handler)
+        self.tester.log("visible")
+        assert self.message == 'visible'
+
+        log.removeLogHandler(self.handler)
+        self.tester.log("not visible again")
+        assert self.message == 'visible'
+
+    def testNoFormattingWhenInvisible(self):
+
+        class Unprintable:
+
+            def __repr__(self):
+                raise AssertionError("formatted an invisible message")
+
+        log.setDebug("testlog:3")
+        log.addLimitedLogHandler(self.handler)
+
+        self.tester.log("not visible %r", Unprintable())
+        log.log("testlog", "not visible %r", Unprintable())
+        assert not self.message
+
 
 class TestOwnLogHandler(unittest.TestCase):
 
@@ -25,25 +25,56 @@ from twisted.internet import reactor
 
 from flumotion.configure import configure
 from flumotion.common import log, keycards, common, errors
-from flumotion.job import job
+from flumotion.job import job, zygote
 from flumotion.twisted import credentials, fdserver
 from flumotion.common.options import OptionParser
 
 __version__ = "$Rev$"
 
 
+def _runZygote(poolSize):
+    log.info('job', 'Starting job zygote')
+    from flumotion.common import registry, setup
+    setup.setupPackagePath()
+    # load what the jobs need before forking them
+    registry.getRegistry()
+
+    avatarId = zygote.Zygote(poolSize).run()
+    if avatarId is None:
+        log.info('job', 'Stopped job zygote')
+        return None
+
+    # in a forked job process from now on
+    registry.getRegistry().verify()
+    return avatarId
+
+
 def main(args):
     parser = OptionParser(domain="flumotion-job")
+    parser.add_option('', '--zygote',
+                      action="store_true", dest="zygote", default=False,
+                      help="fork jobs on request of the worker")
+    parser.add_option('', '--pool-size',
+                      action="store", type="int", dest="poolSize", default=0,
+                      help="number of forked jobs to keep waiting for "
+                           "the worker in zygote mode [default 0]")
 
     log.debug('job', 'Parsing arguments (%r)' % ', '.join(args))
     options, args = parser.parse_args(args)
 
-    # check if a config file was specified; if so, parse config and copy over
-    if len(args) != 3:
-        parser.error("must pass an avatarId and a path to the socket: %r" %
-            args)
-    avatarId = args[1]
-    socket = args[2]
+    if options.zygote:
+        if len(args) != 2:
+            parser.error("must pass a path to the socket: %r" % args)
+        socket = args[1]
+        avatarId = _runZygote(options.poolSize)
+        if avatarId is None:
+            return 0
+    else:
+        if len(args) != 3:
+            parser.error("must pass an avatarId and a path to the socket: "
+                         "%r" % args)
+        avatarId = args[1]
+        socket = args[2]
 
     # log our standardized starting marker
     log.info('job', "Starting job '%s'" % avatarId)
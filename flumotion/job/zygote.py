@@ -0,0 +1,288 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_job_zygote -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+the job-side half of the job zygote
+
+A zygote is a job process that has done the costly imports and
+initialization once, and then forks job processes on request of the
+worker.  The forked processes wait for the worker to give them a job
+before going on with the usual job startup.
+
+The worker writes commands to the zygote's stdin, as pickled tuples
+prefixed with their length on a line of their own:
+  - ('fork',): fork a job process
+  - ('run', pid, avatarId, env): give a job to the forked process pid
+
+The zygote writes events to file descriptor 3, one per line:
+  - 'ready PID': process PID was forked and waits for a job
+  - 'exited PID STATUS': process PID exited with waitpid() STATUS
+"""
+
+import cPickle
+import errno
+import fcntl
+import os
+import select
+import signal
+
+from flumotion.common import log
+
+__version__ = "$Rev$"
+
+COMMAND_FD = 0
+EVENT_FD = 3
+
+
+def encodeMessage(message):
+    data = cPickle.dumps(message, 2)
+    return '%d\n%s' % (len(data), data)
+
+
+def _read(fd, size):
+    while True:
+        try:
+            return os.read(fd, size)
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+def readMessage(fd):
+    """
+    Read a message written with encodeMessage from a file descriptor.
+
+    @returns: the message, or None at end of file
+    """
+    header = ''
+    while not header.endswith('\n'):
+        c = _read(fd, 1)
+        if not c:
+            return None
+        header += c
+    size = int(header)
+    data = ''
+    while len(data) < size:
+        chunk = _read(fd, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return cPickle.loads(data)
+
+
+def _reinstallWaker():
+    # The reactor was installed before forking; its waker pipe is shared
+    # with the zygote and the other forked processes, so one process
+    # could eat another one's wake ups.
+    from twisted.internet import reactor
+    waker = getattr(reactor, 'waker', None)
+    if waker is None:
+        return
+    reactor.removeReader(waker)
+    waker.connectionLost(None)
+    reactor.waker = None
+    reactor.installWaker()
+
+
+class Zygote(log.Loggable):
+    """
+    I fork job processes on request of the worker.
+
+    I keep up to poolSize forked processes waiting for a job, so that
+    the worker does not have to wait for a fork when starting a
+    component.
+    """
+
+    logCategory = 'zygote'
+
+    def __init__(self, poolSize=0):
+        self.poolSize = poolSize
+        self._idle = {} # pid -> fd to give the process its job on
+        self._children = {} # pid -> None
+        self._open = True # whether the worker sends commands
+        self._reporting = True # whether the worker listens to events
+        self._wakeRead = None
+        self._wakeWrite = None
+
+    def run(self):
+        """
+        Serve the worker's commands, until the worker closes the command
+        pipe and all the forked processes have exited.
+
+        Returns in the forked processes too, once they are given a job.
+
+        @returns: the avatarId the forked process should log in with,
+                  or None in the zygote
+        @rtype:   str or None
+        """
+        # a SIGCHLD arriving just before select() would not interrupt
+        # it, so the handler wakes select() up through a pipe instead
+        self._wakeRead, self._wakeWrite = os.pipe()
+        for fd in self._wakeRead, self._wakeWrite:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        signal.signal(signal.SIGCHLD, self._childExited)
+        for i in range(self.poolSize):
+            avatarId = self._fork()
+            if avatarId is not None:
+                return avatarId
+
+        while self._open or self._children:
+            fds = [self._wakeRead]
+            if self._open:
+                fds.append(COMMAND_FD)
+            try:
+                readable = select.select(fds, [], [])[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            if self._wakeRead in readable:
+                self._drainWakeups()
+            self._reap()
+            if COMMAND_FD not in readable:
+                continue
+
+            message = readMessage(COMMAND_FD)
+            if message is None:
+                self.debug('worker closed the command pipe')
+                self._open = False
+                self._closeIdle()
+                continue
+            avatarId = self._handleMessage(message)
+            if avatarId is not None:
+                return avatarId
+        self.debug('all forked processes exited')
+        os.close(self._wakeRead)
+        os.close(self._wakeWrite)
+        return None
+
+    def _childExited(self, signum, frame):
+        try:
+            os.write(self._wakeWrite, 'x')
+        except OSError:
+            # the pipe is full, select() will wake up anyway
+            pass
+
+    def _drainWakeups(self):
+        try:
+            while os.read(self._wakeRead, 4096):
+                pass
+        except OSError, e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+    def _handleMessage(self, message):
+        if message[0] == 'fork':
+            return self._fork()
+        elif message[0] == 'run':
+            pid, avatarId, env = message[1:]
+            fd = self._idle.pop(pid, None)
+            if fd is None:
+                self.warning('asked to run %s in unknown process %d',
+                             avatarId, pid)
+                return None
+            self.debug('running %s in process %d', avatarId, pid)
+            try:
+                os.write(fd, encodeMessage((avatarId, env)))
+            except OSError, e:
+                self.warning('could not give a job to process %d: %s',
+                             pid, log.getExceptionMessage(e))
+            os.close(fd)
+            if len(self._idle) < self.poolSize:
+                return self._fork()
+        else:
+            self.warning('unknown command %r', message[0])
+        return None
+
+    def _fork(self):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(w)
+            return self._waitForJob(r)
+        os.close(r)
+        self._idle[pid] = w
+        self._children[pid] = None
+        self._sendEvent('ready %d' % pid)
+        return None
+
+    def _waitForJob(self, fd):
+        # in the forked process
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for w in self._idle.values():
+            os.close(w)
+        self._idle = {}
+        self._children = {}
+        os.close(self._wakeRead)
+        os.close(self._wakeWrite)
+        os.close(EVENT_FD)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, COMMAND_FD)
+        os.close(devnull)
+
+        message = readMessage(fd)
+        os.close(fd)
+        if message is None:
+            # the zygote is going away
+            os._exit(0)
+        avatarId, env = message
+        os.environ.clear()
+        os.environ.update(env)
+        if 'FLU_DEBUG' in env:
+            log.setDebug(env['FLU_DEBUG'])
+        _reinstallWaker()
+        return avatarId
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                break
+            if pid == 0:
+                break
+            self.debug('process %d exited with status %d', pid, status)
+            self._children.pop(pid, None)
+            fd = self._idle.pop(pid, None)
+            if fd is not None:
+                os.close(fd)
+            self._sendEvent('exited %d %d' % (pid, status))
+
+    def _closeIdle(self):
+        # the processes waiting for a job exit when their pipe closes
+        for fd in self._idle.values():
+            os.close(fd)
+        self._idle = {}
+
+    def _sendEvent(self, event):
+        if not self._reporting:
+            return
+        try:
+            os.write(EVENT_FD, event + '\n')
+        except OSError, e:
+            self.warning('could not send event to the worker: %s',
+                         log.getExceptionMessage(e))
+            self._reporting = False
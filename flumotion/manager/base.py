@@ -212,6 +212,12 @@ class ManagerAvatar(fpb.PingableAvatar, log.Loggable):
             else:
                 sums.append((dep, bundler.bundle().md5sum))
 
+        try:
+            basket.saveHashCache()
+        except EnvironmentError, e:
+            self.warning('Could not save bundle hash cache: %s',
+                         log.getExceptionMessage(e))
+
         self.debug('requested bundles: %r' % [x[0] for x in sums])
         return sums
 
@@ -255,6 +261,55 @@ class ManagerAvatar(fpb.PingableAvatar, log.Loggable):
             zips[name] = bundler.bundle().getZip()
         return zips
 
+    def perspective_getBundleManifests(self, bundles):
+        """
+        Get the md5sums of the given bundles and of the files in them.
+
+        @param bundles: the names of the bundles to get
+        @type  bundles: list of str
+
+        @returns: dictionary of bundleName -> (md5sum, manifest), with
+                  manifest a list of (path, md5sum) of the bundle's files
+        @rtype:   dict of str -> (str, list of (str, str))
+        """
+        basket = self.vishnu.getBundlerBasket()
+        manifests = {}
+        for name in bundles:
+            bundler = basket.getBundlerByName(name)
+            if not bundler:
+                raise errors.NoBundleError(
+                    'The bundle named "%s" was not found' % (name, ))
+            b = bundler.bundle()
+            manifests[name] = (b.md5sum, list(b.manifest))
+        return manifests
+
+    def perspective_getBundleFiles(self, bundles, md5sums):
+        """
+        Get the files with the given md5sums from the given bundles,
+        compressed with L{flumotion.common.bundle.deflate}.
+
+        @param bundles: the names of the bundles with the files
+        @type  bundles: list of str
+        @param md5sums: the md5sums of the files to get
+        @type  md5sums: list of str
+
+        @returns: dictionary of md5sum -> deflated data
+        @rtype:   dict of str -> str
+        """
+        basket = self.vishnu.getBundlerBasket()
+        files = {}
+        for name in bundles:
+            bundler = basket.getBundlerByName(name)
+            if not bundler:
+                raise errors.NoBundleError(
+                    'The bundle named "%s" was not found' % (name, ))
+            files.update(bundler.getDeflatedFiles(md5sums))
+        missing = [md5sum for md5sum in md5sums if md5sum not in files]
+        if missing:
+            raise errors.NoBundleError(
+                'Files with md5sums %s were not found' % ', '.join(missing))
+        return files
+
     def perspective_authenticate(self, bouncerName, keycard):
         """
         Authenticate the given keycard.
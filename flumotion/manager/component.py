@@ -417,6 +417,12 @@ class ComponentAvatar(base.ManagerAvatar):
         return self.mindCallRemote('feedTo', feederName, fullFeedId,
                                    host, port)
 
+    def eatFromLocal(self, eaterAlias, fullFeedId, host, port):
+        self.debug('eater %s connected locally to feed %s', eaterAlias,
+                   fullFeedId)
+        return self.mindCallRemote('eatFromLocal', eaterAlias, fullFeedId,
+                                   host, port)
+
     # FIXME: maybe make a BouncerComponentAvatar subclass ?
 
     def authenticate(self, keycard):
@@ -692,6 +698,9 @@ class ComponentHeaven(base.ManagerHeaven):
 
     logCategory = 'comp-heaven'
 
+    # connect components running on the same worker through socket pairs
+    localFeeds = True
+
     def __init__(self, vishnu):
         # doc in base class
         base.ManagerHeaven.__init__(self, vishnu)
@@ -792,16 +801,67 @@ class ComponentHeaven(base.ManagerHeaven):
             toHost, toPort)
         return toHost, toPort
 
+    def getLocalFeedWorker(self, fromAvatar, toAvatar):
+        """
+        @param fromAvatar: the avatar to connect from
+        @type  fromAvatar: L{ComponentAvatar}
+        @param toAvatar:   the avatar to connect to
+        @type  toAvatar:   L{ComponentAvatar}
+
+        @returns: the worker both avatars run on, if they can be connected
+                  through a local socket pair instead of TCP, or None
+        @rtype:   L{flumotion.manager.worker.WorkerAvatar}
+        """
+        if not self.localFeeds:
+            return None
+        workerName = fromAvatar.getWorkerName()
+        if not workerName or workerName != toAvatar.getWorkerName():
+            return None
+        return self.vishnu.workerHeaven.avatars.get(workerName)
+
     def _connectFeederToEater(self, fromComp, fromFeed,
                               toComp, toFeed, method):
         host, port = self.mapNetFeed(fromComp, toComp)
-        if port:
-            fullFeedId = toComp.getFullFeedId(toFeed)
-            proc = getattr(fromComp, method)
-            proc(fromFeed, fullFeedId, host, port)
-        else:
+        if not port:
             self.debug('postponing connection to %s: feed server '
                        'unavailable', toComp.getFeedId(toFeed))
+            return
+
+        fullFeedId = toComp.getFullFeedId(toFeed)
+        proc = getattr(fromComp, method)
+        worker = self.getLocalFeedWorker(fromComp, toComp)
+        if worker is None:
+            proc(fromFeed, fullFeedId, host, port)
+            return
+
+        if method == 'eatFrom':
+            eaterComp, eaterAlias = fromComp, fromFeed
+            feederComp, feederName = toComp, toFeed
+        else:
+            eaterComp, eaterAlias = toComp, toFeed
+            feederComp, feederName = fromComp, fromFeed
+
+        def connected(success):
+            if not success:
+                self.debug('worker %s could not connect %s locally, '
+                           'using its feed server', worker.avatarId,
+                           fullFeedId)
+                proc(fromFeed, fullFeedId, host, port)
+            elif method == 'eatFrom':
+                # so that the eater can reconnect through the feed
+                # server if the local feed breaks
+                eaterComp.eatFromLocal(eaterAlias, fullFeedId, host, port)
+
+        def connectFailed(failure):
+            self.debug('worker %s failed to connect %s locally, using '
+                       'its feed server: %s', worker.avatarId, fullFeedId,
+                       log.getFailureMessage(failure))
+            proc(fromFeed, fullFeedId, host, port)
+
+        d = worker.connectLocalFeed(feederComp.avatarId, feederName,
+                                    eaterComp.avatarId, eaterAlias)
+        d.addCallbacks(connected, connectFailed)
+        return d
 
     def _connectEatersAndFeeders(self, avatar):
         # FIXME: all connections are upstream for now
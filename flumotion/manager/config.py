@@ -373,7 +373,7 @@ class ConfigEntryManager:
     "I represent a <manager> entry in a planet config file"
 
     def __init__(self, name, host, port, transport, certificate, bouncer,
-            fludebug, plugs):
+            fludebug, plugs, placement=None):
         self.name = name
         self.host = host
         self.port = port
@@ -382,6 +382,7 @@ class ConfigEntryManager:
         self.bouncer = bouncer
         self.fludebug = fludebug
         self.plugs = plugs
+        self.placement = placement
 
 
 class ConfigEntryAtmosphere:
@@ -720,7 +721,9 @@ class ManagerConfigParser(FlumotionConfigParser):
                    'certificate': (simpleparse(str), recordval('certificate')),
                    'component': (_ignore, _ignore),
                    'plugs': (_ignore, _ignore),
-                   'debug': (simpleparse(str), recordval('fludebug'))}
+                   'debug': (simpleparse(str), recordval('fludebug')),
+                   'placement': (simpleparse(enum('requested', 'load')),
+                                 recordval('placement'))}
         self.parseFromTable(node, parsers)
         return ret
 
@@ -750,7 +753,8 @@ class ManagerConfigParser(FlumotionConfigParser):
                    'certificate': (_ignore, _ignore),
                    'component': (parsecomponent, gotcomponent),
                    'plugs': (parseplugs, gotplugs),
-                   'debug': (_ignore, _ignore)}
+                   'debug': (_ignore, _ignore),
+                   'placement': (_ignore, _ignore)}
         self.parseFromTable(node, parsers)
 
     def parseBouncerAndPlugs(self):
@@ -0,0 +1,279 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_manager_creation -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+scheduling of the creation of components on workers
+
+@var MAX_CONCURRENT_CREATES: number of components being created at the
+                             same time on a worker
+@var MAX_RETRIES:            number of times the creation of a component
+                             is retried when it fails for another reason
+                             than the component itself
+@var RETRY_DELAY:            seconds to wait before retrying to create a
+                             component the first time, doubled for each
+                             of the next retries
+"""
+
+import heapq
+
+from twisted.internet import defer, reactor
+
+from flumotion.common import errors, log
+
+__version__ = "$Rev$"
+
+MAX_CONCURRENT_CREATES = 4
+MAX_RETRIES = 3
+RETRY_DELAY = 1.0
+
+
+def getDepths(feeders):
+    """
+    Compute the depth of components in their flow, from the components
+    they eat from.  Components without feeders, like producers, have a
+    depth of 0, the others have a depth of one more than the deepest of
+    their feeders.
+
+    @param feeders: the avatarIds of the components each component eats
+                    from; feeders missing from it are given a depth of 0
+    @type  feeders: dict of avatarId -> list of avatarId
+
+    @rtype: dict of avatarId -> int
+    """
+    depths = {}
+    for avatarId in feeders:
+        if avatarId in depths:
+            continue
+        # iterative depth-first walk, flows can be deep
+        stack = [(avatarId, iter(feeders.get(avatarId, ())))]
+        visiting = set([avatarId])
+        while stack:
+            current, it = stack[-1]
+            for feederId in it:
+                if feederId in depths or feederId in visiting:
+                    # a feed loop is not valid, do not follow it
+                    continue
+                visiting.add(feederId)
+                stack.append((feederId, iter(feeders.get(feederId, ()))))
+                break
+            else:
+                stack.pop()
+                visiting.discard(current)
+                depth = 0
+                for feederId in feeders.get(current, ()):
+                    if feederId in depths:
+                        depth = max(depth, depths[feederId] + 1)
+                depths[current] = depth
+    return depths
+
+
+class CreationScheduler(log.Loggable):
+    """
+    I create components on workers.
+
+    I create a limited number of components at the same time on each
+    worker, the ones with the lowest priority first, and retry the
+    creations that failed because of the worker or the connection to it.
+
+    @ivar maxConcurrent: number of components created at the same time
+                         on a worker
+    @type maxConcurrent: int
+    """
+
+    logCategory = 'creation'
+
+    def __init__(self, create, failed, maxConcurrent=MAX_CONCURRENT_CREATES):
+        """
+        @param create:  called with a workerId and a component state to
+                        create the component on the worker, returning a
+                        deferred
+        @type  create:  callable
+        @param failed:  called with the failure, the workerId and the
+                        component state when a component could not be
+                        created
+        @type  failed:  callable
+        """
+        self.maxConcurrent = maxConcurrent
+        self._create = create
+        self._failed = failed
+        self._counter = 0
+        self._queues = {} # workerId -> heap of (priority, counter, state)
+        self._creating = {} # workerId -> set of states
+        self._scheduled = {} # state -> (workerId, deferred)
+        self._attempts = {} # state -> number of failed creations
+        self._retryDCs = {} # state -> DelayedCall
+        self._starting = set() # workerIds we are starting creations on
+
+    ### Public Methods ###
+
+    def schedule(self, workerId, componentState, priority=0):
+        """
+        Create a component on a worker, after the ones with a lower
+        priority.
+
+        @returns: a deferred that will fire when the component is created,
+                  or could not be created; or None if the component is
+                  already scheduled to be created
+        """
+        if componentState in self._scheduled:
+            self.debug('%r already scheduled on %s', componentState,
+                       self._scheduled[componentState][0])
+            return None
+        d = defer.Deferred()
+        self._scheduled[componentState] = (workerId, d)
+        self._push(workerId, componentState, priority)
+        self._startNext(workerId)
+        return d
+
+    def isScheduled(self, componentState):
+        return componentState in self._scheduled
+
+    def getQueueLength(self, workerId):
+        """
+        @returns: the number of components waiting to be created on a
+                  worker, not counting the ones being created
+        """
+        return len(self._queues.get(workerId, ()))
+
+    def cancel(self, componentState):
+        """
+        Do not create a component that is waiting to be created.
+
+        @returns: whether the component was waiting to be created
+        @rtype:   bool
+        """
+        entry = self._scheduled.get(componentState)
+        if entry is None:
+            return False
+        workerId, d = entry
+        if componentState in self._creating.get(workerId, ()):
+            # too late, the worker is creating it
+            return False
+        self._forget(workerId, componentState)
+        d.callback(None)
+        return True
+
+    def cancelWorker(self, workerId):
+        """
+        Do not create the components waiting to be created on a worker,
+        because it logged out.
+
+        @returns: the states of the components that were waiting
+        @rtype:   list of L{flumotion.common.planet.ManagerComponentState}
+        """
+        cancelled = [state for state, (w, d) in self._scheduled.items()
+                     if w == workerId
+                     and state not in self._creating.get(workerId, ())]
+        for state in cancelled:
+            self.cancel(state)
+        return cancelled
+
+    def stop(self):
+        for dc in self._retryDCs.values():
+            dc.cancel()
+        self._retryDCs.clear()
+
+    ### Private Methods ###
+
+    def _push(self, workerId, componentState, priority):
+        self._counter += 1
+        heapq.heappush(self._queues.setdefault(workerId, []),
+                       (priority, self._counter, componentState))
+
+    def _forget(self, workerId, componentState):
+        del self._scheduled[componentState]
+        self._attempts.pop(componentState, None)
+        dc = self._retryDCs.pop(componentState, None)
+        if dc is not None:
+            dc.cancel()
+        queue = self._queues.get(workerId)
+        if queue:
+            for i, entry in enumerate(queue):
+                if entry[2] is componentState:
+                    queue[i] = queue[-1]
+                    queue.pop()
+                    heapq.heapify(queue)
+                    break
+            if not queue:
+                del self._queues[workerId]
+
+    def _startNext(self, workerId):
+        if workerId in self._starting:
+            # creations that complete right away do not recurse
+            return
+        self._starting.add(workerId)
+        try:
+            while (len(self._creating.get(workerId, ()))
+                   < self.maxConcurrent):
+                queue = self._queues.get(workerId)
+                if not queue:
+                    break
+                priority, counter, state = heapq.heappop(queue)
+                if not queue:
+                    del self._queues[workerId]
+                creating = self._creating.setdefault(workerId, set())
+                creating.add(state)
+                self.debug('creating %r on %s (%d being created)', state,
+                           workerId, len(creating))
+                d = defer.maybeDeferred(self._create, workerId, state)
+                d.addCallbacks(self._createdCallback, self._createdErrback,
+                               callbackArgs=(workerId, state, priority),
+                               errbackArgs=(workerId, state, priority))
+        finally:
+            self._starting.discard(workerId)
+
+    def _done(self, workerId, state):
+        creating = self._creating[workerId]
+        creating.discard(state)
+        if not creating:
+            del self._creating[workerId]
+        self._startNext(workerId)
+
+    def _createdCallback(self, result, workerId, state, priority):
+        d = self._scheduled[state][1]
+        self._forget(workerId, state)
+        self._done(workerId, state)
+        d.callback(result)
+
+    def _createdErrback(self, failure, workerId, state, priority):
+        attempts = self._attempts.get(state, 0) + 1
+        if (attempts <= MAX_RETRIES
+            and not failure.check(errors.ComponentError)):
+            delay = RETRY_DELAY * 2 ** (attempts - 1)
+            self.info('failed to create %r on %s, retrying in %.1f '
+                      'seconds: %s', state, workerId, delay,
+                      log.getFailureMessage(failure))
+            self._attempts[state] = attempts
+            self._retryDCs[state] = reactor.callLater(
+                delay, self._retry, workerId, state, priority)
+            self._done(workerId, state)
+            return
+
+        d = self._scheduled[state][1]
+        self._forget(workerId, state)
+        self._done(workerId, state)
+        self._failed(failure, workerId, state)
+        d.callback(None)
+
+    def _retry(self, workerId, state, priority):
+        del self._retryDCs[state]
+        self._push(workerId, state, priority)
+        self._startNext(workerId)
@@ -46,6 +46,7 @@ from flumotion.common.netutils import addressGetHost
 from flumotion.common.planet import moods
 from flumotion.configure import configure
 from flumotion.manager import admin, component, worker, base, config
+from flumotion.manager import creation, placement
 from flumotion.twisted import checkers
 from flumotion.twisted import portal as fportal
 from flumotion.project import project
@@ -187,12 +188,20 @@ class Vishnu(log.Loggable):
     @cvar configDir:       the configuration directory for
                            this Vishnu's manager
     @type configDir:       str
+    @cvar placer:          the placer choosing the workers components
+                           without a requested worker run on, if enabled
+    @type placer:          L{placement.Placer}
+    @cvar placementDelay:  seconds to wait before placing components, so
+                           that the workers logging in together share them
+    @type placementDelay:  float
     """
 
     implements(server.IServable)
 
     logCategory = "vishnu"
 
+    placementDelay = 1.0
+
     def __init__(self, name, unsafeTracebacks=0, configDir=None):
         # create a Dispatcher which will hand out avatars to clients
         # connecting to me
@@ -229,6 +238,13 @@ class Vishnu(log.Loggable):
 
         self.plugs = {} # socket -> list of plugs
 
+        self.placer = None
+        self._placementQueue = [] # components waiting to be placed
+        self._placementDC = None
+        self._displaced = {} # avatarId -> None, for components of lost workers
+        self._creator = creation.CreationScheduler(self._createComponent,
+                                                   self._createFailed)
+
         # create a portal so that I can be connected to, through our dispatcher
         # implementing the IRealm and a bouncer
         self.portal = fportal.BouncerPortal(self.dispatcher, None)
@@ -249,6 +265,10 @@ class Vishnu(log.Loggable):
         @returns: A deferred that will fire when the manager has shut
         down.
         """
+        if self._placementDC is not None:
+            self._placementDC.cancel()
+            self._placementDC = None
+        self._creator.stop()
         if self.bouncer:
             return self.bouncer.stop()
         else:
@@ -511,7 +531,10 @@ class Vishnu(log.Loggable):
                    (componentsToStart, ))
 
         for workerId, componentStates in componentsToStart.items():
-            self._workerCreateComponents(workerId, componentStates)
+            if workerId is None and self.placer:
+                self._schedulePlacement(componentStates)
+            else:
+                self._workerCreateComponents(workerId, componentStates)
 
     def _loadComponentConfiguration(self, conf, identity):
         # makeBouncer only makes a bouncer if there is one in the config
@@ -625,6 +648,9 @@ class Vishnu(log.Loggable):
         self.debug('loading configuration')
         conf = config.ManagerConfigParser(file)
         conf.parseBouncerAndPlugs()
+        if conf.manager and conf.manager.placement == 'load':
+            self.debug('placing components on the least loaded workers')
+            self.placer = placement.Placer()
         self._loadManagerPlugs(conf)
         self._loadManagerBouncer(conf)
         conf.unlink()
@@ -742,6 +768,10 @@ class Vishnu(log.Loggable):
         # find a worker this component can start on
         workerId = (componentState.get('workerName')
                     or componentState.get('workerRequested'))
+        if workerId is None and self.placer:
+            placed = self._placeComponents([componentState])
+            if placed:
+                workerId = placed.keys()[0]
 
         if not workerId in self.workerHeaven.avatars:
             raise errors.ComponentNoWorkerError(
@@ -841,7 +871,17 @@ class Vishnu(log.Loggable):
             self.warning("Component mapper for component state %r doesn't "
                 "exist", componentState)
             raise errors.UnknownComponentError(componentState)
-        elif not m.avatar:
+
+        if self.placer:
+            self.placer.removeLocation(m.id)
+            self._displaced.pop(m.id, None)
+
+        if self._creator.cancel(componentState):
+            self.debug('cancelled the creation of %s', m.id)
+            componentState.set('moodPending', None)
+            return defer.succeed(None)
+
+        if not m.avatar:
             return self._componentStopNoAvatar(componentState, m.id)
         else:
             return self._componentStopWithAvatar(componentState, m.avatar)
@@ -869,12 +909,15 @@ class Vishnu(log.Loggable):
         # called when a worker logs in
         workerId = workerAvatar.avatarId
         self.debug('vishnu.workerAttached(): id %s' % workerId)
+        if self.placer:
+            self.placer.addWorker(workerId)
 
         # Create all components assigned to this worker. Note that the
         # order of creation is unimportant, it's only the order of
         # starting that matters (and that's different code).
-        components = [c for c in self._getComponentsToCreate()
-                      if c.get('workerRequested') in (workerId, None)]
+        components = set([c for c in self._getComponentsToCreate()
+                          if c.get('workerRequested') in (workerId, None)
+                          and not self._creator.isScheduled(c)])
         # So now, check what components worker is running
         # so we can remove them from this components list
         # also add components we have that are lost but not
@@ -882,19 +925,18 @@ class Vishnu(log.Loggable):
         d = workerAvatar.getComponents()
 
         def workerAvatarComponentListReceived(workerComponents):
-            # list() is called to work around a pychecker bug. FIXME.
-            lostComponents = list([c for c in self.getComponentStates()
-                              if c.get('workerRequested') == workerId and \
-                                 c.get('mood') == moods.lost.value])
+            lostComponents = set([c for c in self.getComponentStates()
+                                  if c.get('workerRequested') == workerId
+                                  and c.get('mood') == moods.lost.value])
             for comp in workerComponents:
                 # comp is an avatarId string
                 # components is a list of {ManagerComponentState}
                 if comp in self._componentMappers:
+                    if self.placer:
+                        self.placer.setLocation(comp, workerId)
                     compState = self._componentMappers[comp].state
-                    if compState in components:
-                        components.remove(compState)
-                    if compState in lostComponents:
-                        lostComponents.remove(compState)
+                    components.discard(compState)
+                    lostComponents.discard(compState)
 
             for compState in lostComponents:
                 self.info(
@@ -906,7 +948,17 @@ class Vishnu(log.Loggable):
                 compState.set('moodPending', None)
                 compState.setMood(moods.sleeping.value)
 
-            allComponents = components + lostComponents
+            allComponents = list(components | lostComponents)
+
+            if self.placer:
+                # Components without a requested worker are placed on
+                # any worker, once the workers logging in together did
+                unpinned = [c for c in allComponents
+                            if c.get('workerRequested') is None]
+                if unpinned:
+                    self._schedulePlacement(unpinned)
+                allComponents = [c for c in allComponents
+                                 if c.get('workerRequested') is not None]
 
             if not allComponents:
                 self.debug(
@@ -921,14 +973,17 @@ class Vishnu(log.Loggable):
 
     def _workerCreateComponents(self, workerId, components):
         """
-        Create the list of components on the given worker, sequentially, but
-        in no specific order.
+        Create the list of components on the given worker, a few of them
+        at the same time, the ones fed by the others last.
 
         @param workerId:   avatarId of the worker
         @type  workerId:   string
         @param components: components to start
         @type  components: list of
                            L{flumotion.common.planet.ManagerComponentState}
+
+        @returns: a deferred that will fire when the components are
+                  created, or could not be created
         """
         self.debug("_workerCreateComponents: workerId %r, components %r" % (
             workerId, components))
@@ -938,46 +993,74 @@ class Vishnu(log.Loggable):
                        'component start' % workerId)
             return defer.succeed(None)
 
-        workerAvatar = self.workerHeaven.avatars[workerId]
-
-        d = defer.Deferred()
-
-        for c in components:
-            componentType = c.get('type')
-            conf = c.get('config')
-            self.debug('scheduling create of %s on %s'
-                       % (conf['avatarId'], workerId))
-            d.addCallback(self._workerCreateComponentDelayed,
-                workerAvatar, c, componentType, conf)
-
-        d.addCallback(lambda result: self.debug(
-            '_workerCreateComponents(): completed setting up create chain'))
-
-        # now trigger the chain
-        self.debug('_workerCreateComponents(): triggering create chain')
-        d.callback(None)
-        #reactor.callLater(0, d.callback, None)
+        if self.placer:
+            for c in components:
+                self.placer.setLocation(self._componentMappers[c].id,
+                                        workerId)
+
+        # schedule them in order, the first ones are created right away
+        depths = self._getCreationDepths(components)
+        order = []
+        for i, c in enumerate(components):
+            avatarId = self._componentMappers[c].id
+            order.append((depths[avatarId], i, avatarId, c))
+        order.sort()
+
+        dl = []
+        for depth, i, avatarId, c in order:
+            if self._creator.isScheduled(c):
+                continue
+            # we set the moodPending to HAPPY, so this component only gets
+            # asked to start once; before scheduling it, as the creation
+            # can fail right away and reset it
+            c.set('moodPending', moods.happy.value)
+            d = self._creator.schedule(workerId, c, depth)
+            self.debug('scheduled create of %s on %s', avatarId, workerId)
+            dl.append(d)
+
+        d = defer.DeferredList(dl)
+        d.addCallback(lambda _: None)
         return d
 
-    def _workerCreateComponentDelayed(self, result, workerAvatar,
-            componentState, componentType, conf):
-
-        avatarId = conf['avatarId']
-        nice = conf.get('nice', 0)
-
-        # we set the moodPending to HAPPY, so this component only gets
-        # asked to start once
-        componentState.set('moodPending', moods.happy.value)
+    def _createComponent(self, workerId, componentState):
+        if not workerId in self.workerHeaven.avatars:
+            # the component is created when the worker logs in again
+            return defer.fail(errors.ComponentNoWorkerError(
+                "worker %s is not logged in" % workerId))
 
-        d = workerAvatar.createComponent(avatarId, componentType, nice,
-                                         conf)
+        workerAvatar = self.workerHeaven.avatars[workerId]
+        conf = componentState.get('config')
+        d = workerAvatar.createComponent(conf['avatarId'],
+                                         componentState.get('type'),
+                                         conf.get('nice', 0), conf)
         # FIXME: here we get the avatar Id of the component we wanted
         # started, so now attach it to the planetState's component state
         d.addCallback(self._createCallback, componentState)
-        d.addErrback(self._createErrback, componentState)
+        return d
 
-        # FIXME: shouldn't we return d here to make sure components
-        # wait on each other to be started ?
+    def _createFailed(self, failure, workerId, componentState):
+        if failure.check(errors.ComponentNoWorkerError):
+            self.debug('not creating %s, worker %s logged out',
+                       componentState.get('name'), workerId)
+            componentState.set('moodPending', None)
+        else:
+            self._createErrback(failure, componentState)
+
+    def _getCreationDepths(self, components):
+        # the depths of the components in the feed graph of their flows,
+        # so that components are created after the ones they eat from
+        feeders = {}
+        flows = set()
+        for c in components:
+            flow = c.get('parent')
+            if flow in flows:
+                continue
+            flows.add(flow)
+            for f in flow.get('components'):
+                m = self._componentMappers.get(f)
+                if m is not None:
+                    feeders[m.id] = self._getFeederIds(f)
+        return creation.getDepths(feeders)
 
     def _createCallback(self, result, componentState):
         self.debug('got avatarId %s for state %s' % (result, componentState))
@@ -1013,6 +1096,27 @@ class Vishnu(log.Loggable):
         # called when a worker logs out
         workerId = workerAvatar.avatarId
         self.debug('vishnu.workerDetached(): id %s' % workerId)
+        # the components waiting to be created on the worker are created
+        # when it logs in again, or placed on another worker
+        for c in self._creator.cancelWorker(workerId):
+            c.set('moodPending', None)
+        if self.placer:
+            # Place the components that ran on the worker again, once
+            # they are lost
+            lost = []
+            for avatarId in self.placer.removeWorker(workerId):
+                m = self._componentMappers.get(avatarId)
+                if m and m.state.get('workerRequested') is None:
+                    self._displaced[avatarId] = None
+                    lost.append(m.state)
+            if lost:
+                self._schedulePlacement(lost)
+
+    def workerLoadReported(self, workerId, report):
+        # called when a worker reports its load
+        self.log('worker %s reported load %r', workerId, report)
+        if self.placer:
+            self.placer.updateLoad(workerId, report)
 
     def addComponentToFlow(self, componentState, flowName):
         # check if we have this flow yet and add if not
@@ -1046,6 +1150,9 @@ class Vishnu(log.Loggable):
         self._componentMappers[m.id] = m
         self._componentMappers[m.avatar] = m
 
+        if self.placer:
+            self.placer.setLocation(m.id, m.jobState.get('workerName'))
+
     def unregisterComponent(self, componentAvatar):
         # called when the component is logging out
         # clear up jobState and avatar
@@ -1069,6 +1176,10 @@ class Vishnu(log.Loggable):
         del self._componentMappers[m.avatar]
         m.avatar = None
 
+        if m.id in self._displaced:
+            # its worker logged out before it
+            self._schedulePlacement([m.state])
+
     def getComponentStates(self):
         cList = self.state.getComponents()
         self.debug('getComponentStates(): %d components' % len(cList))
@@ -1097,7 +1208,11 @@ class Vishnu(log.Loggable):
             or c.get('mood') is not moods.sleeping.value):
             raise errors.BusyComponentError(c)
 
-        del self._componentMappers[self._componentMappers[c].id]
+        avatarId = self._componentMappers[c].id
+        if self.placer:
+            self.placer.removeLocation(avatarId)
+            self._displaced.pop(avatarId, None)
+        del self._componentMappers[avatarId]
         del self._componentMappers[c]
         return flow.remove('components', c)
 
@@ -1228,6 +1343,71 @@ class Vishnu(log.Loggable):
         components = filter(isSleeping, components)
         return components
 
+    def _schedulePlacement(self, components):
+        self._placementQueue.extend(components)
+        if self._placementDC is None:
+            self._placementDC = reactor.callLater(self.placementDelay,
+                                                  self._placeQueued)
+
+    def _placeQueued(self):
+        self._placementDC = None
+        components, self._placementQueue = self._placementQueue, []
+        for workerId, states in self._placeComponents(components).items():
+            self._workerCreateComponents(workerId, states)
+
+    def _placeComponents(self, components):
+        """
+        Choose the workers to create the given components on, skipping
+        the ones that are not waiting to be created anymore.
+
+        @rtype: dict of workerId -> list of
+                L{flumotion.common.planet.ManagerComponentState}
+        """
+        toPlace = []
+        seen = set()
+        for c in components:
+            m = self._componentMappers.get(c)
+            if (m is None or m.avatar is not None or c in seen
+                or c.get('moodPending') is not None):
+                continue
+            mood = c.get('mood')
+            if mood == moods.lost.value:
+                self.info("Restarting previously lost component %s", m.id)
+                c.setMood(moods.sleeping.value)
+            elif mood != moods.sleeping.value:
+                continue
+            self._displaced.pop(m.id, None)
+            seen.add(c)
+            toPlace.append(c)
+
+        placed = self.placer.place(
+            [(self._componentMappers[c].id, self._getFeedNeighbours(c))
+             for c in toPlace])
+        workers = {}
+        for c in toPlace:
+            workerId = placed.get(self._componentMappers[c].id)
+            if workerId is not None:
+                workers.setdefault(workerId, []).append(c)
+        return workers
+
+    def _getFeederIds(self, componentState):
+        flowName = componentState.get('parent').get('name')
+        feederIds = []
+        for feeds in componentState.get('config').get('eater', {}).values():
+            for feedId, alias in feeds:
+                componentName, feedName = common.parseFeedId(feedId)
+                feederIds.append(common.componentId(flowName, componentName))
+        return feederIds
+
+    def _getFeedNeighbours(self, componentState):
+        # the avatarIds of the components feeding or eating from a component
+        avatarId = self._componentMappers[componentState].id
+        neighbours = self._getFeederIds(componentState)
+        for c in componentState.get('parent').get('components'):
+            if avatarId in self._getFeederIds(c):
+                neighbours.append(self._componentMappers[c].id)
+        return neighbours
+
     def _getWorker(self, workerName):
         # returns the WorkerAvatar with the given name
         if not workerName in self.workerHeaven.avatars:
@@ -1267,10 +1447,7 @@ class Vishnu(log.Loggable):
 
         @rtype: L{ComponentMapper} or None
         """
-        if object in self._componentMappers.keys():
-            return self._componentMappers[object]
-
-        return None
+        return self._componentMappers.get(object)
 
     def getManagerComponentState(self, object):
         """
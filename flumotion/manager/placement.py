@@ -0,0 +1,207 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_manager_placement -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+load-aware placement of components on workers
+
+@var COMPONENT_LOAD:    estimated load of a component, in CPUs, until it
+                        is accounted for by a load report of its worker
+@var LOCALITY_BONUS:    load, in CPUs, a worker can have above another
+                        one and still be chosen to run a component for
+                        each of the component's feeders and eaters it
+                        runs
+@var MIN_FREE_MEMORY:   fraction of free memory below which a worker is
+                        only chosen when all of them are overloaded
+@var MAX_NETWORK_USAGE: fraction of the network bandwidth above which a
+                        worker is only chosen when all of them are
+                        overloaded
+"""
+
+from flumotion.common import log
+
+__version__ = "$Rev$"
+
+COMPONENT_LOAD = 0.25
+LOCALITY_BONUS = 0.5
+MIN_FREE_MEMORY = 0.1
+MAX_NETWORK_USAGE = 0.8
+OVERLOAD_PENALTY = 1000.0
+
+
+class _Worker(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.report = None
+        self.components = {} # {avatarId: None}
+        self.pending = 0 # components started since the last report
+
+
+class Placer(log.Loggable):
+    """
+    I choose the workers components without a requested worker run on.
+
+    I know about the workers logged in, about the load they report and
+    about where every component runs.  A component is placed on the
+    worker with the lowest estimated load, minus a bonus for each of its
+    feeders and eaters already running there, so that feeds stay local
+    to a worker when its load allows it.  Components started since the
+    last load report of a worker are accounted with an estimated load.
+
+    I do not talk to workers or components, the manager tells me what
+    happens and creates the components where I placed them.
+    """
+
+    logCategory = 'placer'
+
+    def __init__(self):
+        self._workers = {} # {workerName: _Worker}
+        self._locations = {} # {avatarId: workerName}
+
+    ### Public Methods ###
+
+    def addWorker(self, workerName):
+        if workerName not in self._workers:
+            self._workers[workerName] = _Worker(workerName)
+
+    def removeWorker(self, workerName):
+        """
+        Forget about a worker that logged out.
+
+        @returns: the avatarIds of the components that were running on it
+        @rtype:   list of str
+        """
+        worker = self._workers.pop(workerName, None)
+        if worker is None:
+            return []
+        avatarIds = worker.components.keys()
+        for avatarId in avatarIds:
+            del self._locations[avatarId]
+        return avatarIds
+
+    def getWorkers(self):
+        return self._workers.keys()
+
+    def updateLoad(self, workerName, report):
+        """
+        @param report: load report of the worker, see
+                       L{flumotion.worker.load.LoadSampler}
+        @type  report: dict
+        """
+        worker = self._workers.get(workerName)
+        if worker is None:
+            return
+        worker.report = report
+        worker.pending = 0
+
+    def setLocation(self, avatarId, workerName):
+        """
+        Tell me that a component runs, or is being started, on a worker.
+        """
+        self.removeLocation(avatarId)
+        worker = self._workers.get(workerName)
+        if worker is None:
+            return
+        worker.components[avatarId] = None
+        self._locations[avatarId] = workerName
+
+    def removeLocation(self, avatarId):
+        workerName = self._locations.pop(avatarId, None)
+        if workerName is not None:
+            del self._workers[workerName].components[avatarId]
+
+    def getLocation(self, avatarId):
+        """
+        @returns: the name of the worker running a component, or None
+        """
+        return self._locations.get(avatarId)
+
+    def getLoad(self, workerName):
+        """
+        @returns: the estimated load of a worker, per CPU
+        @rtype:   float
+        """
+        worker = self._workers[workerName]
+        report = worker.report
+        if report is None:
+            # Nothing known yet, only count the components
+            return COMPONENT_LOAD * len(worker.components)
+        cpus = max(1, report.get('cpu-count', 1))
+        load = (report.get('load-average', 0.0)
+                + COMPONENT_LOAD * worker.pending) / cpus
+        total = report.get('memory-total')
+        free = report.get('memory-free')
+        if total and free is not None and free < total * MIN_FREE_MEMORY:
+            load += OVERLOAD_PENALTY
+        network = report.get('network-usage')
+        if network is not None and network > MAX_NETWORK_USAGE:
+            load += OVERLOAD_PENALTY
+        return load
+
+    def place(self, components):
+        """
+        Choose a worker for each of the given components, and remember
+        they run there.
+
+        @param components: the components to place with the avatarIds of
+                           their feeders and eaters
+        @type  components: list of (str, list of str)
+
+        @returns: the chosen workers, empty if no worker is logged in
+        @rtype:   dict of avatarId -> workerName
+        """
+        placed = {}
+        if not self._workers:
+            return placed
+        remaining = list(components)
+        while remaining:
+            # Place first the components with the most neighbours
+            # already placed, to keep flows together
+            index, best = 0, -1
+            for i, (avatarId, neighbours) in enumerate(remaining):
+                count = len([n for n in neighbours if n in self._locations])
+                if count > best:
+                    index, best = i, count
+            avatarId, neighbours = remaining.pop(index)
+            workerName = self._chooseWorker(neighbours)
+            self.debug('placing %s on worker %s', avatarId, workerName)
+            self.setLocation(avatarId, workerName)
+            self._workers[workerName].pending += 1
+            placed[avatarId] = workerName
+        return placed
+
+    ### Private Methods ###
+
+    def _chooseWorker(self, neighbours):
+        local = {}
+        for avatarId in neighbours:
+            workerName = self._locations.get(avatarId)
+            if workerName is not None:
+                local[workerName] = local.get(workerName, 0) + 1
+        names = self._workers.keys()
+        names.sort()
+        best, bestCost = None, None
+        for workerName in names:
+            cost = (self.getLoad(workerName)
+                    - LOCALITY_BONUS * local.get(workerName, 0))
+            if bestCost is None or cost < bestCost:
+                best, bestCost = workerName, cost
+        return best
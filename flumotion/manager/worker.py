@@ -136,6 +136,28 @@ class WorkerAvatar(base.ManagerAvatar):
         return self.mindCallRemote('create', avatarId, type, moduleName,
             methodName, nice, conf)
 
+    def connectLocalFeed(self, feederId, feederName, eaterId, eaterAlias):
+        """
+        Connect a feeder to an eater of two components running on the
+        worker through a unix socket pair created by the worker.
+
+        @param feederId:   the avatarId of the component feeding
+        @type  feederId:   str
+        @param feederName: the name of the feeder
+        @type  feederName: str
+        @param eaterId:    the avatarId of the component eating
+        @type  eaterId:    str
+        @param eaterAlias: the alias of the eater
+        @type  eaterAlias: str
+
+        @returns: a deferred that will give whether the worker connected
+                  the components
+        """
+        self.debug('connecting %s:%s to %s:%s on worker %s', feederId,
+                   feederName, eaterId, eaterAlias, self.avatarId)
+        return self.mindCallRemote('connectLocalFeed', feederId, feederName,
+                                   eaterId, eaterAlias)
+
     def getComponents(self):
         """
         Get a list of components that the worker is running.
@@ -163,6 +185,17 @@ class WorkerAvatar(base.ManagerAvatar):
         self.debug('received message from component %s' % avatarId)
         self.vishnu.componentAddMessage(avatarId, message)
 
+    def perspective_reportLoad(self, report):
+        """
+        Called by the worker to report the load of its machine,
+        used to place components on the least loaded workers.
+
+        @param report: the load report, see
+                       L{flumotion.worker.load.LoadSampler}
+        @type  report: dict
+        """
+        self.vishnu.workerLoadReported(self.avatarId, report)
+
 
 class WorkerHeaven(base.ManagerHeaven):
     """
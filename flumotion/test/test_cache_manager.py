@@ -50,6 +50,7 @@ class DummyStats:
     def __init__(self):
         self.oncleanup = 0
         self.onestimate = 0
+        self.evicted = 0
 
     def info():
         pass
@@ -62,6 +63,42 @@ class DummyStats:
     def onCleanup(self):
         self.oncleanup += 1
 
+    def onEvicted(self, count, size):
+        self.evicted += count
+
+
+class TestCacheIndex(testsuite.TestCase):
+
+    def testOrder(self):
+        index = cachemanager.CacheIndex()
+        for name, size in [('a', 1), ('b', 2), ('c', 3)]:
+            index.add(name, size)
+        self.assertEquals(len(index), 3)
+        self.assertEquals(index.totalSize, 6)
+        self.assertEquals(list(index), [('a', 1), ('b', 2), ('c', 3)])
+
+        index.touch('a')
+        index.touch('unknown')
+        self.assertEquals(list(index), [('b', 2), ('c', 3), ('a', 1)])
+
+        index.addOldest('d', 4)
+        index.addOldest('c', 10)
+        self.assertEquals(list(index),
+                          [('d', 4), ('b', 2), ('c', 3), ('a', 1)])
+
+        self.assertEquals(index.add('b', 5), 2)
+        self.assertEquals(index.totalSize, 13)
+        self.assertEquals(index.remove('c'), 3)
+        self.assertEquals(index.remove('c'), None)
+        self.failIf('c' in index)
+
+        self.assertEquals(index.popOldest(), ('d', 4))
+        self.assertEquals(index.popOldest(), ('a', 1))
+        self.assertEquals(index.popOldest(), ('b', 5))
+        self.assertEquals(index.popOldest(), None)
+        self.assertEquals(index.totalSize, 0)
+        self.assertEquals(len(index), 0)
+
 
 class TestCacheManager(testsuite.TestCase):
 
@@ -239,7 +276,39 @@ class TestCacheManager(testsuite.TestCase):
         d.addCallback(lambda _: m.updateCacheUsage())
         d.addCallback(lambda u: self.failIf(u > CACHE_SIZE / 2))
         d.addCallback(lambda _: self.failIf(m.stats.oncleanup < 5))
+        d.addCallback(lambda _: self.failIf(m.stats.evicted == 0))
+
+        return d
 
+    def testIndexSeeding(self):
+        # files already in the cache are found by the initial scan,
+        # and evicted from the least recently accessed one
+        for i, atime in enumerate([30, 10, 20]):
+            path = os.path.join(self.path, "cached%d" % i)
+            open(path, "w").write("x" * 1024)
+            os.utime(path, (atime, atime))
+        open(os.path.join(self.path, "partial.tmp"), "w").write("x" * 1024)
+
+        m = cachemanager.CacheManager(self.stats, self.path,
+                                      4 * 1024, True, 1.0, 0.75)
+        d = m.setUp()
+        d.addCallback(self.assertEquals, 4 * 1024)
+        d.addCallback(lambda _: self.assertEquals(
+            [os.path.basename(p) for p, s in m._index],
+            ["cached1", "cached2", "cached0"]))
+        # opening a cached file makes it the most recently used one
+        d.addCallback(lambda _: self.assertEquals(
+            m.getCachePath("x"), os.path.join(self.path,
+                                              m.getIdentifier("x"))))
+        d.addCallback(lambda _: m.onCachedFileAccessed(
+            os.path.join(self.path, "cached1")))
+        d.addCallback(lambda _: m.allocateCacheSpace(512))
+        d.addCallback(lambda _: self.assertEquals(
+            sorted(os.listdir(self.path)),
+            ["cached0", "cached1", "partial.tmp"]))
+        d.addCallback(lambda _: self.assertEquals(self.stats.evicted, 1))
+        d.addCallback(lambda _: self.assertEquals(m._cacheUsage,
+                                                  3 * 1024 + 512))
         return d
 
     def testConflict(self):
@@ -416,6 +485,92 @@ class TestCacheManager(testsuite.TestCase):
 
         return d
 
+    def testIdentifierCache(self):
+        m = cachemanager.CacheManager(self.stats, self.path)
+        for i in range(cachemanager.ID_CACHE_MAX_SIZE):
+            m.getIdentifier(str(i))
+        # using an identifier keeps it when the cache is full
+        ident = m.getIdentifier("0")
+        m.getIdentifier("new")
+        self.assertEquals(len(m._identifiers),
+                          cachemanager.ID_CACHE_MAX_SIZE)
+        self.failUnless("0" in m._identifiers)
+        self.failIf("1" in m._identifiers)
+        self.assertEquals(m.getIdentifier("0"), ident)
+
+    def testDirLevels(self):
+        m = cachemanager.CacheManager(self.stats, self.path,
+                                      CACHE_SIZE, True, 0.5, 0.3,
+                                      cacheDirLevels=2)
+        ident = m.getIdentifier("file")
+        path = m.getCachePath("file")
+        self.assertEquals(path, os.path.join(self.path, ident[:2],
+                                             ident[2:4], ident))
+
+        d = m.setUp()
+        d.addCallback(lambda _: m.newTempFile("file", 1024))
+        d.addCallback(self.completeAndClose, m)
+        d.addCallback(lambda _: self.failUnless(os.path.exists(path)))
+        d.addCallback(lambda _: self.failUnless(path in m._index))
+        d.addCallback(lambda _: m.openCacheFile("file"))
+        d.addCallback(lambda f: self.assertEquals(f.name, path) or f.close())
+        return d
+
+    def testMigration(self):
+        flat = cachemanager.CacheManager(self.stats, self.path)
+        names = ["a", "b", "c"]
+        for name in names:
+            f = open(flat.getCachePath(name), "w")
+            f.write("x" * 1024)
+            f.close()
+        open(os.path.join(self.path, "partial.tmp"), "w").write("x" * 1024)
+
+        m = cachemanager.CacheManager(self.stats, self.path,
+                                      CACHE_SIZE, True, 0.5, 0.3,
+                                      cacheDirLevels=1)
+        # files are found in the old layout before the scan
+        d = m.openCacheFile("a")
+        d.addCallback(lambda f: self.assertEquals(
+            f.name, m.getCachePath("a")) or f.close())
+        d.addCallback(lambda _: m.setUp())
+        d.addCallback(self.assertEquals, 4 * 1024)
+
+        def check(_):
+            for name in names:
+                path = m.getCachePath(name)
+                self.failUnless(os.path.exists(path))
+                self.failUnless(path in m._index)
+                self.failIf(os.path.exists(flat.getCachePath(name)))
+            self.failUnless(
+                os.path.exists(os.path.join(self.path, "partial.tmp")))
+            self.failIf(m.migrateCachedFile(m.getCachePath("d")))
+        d.addCallback(check)
+        return d
+
+    def testMigrationIntoExistingDirs(self):
+        flat = cachemanager.CacheManager(self.stats, self.path)
+        m = cachemanager.CacheManager(self.stats, self.path,
+                                      CACHE_SIZE, True, 0.5, 0.3,
+                                      cacheDirLevels=1)
+        names = ["a", "b", "c"]
+        for name in names:
+            f = open(flat.getCachePath(name), "w")
+            f.write("x" * 100)
+            f.close()
+            # the directories of a partly migrated cache
+            dirname = os.path.dirname(m.getCachePath(name))
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        dirname = os.path.dirname(m.getCachePath("d"))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        open(m.getCachePath("d"), "w").write("x" * 100)
+
+        d = m.setUp()
+        d.addCallback(self.assertEquals, 4 * 100)
+        d.addCallback(lambda _: self.assertEquals(len(m._index), 4))
+        return d
+
     def testMultiThread(self):
         # FIXME: this test can deadlock....
         return
@@ -23,7 +23,7 @@ from twisted.trial import unittest
 
 from flumotion.common import testsuite
 
-from flumotion.common import bundle, python
+from flumotion.common import bundle, errors, python
 
 import tempfile
 import os
@@ -125,6 +125,86 @@ class TestBundler(testsuite.TestCase):
         self.assertNotEquals(newsum, sum)
         os.unlink(path)
 
+    def testBundlerDeterministic(self):
+        # the zip only depends on the names and contents of the files
+        b = self.bundler.bundle()
+        time.sleep(0.01)
+        os.utime(self.filename, None)
+        other = bundle.Bundler("test")
+        other.add(self.filename, os.path.split(self.filename)[1])
+        self.assertEquals(other.bundle().md5sum, b.md5sum)
+        self.assertEquals(other.bundle().getZip(), b.getZip())
+
+    def testBundlerManifest(self):
+        name = os.path.split(self.filename)[1]
+        md5sum = python.md5("this is a test file").hexdigest()
+        self.assertEquals(self.bundler.getManifest(), ((name, md5sum), ))
+        self.assertEquals(self.bundler.bundle().manifest, ((name, md5sum), ))
+
+        files = self.bundler.getDeflatedFiles([md5sum, 'unknown'])
+        self.assertEquals(files.keys(), [md5sum])
+        self.assertEquals(bundle.inflate(files[md5sum]),
+                          "this is a test file")
+
+
+class TestHashCache(testsuite.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.py')
+        handle = open(self.filename, 'w')
+        handle.write("print 'I am a bit of python'")
+        handle.close()
+        self.cachePath = os.path.join(self.tempdir, 'hashes.cache')
+
+    def tearDown(self):
+        os.system("rm -r %s" % self.tempdir)
+
+    def makeBundler(self):
+        cache = bundle.HashCache(self.cachePath)
+        bundler = bundle.Bundler("test", cache)
+        bundler.add(self.filename, 'test.py')
+        return cache, bundler
+
+    def testPersisted(self):
+        cache, bundler = self.makeBundler()
+        b = bundler.bundle()
+        self.failUnless(b.zip)
+        cache.save()
+
+        # a restarted manager knows the sums without reading the file
+        cache, bundler = self.makeBundler()
+        key = bundle.BundledFile(self.filename, 'test.py').statKey()
+        self.assertEquals(cache.getFileSum(self.filename, key),
+                          b.manifest[0][1])
+        lazy = bundler.bundle()
+        self.assertEquals(lazy.md5sum, b.md5sum)
+        self.assertEquals(lazy.zip, None)
+        self.assertEquals(lazy.getZip(), b.getZip())
+        self.assertEquals(lazy.md5sum, b.md5sum)
+
+    def testChanged(self):
+        cache, bundler = self.makeBundler()
+        b = bundler.bundle()
+        cache.save()
+
+        handle = open(self.filename, 'w')
+        handle.write("print 'I am a different bit of python'")
+        handle.close()
+
+        cache, bundler = self.makeBundler()
+        changed = bundler.bundle()
+        self.failUnless(changed.zip)
+        self.assertNotEquals(changed.md5sum, b.md5sum)
+
+    def testBadCache(self):
+        handle = open(self.cachePath, 'w')
+        handle.write("not a pickle")
+        handle.close()
+        cache, bundler = self.makeBundler()
+        self.failUnless(bundler.bundle().zip)
+
+
 # we test the Unbundler using the Bundler, should be enough
 
 
@@ -176,6 +256,36 @@ class TestUnbundler(testsuite.TestCase):
         two = open(newfile, "r").read()
         self.assertEquals(one, two)
 
+    def testUnbundleManifest(self):
+        bundler = bundle.Bundler("test")
+        bundler.add(self.filename, 'this/is/a/test.py')
+        b = bundler.bundle()
+        unbundler = bundle.Unbundler(self.tempdir)
+        self.failIf(unbundler.isUnbundled('test', b.md5sum))
+
+        path, md5sum = b.manifest[0]
+        self.failIf(unbundler.hasFile(md5sum))
+        files = bundler.getDeflatedFiles([md5sum])
+        self.assertRaises(errors.NoBundleError, unbundler.storeFile,
+                          'badsum', files[md5sum])
+        unbundler.storeFile(md5sum, files[md5sum])
+        self.failUnless(unbundler.hasFile(md5sum))
+
+        dir = unbundler.unbundleManifest('test', b.md5sum, b.manifest)
+        self.assertEquals(dir, unbundler.unbundlePath(b))
+        self.failUnless(unbundler.isUnbundled('test', b.md5sum))
+        one = open(self.filename, "r").read()
+        two = open(os.path.join(dir, 'this/is/a/test.py'), "r").read()
+        self.assertEquals(one, two)
+
+    def testUnbundleMarksComplete(self):
+        bundler = bundle.Bundler("test")
+        bundler.add(self.filename)
+        b = bundler.bundle()
+        unbundler = bundle.Unbundler(self.tempdir)
+        unbundler.unbundle(b)
+        self.failUnless(unbundler.isUnbundled('test', b.md5sum))
+
 
 class TestBundlerBasket(testsuite.TestCase):
     # everything we need to set up the test environment
@@ -384,6 +384,82 @@ END:VCALENDAR
         self.assertEquals(instances[0].start, start + delta)
 
 
+class ActiveIndexTest(testsuite.TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2015, 4, 4, 6, 0, 0, tzinfo=UTC)
+        hour = datetime.timedelta(hours=1)
+        day = datetime.timedelta(days=1)
+        self.calendar = eventcalendar.Calendar()
+        # daily, with an exception and an instance moved an hour later
+        self.calendar.addEvent(eventcalendar.Event('daily', self.start,
+            self.start + 2 * hour, 'daily', rrules=['FREQ=DAILY'],
+            exdates=[self.start + 2 * day]))
+        self.calendar.addEvent(eventcalendar.Event('daily',
+            self.start + 3 * day + hour, self.start + 3 * day + 3 * hour,
+            'moved', recurrenceid=self.start + 3 * day))
+        # instances longer than the time between them
+        self.calendar.addEvent(eventcalendar.Event('overlap',
+            self.start + 4 * hour, self.start + 7 * hour, 'overlap',
+            rrules=['FREQ=HOURLY;INTERVAL=2;COUNT=20']))
+        self.calendar.addEvent(eventcalendar.Event('single',
+            self.start + hour, self.start + 5 * hour, 'single'))
+
+    def getInstances(self, instances):
+        ret = [(i.start, i.end, i.event.content) for i in instances]
+        ret.sort()
+        return ret
+
+    def testSameAsEventSets(self):
+        minutes = 0
+        while minutes < 6 * 24 * 60:
+            when = self.start + datetime.timedelta(minutes=minutes)
+            expected = []
+            for eventSet in self.calendar._eventSets.values():
+                expected.extend(eventSet.getActiveEventInstances(when))
+            self.assertEquals(
+                self.getInstances(
+                    self.calendar.getActiveEventInstances(when)),
+                self.getInstances(expected), 'at %s' % when)
+            minutes += 30
+
+    def testGoBack(self):
+        later = self.start + datetime.timedelta(days=5, minutes=30)
+        self.assertEquals(
+            self.getInstances(self.calendar.getActiveEventInstances(later)),
+            [(later - datetime.timedelta(minutes=30),
+              later + datetime.timedelta(minutes=90), 'daily')])
+        when = self.start + datetime.timedelta(hours=2)
+        self.assertEquals(
+            self.getInstances(self.calendar.getActiveEventInstances(when)),
+            [(self.start, when, 'daily'),
+             (self.start + datetime.timedelta(hours=1),
+              self.start + datetime.timedelta(hours=5), 'single')])
+
+    def testNextBoundary(self):
+        hour = datetime.timedelta(hours=1)
+        before = self.start - hour
+        self.assertEquals(self.calendar.getNextBoundary(before), self.start)
+        self.assertEquals(self.calendar.getNextBoundary(self.start),
+                          self.start + hour)
+        # the daily event two days later is excluded, so after the second
+        # one and the overlapping ones nothing changes until the moved
+        # one, beyond the index window
+        when = self.start + datetime.timedelta(days=1, hours=22)
+        self.assertEquals(self.calendar.getNextBoundary(when),
+                          self.start + datetime.timedelta(days=3, hours=1))
+
+    def testNoBoundary(self):
+        calendar = eventcalendar.Calendar()
+        self.assertEquals(calendar.getNextBoundary(self.start), None)
+        calendar.addEvent(eventcalendar.Event('single', self.start,
+            self.start + datetime.timedelta(hours=1), 'single'))
+        self.assertEquals(calendar.getNextBoundary(self.start),
+                          self.start + datetime.timedelta(hours=1))
+        self.assertEquals(calendar.getNextBoundary(
+            self.start + datetime.timedelta(hours=1)), None)
+
+
 class ICalSchedulerURGentTest(testsuite.TestCase):
 
     slow = True
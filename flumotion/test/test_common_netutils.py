@@ -145,6 +145,41 @@ class TestRoutingTable(testsuite.TestCase):
         ar('192.168.1.1', 'bar')
         ar('192.168.2.1', 'baz')
 
+    def testSameSubnetRoutes(self):
+        net = RoutingTable()
+        net.addSubnet('foo', '192.168.1.0', 24)
+        net.addSubnet('bar', '192.168.1.0', 24)
+        net.addSubnet('baz', '0.0.0.0', 0)
+        self.assertRaises(ValueError,
+                          net.addSubnet,
+                          'foo', '192.168.1.0', 24)
+
+        self.assertEquals(net.route('192.168.1.1'), 'foo')
+        self.assertEquals(list(net.route_iter('192.168.1.1')),
+                          ['foo', 'bar', 'baz', None])
+
+        net.removeSubnet('foo', '192.168.1.0', 24)
+        self.assertEquals(net.route('192.168.1.1'), 'bar')
+        self.assertRaises(ValueError,
+                          net.removeSubnet,
+                          'foo', '192.168.1.0', 24)
+
+    def testAddSubnets(self):
+        subnets = [('foo', '192.168.1.0', 32),
+                   ('bar', '192.168.1.0', 24),
+                   ('baz', '10.0.0.0', 8)]
+        net = RoutingTable()
+        net.addSubnets(subnets)
+        self.assertEquals(len(net), 3)
+        self.assertEquals(list(net.iterHumanReadable()), subnets)
+
+        # nothing is added if any of the subnets is invalid
+        net = RoutingTable()
+        self.assertRaises(ValueError, net.addSubnets,
+                          [('foo', '192.168.1.0', 24),
+                           ('bar', '192.168.1.1', 24)])
+        self.assertEquals(len(net), 0)
+
     def assertParseFailure(self, string, **kwargs):
         f = StringIO.StringIO(string)
         self.assertRaises(ValueError, RoutingTable.fromFile, f,
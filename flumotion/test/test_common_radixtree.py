@@ -0,0 +1,150 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import random
+
+from flumotion.common import radixtree
+from flumotion.common import testsuite
+
+attr = testsuite.attr
+
+
+def prefix(key, bits):
+    return key & radixtree._MASKS[bits]
+
+
+class TestRadixTree(testsuite.TestCase):
+
+    def assertStructure(self, tree):
+        # every non-root node either holds values or branches in two
+
+        def check(node, parentBits):
+            self.failUnless(node.bits > parentBits)
+            self.assertEquals(prefix(node.key, node.bits), node.key)
+            children = [c for c in node.children if c is not None]
+            self.failUnless(node.values or len(children) == 2,
+                            "useless node %r/%d" % (node.key, node.bits))
+            for c in children:
+                self.assertEquals(prefix(c.key, node.bits), node.key)
+                check(c, node.bits)
+        for c in tree._root.children:
+            if c is not None:
+                check(c, 0)
+
+    def assertMatches(self, tree, entries, key):
+        expected = [e for e in entries if prefix(key, e[1]) == e[0]]
+        expected.sort(lambda a, b: cmp((a[1], a[2]), (b[1], b[2])))
+        expected.reverse()
+        actual = []
+        for k, bits, values in tree.iterMatches(key):
+            actual.extend([(k, bits, v) for v in values[::-1]])
+        self.assertEquals(actual, expected)
+
+        match = tree.longestMatch(key)
+        if not expected:
+            self.assertEquals(match, None)
+        else:
+            k, bits, values = match
+            self.assertEquals((k, bits, values[-1]), expected[0])
+
+    def testEmpty(self):
+        tree = radixtree.RadixTree()
+        self.assertEquals(len(tree), 0)
+        self.assertEquals(list(tree), [])
+        self.assertEquals(tree.longestMatch(0), None)
+        self.assertEquals(list(tree.iterMatches(0xffffffff)), [])
+        self.assertRaises(ValueError, tree.delete, 0, 0, 'foo')
+
+    def testInvalidPrefix(self):
+        tree = radixtree.RadixTree()
+        self.assertRaises(ValueError, tree.insert, 1, 24, 'foo')
+        self.assertRaises(ValueError, tree.insert, 0, 33, 'foo')
+        self.assertRaises(ValueError, tree.insert, 0, -1, 'foo')
+
+    def testDuplicates(self):
+        tree = radixtree.RadixTree()
+        tree.insert(0xc0a80100, 24, 'foo')
+        tree.insert(0xc0a80100, 24, 'bar')
+        self.assertRaises(ValueError, tree.insert, 0xc0a80100, 24, 'foo')
+        self.assertEquals(len(tree), 2)
+        self.assertEquals(tree.longestMatch(0xc0a80101),
+                          (0xc0a80100, 24, ['bar', 'foo']))
+        tree.delete(0xc0a80100, 24, 'bar')
+        self.assertRaises(ValueError, tree.delete, 0xc0a80100, 24, 'bar')
+        self.failUnless((0xc0a80100, 24, 'foo') in tree)
+        self.failIf((0xc0a80100, 24, 'bar') in tree)
+
+    def testLongestMatch(self):
+        tree = radixtree.RadixTree()
+        tree.insert(0, 0, 'default')
+        tree.insert(0xc0a80000, 16, 'lan')
+        tree.insert(0xc0a80100, 24, 'office')
+        tree.insert(0xc0a80101, 32, 'host')
+        self.assertStructure(tree)
+
+        def lm(key):
+            return tree.longestMatch(key)[2][-1]
+        self.assertEquals(lm(0xc0a80101), 'host')
+        self.assertEquals(lm(0xc0a80102), 'office')
+        self.assertEquals(lm(0xc0a80201), 'lan')
+        self.assertEquals(lm(0x0a000001), 'default')
+
+        tree.delete(0, 0, 'default')
+        self.assertEquals(tree.longestMatch(0x0a000001), None)
+
+    def testBulkLoad(self):
+        entries = [(0xc0a80101, 32, 'host'),
+                   (0xc0a80000, 16, 'lan'),
+                   (0, 0, 'default'),
+                   (0xc0a80100, 24, 'office')]
+        tree = radixtree.RadixTree(entries)
+        self.assertStructure(tree)
+        self.assertEquals(len(tree), 4)
+        entries.sort()
+        self.assertEquals(sorted(tree), entries)
+
+    @attr('slow')
+    def testRandomInsertDelete(self):
+        tree = radixtree.RadixTree()
+        entries = []
+        for i in range(300):
+            bits = random.randint(0, 32)
+            key = prefix(random.choice([0x0a000000, 0xc0a80100,
+                                        random.randint(0, 0xffffffff)]),
+                         bits)
+            entry = (key, bits, random.choice('abc'))
+            if entry in entries:
+                continue
+            tree.insert(*entry)
+            entries.append(entry)
+        self.assertStructure(tree)
+        self.assertEquals(sorted(tree), sorted(entries))
+
+        random.shuffle(entries)
+        while entries:
+            for i in range(10):
+                key = random.choice(entries)[0] | random.randint(0, 255)
+                self.assertMatches(tree, entries, key)
+            tree.delete(*entries.pop())
+            self.assertStructure(tree)
+            self.assertEquals(len(tree), len(entries))
+
+        self.assertEquals(tree._root.children, [None, None])
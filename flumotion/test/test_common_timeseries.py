@@ -0,0 +1,162 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_common_timeseries -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import tempfile
+
+from flumotion.common import testsuite, timeseries
+from flumotion.component.plugs import timeseries as tsplug
+
+ARCHIVES = ((1, 10), (60, 5))
+T0 = 1200000000 # a multiple of 60
+
+
+class FakeUIState(object):
+
+    def __init__(self, **values):
+        self.values = values
+
+    def keys(self):
+        return self.values.keys()
+
+    def get(self, key, otherwise=None):
+        return self.values.get(key, otherwise)
+
+
+class FakeComponent(object):
+
+    def __init__(self, uiState):
+        self.uiState = uiState
+        self.timeSeries = None
+        self.messages = []
+
+    def addMessage(self, message):
+        self.messages.append(message)
+
+
+class TimeSeriesTestCase(testsuite.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".flumotion.test")
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TestTimeSeriesFile(TimeSeriesTestCase):
+
+    def setUp(self):
+        TimeSeriesTestCase.setUp(self)
+        self.file = timeseries.TimeSeriesFile(
+            os.path.join(self.path, 'clients.ts'), ARCHIVES)
+
+    def tearDown(self):
+        self.file.close()
+        TimeSeriesTestCase.tearDown(self)
+
+    def testEmpty(self):
+        self.assertEquals(self.file.fetch(T0), (1, []))
+        self.assertEquals(self.file.getLastTime(), 0.0)
+
+    def testDownsampling(self):
+        for i in range(120):
+            self.file.record(T0 + i + 0.5, i)
+        self.assertEquals(self.file.fetch(T0 + 115),
+                          (1, [(T0 + i, float(i))
+                               for i in range(115, 120)]))
+        # the seconds before the last ten are gone, the minutes are not
+        self.assertEquals(self.file.fetch(T0),
+                          (60, [(T0, 29.5), (T0 + 60, 89.5)]))
+        self.assertEquals(self.file.fetch(T0 + 119, step=60),
+                          (60, [(T0 + 60, 89.5)]))
+        self.assertRaises(ValueError, self.file.fetch, T0, step=5)
+
+    def testAverage(self):
+        self.file.record(T0, 1)
+        self.file.record(T0 + 0.5, 2)
+        self.assertEquals(self.file.fetch(T0), (1, [(T0, 1.5)]))
+
+    def testWrapAround(self):
+        self.file.record(T0, 1)
+        # same slot in the seconds archive, ten seconds later
+        self.file.record(T0 + 10, 2)
+        self.assertEquals(self.file.fetch(T0, T0 + 10, step=1),
+                          (1, [(T0 + 10, 2.0)]))
+
+    def testReopen(self):
+        self.file.record(T0, 3)
+        self.file.close()
+        self.file = timeseries.TimeSeriesFile(self.file.path)
+        self.assertEquals(self.file.archives, list(ARCHIVES))
+        self.assertEquals(self.file.getLastTime(), T0)
+        self.assertEquals(self.file.fetch(T0), (1, [(T0, 3.0)]))
+
+    def testNotTimeSeries(self):
+        path = os.path.join(self.path, 'other')
+        open(path, 'w').write('something else')
+        self.assertRaises(ValueError, timeseries.TimeSeriesFile, path)
+
+
+class TestTimeSeriesStore(TimeSeriesTestCase):
+
+    def testStore(self):
+        store = timeseries.TimeSeriesStore(self.path, ARCHIVES)
+        store.record('clients', T0, 4)
+        store.record('bytes', T0, 1000)
+        self.assertEquals(store.getKeys(), ['bytes', 'clients'])
+        self.assertEquals(store.fetch('clients', T0), (1, [(T0, 4.0)]))
+        self.assertRaises(KeyError, store.fetch, 'unknown', T0)
+        self.assertRaises(KeyError, store.record, '../clients', T0, 1)
+        store.close()
+
+        store = timeseries.TimeSeriesStore(self.path, ARCHIVES)
+        self.assertEquals(store.fetch('bytes', T0), (1, [(T0, 1000.0)]))
+        store.close()
+
+
+class TestTimeSeriesPlug(TimeSeriesTestCase):
+
+    def makePlug(self, **properties):
+        properties['directory'] = os.path.join(self.path, 'stats')
+        return tsplug.ComponentTimeSeriesPlug({'properties': properties})
+
+    def testRecordNumericKeys(self):
+        component = FakeComponent(FakeUIState(
+            clients=3, bytes=10.5, name='stream', busy=True, empty=None))
+        plug = self.makePlug()
+        plug.start(component)
+        self.failUnless(component.timeSeries is not None)
+        plug._sample()
+        self.assertEquals(component.timeSeries.getKeys(),
+                          ['bytes', 'clients'])
+        step, samples = component.timeSeries.fetch('clients', 0)
+        self.assertEquals(samples[0][1], 3.0)
+        plug.stop(component)
+        self.assertEquals(component.timeSeries, None)
+
+    def testRecordKeys(self):
+        component = FakeComponent(FakeUIState(clients=3, bytes=10))
+        plug = self.makePlug(key=['clients'])
+        plug.start(component)
+        plug._sample()
+        self.assertEquals(component.timeSeries.getKeys(), ['clients'])
+        plug.stop(component)
@@ -19,6 +19,7 @@
 
 # Headers in this file shall remain intact.
 
+from flumotion.common import keycards
 from flumotion.component.bouncers import bouncer
 from flumotion.test import bouncertest
 
@@ -46,3 +47,98 @@ class TrivialBouncerTest(bouncertest.TrivialBouncerTest):
         d = self.obj.stop()
         d.addCallback(lambda _: bouncertest.TrivialBouncerTest.tearDown(self))
         return d
+
+    def getKeycardTTL(self, keycard):
+        ttl = self.obj.getKeycardTTL(keycard)
+        if ttl is None:
+            # expired keycards get their ttl set when they expire
+            return keycard.ttl
+        return ttl
+
+    def addKeycard(self, issuerName, ttl):
+        k = keycards.KeycardGeneric()
+        k.issuerName = issuerName
+        k.requesterId = issuerName
+        k.ttl = ttl
+        self.failUnless(self.obj.addKeycard(k))
+        return k
+
+    def testExpireOnlyExpired(self):
+        short = self.addKeycard('foo', 1)
+        long = self.addKeycard('foo', 3)
+        self.failUnless(self.obj.do_expireKeycards(2))
+        self.failIf(self.obj.hasKeycard(short))
+        self.failUnless(self.obj.hasKeycard(long))
+        self.assertEquals(short.ttl, -1)
+        self.assertEquals(long.ttl, 3)
+        self.assertEquals(self.obj.getKeycardTTL(long), 1)
+        self.assertEquals(self.medium.calls,
+                          [('expireKeycard', ('foo', short.id), {})])
+
+        self.failIf(self.obj.do_expireKeycards(1))
+        self.failIf(self.obj.hasKeycard(long))
+
+    def testKeepAliveIssuer(self):
+        foo = self.addKeycard('foo', 2)
+        bar = self.addKeycard('bar', 2)
+        self.obj.do_expireKeycards(1)
+        self.obj.keepAlive('foo', 5)
+        self.obj.do_expireKeycards(1)
+        self.failUnless(self.obj.hasKeycard(foo))
+        self.failIf(self.obj.hasKeycard(bar))
+        self.assertEquals(self.obj.getKeycardTTL(foo), 4)
+
+        # keep alives for removed keycards don't bring them back
+        self.obj.removeKeycard(foo)
+        self.obj.keepAlive('foo', 5)
+        self.obj.do_expireKeycards(5)
+        self.failIf(self.obj.hasKeycard(foo))
+        self.assertEquals(self.medium.calls,
+                          [('expireKeycard', ('bar', bar.id), {})])
+
+    def testKeepAliveLaterKeycards(self):
+        old = self.addKeycard('foo', 5)
+        self.obj.keepAlive('foo', 5)
+        new = self.addKeycard('foo', 2)
+        self.obj.do_expireKeycards(1)
+        self.assertEquals(self.obj.getKeycardTTL(old), 4)
+        self.assertEquals(self.obj.getKeycardTTL(new), 1)
+
+        # a keep alive now covers both
+        self.obj.keepAlive('foo', 3)
+        self.obj.do_expireKeycards(2)
+        self.failUnless(self.obj.hasKeycard(old))
+        self.failUnless(self.obj.hasKeycard(new))
+        self.obj.do_expireKeycards(1)
+        self.failIf(self.obj.hasKeycard(old))
+        self.failIf(self.obj.hasKeycard(new))
+        self.assertEquals(len(self.medium.calls), 2)
+
+    def testManyKeepAlives(self):
+        k = self.addKeycard('foo', 2)
+        for i in range(1000):
+            self.obj.keepAlive('foo', 2)
+        self.obj.do_expireKeycards(1)
+        self.failUnless(self.obj.hasKeycard(k))
+        self.obj.do_expireKeycards(1)
+        self.failIf(self.obj.hasKeycard(k))
+        self.assertEquals(len(self.medium.calls), 1)
+
+    def testExpireKeycardIds(self):
+        foo = self.addKeycard('foo', 2)
+        bar = self.addKeycard('bar', 2)
+        d = self.obj.expireKeycardIds([foo.id, bar.id])
+
+        def expired(_):
+            self.failIf(self.obj.hasKeycard(foo))
+            self.failIf(self.obj.hasKeycard(bar))
+            calls = self.medium.calls[:]
+            calls.sort()
+            self.assertEquals(calls,
+                              [('expireKeycards', ('bar', [bar.id]), {}),
+                               ('expireKeycards', ('foo', [foo.id]), {})])
+            # nothing is left to expire
+            self.failIf(self.obj.do_expireKeycards(5))
+            self.assertEquals(len(self.medium.calls), 2)
+        d.addCallback(expired)
+        return d
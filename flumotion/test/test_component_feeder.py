@@ -40,6 +40,13 @@ class TestFeeder(testsuite.TestCase):
         self.failUnless(client in clients)
         self.assertEquals(client.uiState.get('client-id'), clientId)
 
+    def testBatchWindow(self):
+        f = feeder.Feeder('video:default', batchWindow=0.5)
+        client = f.clientConnected('/default/muxer-video', 3,
+                                   lambda _: None)
+        self.assertEquals(client.uiState._batchWindow, 0.5)
+        client.uiState.flushBatches()
+
     def testReconnect(self):
         clientId = '/default/muxer-video'
 
@@ -0,0 +1,238 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import tempfile
+import time
+
+from twisted.internet import defer, reactor
+from twisted.web import server, static
+
+from flumotion.common.testsuite import TestCase
+from flumotion.component.misc.httpserver.httpcached import common
+from flumotion.component.misc.httpserver.httpcached import http_client
+from flumotion.component.misc.httpserver.httpcached import http_utils
+
+CONTENT = "".join([chr(i % 256) for i in range(100000)])
+
+
+class OriginSite(server.Site):
+    """
+    A site serving static files, that keeps track of its connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        server.Site.__init__(self, *args, **kwargs)
+        self.connections = []
+
+    def buildProtocol(self, addr):
+        p = server.Site.buildProtocol(self, addr)
+        self.connections.append(p)
+        return p
+
+
+class Consumer(object):
+
+    def __init__(self):
+        self.deferred = defer.Deferred()
+        self.data = []
+        self.info = None
+
+    def serverError(self, getter, code, message):
+        self.deferred.callback(('error', code))
+
+    def conditionFail(self, getter, code, message):
+        self.deferred.callback(('condition', code))
+
+    def streamNotAvailable(self, getter, code, message):
+        self.deferred.callback(('unavailable', code))
+
+    def onInfo(self, getter, info):
+        self.info = info
+
+    def onData(self, getter, data):
+        self.data.append(data)
+
+    def streamDone(self, getter):
+        self.deferred.callback(('done', "".join(self.data)))
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".origin")
+        f = open(os.path.join(self.path, "file"), "w")
+        f.write(CONTENT)
+        f.close()
+        self.site = OriginSite(static.File(self.path))
+        self.port = reactor.listenTCP(0, self.site, interface="127.0.0.1")
+        self.portNumber = self.port.getHost().port
+        self.requester = None
+
+    def tearDown(self):
+        if self.requester is not None:
+            self.requester.cleanup()
+        for p in self.site.connections:
+            p.transport.loseConnection()
+        shutil.rmtree(self.path, ignore_errors=True)
+        d = defer.maybeDeferred(self.port.stopListening)
+        # let the connections close
+        d.addCallback(lambda _: self._sleep(0.1))
+        return d
+
+    def _sleep(self, delay):
+        d = defer.Deferred()
+        reactor.callLater(delay, d.callback, None)
+        return d
+
+    def _makeRequester(self, **kwargs):
+        pool = http_client.ConnectionPool(2, **kwargs)
+        self.requester = http_client.StreamRequester(2, 5, pool)
+        return self.requester
+
+    def _get(self, start=None, size=None, ifModifiedSince=None):
+        url = http_utils.Url.fromString(
+            "http://127.0.0.1:%d/file" % self.portNumber)
+        consumer = Consumer()
+        self.requester.retrieve(consumer, url, start=start, size=size,
+                                ifModifiedSince=ifModifiedSince)
+        return consumer.deferred
+
+    def _getStatistics(self):
+        stats = self.requester.pool.getStatistics()
+        return stats[("127.0.0.1", self.portNumber)]
+
+    def _getBlocks(self, count, size):
+        d = defer.succeed(None)
+        for i in range(count):
+
+            def check(result, start):
+                self.assertEquals(result,
+                                  ('done', CONTENT[start:start+size]))
+            d.addCallback(lambda _, start=i*size: self._get(start, size))
+            d.addCallback(check, i * size)
+        return d
+
+    def testReuse(self):
+        self._makeRequester()
+        d = self._getBlocks(10, 1000)
+
+        def check(_):
+            stats = self._getStatistics()
+            self.assertEquals(stats['connects'], 1)
+            self.assertEquals(stats['reuses'], 9)
+            self.assertEquals(stats['idle'], 1)
+            self.assertEquals(len(self.site.connections), 1)
+        d.addCallback(check)
+        return d
+
+    def testNoKeepAlive(self):
+        self._makeRequester(keepAliveTimeout=0)
+        d = self._getBlocks(5, 1000)
+
+        def check(_):
+            stats = self._getStatistics()
+            self.assertEquals(stats['connects'], 5)
+            self.assertEquals(stats['reuses'], 0)
+            self.assertEquals(stats['idle'], 0)
+        d.addCallback(check)
+        return d
+
+    def testConnectionLimit(self):
+        self._makeRequester(maxConnections=2)
+        dl = []
+        for i in range(6):
+            start = i * 1000
+            d = self._get(start, 1000)
+            d.addCallback(self.assertEquals,
+                          ('done', CONTENT[start:start+1000]))
+            dl.append(d)
+        self.assertEquals(self._getStatistics()['waiting'], 4)
+        d = defer.DeferredList(dl, fireOnOneErrback=True)
+
+        def check(_):
+            stats = self._getStatistics()
+            self.assertEquals(stats['connects'], 2)
+            self.assertEquals(stats['reuses'], 4)
+            self.assertEquals(stats['waiting'], 0)
+        d.addCallback(check)
+        return d
+
+    def testIdleTimeout(self):
+        self._makeRequester(keepAliveTimeout=0.1)
+        d = self._get()
+        d.addCallback(self.assertEquals, ('done', CONTENT))
+        d.addCallback(lambda _: self._sleep(0.3))
+        d.addCallback(lambda _:
+                      self.assertEquals(self._getStatistics()['idle'], 0))
+        d.addCallback(lambda _: self._get(0, 10))
+        d.addCallback(lambda _:
+                      self.assertEquals(self._getStatistics()['connects'], 2))
+        return d
+
+    def testClosedByServer(self):
+        self._makeRequester()
+        d = self._get(0, 10)
+
+        def closeAndGet(_):
+            for p in self.site.connections:
+                p.transport.loseConnection()
+            return self._get(10, 10)
+        d.addCallback(closeAndGet)
+        d.addCallback(self.assertEquals, ('done', CONTENT[10:20]))
+        d.addCallback(lambda _:
+                      self.assertEquals(self._getStatistics()['connects'], 2))
+        return d
+
+    def testNotModifiedKeepsConnection(self):
+        self._makeRequester()
+        d = self._get(ifModifiedSince=time.time() + 3600)
+        d.addCallback(self.assertEquals,
+                      ('condition', common.STREAM_NOT_MODIFIED))
+        # the consumer is told before the end of the response is read
+        d.addCallback(lambda _: self._sleep(0.1))
+        d.addCallback(lambda _:
+                      self.assertEquals(self._getStatistics()['idle'], 1))
+        d.addCallback(lambda _: self._get(0, 10))
+        d.addCallback(self.assertEquals, ('done', CONTENT[:10]))
+        d.addCallback(lambda _:
+                      self.assertEquals(self._getStatistics()['connects'], 1))
+        return d
+
+    def testServerDown(self):
+        self._makeRequester()
+        d = defer.maybeDeferred(self.port.stopListening)
+        for i in range(http_client.ConnectionPool.HOST_MAX_FAILURES):
+            d.addCallback(lambda _: self._get())
+            d.addCallback(self.assertEquals,
+                          ('error', common.SERVER_UNAVAILABLE))
+
+        def checkDown(_):
+            connects = self._getStatistics()['connects']
+            d = self._get()
+            d.addCallback(self.assertEquals,
+                          ('error', common.SERVER_UNAVAILABLE))
+            d.addCallback(lambda _: self.assertEquals(
+                self._getStatistics()['connects'], connects))
+            return d
+        d.addCallback(checkDown)
+        return d
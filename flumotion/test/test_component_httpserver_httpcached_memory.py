@@ -0,0 +1,125 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+from flumotion.common.testsuite import TestCase
+from flumotion.component.misc.httpserver import cachestats
+from flumotion.component.misc.httpserver.httpcached import memory_cache
+
+
+class DummyStatistics(object):
+
+    def __init__(self):
+        self.usage = None
+
+    def onMemoryCacheUsage(self, usage, max):
+        self.usage = usage
+
+
+class TestMemoryCache(TestCase):
+
+    def setUp(self):
+        self.stats = DummyStatistics()
+        self.cache = memory_cache.MemoryCache(self.stats, 1000, 300)
+
+    def _fill(self, identifier, size):
+        # the second disk hit admits the file
+        self.failIf(self.cache.admit(identifier, size))
+        self.failUnless(self.cache.admit(identifier, size))
+        self.cache.add(identifier, "x" * size, 42)
+
+    def testAdmission(self):
+        self.failIf(self.cache.admit("a", 100))
+        self.failIf(self.cache.admit("b", 100))
+        self.failUnless(self.cache.admit("a", 100))
+        # too big to be kept in memory
+        self.failIf(self.cache.admit("c", 301))
+        self.failIf(self.cache.admit("c", 301))
+
+    def testAdmissionHistory(self):
+        self.failIf(self.cache.admit("a", 100))
+        for i in range(memory_cache.HISTORY_SIZE):
+            self.cache.admit(str(i), 100)
+        self.failIf(self.cache.admit("a", 100))
+
+    def testGet(self):
+        self.assertEquals(self.cache.get("a"), None)
+        self._fill("a", 100)
+        self.assertEquals(self.cache.get("a"), ("x" * 100, 42))
+        self.assertEquals(self.stats.usage, 100)
+        self.cache.remove("a")
+        self.assertEquals(self.cache.get("a"), None)
+        self.assertEquals(self.stats.usage, 0)
+
+    def testBudget(self):
+        for i in range(5):
+            self._fill(str(i), 300)
+        self.assertEquals(len(self.cache), 3)
+        self.failIf("0" in self.cache)
+        self.failIf("1" in self.cache)
+        self.assertEquals(self.cache.getUsage(), 900)
+        self.assertEquals(self.stats.usage, 900)
+
+    def testHitFilesKept(self):
+        self._fill("hot", 300)
+        self.cache.get("hot")
+        # files read only once go through probation without
+        # pushing out the file that was hit
+        for i in range(10):
+            self._fill(str(i), 300)
+        self.failUnless("hot" in self.cache)
+        self.failUnless("9" in self.cache)
+        self.failUnless("8" in self.cache)
+        self.failIf("7" in self.cache)
+
+    def testProtectedDemoted(self):
+        for name in ("a", "b", "c"):
+            self._fill(name, 300)
+            self.cache.get(name)
+        # only 800 bytes can be protected, the oldest one is back
+        # in probation and is the first one to go
+        self._fill("d", 300)
+        self.failIf("a" in self.cache)
+        self.failUnless("b" in self.cache)
+        self.failUnless("c" in self.cache)
+        self.failUnless("d" in self.cache)
+
+    def testClear(self):
+        self._fill("a", 100)
+        self._fill("b", 100)
+        self.cache.clear()
+        self.assertEquals(len(self.cache), 0)
+        self.assertEquals(self.stats.usage, 0)
+
+
+class TestMemoryStatistics(TestCase):
+
+    def testHitRatio(self):
+        stats = cachestats.CacheStatistics()
+        for status in (cachestats.CACHE_MISS, cachestats.CACHE_HIT,
+                       cachestats.MEMORY_HIT, cachestats.MEMORY_HIT):
+            request = cachestats.RequestStatistics(stats)
+            request.onStarted(10, status)
+        self.assertEquals(stats.cacheHitCount, 3)
+        self.assertEquals(stats.memoryHitCount, 2)
+        self.assertEquals(stats.cacheHitRatio, 0.75)
+        self.assertEquals(stats.memoryHitRatio, 0.5)
+        self.assertEquals(request.getLogFields()["cache-status"],
+                          "memory-hit")
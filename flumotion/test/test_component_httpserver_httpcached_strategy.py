@@ -34,6 +34,7 @@ from flumotion.common.testsuite import attr, TestCase
 from flumotion.component.misc.httpserver import fileprovider
 from flumotion.component.misc.httpserver.httpcached import common
 from flumotion.component.misc.httpserver.httpcached import http_utils
+from flumotion.component.misc.httpserver.httpcached import memory_cache
 from flumotion.component.misc.httpserver.httpcached import strategy_base
 from flumotion.component.misc.httpserver.httpcached import strategy_basic
 
@@ -157,6 +158,97 @@ class TestBasicCachingStrategy(TestCase):
         d.callback(None)
         return d
 
+    def testCachedInMemory(self):
+        data = os.urandom(BLOCK_SIZE + EXTRA_DATA)
+        mtime = time.time()
+        memcache = memory_cache.MemoryCache(DummyStatistics(), BLOCK_SIZE * 4)
+
+        d = defer.Deferred()
+
+        d.addCallback(self._setup,
+                      [FileDef("/dummy", data, mtime)],
+                      [ResDef("/dummy", data, mtime)], ttl=2,
+                      memcache=memcache)
+
+        def getCached(result, cls, fileCount):
+            d = self._getSource(result, "http://www.flumotion.net/dummy")
+            d.addCallback(self._gotSource, "source")
+            d.addCallback(self._isInstance, cls)
+            d.addCallback(self._readAllData)
+            d.addCallback(self._checkData, data)
+            d.addCallback(self._closeSource, "source")
+            d.addCallback(self._checkFileCount, fileCount)
+            d.addCallback(self._checkFilesClosed)
+            d.addCallback(self._reset)
+            return d
+
+        # The first time the file is checked, the second time it is
+        # read from the disk cache and the third time it is kept in memory
+
+        d.addCallback(getCached, strategy_base.CachedSource, 1)
+        d.addCallback(getCached, strategy_base.CachedSource, 1)
+        d.addCallback(lambda r: passthrough(r, self.failIf,
+                                            path2ident("/dummy") in memcache))
+        d.addCallback(getCached, strategy_base.MemorySource, 1)
+
+        # Now it should not even open the cached file
+
+        d.addCallback(getCached, strategy_base.MemorySource, 0)
+        d.addCallback(getCached, strategy_base.MemorySource, 0)
+        d.addCallback(self._checkReqCount, 0)
+
+        # Waiting for the TTL to expire
+
+        d.addCallback(wait, 2)
+
+        # Now it should check again if outdated, from the disk cache
+
+        d.addCallback(getCached, strategy_base.CachedSource, 1)
+        d.addCallback(lambda r: passthrough(r, self.assertEqual,
+                                            len(memcache), 0))
+
+        d.callback(None)
+        return d
+
+    def testOutdatedInMemory(self):
+        data = os.urandom(BLOCK_SIZE + EXTRA_DATA)
+        newData = os.urandom(BLOCK_SIZE + EXTRA_DATA)
+        mtime = time.time()
+        res = ResDef("/dummy", data, mtime)
+        memcache = memory_cache.MemoryCache(DummyStatistics(), BLOCK_SIZE * 4)
+
+        d = defer.Deferred()
+
+        d.addCallback(self._setup,
+                      [FileDef("/dummy", data, mtime)], [res], ttl=2,
+                      memcache=memcache)
+
+        for i in range(3):
+            d.addCallback(self._getSource, "http://www.flumotion.net/dummy")
+            d.addCallback(self._gotSource, "source")
+            d.addCallback(self._closeSource, "source")
+        d.addCallback(lambda r: passthrough(r, self.assertEqual,
+                                            len(memcache), 1))
+
+        # The resource is modified and the TTL expires,
+        # the new version should be served
+
+        d.addCallback(self._updateResource, res, newData, mtime + 1)
+        d.addCallback(wait, 2)
+        d.addCallback(self._reset)
+        d.addCallback(self._getSource, "http://www.flumotion.net/dummy")
+        d.addCallback(self._gotSource, "source", "session")
+        d.addCallback(self._isInstance, strategy_base.RemoteSource)
+        d.addCallback(lambda r: passthrough(r, self.assertEqual,
+                                            len(memcache), 0))
+        d.addCallback(self._readAllData)
+        d.addCallback(self._checkData, newData)
+        d.addCallback(self._closeSource, "source")
+        d.addCallback(self._waitFinished, "session")
+
+        d.callback(None)
+        return d
+
     def testNotCachedSimple(self):
         data = os.urandom(BLOCK_SIZE*4 + EXTRA_DATA)
         mtime = time.time()
@@ -1309,11 +1401,12 @@ class TestBasicCachingStrategy(TestCase):
         d.callback(None)
         return d
 
-    def _setup(self, _, files, resources, ttl=DEFAULT_TTL):
+    def _setup(self, _, files, resources, ttl=DEFAULT_TTL, memcache=None):
         self.cachemgr = DummyCacheMgr(*files)
         self.reqmgr = DummyReqMgr(*resources)
         self.stgy = strategy_basic.CachingStrategy(self.cachemgr,
-                                                   self.reqmgr, ttl)
+                                                   self.reqmgr, ttl,
+                                                   memcache)
         return self.stgy.setup()
 
     def _getSource(self, _, urlstr):
@@ -1617,6 +1710,9 @@ class DummyStatistics:
     def onCopyFinished(self, size):
         pass
 
+    def onMemoryCacheUsage(self, usage, max):
+        pass
+
 
 class DummyCacheMgr(object):
 
@@ -19,10 +19,13 @@
 
 # Headers in this file shall remain intact.
 
+import os
+import shutil
 import time
 import tempfile
 import gst
 
+from twisted.internet import reactor, task
 from twisted.trial import unittest
 
 from flumotion.component.producers.playlist import playlistparser
@@ -60,6 +63,30 @@ class FakeDiscoverer(object):
     discover = noop
 
 
+class FakeMediaDiscoverer(object):
+    started = []
+    mimetype = 'video/x-theora'
+    is_audio = False
+    is_video = True
+    audiolength = 0
+    videolength = 200 * gst.SECOND
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._callback = None
+        FakeMediaDiscoverer.started.append(self)
+
+    def connect(self, signal, callback):
+        self._callback = callback
+
+    def discover(self):
+        pass
+
+    def finish(self):
+        # like the discoverer, from another thread
+        self._callback(self, True)
+
+
 class TestPlaylist(testsuite.TestCase):
 
     def setUp(self):
@@ -85,6 +112,10 @@ class TestPlaylist(testsuite.TestCase):
             cur = cur.next
 
         self.assertEquals(l, expectedlen)
+        # the index follows the list
+        self.assertEquals(self.playlist._sorted, all)
+        self.assertEquals(self.playlist._starts,
+                          [item.timestamp for item in all])
 
         itemsbyidtotal = 0
 
@@ -162,6 +193,41 @@ class TestPlaylist(testsuite.TestCase):
         self.checkItems(2)
         self.assertEquals(second.duration, 25)
 
+    def testAddItemOverlappingFirstItems(self):
+        first = self.playlist.addItem('id1', 50, "file:///testuri", 0, 50,
+            True, True)
+        second = self.playlist.addItem('id1', 100, "file:///testuri", 0, 50,
+            True, True)
+        third = self.playlist.addItem('id1', 150, "file:///testuri", 0, 100,
+            True, True)
+        self.checkItems(3)
+
+        fourth = self.playlist.addItem('id2', 0, "file:///testuri", 0, 200,
+            True, True)
+        # the first two were covered, the third one is shortened
+        self.checkItems(2)
+        self.assertEquals(self.playlist.items, fourth)
+        self.assertEquals(fourth.next, third)
+        self.assertEquals(third.timestamp, 200)
+        self.assertEquals(third.duration, 50)
+
+    def testFindItem(self):
+        self.assertEquals(self.playlist._findItem(50), None)
+        first = self.playlist.addItem('id1', 0, "file:///testuri", 0, 100,
+            True, True)
+        second = self.playlist.addItem('id1', 200, "file:///testuri", 0, 100,
+            True, True)
+        third = self.playlist.addItem('id1', 300, "file:///testuri", 0, 100,
+            True, True)
+
+        self.assertEquals(self.playlist._findItem(0), None)
+        self.assertEquals(self.playlist._findItem(50), first)
+        self.assertEquals(self.playlist._findItem(150), None)
+        self.assertEquals(self.playlist._findItem(250), second)
+        self.assertEquals(self.playlist._findItem(300), None)
+        self.assertEquals(self.playlist._findItem(301), third)
+        self.assertEquals(self.playlist._findItem(400), None)
+
     def testAddRemoveRepeatedly(self):
         self.playlist.addItem('id1', 0, "file:///testuri",
                               0, 100, True, True)
@@ -290,5 +356,102 @@ class TestPlaylistXMLParser(testsuite.TestCase):
                           ['temp2.ogg', 'temp6.ogg'])
         self.assertEquals(FakeDiscoverer.filename, 'temp1.ogg')
 
+
+class TestDiscovery(testsuite.TestCase):
+
+    def setUp(self):
+        from gst.extend import discoverer
+        self.old_discoverer = discoverer.Discoverer
+        discoverer.Discoverer = FakeMediaDiscoverer
+        FakeMediaDiscoverer.started = []
+
+        self.playlist = playlistparser.Playlist(FakeProducer())
+        self.tempdir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.tempdir, 'cache')
+        self.done = []
+        self.start = int((time.time() + 3600) * gst.SECOND)
+        self.files = []
+        for i in range(3):
+            filename = os.path.join(self.tempdir, '%d.ogg' % i)
+            open(filename, 'w').write('media %d' % i)
+            self.files.append(filename)
+
+    def tearDown(self):
+        from gst.extend import discoverer
+        discoverer.Discoverer = self.old_discoverer
+        shutil.rmtree(self.tempdir)
+
+    def makeParser(self, cache=None):
+        return playlistparser.PlaylistXMLParser(self.playlist,
+            discoverers=2, cache=cache,
+            discoveryDone=lambda *args: self.done.append(args[:2]))
+
+    def addFiles(self, parser):
+        parser.blockDiscovery()
+        for i, filename in enumerate(self.files):
+            parser.addItemToPlaylist(filename,
+                self.start + i * 100 * gst.SECOND, 100 * gst.SECOND, 0,
+                None)
+        parser.unblockDiscovery()
+
+    def finish(self, discoverer):
+        discoverer.finish()
+        return task.deferLater(reactor, 0, lambda: None)
+
+    def getItems(self):
+        return [item.uri[len('file://'):] for item in self.playlist._sorted]
+
+    def testDiscoverConcurrently(self):
+        parser = self.makeParser()
+        self.addFiles(parser)
+        started = FakeMediaDiscoverer.started
+        self.assertEquals([d.filename for d in started], self.files[:2])
+
+        # the entries are added in order, the second one waits for the
+        # first one to be discovered
+        d = self.finish(started[1])
+        d.addCallback(lambda _: self.assertEquals(self.getItems(), []))
+        d.addCallback(lambda _: self.finish(started[0]))
+        d.addCallback(lambda _: self.assertEquals(self.getItems(),
+                                                  self.files[:2]))
+        d.addCallback(lambda _: self.assertEquals(len(started), 3))
+        d.addCallback(lambda _: self.assertEquals(self.done, []))
+        d.addCallback(lambda _: self.finish(started[2]))
+        d.addCallback(lambda _: self.assertEquals(self.getItems(),
+                                                  self.files))
+        d.addCallback(lambda _: self.assertEquals(self.done, [(3, 0)]))
+        return d
+
+    def testCache(self):
+        parser = self.makeParser(playlistparser.DiscoveryCache(
+            self.cacheFile))
+        self.addFiles(parser)
+        started = FakeMediaDiscoverer.started
+        d = self.finish(started[0])
+        d.addCallback(lambda _: self.finish(started[1]))
+        d.addCallback(lambda _: self.finish(started[2]))
+
+        def rediscover(_):
+            self.failUnless(os.path.exists(self.cacheFile))
+            self.playlist = playlistparser.Playlist(FakeProducer())
+            FakeMediaDiscoverer.started = []
+            # a modified file is discovered again
+            open(self.files[1], 'w').write('other media')
+            parser = self.makeParser(playlistparser.DiscoveryCache(
+                self.cacheFile))
+            self.addFiles(parser)
+            self.assertEquals([d.filename for d in
+                               FakeMediaDiscoverer.started],
+                              [self.files[1]])
+            self.assertEquals(self.getItems(), self.files[:1])
+            return self.finish(FakeMediaDiscoverer.started[0])
+        d.addCallback(rediscover)
+        d.addCallback(lambda _: self.assertEquals(self.getItems(),
+                                                  self.files))
+        d.addCallback(lambda _: self.assertEquals(self.done,
+                                                  [(3, 0), (3, 2)]))
+        return d
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import tempfile
+import time
+
+from flumotion.common import errors, testsuite
+from flumotion.common.componentui import WorkerComponentUIState
+from flumotion.component.plugs import request
+
+
+def makeArgs(uri):
+    return {'ip': '127.0.0.1', 'username': '-',
+            'time': time.gmtime(1200000000), 'method': 'GET', 'uri': uri,
+            'clientproto': 'HTTP/1.0', 'response': 200, 'bytes-sent': 10,
+            'referer': '-', 'user-agent': 'test', 'time-connected': 1}
+
+
+class FakeComponent(object):
+
+    def __init__(self):
+        self.uiState = WorkerComponentUIState()
+
+
+class TestRequestLoggerBufferedFilePlug(testsuite.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".flumotion.test")
+        self.logfile = os.path.join(self.path, 'access.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def makePlug(self, **properties):
+        properties['logfile'] = self.logfile
+        return request.RequestLoggerBufferedFilePlug(
+            {'properties': properties})
+
+    def readLines(self, path=None):
+        return open(path or self.logfile).readlines()
+
+    def testWrite(self):
+        plug = self.makePlug(**{'flush-interval': 60.0})
+        plug.start()
+        for i in range(100):
+            plug.event('http_session_completed', makeArgs('/%d' % i))
+        plug.stop()
+        lines = self.readLines()
+        self.assertEquals(len(lines), 100)
+        self.assertEquals(lines[0],
+            '127.0.0.1 - - [10/Jan/2008:21:20:00 +0000] "GET /0 HTTP/1.0" '
+            '200 10 - "test" 1\n')
+        self.failUnless('/99 ' in lines[-1])
+
+    def testDrop(self):
+        component = FakeComponent()
+        plug = self.makePlug(**{'max-queue': 5, 'flush-interval': 60.0})
+        plug.start(component)
+        # keep the writer thread from emptying the queue
+        plug._cond.acquire()
+        try:
+            for i in range(8):
+                plug.event('http_session_completed', makeArgs('/%d' % i))
+            self.assertEquals(plug.getQueueDepth(), 5)
+            self.assertEquals(plug.dropped, 3)
+        finally:
+            plug._cond.release()
+        plug._updateStats()
+        self.assertEquals(component.uiState.get('request-log-dropped'), 3)
+        plug.stop(component)
+        self.assertEquals(len(self.readLines()), 5)
+
+    def testBlock(self):
+        plug = self.makePlug(**{'max-queue': 2, 'buffer-size': 1,
+                                'overflow': 'block'})
+        plug.start()
+        for i in range(50):
+            plug.event('http_session_completed', makeArgs('/%d' % i))
+        plug.stop()
+        self.assertEquals(plug.dropped, 0)
+        self.assertEquals(len(self.readLines()), 50)
+
+    def testWriteError(self):
+        plug = self.makePlug(**{'max-queue': 2, 'buffer-size': 1,
+                                'overflow': 'block'})
+
+        def writeLines(lines):
+            raise RuntimeError('cannot write')
+        plug._writeLines = writeLines
+        plug.start()
+        # the writer thread survives, so the reactor does not block
+        for i in range(10):
+            plug.event('http_session_completed', makeArgs('/%d' % i))
+        plug.stop()
+        self.assertEquals(plug.dropped, 0)
+
+    def testRotate(self):
+        plug = self.makePlug(**{'flush-interval': 60.0})
+        plug.start()
+        plug.event('http_session_completed', makeArgs('/old'))
+        os.rename(self.logfile, self.logfile + '.1')
+        plug.rotate()
+        # wait for the writer thread to reopen the file
+        for i in range(100):
+            if os.path.exists(self.logfile):
+                break
+            time.sleep(0.01)
+        plug.event('http_session_completed', makeArgs('/new'))
+        plug.stop()
+        self.assertEquals(len(self.readLines(self.logfile + '.1')), 1)
+        self.failUnless('/new ' in self.readLines()[0])
+
+    def testBadOverflow(self):
+        plug = self.makePlug(overflow='sometimes')
+        self.assertRaises(errors.PropertyError, plug.start)
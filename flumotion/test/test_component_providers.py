@@ -36,7 +36,7 @@ from flumotion.component.misc.httpserver import localpath
 from flumotion.component.misc.httpserver import localprovider
 from flumotion.component.misc.httpserver import cachedprovider
 from flumotion.component.misc.httpserver.fileprovider \
-    import InsecureError, NotFoundError, CannotOpenError
+    import InsecureError, NotFoundError, CannotOpenError, FileClosedError
 
 attr = testsuite.attr
 
@@ -225,9 +225,105 @@ class LocalPathLocalProvider(testsuite.TestCase):
         self.assertRaises(NotFoundError, child.open)
 
 
+class ThreadedLocalProviderFileTest(testsuite.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".flumotion.test")
+        self.data = ''.join([chr(i % 256) for i in range(1000)])
+        open(os.path.join(self.path, 'a'), "w").write(self.data)
+        plugProps = {"properties": {"path": self.path,
+                                    "read-threads": 2,
+                                    "read-ahead": 300}}
+        self.fileProviderPlug = \
+            localprovider.FileProviderLocalPlug(plugProps)
+        self.fileProviderPlug.start(None)
+        self.file = None
+
+    def tearDown(self):
+        if self.file is not None:
+            self.file.close()
+        self.fileProviderPlug.stop(None)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def openFile(self, name):
+        d = self.fileProviderPlug.getRootPath().child(name).open()
+
+        def opened(f):
+            self.failUnless(isinstance(f, localprovider.ThreadedLocalFile))
+            self.file = f
+            return f
+        return d.addCallback(opened)
+
+    def readAll(self, f, size, chunks=None):
+        if chunks is None:
+            chunks = []
+        d = f.read(size)
+
+        def gotData(data):
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+            return self.readAll(f, size, chunks)
+        return d.addCallback(gotData)
+
+    def testReadAll(self):
+        d = self.openFile('a')
+        d.addCallback(self.readAll, 128)
+        d.addCallback(self.assertEquals, self.data)
+        d.addCallback(lambda _: self.assertEquals(self.file.tell(), 1000))
+        return d
+
+    def testSeek(self):
+        d = self.openFile('a')
+        d.addCallback(lambda f: f.read(10))
+        d.addCallback(self.assertEquals, self.data[:10])
+        # inside the read-ahead buffer
+        d.addCallback(lambda _: self.file.seek(100))
+        d.addCallback(lambda _: self.file.read(10))
+        d.addCallback(self.assertEquals, self.data[100:110])
+        # outside of it
+        d.addCallback(lambda _: self.file.seek(900))
+        d.addCallback(lambda _: self.file.read(200))
+        d.addCallback(self.assertEquals, self.data[900:])
+        d.addCallback(lambda _: self.file.seek(5))
+        d.addCallback(lambda _: self.assertEquals(self.file.tell(), 5))
+        d.addCallback(lambda _: self.file.read(5))
+        d.addCallback(self.assertEquals, self.data[5:10])
+        return d
+
+    def testQueuedReads(self):
+        d = self.openFile('a')
+
+        def readTwice(f):
+            return defer.gatherResults([f.read(400), f.read(400)])
+        d.addCallback(readTwice)
+        d.addCallback(self.assertEquals, [self.data[:400], self.data[400:800]])
+        return d
+
+    def testCloseWhileReading(self):
+        d = self.openFile('a')
+
+        def readAndClose(f):
+            rd = f.read(10)
+            f.close()
+            self.assertRaises(FileClosedError, f.tell)
+            return self.assertFailure(rd, FileClosedError)
+        d.addCallback(readAndClose)
+        return d
+
+    def testOpenNonExisting(self):
+        d = self.fileProviderPlug.getRootPath().child('foo').open()
+        return self.assertFailure(d, NotFoundError)
+
+    def testOpendir(self):
+        d = self.fileProviderPlug.getRootPath().open()
+        return self.assertFailure(d, CannotOpenError)
+
+
 class CachedProviderFileTest(testsuite.TestCase):
 
     skip = SKIP_MSG
+    copyWorkers = None
 
     def setUp(self):
         from twisted.python import threadpool
@@ -239,6 +335,8 @@ class CachedProviderFileTest(testsuite.TestCase):
 
         plugProps = {"properties": {"path": self.src_path,
                                     "cache-dir": self.cache_path}}
+        if self.copyWorkers is not None:
+            plugProps["properties"]["copy-workers"] = self.copyWorkers
         self.fileProviderPlug = \
             cachedprovider.FileProviderLocalCachedPlug(plugProps)
         d = self.fileProviderPlug.start(None)
@@ -333,6 +431,102 @@ class CachedProviderFileTest(testsuite.TestCase):
         return self.cachedFile.read(size)
 
 
+class CopyWorkersFileTest(CachedProviderFileTest):
+
+    copyWorkers = 3
+
+    def testConcurrentCopies(self):
+        size = cachedprovider.MAX_COPY_BUFFER_SIZE * 2 + 123
+        names = ['b', 'c', 'd', 'e']
+        contents = {}
+        for i, name in enumerate(names):
+            contents[name] = "".join([chr((i + j) % 256)
+                                      for j in range(256)]) * (size / 256)
+            self.createFile(name, contents[name], old=True)
+
+        def readAll(name):
+            f = self.fileProviderPlug.getRootPath().child(name).open()
+            chunks = []
+
+            def readChunk(_):
+                d = defer.maybeDeferred(f.read, 100000)
+                d.addCallback(gotChunk)
+                return d
+
+            def gotChunk(data):
+                if not data:
+                    f.close()
+                    return "".join(chunks)
+                chunks.append(data)
+                return readChunk(None)
+
+            # start at the end so reads are delegated to the workers
+            f.seek(len(contents[name]) - 10)
+            d = defer.maybeDeferred(f.read, 10)
+            d.addCallback(lambda tail: self.assertEquals(
+                tail, contents[name][-10:]))
+            d.addCallback(lambda _: f.seek(0))
+            d.addCallback(readChunk)
+            d.addCallback(self.assertEquals, contents[name])
+            return d
+
+        d = defer.DeferredList([readAll(name) for name in names],
+                               fireOnOneErrback=True)
+        d.addCallback(delay, 1)
+
+        def checkCached(_):
+            for name in names:
+                path = self.getCachePath(os.path.join(self.src_path, name))
+                self.assertEquals(open(path).read(), contents[name])
+            workers = self.fileProviderPlug.stats._copyWorkers
+            self.assertEquals(len(workers), 3)
+            self.assertEquals(sum([w.bytesCopied for w in workers]),
+                              sum(map(len, contents.values())))
+        d.addCallback(checkCached)
+        return d
+
+
+class DummyCopySession:
+
+    def __init__(self):
+        self.pending = False
+
+    def hasPendingReads(self):
+        return self.pending
+
+
+class CopySchedulerTest(testsuite.TestCase):
+
+    def testScheduling(self):
+        scheduler = cachedprovider.CopyScheduler(None, 0)
+        scheduler.start()
+        a, b, c = DummyCopySession(), DummyCopySession(), DummyCopySession()
+        for session in a, b, c:
+            scheduler.add(session)
+        self.assertEquals(len(scheduler), 3)
+
+        # sessions with pending reads come first
+        scheduler.prioritize(c)
+        self.assertIdentical(scheduler.next(), c)
+        # prioritized while being handled, queued again even if done
+        scheduler.prioritize(c)
+        scheduler.done(c, False)
+        self.assertIdentical(scheduler.next(), c)
+        scheduler.done(c, False)
+
+        self.assertIdentical(scheduler.next(), a)
+        a.pending = True
+        scheduler.done(a, True)
+        scheduler.remove(b)
+        self.assertIdentical(scheduler.next(), a)
+        scheduler.done(a, True)
+        scheduler.remove(a)
+        self.assertEquals(len(scheduler), 1)
+
+        scheduler.stop()
+        self.assertEquals(scheduler.next(), None)
+
+
 def pass_through(result, fun, *args, **kwargs):
     fun(*args, **kwargs)
     return result
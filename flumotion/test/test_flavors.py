@@ -85,6 +85,17 @@ class TestRoot(testsuite.TestManagerRoot):
     def remote_haveAdopted(self, name):
         return self.state.remove('children', name)
 
+    def remote_batchedChanges(self):
+        self.state.setBatchWindow(0.01)
+        self.state.set('name', 'lana')
+        self.state.set('name', 'chloe')
+        self.state.append('children', 'robin')
+        self.state.setitem('nationalities', 'mary queen of scots',
+                           'scotland')
+        self.state.setitem('nationalities', 'mary queen of scots',
+                           'norway')
+        return self.state.set('name', 'lois')
+
 
 class StateTest(testsuite.TestCase):
 
@@ -289,6 +300,122 @@ class TestStateSet(StateTest):
         return d
 
 
+class TestBatchedStateSet(StateTest):
+
+    def testBatchListener(self):
+        d = self.runClient()
+        d.addCallback(lambda _: self.perspective.callRemote('getState'))
+
+        def add_listener_and_change(state):
+            d.state = state # monkeypatch
+
+            def set_(state, key, value):
+                # the whole batch is applied before notifying
+                self.changes.append(('set', key, value,
+                                     list(state.get('children'))))
+
+            def append(state, key, value):
+                self.changes.append(('append', key, value))
+
+            def setitem(state, key, subkey, value):
+                self.changes.append(('setitem', key, subkey, value))
+            state.addListener(self, set_=set_, append=append,
+                              setitem=setitem)
+            return self.perspective.callRemote('batchedChanges')
+
+        def check_results(_):
+            self.assertEquals(self.changes,
+                [('set', 'name', 'lois', ['robin']),
+                 ('append', 'children', 'robin'),
+                 ('setitem', 'nationalities', 'mary queen of scots',
+                  'norway')])
+            self.assertEquals(d.state.get('name'), 'lois')
+            self.assertEquals(d.state.get('nationalities'),
+                              {'mary queen of scots': 'norway'})
+            return self.stopClient()
+
+        d.addCallback(add_listener_and_change)
+        d.addCallback(check_results)
+        return d
+
+
+class FakeObserver:
+
+    def __init__(self):
+        self.calls = []
+
+    def callRemote(self, name, *args):
+        self.calls.append((name, ) + args)
+        return defer.succeed(None)
+
+
+class TestProxyState(flavors.StateCacheable, flavors.StateRemoteCache):
+    pass
+
+
+class TestBatch(testsuite.TestCase):
+
+    def assertBatch(self, changes, expected):
+        batch = flavors._Batch()
+        for change in changes:
+            batch.add(change)
+        self.assertEquals(batch.changes, expected)
+
+    def testCoalesce(self):
+        self.assertBatch([('set', 'a', 1), ('set', 'b', 2), ('set', 'a', 3)],
+                         [('set', 'a', 3), ('set', 'b', 2)])
+        self.assertBatch([('setitem', 'a', 'x', 1), ('setitem', 'a', 'y', 2),
+                          ('setitem', 'a', 'x', 3)],
+                         [('setitem', 'a', 'x', 3), ('setitem', 'a', 'y', 2)])
+
+    def testOrderKept(self):
+        # a set can not jump over another change to the same key
+        changes = [('set', 'a', [1]), ('append', 'a', 2), ('set', 'a', [3])]
+        self.assertBatch(changes, changes)
+        changes = [('set', 'a', {}), ('setitem', 'a', 'x', 1),
+                   ('set', 'a', {})]
+        self.assertBatch(changes, changes)
+        changes = [('setitem', 'a', 'x', 1), ('delitem', 'a', 'x', 1),
+                   ('setitem', 'a', 'x', 2)]
+        self.assertBatch(changes, changes)
+        # None is a valid subkey, not a set of the whole key
+        changes = [('setitem', 'a', None, 1), ('set', 'a', {})]
+        self.assertBatch(changes, changes)
+
+    def testFlush(self):
+        state = TestStateCacheable()
+        state.addKey('name')
+        observer = FakeObserver()
+        state.getStateToCacheAndObserveFor(None, observer)
+        state.setBatchWindow(60)
+        d = state.set('name', 'lana')
+        state.set('name', 'lois')
+        self.assertEquals(observer.calls, [])
+        state.flushBatches()
+        self.failUnless(d.called)
+        self.assertEquals(observer.calls, [('batch', [('set', 'name',
+                                                       'lois')])])
+        state.setBatchWindow(None)
+        state.set('name', 'chloe')
+        self.assertEquals(observer.calls[-1], ('set', 'name', 'chloe'))
+
+    def testProxyBatch(self):
+        # a proxy passes on a batch as one batch
+        state = TestProxyState()
+        state.addKey('name')
+        state.addListKey('children')
+        observer = FakeObserver()
+        state.getStateToCacheAndObserveFor(None, observer)
+        state.observe_batch([('set', 'name', 'lois'),
+                             ('append', 'children', 'robin')])
+        self.assertEquals(state.get('name'), 'lois')
+        self.assertEquals(observer.calls,
+                          [('batch', [('set', 'name', 'lois'),
+                                      ('append', 'children', 'robin')])])
+        self.assertRaises(ValueError, state.observe_batch,
+                          [('explode', 'name')])
+
+
 class TestFullListener(StateTest):
 
     def testStateSetListener(self):
@@ -24,7 +24,7 @@ from twisted.web import http, server
 
 from flumotion.component.base.http import HTTPAuthentication
 from flumotion.component.consumers.httpstreamer import resources
-from flumotion.common import keycards, log, errors
+from flumotion.common import componentui, keycards, log, errors
 from flumotion.common import testsuite
 
 # From twisted/test/proto_helpers.py
@@ -414,3 +414,150 @@ class TestHTTPRoot(testsuite.TestCase):
         self.assertEquals(r, resource)
         output = r.render(request)
         self.assertEquals(output, server.NOT_DONE_YET)
+
+
+class FakeBouncingMedium:
+    # this medium allows HTTP auth if there is a "LETMEIN" token, and
+    # lets the test decide when the bouncer answers
+
+    def __init__(self):
+        self.count = 0
+        self.pending = []
+        self.removed = []
+
+    def authenticate(self, bouncerName, keycard):
+        d = defer.Deferred()
+        self.pending.append((d, keycard))
+        return d
+
+    def answer(self):
+        pending, self.pending = self.pending, []
+        for d, keycard in pending:
+            if keycard.token == 'LETMEIN':
+                keycard.id = self.count
+                self.count += 1
+                keycard.state = keycards.AUTHENTICATED
+                d.callback(keycard)
+            else:
+                d.callback(None)
+
+    def removeKeycardId(self, bouncerName, keycardId):
+        self.removed.append(keycardId)
+        return defer.succeed(None)
+
+
+class FakeCachingStreamer(FakeStreamer):
+
+    def __init__(self):
+        FakeStreamer.__init__(self, mediumClass=FakeBouncingMedium)
+        self.uiState = componentui.WorkerComponentUIState()
+        self.removedClients = []
+
+    def remove_client(self, fd):
+        self.removedClients.append(fd)
+
+
+class TestDecisionCache(testsuite.TestCase):
+
+    def setUp(self):
+        self.streamer = FakeCachingStreamer()
+        self.medium = self.streamer.medium
+        self.httpauth = HTTPAuthentication(self.streamer)
+        self.httpauth.setIssuerClass('HTTPTokenIssuer')
+        self.httpauth.setBouncerName('fakebouncer')
+        self.httpauth.setDecisionCache(2, 60)
+
+    def authenticate(self, token='LETMEIN', ip='127.0.0.1'):
+        request = FakeRequest(ip=ip, args={'token': token},
+                              transport=PipeTransport())
+        d = self.httpauth.startAuthentication(request)
+        d.addErrback(lambda f: f.trap(errors.NotAuthenticatedError))
+        d.addCallback(lambda _: request)
+        return d
+
+    def assertCounts(self, hits, misses):
+        self.assertEquals(self.streamer.uiState.get('auth-cache-hits'), hits)
+        self.assertEquals(self.streamer.uiState.get('auth-cache-misses'),
+                          misses)
+
+    def testReuse(self):
+        requests = []
+        d = self.authenticate()
+        d.addCallback(requests.append)
+        self.medium.answer()
+        d = self.authenticate()
+        d.addCallback(requests.append)
+
+        self.assertEquals(self.medium.pending, [])
+        self.assertEquals(self.medium.count, 1)
+        self.assertEquals([r.response for r in requests], [http.OK] * 2)
+        self.assertCounts(1, 1)
+        # both clients use the same keycard of the bouncer
+        self.assertEquals(len(self.httpauth._fdToKeycard), 2)
+
+    def testCoalesce(self):
+        requests = []
+        for i in range(3):
+            d = self.authenticate()
+            d.addCallback(requests.append)
+        self.assertEquals(len(self.medium.pending), 1)
+        self.assertEquals(requests, [])
+
+        self.medium.answer()
+        self.assertEquals([r.response for r in requests], [http.OK] * 3)
+        self.assertCounts(2, 1)
+
+    def testRefusal(self):
+        requests = []
+        for i in range(2):
+            d = self.authenticate(token='WRONG')
+            d.addCallback(requests.append)
+            self.medium.answer()
+        self.assertEquals([r.response for r in requests],
+                          [http.UNAUTHORIZED] * 2)
+        self.assertCounts(1, 1)
+
+    def testOtherCredentials(self):
+        self.authenticate()
+        self.authenticate(ip='127.0.0.2')
+        self.assertEquals(len(self.medium.pending), 2)
+        self.assertCounts(0, 2)
+
+    def testExpireKeycards(self):
+        requests = []
+        for i in range(2):
+            d = self.authenticate()
+            d.addCallback(requests.append)
+            self.medium.answer()
+
+        # the bouncer expires the keycard, so both clients go away
+        self.assertEquals(self.httpauth.expireKeycards([0]), 1)
+        fds = [r.transport.fileno() for r in requests]
+        fds.sort()
+        self.streamer.removedClients.sort()
+        self.assertEquals(self.streamer.removedClients, fds)
+        self.assertEquals(self.httpauth._fdToKeycard, {})
+        for fd in fds:
+            self.httpauth.cleanupAuth(fd)
+        self.assertEquals(self.medium.removed, [])
+
+        # and the decision is not reused
+        self.authenticate()
+        self.assertEquals(len(self.medium.pending), 1)
+
+    def testCleanup(self):
+        requests = []
+        d = self.authenticate()
+        d.addCallback(requests.append)
+        self.medium.answer()
+        fd = requests[0].transport.fileno()
+
+        # the keycard stays with the bouncer while it can be reused
+        self.httpauth.cleanupAuth(fd)
+        self.assertEquals(self.medium.removed, [])
+
+        # until two other decisions push it out
+        for ip in '127.0.0.2', '127.0.0.3':
+            self.authenticate(ip=ip)
+            self.medium.answer()
+        self.assertEquals(self.medium.removed, [0])
@@ -0,0 +1,165 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_job_zygote -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import sys
+import tempfile
+
+from twisted.internet import defer, error, protocol
+
+from flumotion.common import errors, testsuite
+from flumotion.job import zygote
+from flumotion.worker import base
+
+# runs a zygote; the forked processes write their avatarId to a file
+# and exit with the code they find in their environment
+ZYGOTE_SCRIPT = """#!%s
+import os, sys
+from flumotion.job import zygote
+avatarId = zygote.Zygote(int(sys.argv[3])).run()
+if avatarId is None:
+    sys.exit(0)
+open(os.environ['ZYGOTE_TEST_OUTPUT'], 'w').write(avatarId)
+os._exit(int(os.environ['ZYGOTE_TEST_EXIT']))
+"""
+
+
+class FakeHeaven:
+
+    def getSocketPath(self):
+        return '/nonexistent/socket'
+
+
+class JobProtocol(protocol.ProcessProtocol):
+
+    def __init__(self):
+        self.ended = defer.Deferred()
+
+    def processEnded(self, status):
+        self.ended.callback(status.value)
+
+
+class TestMessages(testsuite.TestCase):
+
+    def setUp(self):
+        self.r, self.w = os.pipe()
+
+    def tearDown(self):
+        os.close(self.r)
+        if self.w is not None:
+            os.close(self.w)
+
+    def testRoundtrip(self):
+        message = ('run', 1234, '/default/producer', {'FOO': 'bar'})
+        os.write(self.w, zygote.encodeMessage(message))
+        os.write(self.w, zygote.encodeMessage(('fork', )))
+        self.assertEquals(zygote.readMessage(self.r), message)
+        self.assertEquals(zygote.readMessage(self.r), ('fork', ))
+
+    def testEndOfFile(self):
+        os.write(self.w, zygote.encodeMessage(('fork', ))[:-1])
+        os.close(self.w)
+        self.w = None
+        self.assertEquals(zygote.readMessage(self.r), None)
+
+
+class TestJobZygote(testsuite.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.executable = os.path.join(self.tempdir, 'flumotion-job')
+        f = open(self.executable, 'w')
+        f.write(ZYGOTE_SCRIPT % sys.executable)
+        f.close()
+        os.chmod(self.executable, 0755)
+        self.output = os.path.join(self.tempdir, 'output')
+        self.env = {'PYTHONPATH': os.pathsep.join(sys.path),
+                    'ZYGOTE_TEST_OUTPUT': self.output}
+        self.zygote = None
+
+    def tearDown(self):
+        d = defer.succeed(None)
+        if self.zygote:
+            d.addCallback(lambda _: self.zygote.stop())
+        d.addCallback(lambda _: shutil.rmtree(self.tempdir))
+        return d
+
+    def startZygote(self, poolSize):
+        self.zygote = base.JobZygote(FakeHeaven(), poolSize)
+        oldPath = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = self.env['PYTHONPATH']
+        try:
+            self.zygote.start(self.executable)
+        finally:
+            if oldPath is None:
+                del os.environ['PYTHONPATH']
+            else:
+                os.environ['PYTHONPATH'] = oldPath
+
+    def runJob(self, avatarId, exitCode):
+        p = JobProtocol()
+        env = dict(self.env)
+        env['ZYGOTE_TEST_EXIT'] = str(exitCode)
+
+        def forked(pid):
+            self.failUnless(pid > 0)
+            self.zygote.run(pid, p, avatarId, env)
+            return p.ended
+        d = self.zygote.fork()
+        d.addCallback(forked)
+        return d
+
+    def assertOutput(self, avatarId):
+        f = open(self.output)
+        self.assertEquals(f.read(), avatarId)
+        f.close()
+
+    def testForkOnRequest(self):
+        self.startZygote(0)
+
+        def ended(status):
+            self.failUnless(isinstance(status, error.ProcessTerminated))
+            self.assertEquals(status.exitCode, 3)
+            self.assertOutput('/default/producer')
+        d = self.runJob('/default/producer', 3)
+        d.addCallback(ended)
+        return d
+
+    def testPool(self):
+        self.startZygote(1)
+
+        def ended(status, avatarId):
+            self.failUnless(isinstance(status, error.ProcessDone))
+            self.assertOutput(avatarId)
+        d = self.runJob('/default/producer', 0)
+        d.addCallback(ended, '/default/producer')
+        d.addCallback(lambda _: self.runJob('/default/encoder', 0))
+        d.addCallback(ended, '/default/encoder')
+        return d
+
+    def testStop(self):
+        self.startZygote(2)
+        d = self.zygote.stop()
+        d.addCallback(lambda _: self.assertEquals(self.zygote.process, None))
+        d.addCallback(lambda _: self.failUnlessFailure(
+            self.zygote.fork(), errors.ComponentCreateError))
+        return d
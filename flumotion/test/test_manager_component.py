@@ -56,6 +56,7 @@ class FakeComponentAvatar(log.Loggable):
 
         self._eatlog = []
         self._feedlog = []
+        self._locallog = []
 
         if eaters is None:
             eaters = {}
@@ -102,6 +103,9 @@ class FakeComponentAvatar(log.Loggable):
     def getParentName(self):
         return self._parent
 
+    def getWorkerName(self):
+        return self._worker
+
     def getClientAddress(self):
         return self._host
 
@@ -118,12 +122,33 @@ class FakeComponentAvatar(log.Loggable):
         self.debug('%r feedTo: %r, %r, %r, %r', self, feederName, fullFeedId,
                    host, port)
         self._feedlog.append((feederName, fullFeedId, host, port))
+
+    def eatFromLocal(self, eaterAlias, fullFeedId, host, port):
+        self._locallog.append((eaterAlias, fullFeedId, host, port))
+        return defer.succeed(None)
 fca = FakeComponentAvatar
 
 
+class FakeWorkerAvatar(log.Loggable):
+
+    def __init__(self, name, result=True):
+        self.avatarId = name
+        self.result = result
+        self.connected = []
+
+    def connectLocalFeed(self, feederId, feederName, eaterId, eaterAlias):
+        self.connected.append((feederId, feederName, eaterId, eaterAlias))
+        if isinstance(self.result, Exception):
+            return defer.fail(self.result)
+        return defer.succeed(self.result)
+
+
 class FakeVishnu(log.Loggable):
     running = True
 
+    def __init__(self):
+        self.workerHeaven = dac(avatars={})
+
 
 class TestComponentHeaven(testsuite.TestCase):
 
@@ -650,3 +675,57 @@ class TestComponentHeaven(testsuite.TestCase):
                             (cA, [('default-prime', '/a/comp9:default',
                                    '127.0.0.1', 1032)], [])], *without(c9, cA))
         self.resetEatFeed(c9, cA)
+
+    def testLocalFeed(self):
+        w = FakeWorkerAvatar('localhost')
+        self.vishnu.workerHeaven.avatars['localhost'] = w
+        c1 = fca('a', 'comp1')
+        c2 = fca('a', 'comp2',
+                 eaters={'default': [('comp1:default', 'default-prime')]})
+        c3 = fca('a', 'comp3', worker='other',
+                 eaters={'default': [('comp1:default', 'default-prime')]})
+
+        self.attach(c1)
+        self.attach(c2)
+        # the worker connects the components on the same worker
+        self.assertEquals(w.connected, [('/a/comp1', 'default',
+                                         '/a/comp2', 'default-prime')])
+        self.assertEquals(c2._locallog, [('default-prime', '/a/comp1:default',
+                                          '127.0.0.1', 1024)])
+        self.assertNoEatFeed(c1, c2)
+
+        # components on other workers go through the feed server
+        self.attach(c3)
+        self.assertEquals(len(w.connected), 1)
+        self.assertEatFeed([(c3, [('default-prime', '/a/comp1:default',
+                                   '127.0.0.1', 1024)], [])], c1, c2)
+
+    def testLocalFeedFallback(self):
+        w = FakeWorkerAvatar('localhost', result=False)
+        self.vishnu.workerHeaven.avatars['localhost'] = w
+        c1 = fca('a', 'comp1')
+        c2 = fca('a', 'comp2',
+                 eaters={'default': [('comp1:default', 'default-prime')]})
+        self.attach(c1)
+        self.attach(c2)
+        self.assertEquals(len(w.connected), 1)
+        self.assertEquals(c2._locallog, [])
+        self.assertEatFeed([(c2, [('default-prime', '/a/comp1:default',
+                                   '127.0.0.1', 1024)], [])], c1)
+
+        # older workers do not know how to connect local feeds
+        w.result = ValueError('no such method')
+        self.resetEatFeed(c2)
+        self.detach(c1)
+        self.attach(c1)
+        self.assertEquals(len(w.connected), 2)
+        self.assertEatFeed([(c2, [('default-prime', '/a/comp1:default',
+                                   '127.0.0.1', 1024)], [])], c1)
+
+        self.heaven.localFeeds = False
+        self.resetEatFeed(c2)
+        self.detach(c1)
+        self.attach(c1)
+        self.assertEquals(len(w.connected), 2)
+        self.assertEatFeed([(c2, [('default-prime', '/a/comp1:default',
+                                   '127.0.0.1', 1024)], [])], c1)
@@ -56,7 +56,8 @@ class TestManagerConfigParser(testsuite.TestCase):
                            <port>999</port>
                            <transport>tcp</transport>
                            <certificate>manager.cert</certificate>
-                           <debug>true</debug>""",
+                           <debug>true</debug>
+                           <placement>load</placement>""",
                         extra=' name="mname"')
         parser = ManagerConfigParser(f)
         self.failUnless(parser.manager)
@@ -68,6 +69,7 @@ class TestManagerConfigParser(testsuite.TestCase):
         self.assertEquals(manager.transport, 'tcp')
         self.assertEquals(manager.certificate, 'manager.cert')
         self.assertEquals(manager.fludebug, 'true')
+        self.assertEquals(manager.placement, 'load')
 
     def testParseManagerInvalid(self):
         f = self._buildManager('<transport>foo</transport>')
@@ -78,6 +80,8 @@ class TestManagerConfigParser(testsuite.TestCase):
         self.assertRaises(ConfigError, ManagerConfigParser, f)
         f = self._buildManager('<host><xxx/></host>')
         self.assertRaises(ConfigError, ManagerConfigParser, f)
+        f = self._buildManager('<placement>random</placement>')
+        self.assertRaises(ConfigError, ManagerConfigParser, f)
 
     def testParseBouncerComponent(self):
         f = self._buildManager("""<component name="foobar" type="bouncer"/>""")
@@ -0,0 +1,174 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_manager_creation -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+from twisted.internet import defer, reactor
+
+from flumotion.common import errors, testsuite
+from flumotion.manager import creation
+
+
+class FakeWorkers(object):
+
+    def __init__(self):
+        self.creating = {} # name -> deferred
+        self.created = []
+        self.failures = {} # name -> list of exceptions to fail with
+        self.failed = []
+
+    def create(self, workerId, name):
+        failures = self.failures.get(name)
+        if failures:
+            return defer.fail(failures.pop(0))
+        d = defer.Deferred()
+        self.creating[name] = d
+        return d
+
+    def finish(self, name):
+        self.created.append(name)
+        self.creating.pop(name).callback(name)
+
+    def fail(self, failure, workerId, name):
+        self.failed.append(name)
+
+
+class TestDepths(testsuite.TestCase):
+
+    def testFlow(self):
+        depths = creation.getDepths({
+            '/a/producer': [],
+            '/a/overlay': ['/a/producer'],
+            '/a/encoder': ['/a/overlay', '/a/audio'],
+            '/a/muxer': ['/a/encoder', '/a/audio'],
+            '/a/audio': []})
+        self.assertEquals(depths, {'/a/producer': 0, '/a/audio': 0,
+                                   '/a/overlay': 1, '/a/encoder': 2,
+                                   '/a/muxer': 3})
+
+    def testUnknownFeeder(self):
+        self.assertEquals(creation.getDepths({'/a/b': ['/a/gone']}),
+                          {'/a/b': 1, '/a/gone': 0})
+
+    def testLoop(self):
+        depths = creation.getDepths({'/a/a': ['/a/b'], '/a/b': ['/a/a']})
+        self.assertEquals(len(depths), 2)
+
+    def testDeep(self):
+        feeders = {'/a/0': []}
+        for i in range(1, 5000):
+            feeders['/a/%d' % i] = ['/a/%d' % (i - 1)]
+        self.assertEquals(creation.getDepths(feeders)['/a/4999'], 4999)
+
+
+class TestCreationScheduler(testsuite.TestCase):
+
+    def setUp(self):
+        self.workers = FakeWorkers()
+        self.scheduler = creation.CreationScheduler(
+            self.workers.create, self.workers.fail, maxConcurrent=2)
+        self._retryDelay = creation.RETRY_DELAY
+        creation.RETRY_DELAY = 0.01
+
+    def tearDown(self):
+        creation.RETRY_DELAY = self._retryDelay
+        self.scheduler.stop()
+
+    def testConcurrency(self):
+        self.scheduler.schedule('w1', 'a')
+        self.scheduler.schedule('w1', 'b')
+        for name, priority in (('muxer', 2), ('encoder', 1),
+                               ('producer', 0)):
+            self.scheduler.schedule('w1', name, priority)
+        self.scheduler.schedule('w2', 'other', 5)
+        creating = self.workers.creating.keys()
+        creating.sort()
+        self.assertEquals(creating, ['a', 'b', 'other'])
+        self.assertEquals(self.scheduler.getQueueLength('w1'), 3)
+
+        # the waiting components are created by priority
+        self.workers.finish('a')
+        self.failUnless('producer' in self.workers.creating)
+        self.workers.finish('producer')
+        self.failUnless('encoder' in self.workers.creating)
+        self.failIf('muxer' in self.workers.creating)
+        self.workers.finish('b')
+        self.workers.finish('encoder')
+        self.workers.finish('muxer')
+        self.assertEquals(self.workers.created,
+                          ['a', 'producer', 'b', 'encoder', 'muxer'])
+        self.failIf(self.scheduler.isScheduled('muxer'))
+
+    def testScheduledOnce(self):
+        d = self.scheduler.schedule('w1', 'producer')
+        self.assertEquals(self.scheduler.schedule('w1', 'producer'), None)
+        self.workers.finish('producer')
+        d.addCallback(self.assertEquals, 'producer')
+        return d
+
+    def testCancel(self):
+        for name in ('a', 'b', 'c', 'd'):
+            self.scheduler.schedule('w1', name)
+        # too late for the ones being created
+        self.failIf(self.scheduler.cancel('a'))
+        self.failUnless(self.scheduler.cancel('c'))
+        self.assertEquals(self.scheduler.cancelWorker('w1'), ['d'])
+        self.workers.finish('a')
+        self.workers.finish('b')
+        self.assertEquals(self.workers.creating, {})
+        self.assertEquals(self.scheduler.getQueueLength('w1'), 0)
+
+    def testSynchronous(self):
+        # creations that complete right away
+        scheduler = creation.CreationScheduler(lambda w, c: defer.succeed(c),
+                                               self.workers.fail)
+        dl = [scheduler.schedule('w1', i) for i in range(2000)]
+        self.failIf(scheduler.isScheduled(1999))
+        return defer.DeferredList(dl)
+
+    def testRetry(self):
+        self.workers.failures['a'] = [errors.ConnectionError('lost'),
+                                      errors.ConnectionError('lost')]
+        d = self.scheduler.schedule('w1', 'a')
+        self.failIf('a' in self.workers.creating)
+
+        def retried():
+            self.failUnless('a' in self.workers.creating)
+            self.workers.finish('a')
+            return d
+        d2 = defer.Deferred()
+        d2.addCallback(lambda _: retried())
+        d2.addCallback(self.assertEquals, 'a')
+        reactor.callLater(0.1, d2.callback, None)
+        return d2
+
+    def testGiveUp(self):
+        self.workers.failures['a'] = [errors.ComponentCreateError('bad')]
+        self.workers.failures['b'] = [errors.ConnectionError('lost')] * (
+            creation.MAX_RETRIES + 1)
+        self.scheduler.schedule('w1', 'a')
+        d = self.scheduler.schedule('w1', 'b')
+        # component errors are not retried
+        self.assertEquals(self.workers.failed, ['a'])
+
+        def gaveUp(result):
+            self.assertEquals(result, None)
+            self.assertEquals(self.workers.failed, ['a', 'b'])
+        d.addCallback(gaveUp)
+        return d
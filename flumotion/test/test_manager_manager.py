@@ -29,7 +29,7 @@ from flumotion.common import log, planet, interfaces, common
 from flumotion.common import errors
 from flumotion.common import testsuite
 from flumotion.common.planet import moods
-from flumotion.manager import component, manager
+from flumotion.manager import component, creation, manager, placement
 from flumotion.twisted import flavors
 
 
@@ -271,6 +271,11 @@ class FakeWorkerMind(FakeMind):
         self._createDeferreds = []
         return d
 
+    def remote_connectLocalFeed(self, feederId, feederName, eaterId,
+                                eaterAlias):
+        # pretend this works
+        return True
+
     def remote_getComponents(self):
         # Fire only asychronously; with an empty list.
         d = defer.Deferred()
@@ -333,6 +338,9 @@ class FakeComponentMind(FakeMind):
         # pretend this works
         return
 
+    def remote_eatFromLocal(self, eaterAlias, fullFeedId, host, port):
+        return
+
 
 class TestVishnu(testsuite.TestCase):
 
@@ -436,6 +444,26 @@ class TestVishnu(testsuite.TestCase):
         # now lets empty planet
         return self.vishnu.emptyPlanet()
 
+    def testCreateFailingRightAway(self):
+        __thisdir = os.path.dirname(os.path.abspath(__file__))
+        file = os.path.join(__thisdir, 'test.xml')
+        self.vishnu.loadComponentConfigurationXML(file, manager.LOCAL_IDENTITY)
+        state = self.vishnu.state.get('flows')[0].get('components')[0]
+
+        def create(workerId, componentState):
+            return defer.fail(errors.ComponentNoWorkerError('logged out'))
+        self.vishnu._creator = creation.CreationScheduler(
+            create, self.vishnu._createFailed)
+        self.vishnu.workerHeaven.avatars['worker'] = None
+        d = self.vishnu._workerCreateComponents('worker', [state])
+        # the failure resets the pending mood, so it is created again
+        # when the worker logs in
+        d.addCallback(lambda _: self.assertEquals(state.get('moodPending'),
+                                                  None))
+        d.addCallback(lambda _: self.vishnu.workerHeaven.avatars.clear())
+        d.addCallback(lambda _: self.vishnu.emptyPlanet())
+        return d
+
     def testLoadComponentWithSynchronization(self):
 
         def loadProducer():
@@ -526,6 +554,60 @@ class TestVishnu(testsuite.TestCase):
         d.addCallback(loadConverter)
         return d
 
+    def testPlacement(self):
+        self.vishnu.placer = placement.Placer()
+        self.vishnu.placementDelay = 0
+        converterId = common.componentId("testflow", "converter-ogg-theora")
+        streamerId = common.componentId("testflow", "streamer-ogg-theora")
+
+        def sleep(delay):
+            d = defer.Deferred()
+            reactor.callLater(delay, d.callback, None)
+            return d
+
+        def loadComponents(_):
+            self.vishnu.workerLoadReported(
+                'w1', {'cpu-count': 1, 'load-average': 2.0})
+            self.vishnu.workerLoadReported(
+                'w2', {'cpu-count': 2, 'load-average': 1.0})
+            self.vishnu.loadComponent(
+                manager.LOCAL_IDENTITY, "pipeline-converter", converterId,
+                None, [("pipeline", "identity")], None, [],
+                [("default", "producer-video-test:default")], False, [])
+            self.vishnu.loadComponent(
+                manager.LOCAL_IDENTITY, "http-streamer", streamerId,
+                None, [("port", 8800)], None, [],
+                [("default", "converter-ogg-theora:default")], False, [])
+            return sleep(0.1)
+
+        def checkWorkers(_, workerName):
+            for avatarId in (converterId, streamerId):
+                avatar = self._components[avatarId]
+                self.assertEquals(avatar.jobState.get('workerName'),
+                                  workerName)
+
+        def loseWorker(_):
+            # the components are placed again once they are lost
+            self._logoutAvatar(self._workers.pop('w2'))
+            for avatarId in (converterId, streamerId):
+                self._logoutAvatar(self._components.pop(avatarId))
+            return sleep(0.1)
+
+        def logout(_):
+            for avatar in self._components.values():
+                self._logoutAvatar(avatar)
+            for avatar in self._workers.values():
+                self._logoutAvatar(avatar)
+
+        d = self._loginWorker('w1')
+        d.addCallback(lambda _: self._loginWorker('w2'))
+        d.addCallback(loadComponents)
+        d.addCallback(checkWorkers, 'w2')
+        d.addCallback(loseWorker)
+        d.addCallback(checkWorkers, 'w1')
+        d.addCallback(logout)
+        return d
+
     def testConfigBeforeWorker(self):
         # test a config with three components being loaded before the worker
         # logs in
@@ -0,0 +1,174 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_manager_placement -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import tempfile
+
+from flumotion.common import testsuite
+from flumotion.manager import placement
+from flumotion.worker import load
+
+
+def report(loadAverage, cpus=1, memoryFree=None, network=None):
+    r = {'cpu-count': cpus, 'load-average': loadAverage}
+    if memoryFree is not None:
+        r['memory-total'] = 1000
+        r['memory-free'] = memoryFree
+    if network is not None:
+        r['network-usage'] = network
+    return r
+
+
+class TestPlacer(testsuite.TestCase):
+
+    def setUp(self):
+        self.placer = placement.Placer()
+        for name in ('w1', 'w2', 'w3'):
+            self.placer.addWorker(name)
+
+    def testNoWorkers(self):
+        placer = placement.Placer()
+        self.assertEquals(placer.place([('/flow/a', [])]), {})
+
+    def testLeastLoaded(self):
+        self.placer.updateLoad('w1', report(1.5))
+        self.placer.updateLoad('w2', report(1.0, cpus=4))
+        self.placer.updateLoad('w3', report(0.5))
+        self.assertEquals(self.placer.place([('/flow/a', [])]),
+                          {'/flow/a': 'w2'})
+
+    def testSpread(self):
+        # without load reports, the components are spread on the workers
+        placed = self.placer.place([('/flow/%d' % i, []) for i in range(6)])
+        counts = {}
+        for workerName in placed.values():
+            counts[workerName] = counts.get(workerName, 0) + 1
+        self.assertEquals(counts, {'w1': 2, 'w2': 2, 'w3': 2})
+
+    def testPendingUntilReport(self):
+        self.placer.updateLoad('w1', report(0.0))
+        self.placer.updateLoad('w2', report(0.0))
+        self.placer.updateLoad('w3', report(2.0))
+        self.placer.place([('/flow/a', []), ('/flow/b', [])])
+        self.assertEquals(self.placer.getLoad('w1'),
+                          placement.COMPONENT_LOAD)
+        # the report accounts for the components started since the last one
+        self.placer.updateLoad('w1', report(0.1))
+        self.assertEquals(self.placer.getLoad('w1'), 0.1)
+
+    def testLocality(self):
+        self.placer.updateLoad('w1', report(0.1))
+        self.placer.updateLoad('w2', report(0.0))
+        self.placer.updateLoad('w3', report(0.1))
+        self.placer.setLocation('/flow/producer', 'w1')
+        placed = self.placer.place([
+            ('/flow/streamer', ['/flow/encoder']),
+            ('/flow/encoder', ['/flow/producer', '/flow/streamer'])])
+        # the encoder is placed first, next to its producer
+        self.assertEquals(placed, {'/flow/encoder': 'w1',
+                                   '/flow/streamer': 'w1'})
+
+    def testOverloaded(self):
+        self.placer.updateLoad('w1', report(0.0, memoryFree=50))
+        self.placer.updateLoad('w2', report(0.0, network=0.9))
+        self.placer.updateLoad('w3', report(3.0))
+        self.placer.setLocation('/flow/producer', 'w1')
+        self.assertEquals(
+            self.placer.place([('/flow/encoder', ['/flow/producer'])]),
+            {'/flow/encoder': 'w3'})
+
+    def testRemoveWorker(self):
+        self.placer.setLocation('/flow/a', 'w1')
+        self.placer.setLocation('/flow/b', 'w1')
+        self.placer.setLocation('/flow/c', 'w2')
+        self.placer.setLocation('/flow/d', 'unknown')
+        self.assertEquals(self.placer.getLocation('/flow/d'), None)
+        removed = self.placer.removeWorker('w1')
+        removed.sort()
+        self.assertEquals(removed, ['/flow/a', '/flow/b'])
+        self.assertEquals(self.placer.getLocation('/flow/a'), None)
+        self.assertEquals(self.placer.getLocation('/flow/c'), 'w2')
+        self.placer.removeLocation('/flow/c')
+        self.assertEquals(self.placer.removeWorker('w2'), [])
+
+
+class TestLoadSampler(testsuite.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".flumotion.test")
+        self.proc = os.path.join(self.path, 'proc')
+        self.sys = os.path.join(self.path, 'sys')
+        os.makedirs(os.path.join(self.proc, 'net'))
+        os.makedirs(os.path.join(self.sys, 'class', 'net', 'eth0'))
+        self._write(self.proc, 'loadavg', '0.50 0.40 0.30 1/100 1234\n')
+        self._write(self.proc, 'meminfo',
+                    'MemTotal:        1000 kB\n'
+                    'MemFree:          100 kB\n'
+                    'Buffers:           50 kB\n'
+                    'Cached:           150 kB\n')
+        self._write(self.sys, 'class/net/eth0/speed', '8\n')
+        self._writeNetwork(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write(self, directory, name, content):
+        f = open(os.path.join(directory, name), 'w')
+        f.write(content)
+        f.close()
+
+    def _writeNetwork(self, received):
+        self._write(self.proc, 'net/dev',
+            'Inter-|   Receive |  Transmit\n'
+            ' face |bytes    packets errs drop fifo frame compressed '
+            'multicast|bytes    packets\n'
+            '    lo: 5000 1 0 0 0 0 0 0 5000 1 0 0 0 0 0 0\n'
+            '  eth0: %d 1 0 0 0 0 0 0 0 1 0 0 0 0 0 0\n' % received)
+
+    def testReport(self):
+        sampler = load.LoadSampler(self.proc, self.sys)
+        r = sampler.getReport()
+        self.assertEquals(r['load-average'], 0.5)
+        self.assertEquals(r['memory-total'], 1000 * 1024)
+        self.assertEquals(r['memory-free'], 300 * 1024)
+        # the network usage needs two samples
+        self.failIf('network-usage' in r)
+
+        self._writeNetwork(10 ** 9)
+        r = sampler.getReport()
+        # 8 Mbit/s is 1 MB/s, saturated by 1 GB
+        self.assertEquals(r['network-usage'], 1.0)
+
+    def testMissing(self):
+        sampler = load.LoadSampler(os.path.join(self.path, 'none'),
+                                   self.sys)
+        r = sampler.getReport()
+        self.failIf('load-average' in r)
+        self.failIf('memory-total' in r)
+
+    def testNoMemTotal(self):
+        self._write(self.proc, 'meminfo', 'MemFree:          100 kB\n')
+        sampler = load.LoadSampler(self.proc, self.sys)
+        r = sampler.getReport()
+        self.assertEquals(r['load-average'], 0.5)
+        self.failIf('memory-total' in r)
+        self.assertEquals(r['memory-free'], 100 * 1024)
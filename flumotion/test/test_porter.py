@@ -270,3 +270,72 @@ class TestHTTPPorterProtocolParser(testsuite.TestCase):
             unparsed = self.pp.unparseLine(injected)
             self.containsSameInfo(line, unparsed,
                                   {self.pp.requestIdParameter: ['ID']})
+
+
+class TestPrefixTree(testsuite.TestCase):
+
+    def setUp(self):
+        self.tree = porter.PrefixTree()
+
+    def testEmpty(self):
+        self.assertEquals(len(self.tree), 0)
+        self.assertEquals(self.tree.keys(), [])
+        self.assertEquals(self.tree.longestPrefixMatch('/foo'), None)
+        self.assertEquals(self.tree.longestPrefixMatch('/foo', 'x'), 'x')
+        self.failIf('/foo' in self.tree)
+        self.assertRaises(KeyError, lambda: self.tree['/foo'])
+
+    def testLongestPrefixMatch(self):
+        self.tree['/'] = 'root'
+        self.tree['/live/'] = 'live'
+        self.tree['/live/hd/'] = 'hd'
+        self.tree['/lively'] = 'lively'
+
+        def lpm(path):
+            return self.tree.longestPrefixMatch(path)
+        self.assertEquals(lpm(''), None)
+        self.assertEquals(lpm('/'), 'root')
+        self.assertEquals(lpm('/vod/file.ogg'), 'root')
+        self.assertEquals(lpm('/live'), 'root')
+        self.assertEquals(lpm('/live/'), 'live')
+        self.assertEquals(lpm('/live/sd/stream.ogg'), 'live')
+        self.assertEquals(lpm('/live/hd/stream.ogg'), 'hd')
+        self.assertEquals(lpm('/lively/stream.ogg'), 'lively')
+        self.assertEquals(lpm('/livel'), 'root')
+
+    def testReplaceAndRemove(self):
+        self.tree['/live/'] = 'live'
+        self.tree['/live/hd/'] = 'hd'
+        self.tree['/live/'] = 'other'
+        self.assertEquals(len(self.tree), 2)
+        self.assertEquals(self.tree['/live/'], 'other')
+
+        del self.tree['/live/']
+        self.assertEquals(len(self.tree), 1)
+        self.failIf('/live/' in self.tree)
+        self.failUnless('/live/hd/' in self.tree)
+        self.assertEquals(
+            self.tree.longestPrefixMatch('/live/hd/stream.ogg'), 'hd')
+        self.assertEquals(
+            self.tree.longestPrefixMatch('/live/sd/stream.ogg'), None)
+        self.assertRaises(KeyError, self.tree.__delitem__, '/live/')
+        self.assertRaises(KeyError, self.tree.__delitem__, '/live/h')
+
+        del self.tree['/live/hd/']
+        self.assertEquals(len(self.tree), 0)
+        self.assertEquals(self.tree._root.children, {})
+
+    def testKeys(self):
+        prefixes = ['/a', '/ab', '/abc', '/b', '/ba/c', '/']
+        for prefix in prefixes:
+            self.tree[prefix] = prefix
+        keys = self.tree.keys()
+        keys.sort()
+        prefixes.sort()
+        self.assertEquals(keys, prefixes)
+
+        for prefix in prefixes:
+            del self.tree[prefix]
+            self.failIf(prefix in self.tree)
+            self.assertEquals(len(self.tree), len(self.tree.keys()))
+        self.assertEquals(self.tree._root.children, {})
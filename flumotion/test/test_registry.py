@@ -657,3 +657,41 @@ class TestRegistryUpdate(testsuite.TestCase):
         reg.verify()
         types = sorted(c.getType() for c in reg.getComponents())
         self.assertEquals(types, ['first', 'second-new'])
+
+    def testBinaryCache(self):
+        clock = task.Clock()
+
+        d = os.path.join(self.regpath, 'flumotion')
+        os.mkdir(d)
+        f1 = writeComponent(os.path.join(d, 'first.xml'), 'first')
+        f2 = writeComponent(os.path.join(d, 'second.xml'), 'second')
+        self.mtime[d] = self.mtime[f1] = self.mtime[f2] = clock.seconds()
+
+        reg = registry.ComponentRegistry(
+            [self.regpath], 'flumotion', self.regcache, clock.seconds)
+        self.failUnless(os.path.exists(reg.binaryFilename))
+
+        # another process loads the entries lazily from the binary cache
+        reg = registry.ComponentRegistry(
+            [self.regpath], 'flumotion', self.regcache, clock.seconds)
+        components = reg._parser._components
+        self.failUnless(isinstance(components, registry._LazyEntries))
+        self.failIf(reg.rebuildNeeded())
+        self.assertEquals(reg.getComponent('first').getType(), 'first')
+        self.failIf(isinstance(dict.__getitem__(components, 'first'),
+                               registry._Pickled))
+        self.failUnless(isinstance(dict.__getitem__(components, 'second'),
+                                   registry._Pickled))
+
+        # adding a snippet only changes the mtime of its directory
+        clock.advance(1)
+        f3 = writeComponent(os.path.join(d, 'third.xml'), 'third')
+        self.mtime[d] = self.mtime[f3] = clock.seconds()
+        self.failUnless(reg.rebuildNeeded())
+
+        reg = registry.ComponentRegistry(
+            [self.regpath], 'flumotion', self.regcache, clock.seconds)
+        self.failIf(isinstance(reg._parser._components,
+                               registry._LazyEntries))
+        types = sorted([c.getType() for c in reg.getComponents()])
+        self.assertEquals(types, ['first', 'second', 'third'])
@@ -0,0 +1,266 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_rrdmon -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+HAS_MODULES = False
+try:
+    import rrdtool
+    HAS_MODULES = True
+except ImportError:
+    pass
+
+from twisted.internet import defer
+
+from flumotion.common import errors
+from flumotion.common import testsuite
+from flumotion.common.planet import moods
+
+if HAS_MODULES:
+    from flumotion.admin.rrdmon import rrdmon
+
+
+class RequiredModulesMixin(object):
+    if not HAS_MODULES:
+        skip = 'This test requires the rrdtool module'
+
+
+class FakeState(object):
+
+    def __init__(self, **values):
+        self.values = values
+        self.listeners = {}
+
+    def get(self, key, otherwise=None):
+        return self.values.get(key, otherwise)
+
+    def hasKey(self, key):
+        return key in self.values
+
+    def addListener(self, listener, set_=None, append=None, remove=None,
+                    invalidate=None):
+        self.listeners[listener] = (set_, append, remove, invalidate)
+
+    def removeListener(self, listener):
+        del self.listeners[listener]
+
+    def set(self, key, value):
+        self.values[key] = value
+        for set_, append, remove, invalidate in self.listeners.values():
+            if set_:
+                set_(self, key, value)
+
+    def append(self, key, value):
+        self.values[key].append(value)
+        for set_, append, remove, invalidate in self.listeners.values():
+            if append:
+                append(self, key, value)
+
+    def remove(self, key, value):
+        self.values[key].remove(value)
+        for set_, append, remove, invalidate in self.listeners.values():
+            if remove:
+                remove(self, key, value)
+
+
+class FakeAdmin(object):
+
+    def __init__(self, uiState, managerId='manager'):
+        self.managerId = managerId
+        self.uiState = uiState
+        self.calls = 0
+        self.fail = False
+
+    def componentCallRemote(self, state, methodName):
+        assert methodName == 'getUIState'
+        self.calls += 1
+        if self.fail:
+            return defer.fail(errors.SleepingComponentError(state))
+        return defer.succeed(self.uiState)
+
+
+def makeSource(name, key, rrdFile='/tmp/a.rrd'):
+    return {'name': name, 'manager': 'manager',
+            'component-id': '/default/streamer', 'ui-state-key': key,
+            'sample-frequency': 10, 'is-gauge': True, 'rrd-ds-spec': None,
+            'rrd-file': rrdFile, 'archives': []}
+
+
+class TestUIStateSubscription(testsuite.TestCase, RequiredModulesMixin):
+
+    def setUp(self):
+        self.uiState = FakeState(clients=3, bytes=100, other=1)
+        self.admin = FakeAdmin(self.uiState)
+        self.state = FakeState(mood=moods.happy.value)
+        self.subscription = rrdmon.UIStateSubscription(
+            'manager', '/default/streamer', ['clients', 'bytes'])
+
+    def testValues(self):
+        self.subscription.attach(self.admin, self.state)
+        self.assertEquals(self.subscription.getValue('clients'), 3)
+        self.uiState.set('clients', 4)
+        self.uiState.set('other', 2)
+        self.assertEquals(self.subscription.getValue('clients'), 4)
+        self.assertEquals(self.subscription.getValue('other'), None)
+        # the ui state is asked for once, not for every value
+        self.assertEquals(self.admin.calls, 1)
+
+    def testComponentRestart(self):
+        self.state.values['mood'] = moods.sleeping.value
+        self.subscription.attach(self.admin, self.state)
+        self.assertEquals(self.admin.calls, 0)
+        self.assertEquals(self.subscription.getValue('clients'), None)
+
+        self.state.set('mood', moods.happy.value)
+        self.assertEquals(self.subscription.getValue('clients'), 3)
+        self.state.set('mood', moods.lost.value)
+        self.assertEquals(self.subscription.getValue('clients'), None)
+        self.assertEquals(self.uiState.listeners, {})
+        self.state.set('mood', moods.happy.value)
+        self.assertEquals(self.admin.calls, 2)
+
+    def testRetry(self):
+        self.admin.fail = True
+        self.subscription.attach(self.admin, self.state)
+        self.assertEquals(self.subscription.getValue('clients'), None)
+        self.subscription.retry()
+        self.assertEquals(self.admin.calls, 2)
+
+        self.admin.fail = False
+        self.subscription.retry()
+        self.assertEquals(self.subscription.getValue('clients'), 3)
+        self.subscription.retry()
+        self.assertEquals(self.admin.calls, 3)
+
+    def testNoRetryWhenSleeping(self):
+        self.admin.fail = True
+        self.subscription.attach(self.admin, self.state)
+        self.state.set('mood', moods.sleeping.value)
+        self.subscription.retry()
+        self.assertEquals(self.admin.calls, 1)
+
+    def testDetach(self):
+        self.subscription.attach(self.admin, self.state)
+        self.subscription.detach()
+        self.failIf(self.subscription.isAttached())
+        self.assertEquals(self.state.listeners, {})
+        self.assertEquals(self.uiState.listeners, {})
+        self.assertEquals(self.subscription.getValue('bytes'), None)
+
+
+class TestRRDMonitor(testsuite.TestCase, RequiredModulesMixin):
+
+    def setUp(self):
+        self.updates = []
+        self._update = rrdmon.rrdtool.update
+        rrdmon.rrdtool.update = lambda *args: self.updates.append(args)
+
+    def tearDown(self):
+        rrdmon.rrdtool.update = self._update
+
+    def testGroupByFile(self):
+        a = makeSource('a', 'clients')
+        b = makeSource('b', 'bytes', '/tmp/b.rrd')
+        c = makeSource('c', 'bytes')
+        self.assertEquals(rrdmon.sourcesGroupByFile([a, b, c]),
+                          [('/tmp/a.rrd', [a, c]), ('/tmp/b.rrd', [b])])
+
+    def makeMonitor(self, sources):
+
+        class Monitor(rrdmon.RRDMonitor):
+
+            def ensureRRDFiles(self, sources):
+                pass
+
+            def connectToManagers(self, sources):
+                pass
+
+            def startSampling(self):
+                pass
+        return Monitor(sources)
+
+    def makeFlow(self, mood=moods.happy.value):
+        component = FakeState(name='streamer', mood=mood)
+        return FakeState(name='default', components=[component]), component
+
+    def testUpdateFile(self):
+        sources = [makeSource('clients', 'clients'),
+                   makeSource('bytes', 'bytes'),
+                   makeSource('missing', 'missing')]
+        monitor = self.makeMonitor(sources)
+        subscription = monitor._subscriptions[
+            ('manager', '/default/streamer')]
+        subscription.attach(FakeAdmin(FakeState(clients=3, bytes=100)),
+                            FakeState(mood=moods.happy.value))
+
+        monitor.updateFile('/tmp/a.rrd', sources)
+        self.assertEquals(len(self.updates), 1)
+        rrdFile, t, names, values = self.updates[0]
+        self.assertEquals((rrdFile, t, names), ('/tmp/a.rrd', '-t',
+                                                'clients:bytes'))
+        self.assertEquals(values.split(':')[1:], ['3', '100'])
+
+    def testComponentReloaded(self):
+        monitor = self.makeMonitor([makeSource('clients', 'clients')])
+        subscription = monitor._subscriptions[
+            ('manager', '/default/streamer')]
+        uiState = FakeState(clients=3)
+        admin = FakeAdmin(uiState)
+        flow, component = self.makeFlow()
+        planet = FakeState(flows=[flow])
+        monitor.model_addPlanet(admin, planet)
+        self.failUnless(subscription.isAttachedTo(component))
+        self.assertEquals(subscription.getValue('clients'), 3)
+
+        # the component is removed and loaded again
+        flow.remove('components', component)
+        self.failIf(subscription.isAttached())
+        self.assertEquals(component.listeners, {})
+        uiState.values['clients'] = 4
+        flow.append('components', FakeState(name='streamer',
+                                            mood=moods.happy.value))
+        self.assertEquals(subscription.getValue('clients'), 4)
+
+        # the whole flow is removed and loaded again
+        planet.remove('flows', flow)
+        self.failIf(subscription.isAttached())
+        self.assertEquals(flow.listeners, {})
+        flow, component = self.makeFlow()
+        planet.append('flows', flow)
+        self.failUnless(subscription.isAttachedTo(component))
+
+        monitor.model_removePlanet(admin, planet)
+        self.failIf(subscription.isAttached())
+        self.assertEquals(planet.listeners, {})
+        self.assertEquals(flow.listeners, {})
+
+    def testUpdateFileRetries(self):
+        sources = [makeSource('clients', 'clients')]
+        monitor = self.makeMonitor(sources)
+        admin = FakeAdmin(FakeState(clients=3))
+        admin.fail = True
+        flow, component = self.makeFlow()
+        monitor.model_addPlanet(admin, FakeState(flows=[flow]))
+        monitor.updateFile('/tmp/a.rrd', sources)
+        self.assertEquals(self.updates, [])
+
+        admin.fail = False
+        monitor.updateFile('/tmp/a.rrd', sources)
+        self.assertEquals(len(self.updates), 1)
+        self.assertEquals(self.updates[0][3].split(':')[1:], ['3'])
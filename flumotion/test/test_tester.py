@@ -0,0 +1,285 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_tester -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+import os
+import shutil
+import tempfile
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+from flumotion.common import testsuite
+from flumotion.component.misc.httpserver import httpserver
+from flumotion.tester import client, loadgen
+from flumotion.tester.histogram import Histogram
+
+
+class TestHistogram(testsuite.TestCase):
+
+    def testPercentiles(self):
+        h = Histogram()
+        for i in range(1, 10001):
+            h.record(i)
+        self.assertEquals(h.count, 10000)
+        self.assertEquals(h.getMean(), 5000.5)
+        self.assertEquals((h.min, h.max), (1, 10000))
+        # two significant digits
+        for p in (1, 50, 90, 99.9):
+            expected = p * 100
+            self.failUnless(abs(h.getPercentile(p) - expected)
+                            <= expected / 100.0, (p, h.getPercentile(p)))
+        self.assertEquals(h.getPercentile(100), 10000)
+
+    def testSmallValuesExact(self):
+        h = Histogram()
+        for value in (3, 3, 7, 150):
+            h.record(value)
+        self.assertEquals(h.getPercentile(50), 3)
+        self.assertEquals(h.getPercentile(75), 7)
+        self.assertEquals(h.getPercentile(100), 150)
+
+    def testLargeValues(self):
+        h = Histogram()
+        h.record(10 ** 12)
+        h.record(10 ** 9)
+        # within the precision of the histogram
+        self.failUnless(abs(h.getPercentile(50) - 10 ** 9) < 10 ** 7)
+        self.assertEquals(h.getPercentile(100), 10 ** 12)
+
+    def testMerge(self):
+        a, b = Histogram(), Histogram()
+        a.record(10)
+        b.record(20, 3)
+        a.merge(b)
+        self.assertEquals((a.count, a.min, a.max), (4, 10, 20))
+        self.assertEquals(a.getPercentile(50), 20)
+
+    def testEmpty(self):
+        h = Histogram()
+        self.assertEquals(h.getPercentile(50), None)
+        self.assertEquals(h.getMean(), None)
+        self.assertRaises(ValueError, h.record, -1)
+
+
+class TestRampProfile(testsuite.TestCase):
+
+    def testInterpolate(self):
+        profile = loadgen.RampProfile.fromString('0:0,10:100,20:100,25:0')
+        self.assertEquals(profile.getDuration(), 25)
+        self.assertEquals(profile.getTarget(0), 0)
+        self.assertEquals(profile.getTarget(5), 50)
+        self.assertEquals(profile.getTarget(15), 100)
+        self.assertEquals(profile.getTarget(22.5), 50)
+        self.assertEquals(profile.getTarget(30), 0)
+
+    def testParseURL(self):
+        self.assertEquals(loadgen.parseURL('http://localhost:8800/a?b=c'),
+                          ('localhost', 8800, '/a?b=c'))
+        self.assertEquals(loadgen.parseURL('http://example.com'),
+                          ('example.com', 80, '/'))
+        self.assertRaises(ValueError, loadgen.parseURL, 'ftp://host/')
+
+
+class StreamResource(resource.Resource):
+    # writes a chunk every few milliseconds, like a live stream
+
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.calls = {} # request -> DelayedCall
+
+    def render_GET(self, request):
+        self._write(request)
+        return server.NOT_DONE_YET
+
+    def _write(self, request):
+        request.write('x' * 1000)
+        self.calls[request] = reactor.callLater(0.005, self._write, request)
+
+    def stop(self):
+        for dc in self.calls.values():
+            if dc.active():
+                dc.cancel()
+        self.calls.clear()
+
+
+def runClients(port, path, profile, maxClients=None, **kwargs):
+
+    def makeClient(generator, id):
+        return loadgen.HTTPLoadClient(generator, id, 'localhost', port,
+                                      path, **kwargs)
+    generator = loadgen.LoadGenerator(makeClient, profile, maxClients)
+    return generator.run()
+
+
+class TestLoadGenerator(testsuite.TestCase):
+
+    def testStreaming(self):
+        stream = StreamResource()
+        site = server.Site(stream)
+        site.noisy = False
+        listener = reactor.listenTCP(0, site, interface='127.0.0.1')
+        port = listener.getHost().port
+
+        def done(results):
+            stream.stop()
+            self.assertEquals(results.stopped[client.STOPPED_SUCCESS], 20)
+            self.assertEquals(results.maxConnected, 10)
+            self.assertEquals(results.ttfb.count, 20)
+            self.assertEquals(results.throughput.count, 20)
+            self.failUnless(results.bytes >= 20 * 20000)
+            self.failUnless(results.getReport())
+            return listener.stopListening()
+
+        d = runClients(port, '/', loadgen.RampProfile([(0, 10)]),
+                       maxClients=20, stopSize=20000)
+        d.addCallback(done)
+        return d
+
+    def testRateAndRamp(self):
+        stream = StreamResource()
+        site = server.Site(stream)
+        site.noisy = False
+        listener = reactor.listenTCP(0, site, interface='127.0.0.1')
+        port = listener.getHost().port
+
+        def done(results):
+            stream.stop()
+            # the clients were stopped by the end of the ramp
+            self.assertEquals(results.stopped[client.STOPPED_SUCCESS], 2)
+            # the stream is sent at 200 KB/s, read at 20 KB/s for a
+            # second, with some slack for the socket buffers
+            self.failUnless(results.bytes < 2 * 50000, results.bytes)
+            return listener.stopListening()
+
+        d = runClients(port, '/', loadgen.RampProfile([(0, 2), (1, 2)]),
+                       rate=20000)
+        d.addCallback(done)
+        return d
+
+
+class LastRandom(object):
+
+    def randint(self, a, b):
+        return b
+
+
+class FakeGenerator(object):
+
+    def __init__(self):
+        self.random = LastRandom()
+
+
+class TestHTTPLoadClient(testsuite.TestCase):
+
+    def makeClient(self, totalSize, rangeSize=None):
+        c = loadgen.HTTPLoadClient(FakeGenerator(), 0, 'localhost', 80,
+                                   '/file', seeks=1, rangeSize=rangeSize)
+        c._totalSize = totalSize
+        return c
+
+    def testRandomOffset(self):
+        # the last byte of the file is the last one to seek to
+        self.assertEquals(self.makeClient(1000)._getRandomOffset(), 999)
+        self.assertEquals(self.makeClient(1)._getRandomOffset(), 0)
+        self.assertEquals(self.makeClient(None)._getRandomOffset(), 0)
+
+    def testRandomOffsetWithRangeSize(self):
+        c = self.makeClient(1000, rangeSize=100)
+        self.assertEquals(c._getRandomOffset(), 900)
+        c = self.makeClient(50, rangeSize=100)
+        self.assertEquals(c._getRandomOffset(), 0)
+
+
+class TestLoadGeneratorHTTPServer(testsuite.TestCase):
+
+    slow = True
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(suffix=".flumotion.test")
+        f = open(os.path.join(self.path, 'file'), 'w')
+        f.write('x' * 100000)
+        f.close()
+        config = {
+            'feed': [],
+            'name': 'http-server',
+            'parent': 'default',
+            'avatarId': '/default/http-server',
+            'clock-master': None,
+            'type': 'http-server',
+            'plugs': {},
+            'properties': {u'mount-point': '/', u'path': self.path,
+                           u'port': 0},
+        }
+        self.component = httpserver.HTTPFileStreamer(config)
+
+    def tearDown(self):
+        d = self.component.stop()
+        d.addCallback(lambda _: shutil.rmtree(self.path, ignore_errors=True))
+        return d
+
+    def testDownload(self):
+
+        def done(results):
+            self.assertEquals(results.stopped[client.STOPPED_SUCCESS], 10)
+            self.assertEquals(results.bytes, 10 * 100000)
+
+        d = runClients(self.component.port, '/file',
+                       loadgen.RampProfile([(0, 10)]), maxClients=10)
+        d.addCallback(done)
+        return d
+
+    def testSeeks(self):
+
+        def done(results):
+            self.assertEquals(results.stopped[client.STOPPED_SUCCESS], 4)
+            self.assertEquals(results.bytes, 4 * 4 * 1000)
+
+        d = runClients(self.component.port, '/file',
+                       loadgen.RampProfile([(0, 4)]), maxClients=4,
+                       seeks=3, rangeSize=1000)
+        d.addCallback(done)
+        return d
+
+    def testSeeksToTheEnd(self):
+
+        def done(results):
+            self.assertEquals(results.stopped[client.STOPPED_SUCCESS], 2)
+            # the seeks get the rest of the file, not all of it
+            self.failUnless(2 * 100000 < results.bytes < 2 * 4 * 100000,
+                            results.bytes)
+
+        d = runClients(self.component.port, '/file',
+                       loadgen.RampProfile([(0, 2)]), maxClients=2,
+                       seeks=3)
+        d.addCallback(done)
+        return d
+
+    def testNotFound(self):
+
+        def done(results):
+            self.assertEquals(results.stopped[client.STOPPED_ERROR], 2)
+
+        d = runClients(self.component.port, '/missing',
+                       loadgen.RampProfile([(0, 2)]), maxClients=2)
+        d.addCallback(done)
+        return d
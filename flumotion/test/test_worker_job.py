@@ -32,6 +32,8 @@ class FakeOptions:
         self.name = 'fakeworker'
         self.feederports = []
         self.randomFeederports = False
+        self.zygote = False
+        self.zygotePoolSize = 0
 
 
 class TestCheckJobHeaven(testsuite.TestCase):
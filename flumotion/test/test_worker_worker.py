@@ -19,6 +19,9 @@
 
 # Headers in this file shall remain intact.
 
+import os
+import socket
+
 from flumotion.common import testsuite
 from flumotion.worker import worker
 
@@ -32,9 +35,83 @@ class FakeOptions:
         self.feederports = [9998]
         self.randomFeederports = False
         self.name = 'fakeworker'
+        self.zygote = False
+        self.zygotePoolSize = 0
+
+
+class FakeJobAvatar:
+
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.fds = []
+        self.calls = []
+
+    def _keep(self, fd):
+        # the brain closes its fds once they are handed off
+        if self.accept:
+            self.fds.append(os.dup(fd))
+        return self.accept
+
+    def sendFeed(self, feedName, fd, eaterId):
+        self.calls.append(('sendFeed', feedName, eaterId))
+        return self._keep(fd)
+
+    def receiveFeed(self, eaterAlias, fd, feedId):
+        self.calls.append(('receiveFeed', eaterAlias, feedId))
+        return self._keep(fd)
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
 
 
 class TestBrain(testsuite.TestCase):
 
     def testInit(self):
         brain = worker.WorkerBrain(FakeOptions())
+
+    def testConnectLocalFeed(self):
+        brain = worker.WorkerBrain(FakeOptions())
+        producer = FakeJobAvatar()
+        encoder = FakeJobAvatar()
+        brain.jobHeaven.avatars['/default/producer'] = producer
+        brain.jobHeaven.avatars['/default/encoder'] = encoder
+        try:
+            self.failUnless(brain.connectLocalFeed(
+                '/default/producer', 'video', '/default/encoder', 'default'))
+            self.assertEquals(producer.calls, [
+                ('sendFeed', 'video', '/default/encoder:default')])
+            self.assertEquals(encoder.calls, [
+                ('receiveFeed', 'default', 'producer:video')])
+
+            # both ends are connected to each other
+            feeder = socket.fromfd(producer.fds[0], socket.AF_UNIX,
+                                   socket.SOCK_STREAM)
+            eater = socket.fromfd(encoder.fds[0], socket.AF_UNIX,
+                                  socket.SOCK_STREAM)
+            feeder.setblocking(True)
+            eater.setblocking(True)
+            feeder.sendall('buffer')
+            self.assertEquals(eater.recv(6), 'buffer')
+            feeder.close()
+            eater.close()
+        finally:
+            brain.jobHeaven.avatars.clear()
+            producer.close()
+            encoder.close()
+
+    def testConnectLocalFeedFailed(self):
+        brain = worker.WorkerBrain(FakeOptions())
+        producer = FakeJobAvatar(accept=False)
+        encoder = FakeJobAvatar()
+        brain.jobHeaven.avatars['/default/producer'] = producer
+        self.failIf(brain.connectLocalFeed(
+            '/default/producer', 'video', '/default/encoder', 'default'))
+        self.assertEquals(producer.calls, [])
+
+        brain.jobHeaven.avatars['/default/encoder'] = encoder
+        self.failIf(brain.connectLocalFeed(
+            '/default/producer', 'video', '/default/encoder', 'default'))
+        # the eater is not given a feed the feeder did not accept
+        self.assertEquals(encoder.calls, [])
+        brain.jobHeaven.avatars.clear()
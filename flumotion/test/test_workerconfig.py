@@ -58,6 +58,19 @@ class TestConfig(testsuite.TestCase):
         self.assertEquals(conf.feederports, [1000, 1001, 1002])
         self.assertEquals(conf.randomFeederports, False)
 
+    def testParseWorkerZygote(self):
+        conf = parse('<worker></worker>')
+        self.assertEquals(conf.zygote, False)
+        self.assertEquals(conf.zygotePoolSize, 0)
+        conf = parse('<worker><zygote pool-size="2" /></worker>')
+        self.assertEquals(conf.zygote, True)
+        self.assertEquals(conf.zygotePoolSize, 2)
+        conf = parse('<worker><zygote enabled="no" /></worker>')
+        self.assertEquals(conf.zygote, False)
+
+        s = '<worker><zygote pool-size="many" /></worker>'
+        self.assertRaises(config.ConfigError, parse, s)
+
     def testParseManager(self):
         conf = parse("""<worker><manager>
         <host>hostname</host>
@@ -0,0 +1,133 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_tester -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+histograms of measurements with a bounded relative error
+"""
+
+import math
+
+__version__ = "$Rev$"
+
+
+class Histogram(object):
+    """
+    I count non-negative integer values in buckets whose width grows
+    with the values, like an HDR histogram: the values are kept with the
+    given number of significant digits, whatever their magnitude, in a
+    few hundred buckets per power of two.
+
+    @ivar count: number of values recorded
+    @type count: int
+    @ivar min:   smallest value recorded, or None
+    @ivar max:   largest value recorded, or None
+    """
+
+    def __init__(self, significantDigits=2):
+        bits = 1
+        while (1 << bits) < 2 * 10 ** significantDigits:
+            bits += 1
+        self._bits = bits
+        self._subCount = 1 << bits
+        self._half = self._subCount >> 1
+        self._counts = {} # bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    ### Public Methods ###
+
+    def record(self, value, count=1):
+        """
+        Record a value, rounded down to an integer.
+        """
+        value = int(value)
+        if value < 0:
+            raise ValueError('cannot record negative value %d' % value)
+        index = self._getIndex(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values of another histogram with the same precision.
+        """
+        assert other._bits == self._bits
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def getMean(self):
+        """
+        @returns: the mean of the values, or None if there is none
+        """
+        if not self.count:
+            return None
+        return float(self.total) / self.count
+
+    def getPercentile(self, percentile):
+        """
+        @param percentile: percentage of the values, between 0 and 100
+        @type  percentile: float
+
+        @returns: the value the given percentage of the values are lower
+                  than or equal to, or None if there is none
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percentile * self.count / 100.0)))
+        indexes = self._counts.keys()
+        indexes.sort()
+        seen = 0
+        for index in indexes:
+            seen += self._counts[index]
+            if seen >= rank:
+                return max(self.min, min(self.max, self._getHighest(index)))
+        return self.max
+
+    ### Private Methods ###
+
+    def _getIndex(self, value):
+        if value < self._subCount:
+            return value
+        shift = math.frexp(value)[1] - self._bits
+        return (shift << (self._bits - 1)) + (value >> shift)
+
+    def _getHighest(self, index):
+        # the highest value counted in a bucket
+        if index < self._subCount:
+            return index
+        shift = index // self._half - 1
+        sub = index - shift * self._half
+        return ((sub + 1) << shift) - 1
@@ -0,0 +1,548 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_tester -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+HTTP load generator simulating many streaming and download clients
+
+All the clients are driven by the reactor from a single process; a
+client is a TCP connection reading as fast as its rate allows, the reads
+are throttled by pausing the connection.
+
+@var STALL_THRESHOLD: seconds without data after which a client counts
+                      the wait as a stall
+@var TICK:            seconds between two adjustments of the number of
+                      clients to the ramp profile
+@var MIN_RECEIVE_BUFFER: smallest socket receive buffer, in bytes, of
+                         the clients reading at a limited rate
+"""
+
+import random
+import socket
+import time
+import urlparse
+
+from twisted.internet import defer, protocol, reactor
+
+from flumotion.common import log
+from flumotion.tester import client
+from flumotion.tester.histogram import Histogram
+
+__version__ = "$Rev$"
+
+STALL_THRESHOLD = 0.5
+TICK = 0.1
+MIN_RECEIVE_BUFFER = 4096
+
+
+def parseURL(url):
+    """
+    @returns: the host, port and path of an HTTP URL
+    @rtype:   tuple of (str, int, str)
+    """
+    scheme, netloc, path, params, query, fragment = urlparse.urlparse(url)
+    if scheme != 'http':
+        raise ValueError('not an HTTP URL: %s' % url)
+    host, port = netloc, 80
+    if ':' in netloc:
+        host, port = netloc.split(':', 1)
+        port = int(port)
+    path = path or '/'
+    if params:
+        path += ';' + params
+    if query:
+        path += '?' + query
+    return host, port, path
+
+
+class RampProfile(object):
+    """
+    I tell how many clients should be connected over time, interpolating
+    linearly between points.
+    """
+
+    def __init__(self, points):
+        """
+        @param points: the number of clients at given times since the
+                       start, in seconds
+        @type  points: list of (float, int)
+        """
+        points = list(points)
+        points.sort()
+        if not points:
+            raise ValueError('a ramp profile needs at least one point')
+        self.points = points
+
+    def fromString(cls, string):
+        """
+        Parse a profile like '0:0,30:1000,90:1000,100:0', a list of
+        time:clients points.
+        """
+        points = []
+        for point in string.split(','):
+            t, clients = point.split(':')
+            points.append((float(t), int(clients)))
+        return cls(points)
+    fromString = classmethod(fromString)
+
+    def getDuration(self):
+        return self.points[-1][0]
+
+    def getTarget(self, elapsed):
+        """
+        @returns: the number of clients that should be connected
+        """
+        previous = self.points[0]
+        if elapsed <= previous[0]:
+            return previous[1]
+        for point in self.points[1:]:
+            if elapsed < point[0]:
+                t0, n0 = previous
+                t1, n1 = point
+                return int(n0 + (n1 - n0) * (elapsed - t0) / (t1 - t0))
+            previous = point
+        return previous[1]
+
+
+class Results(object):
+    """
+    I gather the measurements of the clients of a run.
+
+    @ivar stopped:    number of clients stopped per reason, one of the
+                      STOPPED_ constants of L{flumotion.tester.client}
+    @type stopped:    dict of int -> int
+    @ivar ttfb:       time to the first byte of the responses, in
+                      microseconds
+    @type ttfb:       L{Histogram}
+    @ivar stall:      time clients spent waiting for data more than
+                      L{STALL_THRESHOLD}, in microseconds
+    @type stall:      L{Histogram}
+    @ivar throughput: bytes per second received by the clients
+    @type throughput: L{Histogram}
+    """
+
+    def __init__(self):
+        self.stopped = {}
+        for i in range(client.STOPPED_SUCCESS, client.STOPPED_LAST):
+            self.stopped[i] = 0
+        self.ttfb = Histogram()
+        self.stall = Histogram()
+        self.throughput = Histogram()
+        self.maxConnected = 0
+        self.bytes = 0
+        self.duration = 0.0
+
+    def getReport(self):
+        """
+        @returns: the results, as lines of text
+        @rtype:   list of str
+        """
+        lines = []
+        for name, reason in (('successful', client.STOPPED_SUCCESS),
+                             ('refused', client.STOPPED_REFUSED),
+                             ('error', client.STOPPED_ERROR),
+                             ('connect error', client.STOPPED_CONNECT_ERROR),
+                             ('read error', client.STOPPED_READ_ERROR),
+                             ('internal error',
+                              client.STOPPED_INTERNAL_ERROR)):
+            lines.append('%-15s clients: %d' % (name, self.stopped[reason]))
+        lines.append('max connected  clients: %d' % self.maxConnected)
+        lines.append('received %d bytes in %.1f seconds'
+                     % (self.bytes, self.duration))
+        for name, h, scale, unit in (
+            ('time to first byte', self.ttfb, 1000.0, 'ms'),
+            ('stall time', self.stall, 1000.0, 'ms'),
+            ('throughput', self.throughput, 1024.0, 'KiB/s')):
+            if not h.count:
+                lines.append('%-20s no samples' % name)
+                continue
+            values = [h.getPercentile(p) / scale for p in (50, 90, 99)]
+            lines.append('%-20s mean %.1f, p50 %.1f, p90 %.1f, p99 %.1f, '
+                         'max %.1f %s'
+                         % tuple([name, h.getMean() / scale] + values
+                                 + [h.max / scale, unit]))
+        return lines
+
+
+class _HTTPLoadProtocol(protocol.Protocol):
+    # one HTTP request of a client
+
+    def __init__(self, client, request):
+        self.client = client
+        self.request = request
+        self.status = None
+        self.headers = {}
+        self._buffer = ''
+
+    def connectionMade(self):
+        if self.client.rate:
+            # a small buffer lets the server see the client is slow,
+            # instead of sending it bursts between pauses
+            self.transport.getHandle().setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF,
+                max(MIN_RECEIVE_BUFFER, self.client.rate // 10))
+        self.transport.write(self.request)
+        self.client.connected(self)
+
+    def dataReceived(self, data):
+        if self.status is None:
+            self._buffer += data
+            end = self._buffer.find('\r\n\r\n')
+            if end == -1:
+                self.client.received(self, '')
+                return
+            self._parseHeaders(self._buffer[:end])
+            data = self._buffer[end + 4:]
+            self._buffer = ''
+            if not self.client.gotHeaders(self):
+                return
+        self.client.received(self, data)
+
+    def connectionLost(self, reason):
+        self.client.disconnected(self)
+
+    def _parseHeaders(self, text):
+        lines = text.split('\r\n')
+        try:
+            self.status = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            self.status = 0
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                self.headers[name.strip().lower()] = value.strip()
+
+
+class _HTTPLoadConnector(protocol.ClientFactory):
+
+    def __init__(self, client, request):
+        self.client = client
+        self.request = request
+
+    def buildProtocol(self, addr):
+        return _HTTPLoadProtocol(self.client, self.request)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.client.connectionFailed(reason)
+
+
+class HTTPLoadClient(log.Loggable):
+    """
+    I am a simulated viewer, reading a stream or downloading a file,
+    possibly a range at a time.
+
+    I stop successfully after reading a number of bytes, after some
+    time, or when a download is complete; or when the load generator
+    tells me to.
+    """
+
+    logCategory = 'loadclient'
+
+    def __init__(self, generator, id, host, port, path, rate=None,
+                 stopTime=None, stopSize=None, seeks=0, rangeSize=None):
+        """
+        @param rate:      bytes per second to read at most; None to read
+                          as fast as possible
+        @param stopTime:  seconds to stay connected for
+        @param stopSize:  bytes to read
+        @param seeks:     number of random range requests to make after
+                          the first request
+        @param rangeSize: bytes to request in each request, from the
+                          start of the file for the first one; None to
+                          request the whole file, and the rest of it
+                          from the offset of each seek
+        """
+        self.generator = generator
+        self.id = id
+        self.host = host
+        self.port = port
+        self.path = path
+        self.rate = rate
+        self.stopTime = stopTime
+        self.stopSize = stopSize
+        self.seeks = seeks
+        self.rangeSize = rangeSize
+        self.bytes = 0
+        self.stallTime = 0.0
+        self._protocol = None
+        self._stopped = False
+        self._startTime = None
+        self._requestTime = None
+        self._firstByteTime = None
+        self._lastDataTime = None
+        self._requestBytes = 0
+        self._totalSize = None
+        self._resumeDC = None
+        self._stopDC = None
+
+    ### Public Methods ###
+
+    def start(self):
+        self._startTime = time.time()
+        if self.stopTime:
+            self._stopDC = reactor.callLater(self.stopTime, self.stop)
+        self._request(0)
+
+    def stop(self, reason=client.STOPPED_SUCCESS):
+        if self._stopped:
+            return
+        self._stopped = True
+        for dc in (self._resumeDC, self._stopDC):
+            if dc is not None and dc.active():
+                dc.cancel()
+        if self._firstByteTime is not None:
+            elapsed = time.time() - self._firstByteTime
+            if elapsed > 0:
+                self.generator.results.throughput.record(
+                    self.bytes / elapsed)
+        self.generator.results.stall.record(self.stallTime * 1000000)
+        if self._protocol is not None:
+            self._protocol.transport.loseConnection()
+            self._protocol = None
+        self.generator.clientStopped(self, reason)
+
+    ### _HTTPLoadProtocol Callbacks ###
+
+    def connected(self, protocol):
+        if self._stopped:
+            protocol.transport.loseConnection()
+            return
+        self._protocol = protocol
+
+    def gotHeaders(self, protocol):
+        if protocol.status not in (200, 206):
+            self.info('%d: got status %d', self.id, protocol.status)
+            if protocol.status == 503:
+                self.stop(client.STOPPED_REFUSED)
+            else:
+                self.stop(client.STOPPED_ERROR)
+            return False
+        self._totalSize = self._getTotalSize(protocol.headers)
+        return True
+
+    def received(self, protocol, data):
+        if self._stopped:
+            return
+        now = time.time()
+        if self._firstByteTime is None:
+            self._firstByteTime = now
+            self.generator.results.ttfb.record(
+                (now - self._requestTime) * 1000000)
+        elif self._lastDataTime is not None:
+            gap = now - self._lastDataTime
+            if gap > STALL_THRESHOLD:
+                self.stallTime += gap
+        self._lastDataTime = now
+        if not data:
+            return
+
+        self.bytes += len(data)
+        self._requestBytes += len(data)
+        self.generator.results.bytes += len(data)
+        if self.stopSize and self.bytes >= self.stopSize:
+            self.stop()
+            return
+        if self.rate:
+            ahead = (self.bytes / float(self.rate)
+                     - (now - self._firstByteTime))
+            if ahead > 0.01:
+                protocol.transport.pauseProducing()
+                self._resumeDC = reactor.callLater(ahead, self._resume,
+                                                   protocol)
+
+    def disconnected(self, protocol):
+        if protocol is not self._protocol or self._stopped:
+            return
+        self._protocol = None
+        length = protocol.headers.get('content-length')
+        if length is None or self._requestBytes < int(length):
+            # a stream ended, or a download was cut
+            self.info('%d: connection closed after %d bytes', self.id,
+                      self.bytes)
+            self.stop(client.STOPPED_READ_ERROR)
+        elif self.seeks:
+            self.seeks -= 1
+            self._request(self._getRandomOffset())
+        else:
+            self.stop()
+
+    def connectionFailed(self, reason):
+        if self._stopped:
+            return
+        self.info('%d: could not connect: %s', self.id,
+                  log.getFailureMessage(reason))
+        self.stop(client.STOPPED_CONNECT_ERROR)
+
+    ### Private Methods ###
+
+    def _request(self, offset):
+        lines = ['GET %s HTTP/1.0' % self.path, 'Host: %s' % self.host]
+        if self.rangeSize:
+            lines.append('Range: bytes=%d-%d'
+                         % (offset, offset + self.rangeSize - 1))
+        elif offset:
+            lines.append('Range: bytes=%d-' % offset)
+        request = '\r\n'.join(lines) + '\r\n\r\n'
+        self._requestTime = time.time()
+        self._requestBytes = 0
+        self._lastDataTime = None
+        reactor.connectTCP(self.host, self.port,
+                           _HTTPLoadConnector(self, request))
+
+    def _resume(self, protocol):
+        self._resumeDC = None
+        # the pause is ours, not a stall
+        self._lastDataTime = time.time()
+        if protocol is self._protocol:
+            protocol.transport.resumeProducing()
+
+    def _getTotalSize(self, headers):
+        contentRange = headers.get('content-range')
+        if contentRange and '/' in contentRange:
+            try:
+                return int(contentRange.split('/')[1])
+            except ValueError:
+                return None
+        length = headers.get('content-length')
+        if length is not None:
+            return int(length)
+        return None
+
+    def _getRandomOffset(self):
+        # the last offset the server can send a whole range from
+        size = self._totalSize or 0
+        if self.rangeSize:
+            size -= self.rangeSize
+        else:
+            size -= 1
+        if size <= 0:
+            return 0
+        return self.generator.random.randint(0, size)
+
+
+class LoadGenerator(log.Loggable):
+    """
+    I connect clients to a server following a ramp profile, replacing
+    the clients that stop, and gather their measurements.
+
+    @ivar results: the measurements of the run
+    @type results: L{Results}
+    """
+
+    logCategory = 'loadgen'
+
+    def __init__(self, makeClient, profile, maxClients=None):
+        """
+        @param makeClient: called with the generator and the id of a
+                           client to create it
+        @type  makeClient: callable returning a L{HTTPLoadClient}
+        @param profile:    how many clients should be connected over
+                           time; the run ends after its last point, or
+                           when maxClients clients stopped if it has a
+                           single point
+        @type  profile:    L{RampProfile}
+        @param maxClients: number of clients to create at most
+        @type  maxClients: int or None
+        """
+        self.results = Results()
+        self.random = random.Random()
+        self._makeClient = makeClient
+        self._profile = profile
+        self._maxClients = maxClients
+        self._clients = {} # id -> connected client
+        # ids of the clients, oldest first; the ones of stopped clients
+        # are removed lazily
+        self._order = []
+        self._created = 0
+        self._startTime = None
+        self._tickDC = None
+        self._done = None
+
+    ### Public Methods ###
+
+    def run(self):
+        """
+        @returns: a deferred firing with the L{Results} of the run
+        """
+        self._done = defer.Deferred()
+        self._startTime = time.time()
+        self._tick()
+        return self._done
+
+    def stop(self):
+        """
+        Stop all the clients and end the run.
+        """
+        if self._tickDC is not None and self._tickDC.active():
+            self._tickDC.cancel()
+        self._tickDC = None
+        for c in self._clients.values():
+            c.stop()
+        self._finish()
+
+    def getConnectedCount(self):
+        return len(self._clients)
+
+    def clientStopped(self, c, reason):
+        self.log('%d: stopped: %d', c.id, reason)
+        self.results.stopped[reason] = (
+            self.results.stopped.get(reason, 0) + 1)
+        del self._clients[c.id]
+        if len(self._order) > 2 * len(self._clients) + 100:
+            self._order = [id for id in self._order if id in self._clients]
+
+    ### Private Methods ###
+
+    def _tick(self):
+        self._tickDC = None
+        elapsed = time.time() - self._startTime
+        profile = self._profile
+        if len(profile.points) > 1 and elapsed >= profile.getDuration():
+            self.stop()
+            return
+        target = profile.getTarget(elapsed)
+        while len(self._clients) < target and not self._isExhausted():
+            self._created += 1
+            c = self._makeClient(self, self._created)
+            self._clients[c.id] = c
+            self._order.append(c.id)
+            c.start()
+        # ramping down, stop the newest clients
+        while len(self._clients) > target:
+            id = self._order.pop()
+            if id in self._clients:
+                self._clients[id].stop()
+        self.results.maxConnected = max(self.results.maxConnected,
+                                        len(self._clients))
+        if self._isExhausted() and not self._clients:
+            self._finish()
+            return
+        self._tickDC = reactor.callLater(TICK, self._tick)
+
+    def _isExhausted(self):
+        return (self._maxClients is not None
+                and self._created >= self._maxClients)
+
+    def _finish(self):
+        if self._done is None:
+            return
+        self.results.duration = time.time() - self._startTime
+        d, self._done = self._done, None
+        d.callback(self.results)
@@ -0,0 +1,144 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""flumotion-tester entry point, command line parsing and invokation"""
+
+import random
+import resource
+import sys
+
+from twisted.internet import reactor
+
+from flumotion.common import log
+from flumotion.common.options import OptionGroup, OptionParser
+from flumotion.tester import loadgen
+
+__version__ = "$Rev$"
+
+
+def _createParser():
+    parser = OptionParser(usage="%prog [OPTIONS] URL",
+                          domain="flumotion-tester")
+
+    group = OptionGroup(parser, "clients")
+    group.add_option('-c', '--clients', action="store", type="int",
+                     dest="clients",
+                     help="number of clients to start (default 100 "
+                          "without a ramp profile)")
+    group.add_option('-m', '--max-clients', action="store", type="int",
+                     dest="maxclients",
+                     help="maximum number of connected clients")
+    group.add_option('-p', '--ramp', action="store", type="string",
+                     dest="ramp",
+                     help="number of connected clients over time, as "
+                          "seconds:clients points, for example "
+                          "0:0,30:1000,90:1000,100:0")
+    group.add_option('-r', '--readrate', action="store", type="string",
+                     dest="readrate",
+                     help="bytes per second each client reads at most, "
+                          "or range")
+    group.add_option('-b', '--bytes', action="store", type="string",
+                     dest="bytes",
+                     help="number of bytes each client reads, or range")
+    group.add_option('-t', '--time', action="store", type="string",
+                     dest="time",
+                     help="seconds each client stays connected, or range")
+    group.add_option('', '--seeks', action="store", type="int",
+                     dest="seeks", default=0,
+                     help="number of random range requests each client "
+                          "makes after the first one")
+    group.add_option('', '--range-size', action="store", type="int",
+                     dest="rangeSize",
+                     help="bytes to request in each request")
+    parser.add_option_group(group)
+
+    return parser
+
+
+def _parseFromRange(rand, string):
+    if string is None:
+        return None
+    if '-' in string:
+        low, high = string.split('-', 1)
+        return rand.randint(int(low), int(high))
+    return int(string)
+
+
+def _raiseFileLimit():
+    # each client needs a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except ValueError:
+            pass
+
+
+def main(args):
+    parser = _createParser()
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        sys.stderr.write('please give a URL to test\n')
+        return 1
+    try:
+        host, port, path = loadgen.parseURL(args[1])
+    except ValueError, e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+
+    if options.ramp:
+        try:
+            profile = loadgen.RampProfile.fromString(options.ramp)
+        except ValueError:
+            sys.stderr.write('invalid ramp profile %s\n' % options.ramp)
+            return 1
+        maxClients = options.clients
+    else:
+        maxClients = options.clients or 100
+        profile = loadgen.RampProfile(
+            [(0, options.maxclients or maxClients)])
+    _raiseFileLimit()
+
+    rand = random.Random()
+
+    def makeClient(generator, id):
+        return loadgen.HTTPLoadClient(
+            generator, id, host, port, path,
+            rate=_parseFromRange(rand, options.readrate),
+            stopTime=_parseFromRange(rand, options.time),
+            stopSize=_parseFromRange(rand, options.bytes),
+            seeks=options.seeks, rangeSize=options.rangeSize)
+
+    generator = loadgen.LoadGenerator(makeClient, profile, maxClients)
+
+    def done(results):
+        for line in results.getReport():
+            print line
+        reactor.stop()
+
+    def start():
+        log.info('tester', 'testing %s', args[1])
+        d = generator.run()
+        d.addCallback(done)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+    return 0
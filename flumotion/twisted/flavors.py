@@ -25,7 +25,7 @@ Flumotion Twisted-like flavors
 Inspired by L{twisted.spread.flavors}
 """
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.spread import pb
 from zope.interface import Interface
 from flumotion.common import log
@@ -101,14 +101,66 @@ class IStateCacheableListener(Interface):
         """
 
 
+# index of the listener procedure for each kind of change
+_LISTENER_INDEX = {'set': 0, 'append': 1, 'remove': 2, 'setitem': 3,
+                   'delitem': 4}
+
+
+class _Batch:
+    """
+    I am the list of changes to a state object that are waiting to be
+    sent to one observer.
+
+    Setting a key, or a subkey of a dict, replaces a set of the same
+    (sub)key still waiting in the batch, as long as no other change to
+    that key came after it.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self._slots = {} # key -> dict of the sets that can be replaced
+
+    def add(self, change):
+        name, key = change[0], change[1]
+        slots = self._slots.setdefault(key, {}) # slot -> index
+        if name == 'set':
+            slot = ('set', )
+        elif name == 'setitem':
+            slot = ('setitem', change[2])
+        else:
+            slot = None
+        if slot in slots:
+            self.changes[slots[slot]] = change
+            return
+
+        if name == 'setitem' or name == 'delitem':
+            # a later set of the whole key must not replace one before this
+            slots.pop(('set', ), None)
+            slots.pop(('setitem', change[2]), None)
+        else:
+            slots.clear()
+        if slot is not None:
+            slots[slot] = len(self.changes)
+        self.changes.append(change)
+
+
 class StateCacheable(pb.Cacheable):
     """
     I am a cacheable state object.
 
     I cache key-value pairs, where values can be either single objects
     or list of objects.
+
+    By default every change is sent to the observers right away; see
+    L{setBatchWindow} to send them in batches instead.
     """
 
+    _batchWindow = None
+    _batchDepth = 0 # > 0 while applying a batch from the cacheable we proxy
+    _batches = None # observer -> _Batch
+    _batchWaiters = None # deferreds fired when the batches are sent
+    _batchDC = None
+
     def __init__(self):
         self._observers = []
         self._hooks = []
@@ -175,8 +227,7 @@ class StateCacheable(pb.Cacheable):
             raise KeyError('%s in %r' % (key, self))
 
         self._dict[key] = value
-        dList = [o.callRemote('set', key, value) for o in self._observers]
-        return defer.DeferredList(dList)
+        return self._notifyObservers('set', key, value)
 
     def append(self, key, value):
         """
@@ -187,8 +238,7 @@ class StateCacheable(pb.Cacheable):
             raise KeyError('%s in %r' % (key, self))
 
         self._dict[key].append(value)
-        dList = [o.callRemote('append', key, value) for o in self._observers]
-        return defer.DeferredList(dList)
+        return self._notifyObservers('append', key, value)
 
     def remove(self, key, value):
         """
@@ -203,9 +253,7 @@ class StateCacheable(pb.Cacheable):
         except ValueError:
             raise ValueError('value %r not in list %r for key %r' % (
                 value, self._dict[key], key))
-        dList = [o.callRemote('remove', key, value) for o in self._observers]
-        dl = defer.DeferredList(dList)
-        return dl
+        return self._notifyObservers('remove', key, value)
 
     def setitem(self, key, subkey, value):
         """
@@ -216,9 +264,7 @@ class StateCacheable(pb.Cacheable):
             raise KeyError('%s in %r' % (key, self))
 
         self._dict[key][subkey] = value
-        dList = [o.callRemote('setitem', key, subkey, value)
-                for o in self._observers]
-        return defer.DeferredList(dList)
+        return self._notifyObservers('setitem', key, subkey, value)
 
     def delitem(self, key, subkey):
         """
@@ -234,10 +280,81 @@ class StateCacheable(pb.Cacheable):
         except KeyError:
             raise KeyError('key %r not in dict %r for key %r' % (
                 subkey, self._dict[key], key))
-        dList = [o.callRemote('delitem', key, subkey, value) for o in
-                self._observers]
-        dl = defer.DeferredList(dList)
-        return dl
+        return self._notifyObservers('delitem', key, subkey, value)
+
+    def setBatchWindow(self, window):
+        """
+        Send changes to the observers in batches.
+
+        With a window, the changes made to me are collected for each
+        observer for up to window seconds, and sent in one observe_batch
+        call. A key, or a subkey of a dict, that is set repeatedly is
+        only sent with its last value. The deferreds returned by the
+        methods changing me fire when their batch was sent.
+
+        The observers need to implement observe_batch, like
+        L{StateRemoteCache} does.
+
+        @param window: seconds to collect changes for, or None to send
+                       each change right away
+        @type  window: float or None
+        """
+        self._batchWindow = window
+        if window is None:
+            self.flushBatches()
+
+    def flushBatches(self):
+        """
+        Send the changes collected for the observers right away.
+
+        @returns: a deferred firing when the changes were sent
+        """
+        if self._batchDC is not None:
+            if self._batchDC.active():
+                self._batchDC.cancel()
+            self._batchDC = None
+        batches, self._batches = self._batches, None
+        waiters, self._batchWaiters = self._batchWaiters, None
+        if not waiters:
+            return defer.succeed(None)
+
+        dList = [o.callRemote('batch', batch.changes)
+                 for o, batch in batches.items()]
+        d = defer.DeferredList(dList)
+
+        def sent(result):
+            for waiter in waiters:
+                waiter.callback(result)
+            return result
+        d.addCallback(sent)
+        return d
+
+    def _notifyObservers(self, *change):
+        if self._batchWindow is None and not self._batchDepth:
+            dList = [o.callRemote(*change) for o in self._observers]
+            return defer.DeferredList(dList)
+
+        if self._batches is None:
+            self._batches = {}
+            self._batchWaiters = []
+        for o in self._observers:
+            if o not in self._batches:
+                self._batches[o] = _Batch()
+            self._batches[o].add(change)
+        d = defer.Deferred()
+        self._batchWaiters.append(d)
+        if not self._batchDepth:
+            self._scheduleBatches()
+        return d
+
+    def _scheduleBatches(self):
+        if self._batchWaiters is None:
+            return
+        if self._batchWindow is None:
+            self.flushBatches()
+        elif self._batchDC is None:
+            self._batchDC = reactor.callLater(self._batchWindow,
+                                              self.flushBatches)
 
     # pb.Cacheable methods
 
@@ -249,6 +366,8 @@ class StateCacheable(pb.Cacheable):
 
     def stoppedObserving(self, perspective, observer):
         self._observers.remove(observer)
+        if self._batches:
+            self._batches.pop(observer, None)
         for hook in self._hooks:
             hook.observerRemove(observer, len(self._observers))
 
@@ -427,23 +546,69 @@ class StateRemoteCache(pb.RemoteCache):
                                 log.getExceptionMessage(e))
 
     def observe_set(self, key, value):
+        self._apply_set(key, value)
+        self._notifyListeners(0, key, value)
+
+    def observe_append(self, key, value):
+        self._apply_append(key, value)
+        self._notifyListeners(1, key, value)
+
+    def observe_remove(self, key, value):
+        self._apply_remove(key, value)
+        self._notifyListeners(2, key, value)
+
+    def observe_setitem(self, key, subkey, value):
+        self._apply_setitem(key, subkey, value)
+        self._notifyListeners(3, key, subkey, value)
+
+    def observe_delitem(self, key, subkey, value):
+        self._apply_delitem(key, subkey, value)
+        self._notifyListeners(4, key, subkey, value)
+
+    def observe_batch(self, changes):
+        """
+        Apply a batch of changes sent by a L{StateCacheable} with a batch
+        window. All the changes are applied before the listeners are
+        notified of each of them, in order.
+
+        @param changes: the changes, as (name, args...) tuples with the
+                        name of the observe_ method without its prefix
+        @type  changes: list of tuple
+        """
+        for change in changes:
+            if change[0] not in _LISTENER_INDEX:
+                raise ValueError('unknown state change %r' % (change[0], ))
+
+        # if we also subclass from Cacheable, then we're a proxy, so
+        # proxy the changes as a batch too
+        proxy = hasattr(self, '_scheduleBatches')
+        if proxy:
+            self._batchDepth += 1
+        try:
+            for change in changes:
+                getattr(self, '_apply_' + change[0])(*change[1:])
+        finally:
+            if proxy:
+                self._batchDepth -= 1
+                self._scheduleBatches()
+
+        for change in changes:
+            self._notifyListeners(_LISTENER_INDEX[change[0]], *change[1:])
+
+    def _apply_set(self, key, value):
         self._dict[key] = value
         # if we also subclass from Cacheable, then we're a proxy, so proxy
         if hasattr(self, 'set'):
             StateCacheable.set(self, key, value)
 
-        self._notifyListeners(0, key, value)
-
-    def observe_append(self, key, value):
+    def _apply_append(self, key, value):
         # if we also subclass from Cacheable, then we're a proxy, so proxy
         if hasattr(self, 'append'):
             StateCacheable.append(self, key, value)
         else:
             self._dict[key].append(value)
 
-        self._notifyListeners(1, key, value)
-
-    def observe_remove(self, key, value):
+    def _apply_remove(self, key, value):
         # if we also subclass from Cacheable, then we're a proxy, so proxy
         if hasattr(self, 'remove'):
             StateCacheable.remove(self, key, value)
@@ -454,18 +619,14 @@ class StateRemoteCache(pb.RemoteCache):
                 raise ValueError("value %r not under key %r with values %r" %
                     (value, key, self._dict[key]))
 
-        self._notifyListeners(2, key, value)
-
-    def observe_setitem(self, key, subkey, value):
+    def _apply_setitem(self, key, subkey, value):
         # if we also subclass from Cacheable, then we're a proxy, so proxy
         if hasattr(self, 'setitem'):
             StateCacheable.setitem(self, key, subkey, value)
         else:
             self._dict[key][subkey] = value
 
-        self._notifyListeners(3, key, subkey, value)
-
-    def observe_delitem(self, key, subkey, value):
+    def _apply_delitem(self, key, subkey, value):
         # if we also subclass from Cacheable, then we're a proxy, so proxy
         if hasattr(self, 'delitem'):
             StateCacheable.delitem(self, key, subkey)
@@ -476,8 +637,6 @@ class StateRemoteCache(pb.RemoteCache):
                 raise KeyError("key %r not in dict %r for state dict %r" %
                     (subkey, self._dict[key], self._dict))
 
-        self._notifyListeners(4, key, subkey, value)
-
     def invalidate(self):
         """Invalidate this StateRemoteCache.
 
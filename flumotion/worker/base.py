@@ -28,13 +28,16 @@ import sys
 import signal
 
 from twisted.cred import portal
-from twisted.internet import defer, reactor
+from twisted.internet import defer, error, protocol, reactor
+from twisted.python import failure
 from twisted.spread import pb
 from zope.interface import implements
 
 from flumotion.common import errors, log
 from flumotion.common import worker, startset
 from flumotion.common.process import signalPid
+from flumotion.configure import configure
+from flumotion.job import zygote
 from flumotion.twisted import checkers, fdserver
 from flumotion.twisted import pb as fpb
 
@@ -134,6 +137,157 @@ class JobProcessProtocol(worker.ProcessProtocol):
         worker.ProcessProtocol.processEnded(self, status)
 
 
+def _exitStatusFailure(status):
+    # the failure twisted would give to the protocol of a child process
+    if os.WIFEXITED(status):
+        exitCode, signum = os.WEXITSTATUS(status), None
+    else:
+        exitCode, signum = None, os.WTERMSIG(status)
+    if exitCode == 0:
+        return failure.Failure(error.ProcessDone(status))
+    return failure.Failure(error.ProcessTerminated(exitCode, signum, status))
+
+
+class JobZygote(protocol.ProcessProtocol, log.Loggable):
+    """
+    I run a job zygote for a job heaven: a job process that has already
+    done the costly imports and forks new job processes on request.
+
+    The forked job processes are not children of the worker; I pass on
+    their exit status to their process protocols when the zygote
+    reports it.
+
+    See L{flumotion.job.zygote} for the job-side half.
+
+    @ivar poolSize: number of forked job processes the zygote keeps
+                    waiting for a job
+    @type poolSize: int
+    """
+
+    logCategory = 'job-zygote'
+
+    def __init__(self, heaven, poolSize=0):
+        self.heaven = heaven
+        self.poolSize = poolSize
+        self.process = None
+        self._buffer = ''
+        self._ready = [] # pids of forked processes waiting for a job
+        self._waiting = [] # deferreds waiting for a forked process
+        self._protocols = {} # pid -> process protocol of a running job
+        self._onExit = None
+
+    def start(self, executable=None):
+        """
+        Spawn the zygote.
+
+        @param executable: the flumotion-job executable to run
+        @type  executable: str
+        """
+        if executable is None:
+            executable = os.path.join(configure.bindir, 'flumotion-job')
+        argv = [executable, '--zygote', '--pool-size', str(self.poolSize),
+                self.heaven.getSocketPath()]
+        env = {}
+        env.update(os.environ)
+        env['FLU_DEBUG'] = log.getDebug()
+        childFDs = {0: 'w', 1: 1, 2: 2, zygote.EVENT_FD: 'r'}
+        self.debug('spawning job zygote with pool size %d', self.poolSize)
+        self.process = reactor.spawnProcess(self, executable, env=env,
+                                            args=argv, childFDs=childFDs)
+
+    def stop(self):
+        """
+        Stop the zygote. The zygote exits when all the job processes it
+        forked have exited.
+
+        @returns: a deferred fired when the zygote exited
+        """
+        if self.process is None:
+            return defer.succeed(None)
+        self._onExit = defer.Deferred()
+        self.process.closeStdin()
+        return self._onExit
+
+    def fork(self):
+        """
+        Get a forked job process waiting for a job.
+
+        @returns: a deferred firing with the pid of the process
+        """
+        if self.process is None:
+            return defer.fail(errors.ComponentCreateError(
+                "The job zygote is not running."))
+        if self._ready:
+            return defer.succeed(self._ready.pop(0))
+        d = defer.Deferred()
+        self._waiting.append(d)
+        self._sendCommand('fork')
+        return d
+
+    def run(self, pid, processProtocol, avatarId, env):
+        """
+        Run a job in a process obtained with L{fork}.
+
+        @param pid:             the pid of the process
+        @type  pid:             int
+        @param processProtocol: the protocol to notify when it exits
+        @type  processProtocol: L{twisted.internet.protocol.ProcessProtocol}
+        @param avatarId:        the avatarId the job should log in with
+        @type  avatarId:        str
+        @param env:             the environment of the job
+        @type  env:             dict of str -> str
+        """
+        self._protocols[pid] = processProtocol
+        self._sendCommand('run', pid, avatarId, env)
+
+    def _sendCommand(self, *command):
+        self.process.write(zygote.encodeMessage(command))
+
+    ### protocol.ProcessProtocol methods
+
+    def childDataReceived(self, childFD, data):
+        if childFD != zygote.EVENT_FD:
+            return
+        self._buffer += data
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            self._eventReceived(line.split())
+
+    def processEnded(self, status):
+        self.debug('job zygote exited')
+        self.process = None
+        self._ready = []
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(errors.ComponentCreateError(
+                "The job zygote exited."))
+        if self._protocols:
+            self.warning('job zygote exited while %d jobs it forked are '
+                         'running, their exit will go unnoticed',
+                         len(self._protocols))
+            self._protocols = {}
+        if self._onExit is not None:
+            d, self._onExit = self._onExit, None
+            d.callback(None)
+
+    def _eventReceived(self, event):
+        if event[0] == 'ready':
+            pid = int(event[1])
+            if self._waiting:
+                self._waiting.pop(0).callback(pid)
+            else:
+                self._ready.append(pid)
+        elif event[0] == 'exited':
+            pid, status = int(event[1]), int(event[2])
+            if pid in self._ready:
+                self._ready.remove(pid)
+            processProtocol = self._protocols.pop(pid, None)
+            if processProtocol is not None:
+                processProtocol.processEnded(_exitStatusFailure(status))
+        else:
+            self.warning('unknown event from job zygote: %r', event)
+
+
 class BaseJobHeaven(pb.Root, log.Loggable):
     """
     I am similar to but not quite the same as a manager-side Heaven.
@@ -208,6 +362,14 @@ class BaseJobHeaven(pb.Root, log.Loggable):
             self.warning("some programmer is telling me about an avatar "
                          "I have no idea about: %s", avatarId)
 
+    def getSocketPath(self):
+        """
+        Gets the path of the unix socket the jobs log in on.
+
+        @rtype: str
+        """
+        return self._socketPath
+
     def getWorkerName(self):
         """
         Gets the name of the worker that spawns the process.
@@ -63,6 +63,8 @@ class WorkerConfigXML(log.Loggable):
         self.feederports = None
         self.fludebug = None
         self.randomFeederports = False
+        self.zygote = False
+        self.zygotePoolSize = 0
 
         try:
             if filename != None:
@@ -110,6 +112,8 @@ class WorkerConfigXML(log.Loggable):
                     self.parseFeederports(node)
             elif node.nodeName == 'debug':
                 self.fludebug = str(node.firstChild.nodeValue)
+            elif node.nodeName == 'zygote':
+                self.zygote, self.zygotePoolSize = self.parseZygote(node)
             else:
                 raise ConfigError("unexpected node under '%s': %s" % (
                     root.nodeName, node.nodeName))
@@ -177,6 +181,26 @@ class WorkerConfigXML(log.Loggable):
 
         return ConfigEntryAuthentication(username, password)
 
+    def parseZygote(self, node):
+        """
+        Returns whether to fork job processes from a job zygote,
+        and how many forked processes to keep ready.
+
+        @rtype: (bool, int)
+        """
+        # <zygote enabled="true" pool-size="2"/>
+        enabled = True
+        if node.hasAttribute('enabled'):
+            enabled = common.strToBool(node.getAttribute('enabled'))
+        poolSize = 0
+        if node.hasAttribute('pool-size'):
+            try:
+                poolSize = int(node.getAttribute('pool-size'))
+            except ValueError:
+                raise ConfigError("invalid pool-size: %s"
+                                  % node.getAttribute('pool-size'))
+        return (enabled, poolSize)
+
     def parseFeederports(self, node):
         """
         Returns a list of feeder ports to use (possibly empty),
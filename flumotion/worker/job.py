@@ -161,9 +161,35 @@ class ComponentJobInfo(base.JobInfo):
 
 
 class ComponentJobHeaven(base.BaseJobHeaven):
+    """
+    I spawn the job processes running the components of the worker.
+
+    If the worker runs with the zygote option, the job processes are
+    forked by a job zygote instead of being spawned from scratch.
+
+    @ivar zygote: the job zygote, if any
+    @type zygote: L{base.JobZygote}
+    """
     avatarClass = ComponentJobAvatar
     logCategory = 'component-job-heaven'
 
+    def __init__(self, brain):
+        base.BaseJobHeaven.__init__(self, brain)
+        self.zygote = None
+        if brain.options.zygote:
+            self.zygote = base.JobZygote(self, brain.options.zygotePoolSize)
+
+    def listen(self):
+        base.BaseJobHeaven.listen(self)
+        if self.zygote:
+            self.zygote.start()
+
+    def shutdown(self):
+        d = base.BaseJobHeaven.shutdown(self)
+        if self.zygote:
+            d.addCallback(lambda _: self.zygote.stop())
+        return d
+
     def getManagerConnectionInfo(self):
         """
         Gets the L{flumotion.common.connection.PBConnectionInfo}
@@ -178,10 +204,10 @@ class ComponentJobHeaven(base.BaseJobHeaven):
         """
         Spawn a new job.
 
-        This will spawn a new flumotion-job process, running under the
-        requested nice level. When the job logs in, it will be told to
-        load bundles and run a function, which is expected to return a
-        component.
+        This will spawn a new flumotion-job process, or have the job
+        zygote fork one, running under the requested nice level. When
+        the job logs in, it will be told to load bundles and run a
+        function, which is expected to return a component.
 
         @param avatarId:   avatarId the component should use to log in
         @type  avatarId:   str
@@ -225,19 +251,38 @@ class ComponentJobHeaven(base.BaseJobHeaven):
                     '--leak-resolution=high', '--show-reachable=yes',
                     'python'] + argv
 
-        childFDs = {0: 0, 1: 1, 2: 2}
         env = {}
         env.update(os.environ)
         env['FLU_DEBUG'] = log.getDebug()
-        process = reactor.spawnProcess(p, realexecutable, env=env, args=argv,
-            childFDs=childFDs)
 
-        p.setPid(process.pid)
+        def started(pid):
+            p.setPid(pid)
+            self.addJobInfo(pid,
+                            ComponentJobInfo(pid, avatarId, type,
+                                             moduleName, methodName, nice,
+                                             bundles, conf))
+
+        if self.zygote and realexecutable == executable:
+
+            def forked(pid):
+                self.debug('running %s in forked job process %d',
+                           avatarId, pid)
+                started(pid)
+                self.zygote.run(pid, p, avatarId, env)
 
-        self.addJobInfo(process.pid,
-                        ComponentJobInfo(process.pid, avatarId, type,
-                                         moduleName, methodName, nice,
-                                         bundles, conf))
+            def forkFailed(failure):
+                self.warning('could not fork job process for %s: %s',
+                             avatarId, log.getFailureMessage(failure))
+                self._startSet.createFailed(avatarId, failure.value)
+
+            forking = self.zygote.fork()
+            forking.addCallbacks(forked, forkFailed)
+            return d
+
+        childFDs = {0: 0, 1: 1, 2: 2}
+        process = reactor.spawnProcess(p, realexecutable, env=env, args=argv,
+            childFDs=childFDs)
+        started(process.pid)
         return d
 
 
@@ -0,0 +1,125 @@
+# -*- Mode: Python; test-case-name: flumotion.test.test_manager_placement -*-
+# vi:si:et:sw=4:sts=4:ts=4
+#
+# Flumotion - a streaming media server
+# Copyright (C) 2004,2005,2006,2007,2008 Fluendo, S.L. (www.fluendo.com).
+# All rights reserved.
+
+# This file may be distributed and/or modified under the terms of
+# the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+# This file is distributed without any warranty; without even the implied
+# warranty of merchantability or fitness for a particular purpose.
+# See "LICENSE.GPL" in the source distribution for more information.
+
+# Licensees having purchased or holding a valid Flumotion Advanced
+# Streaming Server license may use this file in accordance with the
+# Flumotion Advanced Streaming Server Commercial License Agreement.
+# See "LICENSE.Flumotion" in the source distribution for more information.
+
+# Headers in this file shall remain intact.
+
+"""
+load reports sent by the worker to the manager, used to place components
+"""
+
+import os
+import time
+
+from flumotion.common import log
+
+__version__ = "$Rev$"
+
+
+class LoadSampler(log.Loggable):
+    """
+    I sample the load of the machine the worker runs on.
+
+    My reports are dicts with the following keys, each of them is
+    missing when it cannot be found out:
+      - cpu-count:      number of CPUs
+      - load-average:   load average over the last minute
+      - memory-total:   total memory, in bytes
+      - memory-free:    memory available to new processes, in bytes
+      - network-usage:  fraction of the network interfaces bandwidth
+                        used since the previous report (from 0.0 to 1.0)
+    """
+
+    logCategory = 'load'
+
+    def __init__(self, procDir='/proc', sysDir='/sys'):
+        self._procDir = procDir
+        self._sysDir = sysDir
+        self._lastNetwork = None # (time, bytes)
+
+    def getReport(self):
+        """
+        @rtype: dict of str -> int or float
+        """
+        report = {}
+        for sample in (self._sampleCPU, self._sampleMemory,
+                       self._sampleNetwork):
+            try:
+                sample(report)
+            except (IOError, OSError, ValueError, IndexError, KeyError), e:
+                self.debug('could not sample load: %s',
+                           log.getExceptionMessage(e))
+        return report
+
+    ### Private Methods ###
+
+    def _read(self, *path):
+        f = open(os.path.join(*path))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _sampleCPU(self, report):
+        cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+        if cpus > 0:
+            report['cpu-count'] = cpus
+        loadavg = self._read(self._procDir, 'loadavg')
+        report['load-average'] = float(loadavg.split()[0])
+
+    def _sampleMemory(self, report):
+        info = {}
+        for line in self._read(self._procDir, 'meminfo').splitlines():
+            key, value = line.split(':', 1)
+            info[key] = int(value.split()[0]) * 1024
+        # the memory is unknown if the kernel does not tell it
+        if 'MemTotal' in info:
+            report['memory-total'] = info['MemTotal']
+        if 'MemAvailable' in info:
+            report['memory-free'] = info['MemAvailable']
+        elif 'MemFree' in info:
+            report['memory-free'] = (info['MemFree']
+                                     + info.get('Buffers', 0)
+                                     + info.get('Cached', 0))
+
+    def _sampleNetwork(self, report):
+        total = 0
+        speed = 0 # in bytes per second
+        lines = self._read(self._procDir, 'net', 'dev').splitlines()[2:]
+        for line in lines:
+            name, counters = line.split(':', 1)
+            name = name.strip()
+            if name == 'lo':
+                continue
+            try:
+                mbits = int(self._read(self._sysDir, 'class', 'net',
+                                       name, 'speed'))
+            except (IOError, OSError, ValueError):
+                continue
+            if mbits <= 0:
+                continue
+            counters = counters.split()
+            # received and transmitted bytes
+            total += int(counters[0]) + int(counters[8])
+            speed += mbits * 1000 * 1000 / 8
+        now = time.time()
+        last, self._lastNetwork = self._lastNetwork, (now, total)
+        if last is None or not speed or now <= last[0]:
+            return
+        rate = (total - last[1]) / (now - last[0])
+        report['network-usage'] = max(0.0, min(1.0, rate / speed))
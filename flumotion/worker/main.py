@@ -90,6 +90,14 @@ def _createParser():
                      action="store_true",
                      dest="randomFeederports",
                      help="Use randomly available feeder ports")
+    group.add_option('', '--zygote',
+                     action="store_true", dest="zygote",
+                     help="fork job processes from a job zygote "
+                          "instead of spawning them")
+    group.add_option('', '--zygote-pool-size',
+                     action="store", type="int", dest="zygotePoolSize",
+                     help="number of forked job processes to keep ready "
+                          "in zygote mode [default 0]")
 
     parser.add_option_group(group)
 
@@ -148,6 +156,12 @@ def _readConfig(workerFile, options):
     if options.feederports is not None:
         log.debug('worker', 'Using feederports %r' % options.feederports)
 
+    # job zygote
+    if options.zygote is None:
+        options.zygote = cfg.zygote
+    if options.zygotePoolSize is None:
+        options.zygotePoolSize = cfg.zygotePoolSize
+
     # general
     # command-line debug > environment debug > config file debug
     if not options.debug and cfg.fludebug \
@@ -185,6 +199,8 @@ def main(args):
         options.host = 'localhost'
     if not options.transport:
         options.transport = 'ssl'
+    if not options.zygotePoolSize:
+        options.zygotePoolSize = 0
     if not options.port:
         if options.transport == "tcp":
             options.port = configure.defaultTCPManagerPort
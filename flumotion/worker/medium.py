@@ -29,13 +29,15 @@ from twisted.internet import reactor, error
 from twisted.spread import flavors
 from zope.interface import implements
 
-from flumotion.common import errors, interfaces, debug
-from flumotion.common import medium
+from flumotion.common import errors, interfaces, debug, log
+from flumotion.common import medium, poller
 from flumotion.common.vfs import listDirectory, registerVFSJelly
 from flumotion.twisted.pb import ReconnectingFPBClientFactory
+from flumotion.worker import load
 
 __version__ = "$Rev$"
 JOB_SHUTDOWN_TIMEOUT = 5
+LOAD_REPORT_INTERVAL = 10
 
 
 class WorkerClientFactory(ReconnectingFPBClientFactory):
@@ -146,6 +148,8 @@ class WorkerMedium(medium.PingingMedium):
         """
         self.brain = brain
         self.factory = None
+        self._loadSampler = load.LoadSampler()
+        self._loadPoller = None
         registerVFSJelly()
 
     def startConnecting(self, connectionInfo):
@@ -168,6 +172,32 @@ class WorkerMedium(medium.PingingMedium):
         self.factory.disconnect()
         self.factory.stopTrying()
 
+    def setRemoteReference(self, remoteReference):
+        medium.PingingMedium.setRemoteReference(self, remoteReference)
+        self._loadPoller = poller.Poller(self._reportLoad,
+                                         LOAD_REPORT_INTERVAL,
+                                         immediately=True)
+        self.remote.notifyOnDisconnect(self._stopReportingLoad)
+
+    def _reportLoad(self):
+        d = self.callRemoteLogging(log.LOG, 0, 'reportLoad',
+                                   self._loadSampler.getReport())
+
+        def reportFailed(failure):
+            if failure.check(flavors.NoSuchMethod):
+                self.debug('manager does not take load reports')
+                self._stopReportingLoad()
+            else:
+                self.debug('failed to report load: %s',
+                           log.getFailureMessage(failure))
+        d.addErrback(reportFailed)
+        return d
+
+    def _stopReportingLoad(self, *args):
+        if self._loadPoller is not None:
+            self._loadPoller.stop()
+            self._loadPoller = None
+
     ### pb.Referenceable method for the manager's WorkerAvatar
 
     def remote_getPorts(self):
@@ -189,6 +219,18 @@ class WorkerMedium(medium.PingingMedium):
         """
         return self.brain.getFeedServerPort()
 
+    def remote_connectLocalFeed(self, feederId, feederName, eaterId,
+                                eaterAlias):
+        """
+        Connect a feeder to an eater of two components running on this
+        worker without going through the feed server.
+
+        @returns: whether the components were connected
+        @rtype:   bool
+        """
+        return self.brain.connectLocalFeed(feederId, feederName, eaterId,
+                                           eaterAlias)
+
     def remote_create(self, avatarId, type, moduleName, methodName,
                       nice, conf):
         """
@@ -20,19 +20,27 @@
 # Headers in this file shall remain intact.
 
 """worker-side objects to handle worker clients
+
+@var LOCAL_FEED_BUFFER_SIZE: size, in bytes, of the socket buffers of the
+                             feeds between components running on the
+                             same worker; the kernel caps it to its
+                             maximum socket buffer size
 """
 
 import signal
+import socket
 
 from twisted.internet import defer, error, reactor
 from zope.interface import implements
 
-from flumotion.common import errors, interfaces, log
+from flumotion.common import common, errors, interfaces, log
 from flumotion.worker import medium, job, feedserver
 from flumotion.twisted.defer import defer_call_later
 
 __version__ = "$Rev$"
 
+LOCAL_FEED_BUFFER_SIZE = 4 * 1024 * 1024
+
 
 class ProxyBouncer(log.Loggable):
     logCategory = "proxybouncer"
@@ -230,6 +238,63 @@ class WorkerBrain(log.Loggable):
         avatar = self.jobHeaven.avatars[componentId]
         return avatar.receiveFeed(eaterAlias, fd, feedId)
 
+    def connectLocalFeed(self, feederId, feederName, eaterId, eaterAlias):
+        """
+        Connect a feeder to an eater of two components running on this
+        worker through a unix socket pair, instead of going through the
+        feed server over TCP.
+
+        @param feederId:   the avatarId of the component feeding
+        @type  feederId:   str
+        @param feederName: the name of the feeder
+        @type  feederName: str
+        @param eaterId:    the avatarId of the component eating
+        @type  eaterId:    str
+        @param eaterAlias: the alias of the eater
+        @type  eaterAlias: str
+
+        @returns: whether both ends were handed off to the components.
+        """
+        for componentId in (feederId, eaterId):
+            if componentId not in self.jobHeaven.avatars:
+                self.warning("No such component %s running", componentId)
+                return False
+
+        flowName, componentName = common.parseComponentId(feederId)
+        feedId = common.feedId(componentName, feederName)
+        flowName, componentName = common.parseComponentId(eaterId)
+        eaterFullFeedId = common.fullFeedId(flowName, componentName,
+                                            eaterAlias)
+
+        try:
+            pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            for s in pair:
+                s.setblocking(False)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                             LOCAL_FEED_BUFFER_SIZE)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                             LOCAL_FEED_BUFFER_SIZE)
+        except socket.error, e:
+            self.warning("Could not create a socket pair: %s",
+                         log.getExceptionMessage(e))
+            return False
+
+        feederSocket, eaterSocket = pair
+        self.debug('connecting %s to %s through fds %d and %d', feedId,
+                   eaterFullFeedId, feederSocket.fileno(),
+                   eaterSocket.fileno())
+        try:
+            # the jobs get their own copies of the fds, ours are closed
+            # once they are sent
+            if not self.feedToFD(feederId, feederName,
+                                 feederSocket.fileno(), eaterFullFeedId):
+                return False
+            return self.eatFromFD(eaterId, eaterAlias,
+                                  eaterSocket.fileno(), feedId)
+        finally:
+            feederSocket.close()
+            eaterSocket.close()
+
     ### these methods called by WorkerMedium
 
     def getPorts(self):
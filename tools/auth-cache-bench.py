@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time it takes to authenticate HTTP requests against a
+remote bouncer, and the number of keycards sent to it, with and without
+reusing its decisions.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/auth-cache-bench.py 5000 100
+
+which authenticates 5000 requests with 100 different tokens, 50 at a
+time, against a bouncer reached over PB on the loopback interface.
+"""
+
+import sys
+import time
+
+from twisted.internet import defer, reactor
+from twisted.spread import pb
+
+from flumotion.common import keycards
+from flumotion.component.base.http import HTTPAuthentication
+
+CONCURRENCY = 50
+
+
+class Bouncer(pb.Root):
+
+    def __init__(self):
+        self.count = 0
+
+    def remote_authenticate(self, keycard):
+        self.count += 1
+        keycard.id = self.count
+        keycard.state = keycards.AUTHENTICATED
+        return keycard
+
+    def remote_removeKeycardId(self, keycardId):
+        pass
+
+
+class Medium:
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def authenticate(self, bouncerName, keycard):
+        return self.remote.callRemote('authenticate', keycard)
+
+    def removeKeycardId(self, bouncerName, keycardId):
+        return self.remote.callRemote('removeKeycardId', keycardId)
+
+
+class Streamer:
+
+    def __init__(self, remote):
+        self.medium = Medium(remote)
+        self.plugs = {}
+
+    def getName(self):
+        return 'bench'
+
+
+class Transport:
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+
+class Request:
+    method = 'GET'
+    path = '/'
+
+    def __init__(self, fd, token):
+        self.transport = Transport(fd)
+        self.args = {'token': [token]}
+
+    def getClientIP(self):
+        return '127.0.0.1'
+
+
+def run(remote, requests, tokens, cacheSize):
+    httpauth = HTTPAuthentication(Streamer(remote))
+    httpauth.setIssuerClass('HTTPTokenIssuer')
+    httpauth.setBouncerName('bouncer')
+    httpauth.setDecisionCache(cacheSize)
+    start = time.time()
+    done = defer.Deferred()
+    state = {'next': 0, 'running': 0}
+
+    def authenticated(_, fd):
+        httpauth.cleanupAuth(fd)
+        state['running'] -= 1
+        startMore()
+
+    def startMore():
+        while state['running'] < CONCURRENCY and state['next'] < requests:
+            fd = state['next']
+            state['next'] += 1
+            state['running'] += 1
+            d = httpauth.startAuthentication(
+                Request(fd, 'token-%d' % (fd % tokens)))
+            d.addCallback(authenticated, fd)
+        if not state['running'] and not done.called:
+            done.callback(time.time() - start)
+    startMore()
+    return done
+
+
+def main(args):
+    requests = 5000
+    tokens = 100
+    if len(args) > 1:
+        requests = int(args[1])
+    if len(args) > 2:
+        tokens = int(args[2])
+    bouncer = Bouncer()
+    port = reactor.listenTCP(0, pb.PBServerFactory(bouncer),
+                             interface='127.0.0.1')
+    factory = pb.PBClientFactory()
+    reactor.connectTCP('127.0.0.1', port.getHost().port, factory)
+    result = []
+    before = []
+
+    def bench(remote):
+        print 'authenticating %d requests with %d tokens' % (requests, tokens)
+        d = defer.succeed(None)
+        for what, size in [('every request', 0), ('decisions reused', 1000)]:
+
+            def start(_, size=size):
+                before.append(bouncer.count)
+                return run(remote, requests, tokens, size)
+
+            def report(seconds, what=what):
+                count = bouncer.count - before[-1]
+                print '%-40s %8.3fs %8d keycards' % (what, seconds, count)
+            d.addCallback(start)
+            d.addCallback(report)
+        return d
+
+    d = factory.getRootObject()
+    d.addCallback(bench)
+    d.addErrback(lambda f: result.append(f) or f.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    if result:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
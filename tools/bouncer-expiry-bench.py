@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time a bouncer with many authenticated keycards takes to
+run its expirer and to handle keep alives, with the old bouncer that
+went over all of its keycards for both.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/bouncer-expiry-bench.py 100000
+
+which authenticates 100000 keycards from 20 streamers.
+"""
+
+import sys
+import time
+
+from flumotion.common import keycards
+from flumotion.component.bouncers import bouncer
+
+ISSUERS = 20
+TTL = 60 * 60
+
+
+class OldBouncer(bouncer.TrivialBouncer):
+    """The bouncer as it used to expire keycards and keep them alive."""
+
+    def do_expireKeycards(self, elapsed):
+        for k in self._keycards.values():
+            if hasattr(k, 'ttl'):
+                k.ttl -= elapsed
+                if k.ttl <= 0:
+                    self.expireKeycardId(k.id)
+        return len(self._keycards) > 0
+
+    def keepAlive(self, issuerName, ttl):
+        for k in self._keycards.itervalues():
+            if hasattr(k, 'issuerName') and k.issuerName == issuerName:
+                k.ttl = ttl
+
+
+def makeBouncer(klass, count):
+    b = klass({'name': 'bench',
+               'avatarId': '/default/bench',
+               'plugs': {},
+               'properties': {}})
+    for i in range(count):
+        k = keycards.KeycardGeneric()
+        k.issuerName = 'streamer-%d' % (i % ISSUERS)
+        k.ttl = TTL + i % 100
+        b.do_authenticate(k)
+    return b
+
+
+def run(b, rounds):
+    # a streamer keeps its keycards alive between expirer ticks, and one
+    # streamer has gone away and lets its keycards expire
+    for i in range(rounds):
+        for j in range(1, ISSUERS):
+            b.keepAlive('streamer-%d' % j, TTL)
+        b.do_expireKeycards(b.KEYCARD_EXPIRE_INTERVAL)
+    return len(b._keycards)
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    count = 100000
+    if len(args) > 1:
+        count = int(args[1])
+    rounds = TTL / bouncer.Bouncer.KEYCARD_EXPIRE_INTERVAL + 1
+
+    print 'expiring %d keycards from %d issuers, %d ticks' % (
+        count, ISSUERS, rounds)
+    old = timeit('old bouncer', run, makeBouncer(OldBouncer, count), rounds)
+    new = timeit('new bouncer', run,
+                 makeBouncer(bouncer.TrivialBouncer, count), rounds)
+    if old != new:
+        print 'ERROR: %d keycards left, expected %d' % (new, old)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
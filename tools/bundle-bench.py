@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time the manager takes to compute the md5sums of all the
+registered bundles, and the bytes a worker fetches to set them up, with
+the old bundler that zipped and summed every file on every start.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/bundle-bench.py
+"""
+
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from flumotion.common import bundle, python, registry
+
+
+class OldBundler:
+    """The bundler as it used to be: files are read and summed, and
+    the zip is built, from scratch."""
+
+    def __init__(self, bundler):
+        self.files = bundler._bundledFiles.values()
+
+    def bundle(self):
+        for f in self.files:
+            python.md5(open(f.source).read()).hexdigest()
+        filelike = StringIO.StringIO()
+        zipFile = zipfile.ZipFile(filelike, "w")
+        for f in self.files:
+            zipFile.write(f.source, f.destination)
+        zipFile.close()
+        return filelike.getvalue()
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp()
+    cachePath = os.path.join(tempdir, 'hashes.cache')
+    reg = registry.getRegistry()
+
+    source = reg.makeBundlerBasket()
+    bundlers = []
+    for name in source.getBundlerNames():
+        bundler = source.getBundlerByName(name)
+        # skip bundles with files missing from this tree
+        for f in bundler._bundledFiles.values():
+            if not os.path.exists(f.source):
+                break
+        else:
+            bundlers.append(bundler)
+    names = [bundler.name for bundler in bundlers]
+
+    def makeBasket():
+        # the same bundles as the registry's basket
+        basket = bundle.BundlerBasket(bundle.HashCache(cachePath))
+        for bundler in bundlers:
+            for f in bundler._bundledFiles.values():
+                basket.add(bundler.name, f.source, f.destination)
+        return basket
+
+    def old():
+        return [OldBundler(bundler).bundle() for bundler in bundlers]
+
+    def new(basket):
+        ret = [basket.getBundlerByName(name).bundle().md5sum
+               for name in names]
+        basket.saveHashCache()
+        return ret
+
+    try:
+        print 'bundling %d bundles' % len(names)
+        old() # read the files once so they are all in the page cache
+        zips = timeit('sums, old bundler', old)
+        first = timeit('sums, first start', new, makeBasket())
+        again = timeit('sums, restart with hash cache', new,
+                       makeBasket())
+
+        basket = makeBasket()
+        deflated = 0
+        for name in names:
+            bundler = basket.getBundlerByName(name)
+            sums = [md5sum for path, md5sum in bundler.getManifest()]
+            deflated += sum([len(data) for data in
+                             bundler.getDeflatedFiles(sums).values()])
+        zipped = sum([len(data) for data in zips])
+        print '%-40s %8d' % ('bytes fetched, old, every time', zipped)
+        print '%-40s %8d' % ('bytes fetched, new, first time', deflated)
+        print '%-40s %8d' % ('bytes fetched, new, bundles unchanged', 0)
+    finally:
+        shutil.rmtree(tempdir)
+    if first != again:
+        print 'ERROR: md5sums disagree'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time the HTTP server cache manager takes to create, open,
+scan and clean up cached files with a flat cache directory and with
+cached files spread in sub-directories.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/cache-layout-bench.py 1000000
+
+which creates 1000000 empty cached files with no, one and two levels
+of sub-directories, opens them in a random order, scans the cache
+directory and removes half of them.
+"""
+
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from flumotion.component.misc.httpserver import cachemanager
+
+
+class DummyStats:
+
+    def onEstimateCacheUsage(self, usage, size):
+        pass
+
+
+def create(m, names):
+    for name in names:
+        path = m.getCachePath(name)
+        m.ensureCacheSubdir(path)
+        open(path, "w").close()
+
+
+def openAll(m, names):
+    for name in names:
+        open(m.getCachePath(name)).close()
+
+
+def scan(m):
+    files, usage, migrated = m._listCacheDir()
+    return len(files)
+
+
+def cleanup(m, names):
+    m._rmfiles([m.getCachePath(name) for name in names])
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    count = 100000
+    if len(args) > 1:
+        count = int(args[1])
+    names = [str(i) for i in range(count)]
+    shuffled = list(names)
+    random.shuffle(shuffled)
+    result = 0
+    for levels in (0, 1, 2):
+        cacheDir = tempfile.mkdtemp(suffix=".cache")
+        try:
+            print '%d cached files, %d directory levels' % (count, levels)
+            m = cachemanager.CacheManager(DummyStats(), cacheDir,
+                                          cacheDirLevels=levels)
+            timeit('create', create, m, names)
+            timeit('open', openAll, m, shuffled)
+            found = timeit('scan', scan, m)
+            timeit('cleanup', cleanup, m, shuffled[:count / 2])
+            if found != count:
+                print 'ERROR: found %d files instead of %d' % (found, count)
+                result = 1
+        finally:
+            shutil.rmtree(cacheDir, ignore_errors=True)
+    return result
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
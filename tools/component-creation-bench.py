@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Measure the time the manager takes to get all the components of a big
+planet happy, creating them on fake workers.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/component-creation-bench.py 1000
+
+which loads a planet of 1000 components, in flows of a producer and three
+converters eating from each other, spread on 4 workers.  A fake worker
+runs as many component creations at the same time as it has CPUs, each
+of them taking SPAWN_TIME seconds, the others wait for a CPU.  A
+component turns happy HAPPY_TIME seconds after it is created and all of
+the components it eats from are happy.
+
+The planet is loaded once creating all the components of a worker at the
+same time, like the manager used to, and once creating them a few at a
+time, producers first.
+"""
+
+import sys
+import time
+from StringIO import StringIO
+
+from twisted.internet import defer, reactor
+
+from flumotion.common import setup
+from flumotion.common.planet import moods
+from flumotion.manager import manager
+
+WORKERS = 4
+CPUS = 4
+FLOW_SIZE = 4
+SPAWN_TIME = 0.01
+HAPPY_TIME = 0.005
+
+
+class FakeWorkerAvatar:
+
+    def __init__(self, name, bench):
+        self.avatarId = name
+        self._bench = bench
+        self._running = 0
+        self._waiting = []
+
+    def getComponents(self):
+        return defer.succeed([])
+
+    def createComponent(self, avatarId, type, nice, conf):
+        d = defer.Deferred()
+        self._waiting.append((avatarId, d))
+        self._spawnNext()
+        return d
+
+    def _spawnNext(self):
+        while self._waiting and self._running < CPUS:
+            self._running += 1
+            reactor.callLater(SPAWN_TIME, self._spawned,
+                              *self._waiting.pop(0))
+
+    def _spawned(self, avatarId, d):
+        self._running -= 1
+        self._spawnNext()
+        d.callback(avatarId)
+        self._bench.created(avatarId)
+
+
+class Bench:
+
+    def __init__(self, vishnu, count):
+        self.vishnu = vishnu
+        self.count = count
+        self.done = defer.Deferred()
+        self._created = set()
+        self._happy = set()
+        self._eaters = {} # avatarId -> avatarIds of components eating it
+
+    def created(self, avatarId):
+        self._created.add(avatarId)
+        self._checkHappy(avatarId)
+
+    def _checkHappy(self, avatarId):
+        m = self.vishnu.getComponentMapper(avatarId)
+        for feederId in self.vishnu._getFeederIds(m.state):
+            if feederId not in self._happy:
+                return
+        reactor.callLater(HAPPY_TIME, self._turnHappy, m.state, avatarId)
+
+    def _turnHappy(self, state, avatarId):
+        state.setMood(moods.happy.value)
+        self._happy.add(avatarId)
+        for eaterId in self._eaters.get(avatarId, ()):
+            if eaterId in self._created:
+                self._checkHappy(eaterId)
+        if len(self._happy) == self.count:
+            self.done.callback(None)
+
+    def start(self):
+        for state in self.vishnu.getComponentStates():
+            avatarId = self.vishnu.getComponentMapper(state).id
+            for feederId in self.vishnu._getFeederIds(state):
+                self._eaters.setdefault(feederId, []).append(avatarId)
+        for i in range(WORKERS):
+            avatar = FakeWorkerAvatar('worker%d' % i, self)
+            self.vishnu.workerHeaven.avatars[avatar.avatarId] = avatar
+            self.vishnu.workerAttached(avatar)
+        return self.done
+
+
+def makePlanet(count):
+    xml = ['<planet>']
+    for flow in range(count / FLOW_SIZE):
+        worker = 'worker%d' % (flow % WORKERS)
+        xml.append('<flow name="flow%d">' % flow)
+        # the eaters first, the order of the configuration does not
+        # tell which components should be created first
+        for i in range(FLOW_SIZE - 1, 0, -1):
+            xml.append('<component name="c%d" type="pipeline-converter" '
+                       'worker="%s"><eater name="default"><feed>c%d</feed>'
+                       '</eater><property name="pipeline">identity'
+                       '</property></component>' % (i, worker, i - 1))
+        xml.append('<component name="c0" type="pipeline-producer" '
+                   'worker="%s"><property name="pipeline">fakesrc'
+                   '</property></component>' % worker)
+        xml.append('</flow>')
+    xml.append('</planet>')
+    return '\n'.join(xml)
+
+
+def run(xml, count, maxConcurrent):
+    vishnu = manager.Vishnu('bench')
+    if maxConcurrent is not None:
+        vishnu._creator.maxConcurrent = maxConcurrent
+    start = time.time()
+    d = vishnu.loadComponentConfigurationXML(StringIO(xml),
+                                             manager.LOCAL_IDENTITY)
+    d.addCallback(lambda _: Bench(vishnu, count).start())
+    d.addCallback(lambda _: time.time() - start)
+    return d
+
+
+def main(args):
+    count = 1000
+    if len(args) > 1:
+        count = int(args[1])
+    count -= count % FLOW_SIZE
+    setup.setupPackagePath()
+    xml = makePlanet(count)
+    print 'creating %d components on %d workers of %d CPUs' % (
+        count, WORKERS, CPUS)
+    results = []
+
+    def report(elapsed, what):
+        print '%-40s %8.3fs' % (what, elapsed)
+        results.append(elapsed)
+
+    def failed(failure):
+        print 'ERROR: %s' % failure.getErrorMessage()
+
+    d = run(xml, count, count)
+    d.addCallback(report, 'all at once, time to all happy')
+    d.addCallback(lambda _: run(xml, count, None))
+    d.addCallback(report, 'scheduled, time to all happy')
+    d.addErrback(failed)
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    if len(results) != 2:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Measure the time to find the active event instances of a big calendar.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/eventcalendar-bench.py 2000
+
+which makes a calendar of 2000 recurring events, started a month ago,
+half of them daily and half of them weekly, with a few exceptions and
+moved instances, and asks for the instances active at QUERIES times over
+an hour from now, like the iCalendar bouncer does on every login.  The
+instances are found through each event set, like the calendar used to,
+and through the calendar's index.  Both must agree.
+"""
+
+import datetime
+import random
+import sys
+import time
+
+from flumotion.common import setup
+from flumotion.common import eventcalendar
+
+QUERIES = 100
+
+
+def makeCalendar(count, rand):
+    calendar = eventcalendar.Calendar()
+    now = datetime.datetime.now(eventcalendar.UTC).replace(second=0,
+                                                           microsecond=0)
+    first = now - datetime.timedelta(days=30)
+    for i in range(count):
+        start = first + datetime.timedelta(minutes=rand.randrange(24 * 60))
+        end = start + datetime.timedelta(minutes=rand.randrange(10, 120))
+        uid = 'event%d' % i
+        if i % 2:
+            rule, period = 'FREQ=DAILY', datetime.timedelta(days=1)
+        else:
+            rule, period = 'FREQ=WEEKLY', datetime.timedelta(days=7)
+        exdates = [start + period * rand.randrange(1, 30)]
+        calendar.addEvent(eventcalendar.Event(uid, start, end, uid,
+                                              rrules=[rule],
+                                              exdates=exdates))
+        if not i % 10:
+            moved = start + period * rand.randrange(1, 30)
+            moveStart = moved + datetime.timedelta(minutes=30)
+            calendar.addEvent(eventcalendar.Event(uid, moveStart,
+                                                  moveStart + (end - start),
+                                                  uid, recurrenceid=moved))
+    return calendar, now
+
+
+def fromEventSets(calendar, when):
+    ret = []
+    for eventSet in calendar._eventSets.values():
+        ret.extend(eventSet.getActiveEventInstances(when))
+    return ret
+
+
+def measure(what, function, calendar, times):
+    start = time.time()
+    results = []
+    for when in times:
+        instances = [(i.start, i.end, i.event.uid)
+                     for i in function(calendar, when)]
+        instances.sort()
+        results.append(instances)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return results
+
+
+def main(args):
+    count = 2000
+    if len(args) > 1:
+        count = int(args[1])
+    setup.setupPackagePath()
+    rand = random.Random(0)
+    calendar, now = makeCalendar(count, rand)
+    times = [now + datetime.timedelta(seconds=rand.randrange(3600))
+             for i in range(QUERIES)]
+    times.sort()
+    print '%d queries on a calendar of %d recurring events' % (
+        QUERIES, count)
+
+    old = measure('through the event sets', fromEventSets, calendar,
+                  times)
+    new = measure('through the index, including building it',
+                  eventcalendar.Calendar.getActiveEventInstances, calendar,
+                  times)
+    new = measure('through the index',
+                  eventcalendar.Calendar.getActiveEventInstances, calendar,
+                  times)
+    if old != new:
+        print 'ERROR: the active instances differ'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time the httpcached caching strategy takes to serve small
+and popular files from its disk cache, with and without keeping them in
+memory.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/httpcached-memory-bench.py 20000
+
+which opens and reads 20000 times one of 50 cached files of 16KB.
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+from flumotion.component.misc.httpserver import cachemanager
+from flumotion.component.misc.httpserver import cachestats
+from flumotion.component.misc.httpserver.httpcached import http_utils
+from flumotion.component.misc.httpserver.httpcached import memory_cache
+from flumotion.component.misc.httpserver.httpcached import resource_manager
+from flumotion.component.misc.httpserver.httpcached import strategy_basic
+
+FILES = 50
+FILE_SIZE = 16 * 1024
+
+
+def makeStrategy(cacheDir, stats, memcache):
+    cachemgr = cachemanager.CacheManager(stats, cacheDir)
+    strategy = strategy_basic.CachingStrategy(cachemgr, None, 3600, memcache)
+    urls = []
+    for i in range(FILES):
+        url = http_utils.Url.fromString("http://localhost/file-%d" % i)
+        f = open(cachemgr.getCachePath(url.path), "wb")
+        f.write("x" * FILE_SIZE)
+        f.close()
+        strategy.keepCacheAlive(cachemgr.getIdentifier(url.path))
+        urls.append(url)
+    return strategy, urls
+
+
+def run(stats, strategy, urls, rounds):
+    resmgr = resource_manager.ResourceManager(strategy, stats)
+    results = []
+    for i in range(rounds):
+        d = resmgr.getResourceFor(urls[i % len(urls)])
+        d.addCallback(lambda r: r.read(FILE_SIZE).addCallback(
+            lambda data: r.close() or data))
+        d.addCallback(lambda data: results.append(len(data)))
+    return sum(results)
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    rounds = 20000
+    if len(args) > 1:
+        rounds = int(args[1])
+    cacheDir = tempfile.mkdtemp(suffix=".cache")
+    try:
+        print 'reading %d times one of %d files of %d bytes' % (
+            rounds, FILES, FILE_SIZE)
+        stats = cachestats.CacheStatistics()
+        strategy, urls = makeStrategy(cacheDir, stats, None)
+        disk = timeit('disk cache', run, stats, strategy, urls, rounds)
+        stats = cachestats.CacheStatistics()
+        memcache = memory_cache.MemoryCache(stats, 10 * 1024 * 1024)
+        strategy, urls = makeStrategy(cacheDir, stats, memcache)
+        memory = timeit('memory cache', run, stats, strategy, urls, rounds)
+        print 'memory hit ratio: %.4f' % stats.memoryHitRatio
+    finally:
+        shutil.rmtree(cacheDir, ignore_errors=True)
+    if disk != memory or disk != rounds * FILE_SIZE:
+        print 'ERROR: read %d bytes from disk and %d from memory' % (
+            disk, memory)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time the httpcached HTTP client takes to make range
+requests to an origin server, and the number of connections it opens,
+with a connection per request and with persistent connections.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/httpcached-pool-bench.py 2000 4
+
+which reads 2000 blocks of 16KB, 4 at a time, from a web server on the
+loopback interface.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer, reactor
+from twisted.web import server, static
+
+from flumotion.component.misc.httpserver.httpcached import http_client
+from flumotion.component.misc.httpserver.httpcached import http_utils
+
+BLOCK_SIZE = 16 * 1024
+FILE_SIZE = 4 * 1024 * 1024
+
+
+class Consumer(object):
+
+    def __init__(self, done):
+        self.done = done
+
+    def serverError(self, getter, code, message):
+        self.done.errback(Exception(message))
+
+    def conditionFail(self, getter, code, message):
+        self.done.errback(Exception(message))
+
+    def streamNotAvailable(self, getter, code, message):
+        self.done.errback(Exception(message))
+
+    def onInfo(self, getter, info):
+        pass
+
+    def onData(self, getter, data):
+        pass
+
+    def streamDone(self, getter):
+        self.done.callback(None)
+
+
+def run(url, blocks, concurrency, keepAliveTimeout):
+    pool = http_client.ConnectionPool(5, concurrency, keepAliveTimeout)
+    requester = http_client.StreamRequester(5, 5, pool)
+    blocksPerFile = FILE_SIZE / BLOCK_SIZE
+    start = time.time()
+    state = {'next': 0}
+
+    def readBlocks(_=None):
+        # read blocks one after the other, like a seeking client does
+        if state['next'] >= blocks:
+            return
+        offset = (state['next'] % blocksPerFile) * BLOCK_SIZE
+        state['next'] += 1
+        done = defer.Deferred()
+        requester.retrieve(Consumer(done), url,
+                           start=offset, size=BLOCK_SIZE)
+        return done.addCallback(readBlocks)
+
+    d = defer.DeferredList([readBlocks() for i in range(concurrency)],
+                           fireOnOneErrback=True, consumeErrors=True)
+
+    def report(_):
+        seconds = time.time() - start
+        connects = sum([s['connects']
+                        for s in pool.getStatistics().values()])
+        d = requester.cleanup()
+        d.addCallback(lambda _: (seconds, connects))
+        return d
+    d.addCallback(report)
+    return d
+
+
+def main(args):
+    blocks = 2000
+    concurrency = 4
+    if len(args) > 1:
+        blocks = int(args[1])
+    if len(args) > 2:
+        concurrency = int(args[2])
+
+    path = tempfile.mkdtemp(suffix=".origin")
+    f = open(os.path.join(path, "file"), "w")
+    f.write("x" * FILE_SIZE)
+    f.close()
+    port = reactor.listenTCP(0, server.Site(static.File(path)),
+                             interface="127.0.0.1")
+    url = http_utils.Url.fromString("http://127.0.0.1:%d/file"
+                                    % port.getHost().port)
+    result = []
+
+    def bench():
+        print 'reading %d blocks of %d bytes, %d at a time' % (
+            blocks, BLOCK_SIZE, concurrency)
+        d = defer.succeed(None)
+        for what, timeout in [('connection per request', 0),
+                              ('persistent connections', 30)]:
+
+            def report((seconds, connects), what=what):
+                print '%-40s %8.3fs %8d connections' % (
+                    what, seconds, connects)
+            d.addCallback(lambda _, timeout=timeout:
+                          run(url, blocks, concurrency, timeout))
+            d.addCallback(report)
+        return d
+
+    d = defer.maybeDeferred(bench)
+    d.addErrback(lambda f: result.append(f) or f.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    shutil.rmtree(path, ignore_errors=True)
+    if result:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
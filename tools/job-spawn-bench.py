@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time it takes to get a job process up to the point where
+it logs in to the worker, when spawning it from scratch and when forking
+it from a job zygote.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/job-spawn-bench.py 20
+
+which starts 20 job processes each way, one after the other. The job
+processes do the imports and registry loading of flumotion-job and then
+exit instead of logging in.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import defer, protocol, reactor
+
+from flumotion.worker import base
+
+# what flumotion-job does before it logs in to the worker
+FRESH_JOB = """
+from flumotion.job import main
+from flumotion.common import registry, setup
+setup.setupPackagePath()
+registry.getRegistry().verify()
+"""
+
+ZYGOTE = """#!%s
+import os, sys
+from flumotion.job import main
+avatarId = main._runZygote(int(sys.argv[3]))
+if avatarId is not None:
+    os._exit(0)
+"""
+
+
+class FakeHeaven:
+
+    def getSocketPath(self):
+        return '/nonexistent/socket'
+
+
+class JobProtocol(protocol.ProcessProtocol):
+
+    def __init__(self):
+        self.ended = defer.Deferred()
+
+    def processEnded(self, status):
+        self.ended.callback(None)
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    d = defer.maybeDeferred(func, *args)
+
+    def done(ret):
+        print '%-40s %8.3fs' % (what, time.time() - start)
+        return ret
+    d.addCallback(done)
+    return d
+
+
+def spawn(rounds):
+    d = defer.succeed(None)
+
+    def one(_):
+        p = JobProtocol()
+        reactor.spawnProcess(p, sys.executable,
+                             args=[sys.executable, '-c', FRESH_JOB],
+                             env=os.environ, childFDs={0: 0, 1: 1, 2: 2})
+        return p.ended
+    for i in range(rounds):
+        d.addCallback(one)
+    return d
+
+
+def fork(zygote, rounds):
+    d = defer.succeed(None)
+
+    def one(_):
+        p = JobProtocol()
+
+        def forked(pid):
+            zygote.run(pid, p, '/bench/job%d' % pid, dict(os.environ))
+            return p.ended
+        return zygote.fork().addCallback(forked)
+    for i in range(rounds):
+        d.addCallback(one)
+    return d
+
+
+def startZygote(executable, poolSize):
+    zygote = base.JobZygote(FakeHeaven(), poolSize)
+    zygote.start(executable)
+    # the zygote is ready when it answers the first fork request
+    d = zygote.fork()
+    d.addCallback(lambda pid: zygote._ready.insert(0, pid))
+    d.addCallback(lambda _: zygote)
+    return d
+
+
+def main(args):
+    rounds = 20
+    if len(args) > 1:
+        rounds = int(args[1])
+
+    tempdir = tempfile.mkdtemp()
+    executable = os.path.join(tempdir, 'flumotion-job')
+    f = open(executable, 'w')
+    f.write(ZYGOTE % sys.executable)
+    f.close()
+    os.chmod(executable, 0755)
+    result = []
+
+    def run():
+        print 'starting %d job processes' % rounds
+        d = timeit('spawn from scratch', spawn, rounds)
+        for poolSize in (0, 1):
+            d.addCallback(lambda _, size=poolSize: timeit(
+                'zygote startup, pool size %d' % size,
+                startZygote, executable, size))
+            d.addCallback(lambda zygote, size=poolSize: timeit(
+                'fork from zygote, pool size %d' % size,
+                fork, zygote, rounds).addCallback(lambda _: zygote.stop()))
+        d.addErrback(lambda f: result.append(f) or f.printTraceback())
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    try:
+        reactor.run()
+    finally:
+        shutil.rmtree(tempdir)
+    if result:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
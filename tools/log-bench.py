@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the time taken by log calls that end up not being logged,
+before and after levels were cached per category and messages were
+formatted only when a handler gets them.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/log-bench.py 1000000
+
+which makes a million calls of each kind with the default debug level.
+"""
+
+import sys
+import time
+
+from flumotion.common import log
+from flumotion.extern.log import log as externlog
+
+
+def oldDoLog(level, object, category, format, args, where=-1,
+             filePath=None, line=None):
+    # externlog.doLog as it used to be: format first, check the level
+    # later
+    ret = {}
+    if args:
+        message = format % args
+    else:
+        message = format
+    if externlog._log_handlers:
+        if filePath is None and line is None:
+            (filePath, line) = externlog.getFileLine(where=where)
+        ret['filePath'] = filePath
+        ret['line'] = line
+        for handler in externlog._log_handlers:
+            handler(level, object, category, file, line, message)
+    if level > externlog.getCategoryLevel(category):
+        return ret
+    if externlog._log_handlers_limited:
+        if filePath is None and line is None:
+            (filePath, line) = externlog.getFileLine(where=where)
+        for handler in externlog._log_handlers_limited:
+            handler(level, object, category, filePath, line, message)
+        return ret
+
+
+def oldCanShortcutLogging(category, level):
+    if externlog._log_handlers:
+        return False
+    else:
+        return level > externlog.getCategoryLevel(category)
+
+
+class OldLoggable(log.Loggable):
+    """Loggable.log as it used to be."""
+
+    logCategory = 'bench'
+
+    def log(self, *args):
+        if oldCanShortcutLogging(self.logCategory, log.LOG):
+            return
+        oldDoLog(log.LOG, self.logObjectName(), self.logCategory,
+                 args[0], args[1:])
+
+
+class NewLoggable(log.Loggable):
+
+    logCategory = 'bench'
+
+
+def loggable(loggable, rounds):
+    for i in xrange(rounds):
+        loggable.log('sent chunk %d of %r', i, loggable)
+
+
+def module(doLog, rounds):
+    for i in xrange(rounds):
+        doLog(log.LOG, None, 'bench', 'sent chunk %d of %r', (i, doLog))
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    rounds = 1000000
+    if len(args) > 1:
+        rounds = int(args[1])
+    log.init()
+    log.setDebug('*:3')
+
+    print 'making %d log calls below the debug level' % rounds
+    timeit('Loggable.log, old', loggable, OldLoggable(), rounds)
+    timeit('Loggable.log, new', loggable, NewLoggable(), rounds)
+    timeit('doLog, old', module, oldDoLog, rounds)
+    timeit('doLog, new', module, externlog.doLog, rounds)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Measure the time the playlist producer takes to maintain a big playlist.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/playlist-bench.py 100000
+
+which adds 100000 items of a minute each to a playlist, first in the order
+of their timestamps and then in a random order, looks up the item playing
+at random times, overwrites a tenth of the items with overlapping ones
+and removes a tenth of the playlist files, like the producer does when a
+playlist file changes.  The producer only counts the items it is asked to
+schedule, it does not build a gnonlin timeline.
+"""
+
+import random
+import sys
+import time
+
+import gst
+
+from flumotion.common import setup
+from flumotion.component.producers.playlist import playlistparser
+
+DURATION = 60 * gst.SECOND
+ITEMS_PER_FILE = 100
+
+
+class FakeClock:
+
+    def get_time(self):
+        # before the first item, so nothing is playing yet
+        return 0
+
+
+class FakePipeline:
+
+    def get_clock(self):
+        return FakeClock()
+
+
+class FakeProducer:
+
+    def __init__(self):
+        self.pipeline = FakePipeline()
+        self.scheduled = 0
+
+    def scheduleItem(self, item):
+        self.scheduled += 1
+        return item
+
+    def unscheduleItem(self, item):
+        self.scheduled -= 1
+
+    def adjustItemScheduling(self, item):
+        pass
+
+
+def addItems(playlist, starts):
+    for i, start in enumerate(starts):
+        playlist.addItem('file%d' % (i // ITEMS_PER_FILE), start,
+                         'file:///bench/%d.ogg' % i, 0, DURATION,
+                         True, True)
+
+
+def measure(what, function, *args):
+    start = time.time()
+    function(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+
+
+def main(args):
+    count = 100000
+    if len(args) > 1:
+        count = int(args[1])
+    setup.setupPackagePath()
+    rand = random.Random(0)
+    starts = [gst.SECOND + i * DURATION for i in range(count)]
+    print 'playlist of %d items' % count
+
+    playlist = playlistparser.Playlist(FakeProducer())
+    measure('add in order', addItems, playlist, starts)
+
+    shuffled = starts[:]
+    rand.shuffle(shuffled)
+    playlist = playlistparser.Playlist(FakeProducer())
+    measure('add in random order', addItems, playlist, shuffled)
+
+    positions = [rand.randrange(starts[-1] + DURATION)
+                 for i in range(count)]
+    measure('find the current item', lambda: [
+        playlist._findItem(p) for p in positions])
+
+    # items starting half-way through others, replacing some of them
+    overlapping = [s + DURATION / 2 for s in rand.sample(starts, count / 10)]
+    measure('add overlapping items', addItems, playlist, overlapping)
+
+    files = ['file%d' % i
+             for i in rand.sample(range(count // ITEMS_PER_FILE + 1),
+                                  count // ITEMS_PER_FILE // 10)]
+    measure('remove files', lambda: [
+        playlist.removeItems(f) for f in files])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the porter's prefix lookups through porter.PrefixTree with
+the linear scan over all registered prefixes it replaced.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/porter-prefix-bench.py 10000
+
+which registers 10000 mount point prefixes and looks up random request
+paths.
+"""
+
+import random
+import sys
+import time
+
+from flumotion.component.misc.porter import porter
+
+
+def linearPrefixMatch(prefixes, path):
+    found = None
+    for prefix in prefixes.keys():
+        if (path.startswith(prefix) and
+            (not found or len(found) < len(prefix))):
+            found = prefix
+    if found:
+        return prefixes[found]
+    else:
+        return None
+
+
+def randomPrefixes(count):
+    prefixes = {}
+    while len(prefixes) < count:
+        segments = ['channel%d' % random.randint(0, count / 10),
+                    random.choice(['live', 'vod', 'archive']),
+                    random.choice(['hd', 'sd', 'mobile'])]
+        prefix = '/' + '/'.join(segments[:random.randint(1, 3)]) + '/'
+        prefixes[prefix] = 'avatar%d' % len(prefixes)
+    return prefixes
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    count = 10000
+    lookups = 10000
+    if len(args) > 1:
+        count = int(args[1])
+    if len(args) > 2:
+        lookups = int(args[2])
+
+    random.seed(0)
+    prefixes = randomPrefixes(count)
+    paths = [random.choice(prefixes.keys()) + 'stream.ogg'
+             for i in range(lookups / 2)]
+    paths.extend(['/unknown%d/stream.ogg' % i for i in range(lookups / 2)])
+    print 'looking up %d paths in %d prefixes' % (len(paths), count)
+
+    def load():
+        tree = porter.PrefixTree()
+        for prefix, avatar in prefixes.items():
+            tree[prefix] = avatar
+        return tree
+
+    def linear():
+        return [linearPrefixMatch(prefixes, path) for path in paths]
+
+    def radix(tree):
+        return [tree.longestPrefixMatch(path) for path in paths]
+
+    tree = timeit('load, prefix tree', load)
+    expected = timeit('lookup, linear scan', linear)
+    actual = timeit('lookup, prefix tree', radix, tree)
+    if expected != actual:
+        print 'ERROR: lookups disagree'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the registry startup time when parsing the XML registry
+snippets with the startup time when loading the binary registry cache.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/registry-bench.py 20
+
+which creates the registry 20 times each way, the way a job process
+does at startup, and looks up a component and a plug.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flumotion.common import registry
+from flumotion.configure import configure
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    rounds = 20
+    if len(args) > 1:
+        rounds = int(args[1])
+
+    tempdir = tempfile.mkdtemp()
+    cachePath = os.path.join(tempdir, 'registry.xml')
+    paths = [configure.pythondir]
+
+    def startup():
+        reg = registry.ComponentRegistry(paths, cachePath=cachePath)
+        return (reg.getComponent('http-streamer').getType(),
+                reg.getPlug('requestlogger-file').getType())
+
+    def xml():
+        for i in range(rounds):
+            os.unlink(cachePath.replace('.xml', '.cache'))
+            ret = startup()
+        return ret
+
+    def binary():
+        for i in range(rounds):
+            ret = startup()
+        return ret
+
+    try:
+        print 'creating the registry %d times' % rounds
+        startup()
+        expected = timeit('startup, parsing XML', xml)
+        actual = timeit('startup, binary cache', binary)
+        reg = registry.ComponentRegistry(paths, cachePath=cachePath)
+        timeit('freshness check', reg.rebuildNeeded)
+    finally:
+        shutil.rmtree(tempdir)
+    if expected != actual:
+        print 'ERROR: registries disagree'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
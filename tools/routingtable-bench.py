@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare route lookups of the radix tree backed netutils.RoutingTable
+with the AVL tree backed scan it replaced.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/routingtable-bench.py 10000
+
+which loads 10000 random subnets into both tables and routes random
+addresses through them.
+"""
+
+import random
+import sys
+import time
+
+from flumotion.common import avltree, netutils
+
+
+class AVLRoutingTable(object):
+    """The routing table as it used to be: every lookup walks the
+    subnets from the most to the least specific one."""
+
+    def __init__(self):
+        self.avltree = avltree.AVLTree()
+
+    def addSubnet(self, route, ipv4String, maskBits=32):
+        ipv4Int = netutils.ipv4StringToInt(ipv4String)
+        mask = ~((1 << (32 - maskBits)) - 1)
+        self.avltree.insert((mask, ipv4Int, route))
+
+    def route(self, ip):
+        for netmask, net, route in self.avltree.iterreversed():
+            if ip & netmask == net:
+                return route
+        return None
+
+
+def randomSubnets(count):
+    subnets = {}
+    while len(subnets) < count:
+        maskBits = random.randint(8, 32)
+        net = random.randint(0, 0xffffffff) & ~((1 << (32 - maskBits)) - 1)
+        subnets[(net, maskBits)] = True
+    return [('route%d' % i, netutils.ipv4IntToString(net), maskBits)
+            for i, (net, maskBits) in enumerate(subnets.keys())]
+
+
+def timeit(what, func, *args):
+    start = time.time()
+    ret = func(*args)
+    print '%-40s %8.3fs' % (what, time.time() - start)
+    return ret
+
+
+def main(args):
+    count = 10000
+    lookups = 2000
+    if len(args) > 1:
+        count = int(args[1])
+    if len(args) > 2:
+        lookups = int(args[2])
+
+    random.seed(0)
+    subnets = randomSubnets(count)
+    ips = [random.randint(0, 0xffffffff) for i in range(lookups)]
+    print 'routing %d addresses through %d subnets' % (lookups, count)
+
+    def loadAVL():
+        table = AVLRoutingTable()
+        for subnet in subnets:
+            table.addSubnet(*subnet)
+        return table
+
+    def loadRadix():
+        table = netutils.RoutingTable()
+        for subnet in subnets:
+            table.addSubnet(*subnet)
+        return table
+
+    def bulkLoadRadix():
+        table = netutils.RoutingTable()
+        table.addSubnets(subnets)
+        return table
+
+    def route(table):
+        return [table.route(ip) for ip in ips]
+
+    avl = timeit('load, AVL tree', loadAVL)
+    radix = timeit('load, radix tree', loadRadix)
+    timeit('bulk load, radix tree', bulkLoadRadix)
+    expected = timeit('route, AVL tree', route, avl)
+    actual = timeit('route, radix tree', route, radix)
+    if expected != actual:
+        print 'ERROR: routing tables disagree'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+"""Compare the messages an observer of a state object receives, and the
+time it takes to catch up, when every change is sent right away and
+when changes are sent in batches.
+
+Run it from an uninstalled tree, for example:
+
+$ ./env python tools/state-batch-bench.py 2000
+
+which updates the stats of a feeder client 2000 times, over PB on the
+loopback interface.
+"""
+
+import sys
+import time
+
+from twisted.internet import defer, reactor
+from twisted.spread import pb
+
+from flumotion.twisted import flavors
+
+KEYS = ['bytes-read-current', 'buffers-dropped-current', 'bytes-read-total',
+        'last-activity', 'buffers-dropped-total']
+
+
+class BenchState(flavors.StateCacheable):
+    pass
+
+
+class BenchRemoteState(flavors.StateRemoteCache):
+
+    messages = 0
+
+    def remoteMessageReceived(self, broker, message, args, kw):
+        BenchRemoteState.messages += 1
+        return flavors.StateRemoteCache.remoteMessageReceived(
+            self, broker, message, args, kw)
+
+pb.setUnjellyableForClass(BenchState, BenchRemoteState)
+
+
+class Root(pb.Root):
+
+    def remote_getState(self):
+        self.state = BenchState()
+        for key in KEYS:
+            self.state.addKey(key, 0)
+        return self.state
+
+
+def run(root, remote, rounds, window):
+    state = root.state
+    state.setBatchWindow(window)
+    BenchRemoteState.messages = 0
+    start = time.time()
+    for i in range(rounds):
+        for key in KEYS:
+            d = state.set(key, i)
+    d.addCallback(lambda _: (BenchRemoteState.messages,
+                             time.time() - start,
+                             [remote.get(key) for key in KEYS]))
+    return d
+
+
+def main(args):
+    rounds = 2000
+    if len(args) > 1:
+        rounds = int(args[1])
+    root = Root()
+    port = reactor.listenTCP(0, pb.PBServerFactory(root),
+                             interface='127.0.0.1')
+    factory = pb.PBClientFactory()
+    reactor.connectTCP('127.0.0.1', port.getHost().port, factory)
+    results = {}
+
+    def bench(remote):
+        print 'setting %d keys %d times' % (len(KEYS), rounds)
+        d = defer.succeed(None)
+        for what, window in [('right away', None), ('batched, 0.1s', 0.1)]:
+
+            def report((messages, seconds, values), what=what):
+                print '%-40s %8.3fs %8d messages' % (what, seconds, messages)
+                results[what] = values
+            d.addCallback(lambda _, window=window:
+                          run(root, remote, rounds, window))
+            d.addCallback(report)
+        return d
+
+    d = factory.getRootObject()
+    d.addCallback(lambda r: r.callRemote('getState'))
+    d.addCallback(bench)
+    d.addErrback(lambda f: f.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    values = results.values()
+    if len(values) != 2 or values[0] != values[1]:
+        print 'ERROR: observers disagree'
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))